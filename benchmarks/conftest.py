@@ -0,0 +1,48 @@
+"""Fixtures of the benchmark suite. The scales of the synthetic PIV files are
+selected with the environment variable STANDARDPOSTPIV_BENCH_SCALE, e.g.
+STANDARDPOSTPIV_BENCH_SCALE=small,medium pytest benchmarks"""
+import os
+
+import matplotlib
+import pytest
+
+from standardpostpiv.synthetic import create_piv_file
+
+matplotlib.use('Agg')
+
+# (nt, ny, nx)
+SCALES = {'tiny': (20, 32, 40),
+          'small': (100, 64, 80),
+          'medium': (500, 128, 160),
+          'large': (2000, 256, 320)}
+
+# HDF5 layouts of the 3D datasets
+LAYOUTS = {'frame_chunks': {},
+           'frame_chunks_gzip': {'compression': 'gzip', 'compression_opts': 4},
+           'auto_chunks_lzf': {'chunks': True, 'compression': 'lzf'}}
+
+
+def get_scales():
+    return os.environ.get('STANDARDPOSTPIV_BENCH_SCALE', 'small').split(',')
+
+
+@pytest.fixture(scope='session')
+def piv_file_factory(tmp_path_factory):
+    """Returns a function creating (once per session) a synthetic PIV file of a
+    given scale and layout"""
+    files = {}
+    directory = tmp_path_factory.mktemp('piv_files')
+
+    def factory(scale: str = 'small', layout: str = 'frame_chunks'):
+        if (scale, layout) not in files:
+            nt, ny, nx = SCALES[scale]
+            files[(scale, layout)] = create_piv_file(directory / f'piv_{scale}_{layout}.hdf',
+                                                     nt=nt, ny=ny, nx=nx, seed=42, **LAYOUTS[layout])
+        return files[(scale, layout)]
+
+    return factory
+
+
+@pytest.fixture(scope='session', params=get_scales())
+def piv_file(request, piv_file_factory):
+    return piv_file_factory(request.param)
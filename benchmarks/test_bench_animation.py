@@ -0,0 +1,22 @@
+import h5rdmtoolbox as h5tbx
+import matplotlib.pyplot as plt
+import numpy as np
+
+from standardpostpiv.animation import PIVAnimation
+
+MIN_FPS = 30  # frames per second of the rendering (without encoding)
+
+
+def test_render_frames(benchmark, piv_file):
+    with h5tbx.File(piv_file) as h5:
+        dx, dy = h5['dx'][()], h5['dy'][()]
+    anim = PIVAnimation(np.hypot(dx, dy), dx, dy)
+
+    def render():
+        return sum(1 for _ in anim.render_frames())
+
+    nframes = benchmark.pedantic(render, rounds=3)
+    plt.close(anim.fig)
+    fps = nframes / benchmark.stats.stats.min
+    benchmark.extra_info['fps'] = fps
+    assert fps >= MIN_FPS
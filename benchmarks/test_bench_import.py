@@ -0,0 +1,21 @@
+"""Import time of the package in a fresh interpreter"""
+import json
+import subprocess
+import sys
+
+SCRIPT = """import json, time
+t0 = time.perf_counter()
+import standardpostpiv
+print(json.dumps(time.perf_counter() - t0))
+"""
+
+
+def _import_time() -> float:
+    cp = subprocess.run([sys.executable, '-c', SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(cp.stdout.strip().splitlines()[-1])
+
+
+def test_import_time():
+    # best of three to reduce the influence of a cold file system cache
+    dt = min(_import_time() for _ in range(3))
+    assert dt < 0.5
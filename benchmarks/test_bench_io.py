@@ -0,0 +1,45 @@
+import h5rdmtoolbox as h5tbx
+import pytest
+from conftest import LAYOUTS
+
+import standardpostpiv
+from standardpostpiv.precompute import precompute
+from standardpostpiv.utils import iter_chunks
+
+
+def _read(filename, name):
+    with h5tbx.File(filename) as h5:
+        return h5[name][()]
+
+
+def _read_chunks(filename, name, chunk_size):
+    with h5tbx.File(filename) as h5:
+        for _ in iter_chunks(h5[name], chunk_size):
+            pass
+
+
+def test_standard_piv_result_init(benchmark, piv_file):
+    benchmark(standardpostpiv.StandardPIVResult, piv_file)
+
+
+def test_standard_piv_result_parameters(benchmark, piv_file):
+    res = standardpostpiv.StandardPIVResult(piv_file)
+    benchmark(lambda: (res.eval_method, res.final_iw_size, res.piv_dim, res.piv_type))
+
+
+@pytest.mark.parametrize('layout', list(LAYOUTS))
+def test_read_displacement(benchmark, piv_file_factory, layout):
+    filename = piv_file_factory('small', layout)
+    benchmark(_read, filename, 'dx')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 10, 100])
+def test_read_chunks(benchmark, piv_file_factory, chunk_size):
+    filename = piv_file_factory('small')
+    benchmark(_read_chunks, filename, 'dx', chunk_size)
+
+
+@pytest.mark.parametrize('layout', list(LAYOUTS))
+def test_precompute(benchmark, piv_file_factory, layout, tmp_path):
+    filename = piv_file_factory('small', layout)
+    benchmark(precompute, filename, tmp_path / 'summary.hdf', overwrite=True)
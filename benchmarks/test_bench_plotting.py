@@ -0,0 +1,32 @@
+import h5rdmtoolbox as h5tbx
+import matplotlib.pyplot as plt
+import pytest
+
+from standardpostpiv import plotting
+
+
+@pytest.fixture(scope='module')
+def data(piv_file):
+    with h5tbx.File(piv_file) as h5:
+        return {'dx': h5['dx'][()], 'dy': h5['dy'][()], 'piv_flags': h5['piv_flags'][()]}
+
+
+def _piv_scatter(data, density):
+    ax = plotting.piv_scatter(data['dx'], data['dy'], flags=data['piv_flags'], fiwsize=32, density=density)
+    ax.figure.canvas.draw()
+    plt.close(ax.figure)
+
+
+@pytest.mark.parametrize('density', [False, True], ids=['scatter', 'density'])
+def test_piv_scatter(benchmark, data, density):
+    benchmark.pedantic(_piv_scatter, args=(data, density), rounds=3)
+
+
+def test_pivfield(benchmark, data):
+    def _pivfield():
+        fig, ax = plotting.subplots(1, 1)
+        ax.pivfield(data['dx'].mean('reltime'))
+        fig.canvas.draw()
+        plt.close(fig)
+
+    benchmark(_pivfield)
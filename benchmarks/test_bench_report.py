@@ -0,0 +1,25 @@
+import nbformat
+
+import standardpostpiv
+from standardpostpiv.batch import notebook_errors
+
+
+def _create_report(filename, directory, precompute=False):
+    report = standardpostpiv.get_basic_2D2C_report(filename, precompute=precompute)
+    return report.create(notebook_filename=directory / 'report.ipynb', execute_notebook=True,
+                         overwrite=True, inplace=True, to_html=True)
+
+
+def _assert_no_errors(filenames):
+    assert filenames['html'].exists()
+    assert notebook_errors(nbformat.read(filenames['ipynb'], as_version=4)) == []
+
+
+def test_basic_2d2c_report(benchmark, piv_file, tmp_path):
+    filenames = benchmark.pedantic(_create_report, args=(piv_file, tmp_path), rounds=1, iterations=1)
+    _assert_no_errors(filenames)
+
+
+def test_precomputed_2d2c_report(benchmark, piv_file, tmp_path):
+    filenames = benchmark.pedantic(_create_report, args=(piv_file, tmp_path, True), rounds=1, iterations=1)
+    _assert_no_errors(filenames)
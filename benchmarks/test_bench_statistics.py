@@ -0,0 +1,38 @@
+import h5rdmtoolbox as h5tbx
+import pytest
+
+# noinspection PyUnresolvedReferences
+import standardpostpiv
+from standardpostpiv.flags import eval_flags
+from standardpostpiv.statistics import developing_mean, developing_std, developing_relative_standard_deviation, \
+    is_gaussian, stats
+
+
+@pytest.fixture(scope='module')
+def data(piv_file):
+    with h5tbx.File(piv_file) as h5:
+        return {'dx': h5['dx'][()], 'dy': h5['dy'][()], 'piv_flags': h5['piv_flags'][()]}
+
+
+def test_eval_flags(benchmark, data):
+    benchmark(eval_flags, data['piv_flags'])
+
+
+@pytest.mark.parametrize('func', [developing_mean, developing_std, developing_relative_standard_deviation],
+                         ids=lambda f: f.__name__)
+def test_developing(benchmark, data, func):
+    benchmark(func, data['dx'].values, 0)
+
+
+def test_developing_mean_accessor(benchmark, data):
+    benchmark(data['dx'].stdpiv.compute_developing_mean, 'reltime')
+
+
+@pytest.mark.parametrize('method', ['shapiro', 'agostino_pearson'])
+def test_is_gaussian(benchmark, data, method):
+    # a 16 x 16 window of the time series
+    benchmark(is_gaussian, data['dx'][:, :16, :16], method, 0, 0.05)
+
+
+def test_stats(benchmark, data):
+    benchmark(stats, data['dx'])
@@ -0,0 +1,16 @@
+"""Peak-memory regression of the report stages. The maximal ratio of a stage's
+peak RSS increase and the input size is set with STANDARDPOSTPIV_MAX_MEMORY_RATIO."""
+import os
+
+from conftest import SCALES, get_scales
+
+from standardpostpiv.memprofile import run_memory_harness
+
+MAX_RATIO = float(os.environ.get('STANDARDPOSTPIV_MAX_MEMORY_RATIO', 4))
+
+
+def test_report_stage_memory(tmp_path):
+    table = run_memory_harness([SCALES[scale] for scale in get_scales()], directory=tmp_path,
+                               trace_python=False, max_ratio=MAX_RATIO)
+    print(table[['nt', 'ny', 'nx', 'stage', 'peak_rss_increase', 'ratio', 'error']].to_string(index=False))
+    assert table['error'].isna().all()
@@ -1,11 +1,63 @@
-from . import standardplots
-from . import xr_accessory
+import importlib
+import importlib.abc
+import importlib.util
+import sys
+
 from ._version import __version__
-from .core import StandardPIVResult
 from .logger import logger
-from .reports import get_basic_2D2C_report
+
+
+class _XarrayImportHook(importlib.abc.MetaPathFinder):
+    """Imports the accessor, which registers `.stdpiv` on xarray objects, as
+    soon as xarray is imported, so that importing the package does not import
+    xarray (and numpy, pandas)"""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != 'xarray':
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_register(module):
+            exec_module(module)
+            importlib.import_module('.xr_accessory', __name__)
+
+        spec.loader.exec_module = exec_and_register
+        return spec
+
+
+if 'xarray' in sys.modules:
+    from . import xr_accessory
+else:
+    sys.meta_path.insert(0, _XarrayImportHook())
+
+# Heavy modules (matplotlib, scipy, nbconvert, IPython, h5rdmtoolbox) are only
+# imported on first attribute access (PEP 562):
+_LAZY_SUBMODULES = ('animation', 'badge', 'batch', 'cellprofile', 'cli', 'core', 'executors', 'export', 'figcache',
+                    'flags', 'htmlrender', 'instrumentation', 'live', 'memprofile', 'notebook', 'plotting',
+                    'precompute', 'pyramid', 'reports', 'sectioncache', 'sectiongraph', 'service', 'standardplots',
+                    'statistics', 'synthetic', 'utils', 'xr_accessory')
+_LAZY_ATTRIBUTES = {'StandardPIVResult': 'core',
+                    'get_basic_2D2C_report': 'reports'}
 
 logger.debug('Init package "standardpostpiv"')
 logger.debug('Version: %s' % __version__)
 
-__all__ = ['__version__', 'logger']
+__all__ = ['__version__', 'logger', 'StandardPIVResult', 'get_basic_2D2C_report']
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f'.{_LAZY_ATTRIBUTES[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_SUBMODULES) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,258 @@
+"""Animation (movie) export of instantaneous PIV fields. The artists are created
+once and only their data is updated per frame, while a background thread
+prefetches the next frames from the (HDF5) data."""
+import pathlib
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from typing import Dict, Union
+
+import matplotlib as mpl
+import matplotlib.animation as mpl_animation
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import xarray as xr
+
+from . import plotting
+from .pyramid import FieldPyramid, block_mean
+from .utils import iter_chunks
+
+_STOP = object()
+
+
+class FramePrefetcher:
+    """Iterates frame-wise over one or multiple datasets with the same number of
+    frames (first axis). The data is read chunk by chunk in a background thread
+    and at most `maxsize` chunks are buffered.
+
+    Parameters
+    ----------
+    datasets: Dict[str, array-like]
+        Datasets to read, e.g. HDF5 datasets. Entries with value None are skipped.
+    chunk_size: int
+        Number of frames read at once
+    maxsize: int
+        Maximal number of buffered chunks
+    """
+
+    def __init__(self, datasets: Dict, chunk_size: int = 10, maxsize: int = 2):
+        self.datasets = {k: v for k, v in datasets.items() if v is not None}
+        self.chunk_size = chunk_size
+        self.maxsize = maxsize
+
+    def __len__(self):
+        return next(iter(self.datasets.values())).shape[0]
+
+    def _read(self, buffer: queue.Queue):
+        try:
+            names = list(self.datasets)
+            for chunks in zip(*[iter_chunks(self.datasets[n], self.chunk_size) for n in names]):
+                buffer.put(dict(zip(names, chunks)))
+        except Exception as e:
+            buffer.put(e)
+        buffer.put(_STOP)
+
+    def __iter__(self):
+        buffer = queue.Queue(maxsize=self.maxsize)
+        thread = threading.Thread(target=self._read, args=(buffer,), daemon=True)
+        thread.start()
+        while True:
+            chunks = buffer.get()
+            if chunks is _STOP:
+                break
+            if isinstance(chunks, Exception):
+                raise chunks
+            for i in range(next(iter(chunks.values())).shape[0]):
+                yield {k: v[i] for k, v in chunks.items()}
+        thread.join()
+
+
+def _values(frame) -> np.ndarray:
+    if isinstance(frame, xr.DataArray):
+        return frame.values
+    return np.asarray(frame)
+
+
+class PIVAnimation:
+    """Animation of an instantaneous scalar field with an optional quiver plot
+    on top, e.g. the displacement magnitude and the displacement vectors.
+
+    Parameters
+    ----------
+    field: array-like
+        Scalar field with shape (nt, ny, nx), e.g. an HDF5 dataset or xr.DataArray
+    u, v: array-like, optional
+        Vector components with the same shape as field for the quiver plot
+    every: Union[int, str]
+        Plot only every n-th vector. If 'auto', the vectors are block-averaged
+        (NaN aware) to the level matching `arrow_spacing` (see `StandardAxes.pivquiver`).
+    arrow_spacing: float
+        Approximate distance between two arrows in screen pixels if every='auto'
+    vmin, vmax: float, optional
+        Color limits. Default is the range of the first frame.
+    cmap: str
+        Colormap of the field
+    chunk_size: int
+        Number of frames read at once
+    ax: StandardAxes, optional
+        Axes to plot on. Default creates a new figure.
+    quiver_kwargs: Dict, optional
+        Parameters passed to `ax.quiver`
+    """
+
+    def __init__(self, field, u=None, v=None,
+                 every: Union[int, str] = 'auto',
+                 arrow_spacing: float = 16,
+                 vmin: float = None,
+                 vmax: float = None,
+                 cmap: str = 'viridis',
+                 chunk_size: int = 10,
+                 ax=None,
+                 quiver_kwargs: Dict = None):
+        if (u is None) != (v is None):
+            raise ValueError('Either both or none of u and v must be given')
+        self.prefetcher = FramePrefetcher({'field': field, 'u': u, 'v': v}, chunk_size=chunk_size)
+        self.every = every
+        self.arrow_spacing = arrow_spacing
+        if ax is None:
+            _, ax = plotting.subplots(1, 1, tight_layout=True)
+        self.ax = ax
+        self.fig = ax.figure
+
+        first = {k: v[0] for k, v in self.prefetcher.datasets.items()}
+        values = _values(first['field'])
+        ny, nx = values.shape
+        if isinstance(first['field'], xr.DataArray) and {'x', 'y'} <= set(first['field'].coords):
+            x, y = first['field'].x.values, first['field'].y.values
+        else:
+            x, y = np.arange(nx), np.arange(ny)
+        self._x, self._y = x, y
+        extent = (x[0] - (x[1] - x[0]) / 2, x[-1] + (x[1] - x[0]) / 2,
+                  y[0] - (y[1] - y[0]) / 2, y[-1] + (y[1] - y[0]) / 2)
+        if vmin is None:
+            vmin = np.nanmin(values)
+        if vmax is None:
+            vmax = np.nanmax(values)
+        self.image = ax.imshow(values, extent=extent, origin='lower', cmap=cmap, vmin=vmin, vmax=vmax,
+                               interpolation='nearest', animated=True)
+        self.fig.colorbar(self.image, ax=ax)
+        self.title = ax.set_title('', animated=True)
+
+        self.quiver = None
+        if u is not None:
+            qx, qy, qu, qv = self._vectors(first['u'], first['v'])
+            self.quiver = ax.quiver(qx, qy, qu, qv, animated=True, **(quiver_kwargs or {'color': 'k'}))
+        self.artists = [a for a in (self.image, self.quiver, self.title) if a is not None]
+
+    def __len__(self):
+        return len(self.prefetcher)
+
+    def _as_field(self, values) -> xr.DataArray:
+        return xr.DataArray(_values(values), dims=('y', 'x'), coords={'x': self._x, 'y': self._y})
+
+    def _vectors(self, u, v):
+        """Positions and components of the (decimated) vectors"""
+        if self.every == 'auto':
+            if not hasattr(self, '_level'):
+                # the level is selected once from the first frame and reused for all frames
+                pyramid = FieldPyramid(self._as_field(u))
+                bbox = self.ax.get_window_extent()
+                self._level = pyramid.select_level((bbox.height / self.arrow_spacing,
+                                                    bbox.width / self.arrow_spacing))
+                self._factor = pyramid.factor
+            u, v = (self._as_field(c) for c in (u, v))
+            for _ in range(self._level):
+                u, v = block_mean(u, self._factor), block_mean(v, self._factor)
+            return u.x.values, u.y.values, u.values, v.values
+        every = self.every
+        return self._x[::every], self._y[::every], _values(u)[::every, ::every], _values(v)[::every, ::every]
+
+    def update(self, frame: Dict, index: int = None):
+        """Updates the data of the artists with a frame returned by the prefetcher"""
+        self.image.set_data(_values(frame['field']))
+        if self.quiver is not None:
+            _, _, u, v = self._vectors(frame['u'], frame['v'])
+            self.quiver.set_UVC(u, v)
+        if index is not None:
+            self.title.set_text(f'frame {index}')
+        return self.artists
+
+    def to_funcanimation(self, interval: float = 40, **kwargs) -> mpl_animation.FuncAnimation:
+        """Returns a blitting FuncAnimation for interactive display"""
+        frames = enumerate(self.prefetcher)
+        return mpl_animation.FuncAnimation(self.fig, lambda f: self.update(f[1], f[0]), frames=frames,
+                                           interval=interval, blit=True, save_count=len(self), **kwargs)
+
+    def render_frames(self, dpi: int = 100):
+        """Yields the frames as RGBA arrays. The static part of the figure is drawn
+        once, per frame only the animated artists are drawn on top (blitting)."""
+        orig_canvas = self.fig.canvas
+        canvas = FigureCanvasAgg(self.fig)
+        try:
+            self.fig.set_dpi(dpi)
+            canvas.draw()
+            # the layout is fixed after the first draw:
+            if hasattr(self.fig, 'set_layout_engine'):
+                self.fig.set_layout_engine('none')
+            else:  # matplotlib < 3.6
+                self.fig.set_tight_layout(False)
+                self.fig.set_constrained_layout(False)
+            background = canvas.copy_from_bbox(self.fig.bbox)
+            for index, frame in enumerate(self.prefetcher):
+                canvas.restore_region(background)
+                for artist in self.update(frame, index):
+                    self.fig.draw_artist(artist)
+                yield np.asarray(canvas.buffer_rgba())
+        finally:
+            self.fig.set_canvas(orig_canvas)
+
+    def save(self, filename: Union[str, pathlib.Path], fps: int = 30, dpi: int = 100,
+             codec: str = 'h264') -> Dict:
+        """Writes the animation to a movie file. The rendered frames are piped to
+        ffmpeg (e.g. ".mp4") or, for ".gif", encoded with Pillow.
+
+        Parameters
+        ----------
+        filename: Union[str, pathlib.Path]
+            Movie filename
+        fps: int
+            Frames per second of the movie
+        dpi: int
+            Resolution of the frames
+        codec: str
+            Video codec used by ffmpeg
+
+        Returns
+        -------
+        Dict
+            Number of frames, total time in seconds and the encoding throughput in frames per second
+        """
+        filename = pathlib.Path(filename)
+        t0 = time.perf_counter()
+        n = 0
+        if filename.suffix == '.gif':
+            from PIL import Image
+            images = []
+            for n, rgba in enumerate(self.render_frames(dpi), start=1):
+                # 2: fast octree (Image.Quantize.FASTOCTREE requires Pillow >= 9.1)
+                images.append(Image.fromarray(rgba[..., :3]).quantize(method=2))
+            images[0].save(filename, save_all=True, append_images=images[1:],
+                           duration=int(1000 / fps), loop=0)
+        else:
+            ffmpeg = shutil.which(mpl.rcParams['animation.ffmpeg_path']) or shutil.which('ffmpeg')
+            if ffmpeg is None:
+                raise FileNotFoundError('ffmpeg not found. Install it or save a ".gif" file.')
+            width, height = (int(round(d)) for d in self.fig.get_size_inches() * dpi)
+            cmd = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-vcodec', codec, '-pix_fmt', 'yuv420p', str(filename)]
+            with subprocess.Popen(cmd, stdin=subprocess.PIPE) as proc:
+                for n, rgba in enumerate(self.render_frames(dpi), start=1):
+                    proc.stdin.write(rgba.tobytes())
+                proc.stdin.close()
+                if proc.wait() != 0:
+                    raise RuntimeError(f'ffmpeg failed with return code {proc.returncode}')
+        dt = time.perf_counter() - t0
+        return {'nframes': n, 'time': dt, 'fps': n / dt if dt > 0 else np.nan}
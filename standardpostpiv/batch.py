@@ -0,0 +1,422 @@
+"""Batch generation of reports for many HDF5 files. Every file is processed in
+its own worker process, so a crashing or hanging report does not affect the
+other files: a worker exceeding the timeout is killed (including the Jupyter
+kernel it started). Reports which are newer than their HDF5 file are skipped.
+A summary with the status, runtime and valid detection probability (VDP) of
+every file is written as CSV and HTML."""
+import glob
+import html
+import json
+import multiprocessing
+import os
+import pathlib
+import signal
+import time
+import traceback
+from multiprocessing.connection import wait
+from typing import Dict, Iterable, List, Union
+
+from .logger import logger, get_log_queue
+from .utils import run_in_thread
+
+SUMMARY_COLUMNS = ('filename', 'status', 'vdp', 'runtime', 'ipynb', 'html', 'error')
+
+# flags counted as edited vectors by the VDP (see the statistics section of the report)
+_EDITED_FLAGS = ('NORESULT', 'FILTERED', 'INTERPOLATED', 'REPLACED', 'MANUALEDIT')
+
+
+class ReportResult:
+    """Status of the report of a single HDF5 file (runtime in seconds). The
+    status is one of "ok", "failed", "timeout" or "skipped"."""
+    __slots__ = ('filename', 'status', 'vdp', 'runtime', 'ipynb', 'html', 'error')
+
+    def __init__(self, filename, status=None, vdp=None, runtime=None, ipynb=None, html=None, error=None):
+        self.filename = filename
+        self.status = status
+        self.vdp = vdp
+        self.runtime = runtime
+        self.ipynb = ipynb
+        self.html = html
+        self.error = error
+
+    def __repr__(self):
+        return f'<ReportResult filename={self.filename}, status={self.status}, vdp={self.vdp}>'
+
+    def to_dict(self) -> Dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def mean_vdp(hdf_filename: Union[str, pathlib.Path], flag_name: str = 'piv_flags',
+             chunk_size: int = 100) -> Union[float, None]:
+    """Mean valid detection probability of a PIV file, computed like in the
+    statistics section of the report. The flags are read in chunks of
+    `chunk_size` frames. Returns None if the file has no flags."""
+    import h5py
+    import numpy as np
+
+    with h5py.File(hdf_filename, 'r') as h5:
+        if flag_name not in h5:
+            return None
+        ds = h5[flag_name]
+        flag_meaning = ds.attrs.get('flag_meaning', None)
+        if flag_meaning is None:
+            return None
+        if isinstance(flag_meaning, (str, bytes)):
+            flag_meaning = json.loads(flag_meaning)
+        bits = {v: int(k) for k, v in flag_meaning.items()}
+        if 'ACTIVE' not in bits:
+            return None
+        edited_bits = [bits[f] for f in _EDITED_FLAGS if f in bits]
+        if ds.ndim < 2:
+            return None
+        vdp = []
+        for i0 in range(0, ds.shape[0], chunk_size):
+            flags = ds[i0:i0 + chunk_size].reshape(min(chunk_size, ds.shape[0] - i0), -1)
+            active = np.count_nonzero(flags & bits['ACTIVE'], axis=1)
+            edited = np.sum([np.count_nonzero(flags & b, axis=1) for b in edited_bits], axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vdp.append((active - edited) / active)
+    return float(np.nanmean(np.concatenate(vdp)))
+
+
+def report_filenames(hdf_filename: Union[str, pathlib.Path],
+                     output_dir: Union[str, pathlib.Path] = None) -> Dict[str, pathlib.Path]:
+    """Filenames of the notebook and html report of `hdf_filename`. The default
+    folder is the one of the HDF5 file (like `PIVReportNotebook.create()`)."""
+    hdf_filename = pathlib.Path(hdf_filename)
+    output_dir = hdf_filename.parent if output_dir is None else pathlib.Path(output_dir)
+    ipynb = output_dir / f'{hdf_filename.stem}_StdPIVReport.ipynb'
+    return {'ipynb': ipynb, 'html': ipynb.with_suffix('.html')}
+
+
+def is_up_to_date(hdf_filename: Union[str, pathlib.Path], output_dir: Union[str, pathlib.Path] = None,
+                  to_html: bool = True) -> bool:
+    """Whether the report files of `hdf_filename` exist and are newer than the HDF5 file"""
+    filenames = report_filenames(hdf_filename, output_dir)
+    targets = [filenames['ipynb'], filenames['html']] if to_html else [filenames['ipynb']]
+    if not all(t.exists() for t in targets):
+        return False
+    hdf_mtime = pathlib.Path(hdf_filename).stat().st_mtime
+    return all(t.stat().st_mtime >= hdf_mtime for t in targets)
+
+
+def notebook_errors(nb) -> List[str]:
+    """Errors ("ename: evalue") of the cells of an executed notebook"""
+    return [f'{output.ename}: {output.evalue}'
+            for cell in nb.cells if cell.cell_type == 'code'
+            for output in cell.get('outputs', []) if output.output_type == 'error']
+
+
+def _report_worker(hdf_filename: str, output_dir: str, to_html: bool, executor: str, cache: bool,
+                   html_renderer: str, precompute: bool, conn, log_queue=None):
+    """Builds and executes the report of a single file (runs in a worker process)"""
+    if hasattr(os, 'setsid'):
+        # own process group, so that a timeout also kills the kernel of the worker
+        os.setsid()
+    import matplotlib
+    matplotlib.use('Agg')
+    if log_queue is not None:
+        from .logger import worker_logging
+        worker_logging(log_queue)
+    from .reports import get_basic_2D2C_report
+
+    result = ReportResult(hdf_filename)
+    t0 = time.perf_counter()
+    try:
+        filenames = report_filenames(hdf_filename, output_dir)
+        filenames['ipynb'].parent.mkdir(parents=True, exist_ok=True)
+        report = get_basic_2D2C_report(hdf_filename, precompute=precompute)
+        out = report.create(filenames['ipynb'], execute_notebook=True, overwrite=True, inplace=True,
+                            to_html=to_html, executor=executor, cache=cache, html_renderer=html_renderer)
+        result.ipynb = str(out['ipynb'])
+        result.html = None if out.get('html') is None else str(out['html'])
+        errors = notebook_errors(report.notebook)
+        if errors:
+            result.status = 'failed'
+            result.error = f'{len(errors)} cell(s) failed, first: {errors[0]}'
+        else:
+            result.status = 'ok'
+        result.vdp = mean_vdp(hdf_filename)
+    except Exception as e:
+        result.status = 'failed'
+        result.error = f'{type(e).__name__}: {e}'
+        logger.debug(traceback.format_exc())
+    result.runtime = time.perf_counter() - t0
+    conn.send(result.to_dict())
+    conn.close()
+
+
+def _kill(process):
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.kill()
+    else:
+        process.kill()
+    process.join()
+
+
+def expand_filenames(patterns: Iterable[Union[str, pathlib.Path]]) -> List[pathlib.Path]:
+    """Expands glob patterns (recursive with "**") to a sorted list of unique files"""
+    filenames = set()
+    for pattern in patterns:
+        matches = glob.glob(str(pattern), recursive=True)
+        filenames.update(pathlib.Path(m) for m in matches if pathlib.Path(m).is_file())
+    return sorted(filenames)
+
+
+def run_reports(filenames: Iterable[Union[str, pathlib.Path]],
+                jobs: int = None,
+                timeout: float = None,
+                force: bool = False,
+                output_dir: Union[str, pathlib.Path] = None,
+                to_html: bool = True,
+                executor: str = 'inprocess',
+                cache: bool = False,
+                html_renderer: str = 'nbconvert',
+                precompute: bool = False) -> List[ReportResult]:
+    """Builds and executes the basic report of every file in parallel worker
+    processes (one process per file).
+
+    Parameters
+    ----------
+    filenames: Iterable[Union[str, pathlib.Path]]
+        HDF5 files with PIV data with standard names
+    jobs: int, optional
+        Number of concurrent worker processes. Default is the number of CPUs.
+    timeout: float, optional
+        Timeout per file in seconds. The worker (and its kernel) is killed
+        if the timeout is exceeded.
+    force: bool
+        Whether to regenerate reports that are newer than their HDF5 file
+    output_dir: Union[str, pathlib.Path], optional
+        Folder of the reports. Default is the folder of each HDF5 file.
+    to_html: bool
+        Whether to convert the notebooks to html
+    executor: str
+        Executor of the notebooks in the workers, 'inprocess' (default) or
+        'kernel' (see `PIVReportNotebook.execute()`)
+    cache: bool
+        Whether to use the section cache, so that regenerated reports only
+        execute the changed sections (see `sectioncache`)
+    html_renderer: str
+        'nbconvert' (default) or 'static' (lightweight html with separate figure
+        files, see `htmlrender`)
+    precompute: bool
+        Whether to read each PIV file once in a first section and only plot
+        from the summary (see `get_basic_2D2C_report()`)
+
+    Returns
+    -------
+    List[ReportResult]
+        Results in the order of `filenames`
+    """
+    filenames = [pathlib.Path(f) for f in filenames]
+    jobs = jobs or os.cpu_count() or 1
+    results = [None] * len(filenames)
+    pending = []
+    for i, filename in enumerate(filenames):
+        if not force and is_up_to_date(filename, output_dir, to_html):
+            targets = report_filenames(filename, output_dir)
+            try:
+                vdp = mean_vdp(filename)
+            except Exception:
+                vdp = None
+            results[i] = ReportResult(str(filename), 'skipped', vdp=vdp, ipynb=str(targets['ipynb']),
+                                      html=str(targets['html']) if to_html else None)
+            logger.info(f'Skipping {filename}: report is up to date')
+        else:
+            pending.append(i)
+
+    ctx = multiprocessing.get_context()
+    running = {}  # sentinel -> (index, process, connection, start time)
+    pending = pending[::-1]
+    while pending or running:
+        while pending and len(running) < jobs:
+            i = pending.pop()
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_report_worker,
+                                  args=(str(filenames[i]), None if output_dir is None else str(output_dir),
+                                        to_html, executor, cache, html_renderer, precompute, send_conn,
+                                        get_log_queue()),
+                                  daemon=False)
+            process.start()
+            send_conn.close()
+            running[process.sentinel] = (i, process, recv_conn, time.perf_counter())
+            logger.info(f'Generating report of {filenames[i]}')
+
+        if timeout is None:
+            wait_time = None
+        else:
+            now = time.perf_counter()
+            wait_time = max(0., min(t0 + timeout - now for _, _, _, t0 in running.values()))
+        ready = wait(list(running), timeout=wait_time)
+
+        for sentinel in ready:
+            i, process, conn, t0 = running.pop(sentinel)
+            process.join()
+            if conn.poll():
+                result = ReportResult(**conn.recv())
+            else:
+                result = ReportResult(str(filenames[i]), 'failed', runtime=time.perf_counter() - t0,
+                                      error=f'Worker exited with code {process.exitcode}')
+            conn.close()
+            results[i] = result
+
+        if timeout is not None:
+            now = time.perf_counter()
+            for sentinel, (i, process, conn, t0) in list(running.items()):
+                if now - t0 >= timeout:
+                    _kill(process)
+                    conn.close()
+                    running.pop(sentinel)
+                    results[i] = ReportResult(str(filenames[i]), 'timeout', runtime=now - t0,
+                                              error=f'Timeout after {timeout} s')
+
+    for result in results:
+        if result.status in ('failed', 'timeout'):
+            logger.error(f'Report of {result.filename} {result.status}: {result.error}')
+    return results
+
+
+async def _report_async(hdf_filename: pathlib.Path, output_dir, to_html: bool, executor: str, cache: bool,
+                        html_renderer: str, precompute: bool) -> ReportResult:
+    """Builds and executes the report of a single file in the event loop"""
+    from .reports import get_basic_2D2C_report
+
+    result = ReportResult(str(hdf_filename))
+    t0 = time.perf_counter()
+    try:
+        filenames = report_filenames(hdf_filename, output_dir)
+        filenames['ipynb'].parent.mkdir(parents=True, exist_ok=True)
+        report = get_basic_2D2C_report(hdf_filename, precompute=precompute)
+        out = await report.create_async(filenames['ipynb'], execute_notebook=True, overwrite=True, inplace=True,
+                                        to_html=to_html, executor=executor, cache=cache,
+                                        html_renderer=html_renderer)
+        result.ipynb = str(out['ipynb'])
+        result.html = None if out.get('html') is None else str(out['html'])
+        errors = notebook_errors(report.notebook)
+        if errors:
+            result.status = 'failed'
+            result.error = f'{len(errors)} cell(s) failed, first: {errors[0]}'
+        else:
+            result.status = 'ok'
+        result.vdp = await run_in_thread(mean_vdp, hdf_filename)
+    except Exception as e:
+        result.status = 'failed'
+        result.error = f'{type(e).__name__}: {e}'
+        logger.debug(traceback.format_exc())
+    result.runtime = time.perf_counter() - t0
+    return result
+
+
+async def run_reports_async(filenames: Iterable[Union[str, pathlib.Path]],
+                            max_concurrent: int = 8,
+                            timeout: float = None,
+                            force: bool = False,
+                            output_dir: Union[str, pathlib.Path] = None,
+                            to_html: bool = True,
+                            executor: str = 'kernel',
+                            cache: bool = False,
+                            html_renderer: str = 'nbconvert',
+                            precompute: bool = False) -> List[ReportResult]:
+    """Builds and executes the basic report of every file concurrently from
+    the running event loop (see `PIVReportNotebook.create_async()`). At most
+    `max_concurrent` reports (i.e. kernels) run at the same time. In contrast
+    to `run_reports()`, no worker processes are started, which suits the
+    'kernel' executor: the reports mostly wait on their kernels, and the
+    kernel of a report exceeding `timeout` is shut down (other executors run
+    in a thread, which is abandoned). The other parameters are those of
+    `run_reports()`.
+
+    Returns
+    -------
+    List[ReportResult]
+        Results in the order of `filenames`
+    """
+    import asyncio
+
+    filenames = [pathlib.Path(f) for f in filenames]
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _run(filename: pathlib.Path) -> ReportResult:
+        if not force and is_up_to_date(filename, output_dir, to_html):
+            targets = report_filenames(filename, output_dir)
+            try:
+                vdp = await run_in_thread(mean_vdp, filename)
+            except Exception:
+                vdp = None
+            logger.info(f'Skipping {filename}: report is up to date')
+            return ReportResult(str(filename), 'skipped', vdp=vdp, ipynb=str(targets['ipynb']),
+                                html=str(targets['html']) if to_html else None)
+        async with semaphore:
+            logger.info(f'Generating report of {filename}')
+            t0 = time.perf_counter()
+            try:
+                # a cancelled execution shuts its kernel down
+                return await asyncio.wait_for(
+                    _report_async(filename, output_dir, to_html, executor, cache, html_renderer, precompute),
+                    timeout)
+            except asyncio.TimeoutError:
+                return ReportResult(str(filename), 'timeout', runtime=time.perf_counter() - t0,
+                                    error=f'Timeout after {timeout} s')
+
+    results = await asyncio.gather(*[_run(filename) for filename in filenames])
+    for result in results:
+        if result.status in ('failed', 'timeout'):
+            logger.error(f'Report of {result.filename} {result.status}: {result.error}')
+    return list(results)
+
+
+def _format(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f'{value:.3f}'
+    return str(value)
+
+
+def write_summary(results: List[ReportResult], directory: Union[str, pathlib.Path],
+                  name: str = 'summary') -> Dict[str, pathlib.Path]:
+    """Writes the results as CSV and HTML index (with links to the reports)
+    into `directory` and returns the filenames"""
+    import csv
+
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    csv_filename = directory / f'{name}.csv'
+    with open(csv_filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result.to_dict())
+
+    colors = {'ok': '#dff0d8', 'skipped': '#eeeeee', 'failed': '#f2dede', 'timeout': '#fcf8e3'}
+    rows = []
+    for result in results:
+        link = result.html or result.ipynb
+        if link:
+            link = os.path.relpath(link, directory)
+            report = f'<a href="{html.escape(link)}">{html.escape(pathlib.Path(link).name)}</a>'
+        else:
+            report = ''
+        rows.append(f'<tr style="background-color:{colors.get(result.status, "white")}">'
+                    f'<td>{html.escape(str(result.filename))}</td>'
+                    f'<td>{html.escape(_format(result.status))}</td>'
+                    f'<td>{_format(result.vdp)}</td>'
+                    f'<td>{_format(result.runtime)}</td>'
+                    f'<td>{report}</td>'
+                    f'<td>{html.escape(_format(result.error))}</td></tr>')
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    html_filename = directory / f'{name}.html'
+    html_filename.write_text(
+        '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>PIV report summary</title>\n'
+        '<style>table {border-collapse: collapse} td, th {border: 1px solid #ccc; padding: 4px 8px}</style>\n'
+        '</head>\n<body>\n<h1>PIV report summary</h1>\n'
+        f'<p>{", ".join(f"{k}: {v}" for k, v in sorted(counts.items()))}</p>\n'
+        '<table>\n<tr><th>File</th><th>Status</th><th>VDP</th><th>Runtime [s]</th><th>Report</th>'
+        '<th>Error</th></tr>\n' + '\n'.join(rows) + '\n</table>\n</body>\n</html>\n')
+    return {'csv': csv_filename, 'html': html_filename}
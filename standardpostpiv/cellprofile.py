@@ -0,0 +1,225 @@
+"""Runtime and memory profile of the cells of executed report notebooks. The
+executors record the wall time and the peak increase of the resident set size
+of every code cell in the cell metadata ("profile"). `PIVReportNotebook.execute()`
+appends a "Report performance" section listing the most expensive cells and
+exports the profile as JSON next to the notebook, so the cost of a report can
+be tracked across software versions and datasets."""
+import datetime
+import json
+import pathlib
+import platform
+import time
+from typing import Callable, Dict, List, Union
+
+import nbformat
+
+from ._version import __version__
+from .instrumentation import current_rss, peak_rss, reset_peak_rss
+
+PROFILE_KEY = 'profile'
+PERFORMANCE_LABEL = 'performance'
+
+
+class CellTimer:
+    """Measures the wall time and the memory of a cell execution in the
+    process `pid`. If `pid` is None (e.g. a remote kernel), only the wall
+    time is measured. Memory is only measured on linux.
+
+    Parameters
+    ----------
+    pid: Union[int, str, None]
+        Process id or "self" for the current process
+    """
+    __slots__ = ('pid', 't0', 'rss_before', 'peak_is_reset')
+
+    def __init__(self, pid: Union[int, str, None] = 'self'):
+        self.pid = pid
+        self.t0 = None
+        self.rss_before = None
+        self.peak_is_reset = False
+
+    def __repr__(self):
+        return f'<CellTimer pid={self.pid}>'
+
+    def start(self) -> 'CellTimer':
+        if self.pid is not None:
+            self.peak_is_reset = reset_peak_rss(self.pid)
+            self.rss_before = current_rss(self.pid)
+        self.t0 = time.perf_counter()
+        return self
+
+    def stop(self) -> Dict:
+        """Returns the profile of the cell: wall time in seconds, the peak RSS
+        above the RSS at the start ("peak_memory_delta") and the change of the
+        RSS ("rss_delta") in bytes. Memory values are None if not available."""
+        wall_time = time.perf_counter() - self.t0
+        peak_delta, rss_delta = None, None
+        if self.rss_before is not None:
+            rss = current_rss(self.pid)
+            if rss is not None:
+                rss_delta = rss - self.rss_before
+            # without a reset, the peak is the one of the process lifetime
+            peak = peak_rss(self.pid) if self.peak_is_reset else None
+            if peak is not None:
+                peak_delta = max(peak - self.rss_before, 0)
+        return {'wall_time': wall_time, 'peak_memory_delta': peak_delta, 'rss_delta': rss_delta}
+
+
+def record(cell: nbformat.NotebookNode, profile: Dict):
+    """Writes the `profile` into the metadata of `cell`"""
+    cell.metadata[PROFILE_KEY] = profile
+
+
+class KernelCellProfiler:
+    """Records the profile of cells executed in a Jupyter kernel with the
+    hooks of nbclient (`on_cell_execute`, `on_cell_executed`). The memory is
+    that of the kernel process returned by `get_pid`."""
+    __slots__ = ('get_pid', '_timer')
+
+    def __init__(self, get_pid: Callable[[], Union[int, None]]):
+        self.get_pid = get_pid
+        self._timer = None
+
+    def __repr__(self):
+        return f'<KernelCellProfiler pid={self.get_pid()}>'
+
+    def on_cell_execute(self, cell, cell_index):
+        self._timer = CellTimer(self.get_pid()).start()
+
+    def on_cell_executed(self, cell, cell_index, execute_reply):
+        if self._timer is not None:
+            record(cell, self._timer.stop())
+            self._timer = None
+
+    def attach(self, client):
+        """Registers the hooks at the nbclient `NotebookClient` (or `ExecutePreprocessor`) `client`"""
+        client.on_cell_execute = self.on_cell_execute
+        client.on_cell_executed = self.on_cell_executed
+        return client
+
+
+def kernel_pid(client) -> Union[int, None]:
+    """Process id of the (local) kernel of an nbclient `client`"""
+    km = getattr(client, 'km', None)
+    return getattr(getattr(km, 'provisioner', None), 'pid', None)
+
+
+def _first_line(source: str, n: int = 60) -> str:
+    for line in source.split('\n'):
+        if line.strip() and not line.lstrip().startswith('#'):
+            return line.strip() if len(line.strip()) <= n else line.strip()[:n - 3] + '...'
+    return ''
+
+
+def cell_profiles(nb: nbformat.NotebookNode) -> List[Dict]:
+    """Profile of every code cell of the executed notebook `nb`. Cells without
+    a profile (e.g. restored from the section cache) have "profiled" False."""
+    rows = []
+    for index, cell in enumerate(nb.cells):
+        if cell.cell_type != 'code':
+            continue
+        profile = cell.metadata.get(PROFILE_KEY, None)
+        row = {'index': index, 'section': cell.metadata.get('section', None),
+               'execution_count': cell.execution_count, 'source': _first_line(cell.source),
+               'profiled': profile is not None, 'wall_time': None, 'peak_memory_delta': None, 'rss_delta': None}
+        row.update(profile or {})
+        rows.append(row)
+    return rows
+
+
+def _max(values) -> Union[int, None]:
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def profile_summary(nb: nbformat.NotebookNode, hdf_filename: Union[str, pathlib.Path] = None) -> Dict:
+    """Summary of the cell profiles of an executed notebook: the cells, the
+    totals per section and of the report and information about the software
+    version and the dataset"""
+    cells = cell_profiles(nb)
+    profiled = [c for c in cells if c['profiled']]
+    sections = {}
+    for c in profiled:
+        section = sections.setdefault(c['section'], {'n_cells': 0, 'wall_time': 0., 'peak_memory_delta': None})
+        section['n_cells'] += 1
+        section['wall_time'] += c['wall_time']
+        section['peak_memory_delta'] = _max([section['peak_memory_delta'], c['peak_memory_delta']])
+    hdf_size = None
+    if hdf_filename is not None and pathlib.Path(hdf_filename).exists():
+        hdf_size = pathlib.Path(hdf_filename).stat().st_size
+    return {'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'hdf_filename': None if hdf_filename is None else str(hdf_filename),
+            'hdf_size': hdf_size,
+            'totals': {'n_cells': len(cells), 'n_profiled': len(profiled),
+                       'wall_time': sum(c['wall_time'] for c in profiled),
+                       'peak_memory_delta': _max(c['peak_memory_delta'] for c in profiled)},
+            'sections': sections,
+            'cells': cells}
+
+
+def _mb(value: Union[int, None]) -> str:
+    return '-' if value is None else f'{value / 1024 ** 2:.1f}'
+
+
+def _md(text) -> str:
+    """Escapes text for a markdown table cell"""
+    return str(text).replace('|', '\\|')
+
+
+def performance_markdown(summary: Dict, level: int = 2, n_cells: int = 15) -> str:
+    """Markdown of the "Report performance" section: the totals, the `n_cells`
+    slowest cells and the sections sorted by wall time"""
+    totals = summary['totals']
+    total_time = totals['wall_time']
+    lines = [f'{"#" * level} Report performance <a id="piv-{PERFORMANCE_LABEL}"></a>', '',
+             f'Total: **{total_time:.2f} s** wall time in {totals["n_profiled"]} code cells, '
+             f'largest peak memory increase of a cell: **{_mb(totals["peak_memory_delta"])} MB** '
+             f'(standardpostpiv {summary["version"]}, Python {summary["python"]}).']
+    n_unprofiled = totals['n_cells'] - totals['n_profiled']
+    if n_unprofiled:
+        lines[-1] += f' {n_unprofiled} cells were not executed (e.g. restored from the cache).'
+    if not totals['n_profiled']:
+        return '\n'.join(lines)
+
+    cells = sorted((c for c in summary['cells'] if c['profiled']), key=lambda c: c['wall_time'], reverse=True)
+    lines += ['', '| Cell | Section | Code | Wall time / s | Share | Peak memory increase / MB |',
+              '|---:|---|---|---:|---:|---:|']
+    for c in cells[:n_cells]:
+        share = c['wall_time'] / total_time if total_time else 0.
+        lines.append(f'| {c["execution_count"]} | {_md(c["section"])} | `{_md(c["source"])}` | '
+                     f'{c["wall_time"]:.3f} | {share:.1%} | {_mb(c["peak_memory_delta"])} |')
+    if len(cells) > n_cells:
+        rest = cells[n_cells:]
+        lines.append(f'| | | {len(rest)} more cells | {sum(c["wall_time"] for c in rest):.3f} | | |')
+
+    lines += ['', '| Section | Cells | Wall time / s | Share | Peak memory increase / MB |',
+              '|---|---:|---:|---:|---:|']
+    for name, s in sorted(summary['sections'].items(), key=lambda item: item[1]['wall_time'], reverse=True):
+        share = s['wall_time'] / total_time if total_time else 0.
+        lines.append(f'| {_md(name)} | {s["n_cells"]} | {s["wall_time"]:.3f} | {share:.1%} | '
+                     f'{_mb(s["peak_memory_delta"])} |')
+    lines.append(f'| **Total** | {totals["n_profiled"]} | **{total_time:.3f}** | 100.0% | '
+                 f'{_mb(totals["peak_memory_delta"])} |')
+    return '\n'.join(lines)
+
+
+def add_performance_section(nb: nbformat.NotebookNode, summary: Dict, level: int = 2,
+                            n_cells: int = 15) -> nbformat.NotebookNode:
+    """Appends the "Report performance" section to `nb`. A performance section
+    of a previous execution is replaced."""
+    nb.cells = [cell for cell in nb.cells if cell.metadata.get('section', None) != PERFORMANCE_LABEL]
+    cell = nbformat.v4.new_markdown_cell(performance_markdown(summary, level=level, n_cells=n_cells))
+    cell.metadata['section'] = PERFORMANCE_LABEL
+    nb.cells.append(cell)
+    return nb
+
+
+def write_profile(summary: Dict, filename: Union[str, pathlib.Path]) -> pathlib.Path:
+    """Writes the profile `summary` as JSON"""
+    filename = pathlib.Path(filename)
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return filename
@@ -0,0 +1,131 @@
+"""Command line interface.
+
+Usage::
+
+    standardpostpiv report "campaign/**/*.hdf" -j 8 --timeout 600
+    standardpostpiv serve campaign/ --port 8765
+    standardpostpiv watch run1.hdf --html run1_live.html
+"""
+import argparse
+import logging
+import pathlib
+import sys
+
+from .logger import configure_logging, shutdown_logging
+
+
+def _report(args) -> int:
+    from .batch import expand_filenames, run_reports, write_summary
+
+    filenames = expand_filenames(args.patterns)
+    if not filenames:
+        print(f'No files found matching {" ".join(args.patterns)}', file=sys.stderr)
+        return 1
+    results = run_reports(filenames, jobs=args.jobs, timeout=args.timeout, force=args.force,
+                          output_dir=args.output_dir, to_html=not args.no_html, executor=args.executor,
+                          cache=args.cache, html_renderer='static' if args.static_html else 'nbconvert',
+                          precompute=args.precompute)
+    summary_dir = args.summary_dir or args.output_dir or pathlib.Path.cwd()
+    summary = write_summary(results, summary_dir)
+
+    for result in results:
+        vdp = '' if result.vdp is None else f'{result.vdp:.3f}'
+        runtime = '' if result.runtime is None else f'{result.runtime:.1f} s'
+        print(f'{result.status:8s} {vdp:6s} {runtime:>9s}  {result.filename}')
+    print(f'Summary: {summary["html"]}')
+    return int(any(r.status in ('failed', 'timeout') for r in results))
+
+
+def _serve(args) -> int:
+    from .service import serve
+
+    serve(args.root, host=args.host, port=args.port, memory_budget=int(args.memory_budget * 1024 ** 2),
+          idle_timeout=args.idle_timeout)
+    return 0
+
+
+def _watch(args) -> int:
+    from .live import LiveReport, watch
+
+    callback = None
+    if args.html is not None:
+        callback = LiveReport(args.html, reload=max(args.interval, 1))
+
+    def _print(live, n_new):
+        if callback is not None:
+            callback(live, n_new)
+        vdp = live.summary().vdp()
+        print(f'{live.n_frames:8d} frames (+{n_new}), VDP of the last frame: {float(vdp[-1]):.3f}')
+
+    try:
+        watch(args.filename, summary_filename=args.summary, interval=args.interval, timeout=args.timeout,
+              idle_timeout=args.idle_timeout, callback=_print)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='standardpostpiv',
+                                     description='Post-processing of PIV data with standard names')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Debug output')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report = subparsers.add_parser('report', help='Generate the basic report of many HDF5 files in parallel')
+    report.add_argument('patterns', nargs='+', help='HDF5 files or glob patterns (use quotes for "**")')
+    report.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default: number of CPUs)')
+    report.add_argument('--timeout', type=float, default=None, help='Timeout per file in seconds')
+    report.add_argument('-f', '--force', action='store_true',
+                        help='Regenerate reports that are newer than their HDF5 file')
+    report.add_argument('-o', '--output-dir', default=None,
+                        help='Folder of the reports (default: folder of each HDF5 file)')
+    report.add_argument('--summary-dir', default=None,
+                        help='Folder of summary.csv and summary.html (default: output dir or cwd)')
+    report.add_argument('--no-html', action='store_true', help='Do not convert the notebooks to html')
+    report.add_argument('--static-html', action='store_true',
+                        help='Render lightweight html pages with separate figure files instead of nbconvert')
+    report.add_argument('--executor', choices=('inprocess', 'kernel'), default='inprocess',
+                        help='Execute the notebooks in the worker process (default) or in a Jupyter kernel')
+    report.add_argument('--cache', action='store_true',
+                        help='Cache the outputs of the sections and only execute changed sections')
+    report.add_argument('--precompute', action='store_true',
+                        help='Read each PIV file once in a first section and only plot from the summary')
+    report.set_defaults(func=_report)
+
+    serve = subparsers.add_parser('serve', help='Serve the reports of the HDF5 files in a folder on demand')
+    serve.add_argument('root', nargs='?', default='.', help='Folder of the HDF5 files (default: cwd)')
+    serve.add_argument('--host', default='127.0.0.1', help='Host to bind (default: 127.0.0.1)')
+    serve.add_argument('-p', '--port', type=int, default=8765, help='Port (default: 8765)')
+    serve.add_argument('--memory-budget', type=float, default=2048,
+                       help='Memory of the warm reports in MB, least recently used reports are evicted '
+                            '(default: 2048)')
+    serve.add_argument('--idle-timeout', type=float, default=1800,
+                       help='Seconds after which an unused report is evicted (default: 1800)')
+    serve.set_defaults(func=_serve)
+
+    watch = subparsers.add_parser('watch', help='Update the statistics of a PIV file while frames are appended '
+                                                '(HDF5 SWMR)')
+    watch.add_argument('filename', help='HDF5 file being written')
+    watch.add_argument('--interval', type=float, default=1., help='Seconds between two polls (default: 1)')
+    watch.add_argument('--html', default=None, help='Html page re-rendered after every update')
+    watch.add_argument('--summary', default=None,
+                       help='Live summary file (default: a file in the user cache directory)')
+    watch.add_argument('--timeout', type=float, default=None, help='Stop after this many seconds')
+    watch.add_argument('--idle-timeout', type=float, default=None,
+                       help='Stop if no frames were appended for this many seconds')
+    watch.set_defaults(func=_watch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+    configure_logging(logging.DEBUG if args.verbose else None, logfile=False, use_queue=True)
+    try:
+        return args.func(args)
+    finally:
+        shutdown_logging()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,8 @@
 import h5rdmtoolbox as h5tbx
 import pathlib
 
+from .instrumentation import instrument, span
+
 
 def to_quantity(da):
     """Convert a (0-dimensional) DataArray to a pint Quantity"""
@@ -9,23 +11,50 @@ def to_quantity(da):
     raise ValueError('DataArray must be 0D')
 
 
+class InstrumentedDataset:
+    """Wraps a dataset and records every read (`ds[...]`) as span "core.read".
+    All other attributes are taken from the wrapped dataset."""
+    __slots__ = ('_dataset', '_name')
+
+    def __init__(self, dataset, name: str):
+        self._dataset = dataset
+        self._name = name
+
+    def __getitem__(self, item):
+        with span('core.read', 'core', dataset=self._name, selection=repr(item)):
+            return self._dataset[item]
+
+    def __getattr__(self, item):
+        return getattr(self._dataset, item)
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __repr__(self):
+        return repr(self._dataset)
+
+
 class StandardPIVResult:
     """Interface class to PIV results stored in a HDF5 file"""
 
+    @instrument
     def __init__(self, hdf_filename):
         self.hdf_filename = pathlib.Path(hdf_filename)
         distinct_standard_names = h5tbx.distinct(self.hdf_filename, 'standard_name')
         for dsn in distinct_standard_names:
-            setattr(self, dsn, h5tbx.FileDB(self.hdf_filename).find_one({'standard_name': dsn}))
+            setattr(self, dsn, InstrumentedDataset(h5tbx.FileDB(self.hdf_filename).find_one({'standard_name': dsn}),
+                                                   dsn))
         with h5tbx.File(self.hdf_filename) as h5:
             self._param_grp_name = h5.find_one({'piv_method': {'$exists': True}}).name
 
     @property
+    @instrument
     def eval_method(self):
         with h5tbx.File(self.hdf_filename) as h5:
             return h5[self._param_grp_name].attrs['piv_method']
 
     @property
+    @instrument
     def final_iw_size(self):  # -> Tuple[int, int]:
         with h5tbx.File(self.hdf_filename) as h5:
             x = int(h5[self._param_grp_name]['x_final_iw_size'][()])
@@ -33,6 +62,7 @@ class StandardPIVResult:
         return x, y
 
     @property
+    @instrument
     def overlap(self):  # -> Tuple[int, int]:
         with h5tbx.File(self.hdf_filename) as h5:
             x = int(h5[self._param_grp_name]['x_final_iw_overlap_size'][()])
@@ -40,6 +70,7 @@ class StandardPIVResult:
         return x, y
 
     @property
+    @instrument
     def piv_dim(self):
         with h5tbx.File(self.hdf_filename) as h5:
             z_displacement = h5.find_one({'standard_name': 'z_displacement'})
@@ -50,6 +81,7 @@ class StandardPIVResult:
                 return '2D3C'
 
     @property
+    @instrument
     def piv_type(self):
         with h5tbx.File(self.hdf_filename) as h5:
             x_velocity = h5.find_one({'standard_name': 'x_velocity'})
@@ -60,6 +92,7 @@ class StandardPIVResult:
             if x_velocity.ndim == 3:
                 return 'mplane'
 
+    @instrument
     def get_mask(self):
         return self.piv_flags[()] & 2
 
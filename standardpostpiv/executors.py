@@ -0,0 +1,481 @@
+"""Executors of report notebooks. The default is the Jupyter kernel
+(`nbconvert.preprocessors.ExecutePreprocessor`). The `InProcessExecutor` runs
+the cells in a persistent namespace of the current process instead, which
+avoids the kernel start-up, the re-import of all modules and the message
+round-trips per cell. This is much faster for batch jobs on many files. If the
+full fidelity of a kernel is needed, the `KernelPool` keeps warm kernels to
+execute many notebooks back to back."""
+import ast
+import base64
+import io
+import platform
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import nbformat
+
+from .cellprofile import CellTimer, KernelCellProfiler, kernel_pid, record
+from .instrumentation import instrument
+from .logger import logger
+from .notebook_utils.pivreport_sections import imports
+
+
+class InProcessExecutor:
+    """Executes the code cells of a notebook in-process and writes stdout,
+    stderr, display data, matplotlib figures, results and errors as nbformat
+    outputs into the cells. The interface is that of
+    `ExecutePreprocessor.preprocess()`.
+
+    Parameters
+    ----------
+    allow_errors: bool
+        If False, a `CellExecutionError` is raised for the first failing cell.
+        Otherwise, the error is written to the cell outputs and the execution continues.
+    figure_format: str
+        Format of the captured figures ("png" or "svg")
+    dpi: float, optional
+        Resolution of png figures. Default is the savefig dpi of matplotlib.
+    reset_namespace: bool
+        Whether to start every notebook with an empty namespace. Imported
+        modules stay loaded in any case.
+    """
+
+    # stdout/stderr capturing and matplotlib are process-wide: one notebook at a time
+    _lock = threading.RLock()
+
+    def __init__(self, allow_errors: bool = True, figure_format: str = 'png', dpi: float = None,
+                 reset_namespace: bool = True):
+        if figure_format not in ('png', 'svg'):
+            raise ValueError(f'figure_format must be "png" or "svg" but got "{figure_format}"')
+        self.allow_errors = allow_errors
+        self.figure_format = figure_format
+        self.dpi = dpi
+        self.reset_namespace = reset_namespace
+        self.namespace = {}
+        self.execution_count = 0
+        self._shell = None
+
+    def __repr__(self):
+        return f'<InProcessExecutor execution_count={self.execution_count}, n_names={len(self.namespace)}>'
+
+    @property
+    def shell(self):
+        """IPython shell used to transform magics, format results and capture `display()` calls"""
+        if self._shell is None:
+            from IPython.core.interactiveshell import InteractiveShell
+            from traitlets.config import Config
+
+            # no history database: it could only be used from the thread creating the shell
+            config = Config()
+            config.HistoryManager.enabled = False
+            self._shell = InteractiveShell.instance(config=config)
+        return self._shell
+
+    def reset(self):
+        """Clears the namespace and the execution count"""
+        self.namespace = {'__name__': '__main__', '__builtins__': __builtins__,
+                          'get_ipython': lambda: self.shell}
+        self.execution_count = 0
+
+    def _exec(self, source: str, filename: str):
+        """Executes `source` and returns the value of a trailing expression (or None)"""
+        tree = ast.parse(self.shell.transform_cell(source), filename=filename)
+        last = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last = ast.Expression(tree.body.pop().value)
+        exec(compile(tree, filename, 'exec'), self.namespace)
+        if last is not None:
+            return eval(compile(last, filename, 'eval'), self.namespace)
+        return None
+
+    def execute_silent(self, source: str):
+        """Executes `source` in the namespace without any output: stdout and
+        stderr are discarded and open figures are closed. Errors are raised."""
+        import matplotlib.pyplot as plt
+        from IPython.utils.capture import capture_output
+
+        try:
+            with capture_output():
+                self._exec(source, '<silent>')
+        finally:
+            plt.close('all')
+
+    def _figure_outputs(self) -> List:
+        """Returns all open matplotlib figures as display data and closes them
+        (like the inline backend)"""
+        import matplotlib.pyplot as plt
+        outputs = []
+        for num in plt.get_fignums():
+            fig = plt.figure(num)
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format=self.figure_format, dpi=self.dpi, bbox_inches='tight')
+            if self.figure_format == 'png':
+                data = {'image/png': base64.b64encode(buffer.getvalue()).decode('ascii')}
+            else:
+                data = {'image/svg+xml': buffer.getvalue().decode('utf-8')}
+            data['text/plain'] = repr(fig)
+            outputs.append(nbformat.v4.new_output('display_data', data=data))
+            plt.close(fig)
+        return outputs
+
+    @instrument
+    def run_cell(self, source: str) -> Tuple[List, Dict]:
+        """Executes the code `source` and returns its outputs and the error
+        output (None if successful)"""
+        from IPython.utils.capture import capture_output
+
+        self.execution_count += 1
+        result, error = None, None
+        with capture_output() as captured:
+            try:
+                result = self._exec(source, f'<cell-{self.execution_count}>')
+            except Exception as e:
+                tb = traceback.format_exception(type(e), e, e.__traceback__.tb_next)
+                error = nbformat.v4.new_output('error', ename=type(e).__name__, evalue=str(e),
+                                               traceback=[line.rstrip('\n') for line in tb])
+
+        outputs = []
+        if captured.stdout:
+            outputs.append(nbformat.v4.new_output('stream', name='stdout', text=captured.stdout))
+        if captured.stderr:
+            outputs.append(nbformat.v4.new_output('stream', name='stderr', text=captured.stderr))
+        for rich_output in captured.outputs:
+            outputs.append(nbformat.v4.new_output('display_data', data=rich_output.data,
+                                                  metadata=rich_output.metadata))
+        if result is not None:
+            data, metadata = self.shell.display_formatter.format(result)
+            outputs.append(nbformat.v4.new_output('execute_result', data=data, metadata=metadata,
+                                                  execution_count=self.execution_count))
+        outputs.extend(self._figure_outputs())
+        if error is not None:
+            outputs.append(error)
+        return outputs, error
+
+    @instrument
+    def preprocess(self, nb: nbformat.NotebookNode, resources: Dict = None) -> Tuple[nbformat.NotebookNode, Dict]:
+        """Executes all code cells of the notebook `nb` in place. The wall time
+        and memory of every cell are recorded in the cell metadata (see `cellprofile`).
+
+        Parameters
+        ----------
+        nb: nbformat.NotebookNode
+            The notebook
+        resources: Dict, optional
+            Resources (returned unchanged)
+
+        Returns
+        -------
+        Tuple[nbformat.NotebookNode, Dict]
+            The executed notebook and the resources
+        """
+        import matplotlib
+        import matplotlib.pyplot as plt
+
+        with self._lock:
+            if self.reset_namespace or not self.namespace:
+                self.reset()
+            backend = matplotlib.get_backend()
+            plt.switch_backend('Agg')
+            try:
+                for cell in nb.cells:
+                    if cell.cell_type != 'code':
+                        continue
+                    timer = CellTimer().start()
+                    cell.outputs, error = self.run_cell(cell.source)
+                    record(cell, timer.stop())
+                    cell.execution_count = self.execution_count
+                    if error is not None:
+                        logger.debug(f'Cell {self.execution_count} failed: {error.ename}: {error.evalue}')
+                        if not self.allow_errors:
+                            from nbclient.exceptions import CellExecutionError
+                            raise CellExecutionError.from_cell_and_msg(cell, error)
+            finally:
+                plt.switch_backend(backend)
+        nb.metadata['language_info'] = {'name': 'python', 'version': platform.python_version()}
+        return nb, resources or {}
+
+
+def get_executor(executor='kernel'):
+    """Returns the executor of a notebook: 'kernel' (`ExecutePreprocessor`),
+    'inprocess' (`InProcessExecutor`), 'parallel' (`sectiongraph.ParallelExecutor`)
+    or `executor` itself if it has a method `preprocess(notebook)`"""
+    if executor == 'kernel':
+        from nbconvert.preprocessors import ExecutePreprocessor
+        ep = ExecutePreprocessor(timeout=600, kernel='python3')
+        ep.allow_errors = True
+        ep.store_widget_state = False
+        KernelCellProfiler(lambda: kernel_pid(ep)).attach(ep)
+        return ep
+    if executor == 'inprocess':
+        return InProcessExecutor()
+    if executor == 'parallel':
+        from .sectiongraph import ParallelExecutor
+        return ParallelExecutor()
+    if hasattr(executor, 'preprocess'):
+        return executor
+    raise ValueError(f'executor must be "kernel", "inprocess", "parallel" or an object with a method '
+                     f'"preprocess" but got {executor!r}')
+
+
+def get_async_client(nb: nbformat.NotebookNode):
+    """Returns an nbclient `NotebookClient` executing `nb` in a new kernel like
+    the 'kernel' executor. Run it with `await client.async_execute()`."""
+    from nbclient import NotebookClient
+
+    client = NotebookClient(nb, timeout=600, allow_errors=True, store_widget_state=False)
+    KernelCellProfiler(lambda: kernel_pid(client)).attach(client)
+    return client
+
+
+# modules imported by the imports section of the report, preloaded into the kernels of a `KernelPool`
+DEFAULT_PRELOAD = '\n'.join(line for line in imports.codecells_info.splitlines()
+                            if line.startswith(('import ', 'from ')))
+
+# clears the user namespace, the imported modules stay loaded
+RESET_CODE = """get_ipython().run_line_magic('reset', '-f')
+__import__('matplotlib.pyplot').pyplot.close('all')
+__import__('gc').collect()"""
+
+
+def _process_rss(pid: int) -> Union[int, None]:
+    """Resident set size of process `pid` in bytes (linux only, else None)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, TypeError):
+        return None
+
+
+class PooledKernel:
+    """A running kernel of a `KernelPool`"""
+    __slots__ = ('km', 'uses')
+
+    def __init__(self, km):
+        self.km = km
+        self.uses = 0
+
+    def __repr__(self):
+        return f'<PooledKernel pid={self.pid}, uses={self.uses}, rss={self.rss}>'
+
+    @property
+    def pid(self) -> Union[int, None]:
+        return getattr(self.km.provisioner, 'pid', None)
+
+    @property
+    def rss(self) -> Union[int, None]:
+        """Resident set size of the kernel process in bytes"""
+        return _process_rss(self.pid)
+
+
+class KernelPool:
+    """Pool of warm Jupyter kernels to execute many notebooks back to back.
+    The kernels are started once and the `preload` code (imports) is executed,
+    so a notebook does not pay the kernel start-up and the imports. Before each
+    notebook, the namespace of the kernel is reset. A kernel is replaced by a
+    fresh one after `max_uses` notebooks or if its memory exceeds `max_memory`.
+    If a kernel cannot be started, its slot stays in the pool empty and the
+    start is retried by the next `acquire()`, which raises the error if it
+    fails again.
+
+    The pool is thread-safe: up to `n` notebooks are executed concurrently if
+    `execute()` is called from multiple threads. It can be passed as executor
+    to `PIVReportNotebook.execute()`.
+
+    Parameters
+    ----------
+    n: int
+        Number of kernels
+    kernel_name: str
+        Name of the kernel spec
+    preload: str
+        Code executed once after a kernel is started
+    max_uses: int, optional
+        Number of notebooks after which a kernel is replaced
+    max_memory: int, optional
+        Resident set size in bytes above which a kernel is replaced after a notebook
+    timeout: int
+        Timeout of a single cell in seconds
+    startup_timeout: int
+        Timeout of the kernel start-up in seconds
+    allow_errors: bool
+        Whether to continue the execution of a notebook after a failing cell
+    """
+
+    def __init__(self, n: int = 2, kernel_name: str = 'python3', preload: str = DEFAULT_PRELOAD,
+                 max_uses: int = 20, max_memory: int = None, timeout: int = 600, startup_timeout: int = 60,
+                 allow_errors: bool = True):
+        self.n = n
+        self.kernel_name = kernel_name
+        self.preload = preload
+        self.max_uses = max_uses
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.allow_errors = allow_errors
+        self.n_started = 0
+        self._started = False
+        self._idle = queue.Queue()  # idle kernels and empty slots (None)
+        self._kernels = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<KernelPool n={self.n}, n_started={self.n_started}, idle={self._idle.qsize()}>'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.shutdown()
+
+    def _run(self, kernel: PooledKernel, nb: nbformat.NotebookNode, timeout: int, allow_errors: bool,
+             resources: Dict = None) -> nbformat.NotebookNode:
+        """Executes `nb` on `kernel`. Every execution uses a new client, because
+        the blocking client of jupyter_client cannot be shared with the event
+        loop of nbclient. The kernel stays alive."""
+        from nbclient import NotebookClient
+
+        client = NotebookClient(nb, km=kernel.km, timeout=timeout, startup_timeout=self.startup_timeout,
+                                allow_errors=allow_errors, store_widget_state=False, resources=resources or {})
+        KernelCellProfiler(lambda: kernel.pid).attach(client)
+        try:
+            client.execute()
+        finally:
+            if client.kc is not None:
+                client.kc.stop_channels()
+        return nb
+
+    def _run_code(self, kernel: PooledKernel, code: str, timeout: int):
+        """Executes `code` on `kernel` and raises CellExecutionError on failure"""
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_code_cell(code)]
+        self._run(kernel, nb, timeout=timeout, allow_errors=False)
+
+    @instrument
+    def _start_kernel(self) -> PooledKernel:
+        from jupyter_client import KernelManager
+
+        km = KernelManager(kernel_name=self.kernel_name)
+        km.start_kernel()
+        kernel = PooledKernel(km)
+        if self.preload:
+            try:
+                self._run_code(kernel, self.preload, timeout=self.startup_timeout)
+            except Exception as e:
+                logger.warning(f'Preloading kernel {kernel.pid} failed: {e}')
+        with self._lock:
+            self._kernels.append(kernel)
+            self.n_started += 1
+        logger.debug(f'Started kernel {kernel.pid}')
+        return kernel
+
+    def _stop_kernel(self, kernel: PooledKernel):
+        with self._lock:
+            if kernel in self._kernels:
+                self._kernels.remove(kernel)
+        try:
+            kernel.km.shutdown_kernel(now=True)
+        except Exception as e:
+            logger.debug(f'Shutting down kernel {kernel.pid} failed: {e}')
+
+    def _start_kernel_or_free_slot(self) -> PooledKernel:
+        """Starts a kernel for a slot taken from the pool. If the start fails,
+        the empty slot is returned to the pool and the error is raised."""
+        try:
+            return self._start_kernel()
+        except Exception:
+            self._idle.put(None)
+            raise
+
+    def start(self):
+        """Starts (and preloads) the kernels concurrently. Raises the error of
+        the kernel start-up if no kernel could be started."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        errors = []
+
+        def start_kernel(_):
+            try:
+                return self._start_kernel()
+            except Exception as e:
+                logger.warning(f'Starting a kernel failed: {e}')
+                errors.append(e)
+
+        with ThreadPoolExecutor(self.n) as executor:
+            for kernel in executor.map(start_kernel, range(self.n)):
+                self._idle.put(kernel)
+        if len(errors) == self.n:
+            raise errors[0]
+
+    def shutdown(self):
+        """Shuts all kernels down"""
+        for kernel in list(self._kernels):
+            self._stop_kernel(kernel)
+        self._idle = queue.Queue()
+        self._started = False
+
+    def acquire(self, timeout: float = None) -> PooledKernel:
+        """Returns an idle kernel with a reset namespace (blocks until one is
+        available, at most `timeout` seconds). Raises the error of the kernel
+        start-up if a kernel needs to be started and fails."""
+        self.start()
+        kernel = self._idle.get(timeout=timeout)
+        if kernel is None:
+            return self._start_kernel_or_free_slot()
+        if not kernel.km.is_alive():
+            logger.warning(f'Kernel {kernel.pid} died and is replaced')
+            self._stop_kernel(kernel)
+            return self._start_kernel_or_free_slot()
+        if kernel.uses > 0:
+            try:
+                self._run_code(kernel, RESET_CODE, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f'Resetting kernel {kernel.pid} failed ({e}), it is replaced')
+                self._stop_kernel(kernel)
+                return self._start_kernel_or_free_slot()
+        return kernel
+
+    def release(self, kernel: PooledKernel):
+        """Returns a kernel to the pool. It is replaced if it was used `max_uses`
+        times or its memory exceeds `max_memory`."""
+        kernel.uses += 1
+        recycle = None
+        if not kernel.km.is_alive():
+            recycle = 'kernel death'
+        elif self.max_uses is not None and kernel.uses >= self.max_uses:
+            recycle = f'{kernel.uses} uses'
+        elif self.max_memory is not None:
+            rss = kernel.rss
+            if rss is not None and rss > self.max_memory:
+                recycle = f'{rss / 1024 ** 2:.0f} MB RSS'
+        if recycle:
+            logger.debug(f'Recycling kernel {kernel.pid} after {recycle}')
+            self._stop_kernel(kernel)
+            try:
+                kernel = self._start_kernel()
+            except Exception as e:
+                # the empty slot is filled by the next acquire()
+                logger.warning(f'Starting a kernel failed: {e}')
+                kernel = None
+        self._idle.put(kernel)
+
+    @instrument
+    def execute(self, nb: nbformat.NotebookNode, resources: Dict = None) -> nbformat.NotebookNode:
+        """Executes the notebook `nb` in place on a warm kernel and returns it"""
+        kernel = self.acquire()
+        try:
+            self._run(kernel, nb, timeout=self.timeout, allow_errors=self.allow_errors, resources=resources)
+        finally:
+            self.release(kernel)
+        return nb
+
+    def preprocess(self, nb: nbformat.NotebookNode, resources: Dict = None) -> Tuple[nbformat.NotebookNode, Dict]:
+        """Interface of `ExecutePreprocessor.preprocess()`"""
+        return self.execute(nb, resources), resources or {}
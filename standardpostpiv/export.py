@@ -0,0 +1,186 @@
+"""Batch export of figures in a process pool"""
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Union
+
+from .figcache import PDFTEX_SUFFIXES, figure_key
+from .logger import logger, get_log_queue
+
+
+class FigureSpec:
+    """Specification of a figure to be exported
+
+    Parameters
+    ----------
+    func: Callable
+        Function returning a matplotlib figure. Must be picklable, e.g. a
+        module-level function.
+    filename: Union[str, pathlib.Path]
+        Target filename. The suffix selects the format (e.g. ".svg", ".png").
+    kwargs: Dict, optional
+        Parameters passed to `func`
+    savefig_kwargs: Dict, optional
+        Parameters passed to `fig.savefig`
+    """
+    __slots__ = ('func', 'filename', 'kwargs', 'savefig_kwargs')
+
+    def __init__(self, func: Callable, filename: Union[str, pathlib.Path],
+                 kwargs: Dict = None, savefig_kwargs: Dict = None):
+        self.func = func
+        self.filename = pathlib.Path(filename)
+        self.kwargs = kwargs or {}
+        self.savefig_kwargs = savefig_kwargs or {}
+
+    def __repr__(self):
+        return f'<FigureSpec func={getattr(self.func, "__name__", self.func)}, filename={self.filename}>'
+
+
+class ExportResult:
+    """Result and timings (in seconds) of an exported figure"""
+    __slots__ = ('filename', 'render_time', 'save_time', 'pdftex_time', 'error', 'cached')
+
+    def __init__(self, filename, render_time=None, save_time=None, pdftex_time=None, error=None,
+                 cached=False):
+        self.filename = filename
+        self.render_time = render_time
+        self.save_time = save_time
+        self.pdftex_time = pdftex_time
+        self.error = error
+        self.cached = cached
+
+    def __repr__(self):
+        return f'<ExportResult filename={self.filename}, status={self.status}, total_time={self.total_time:.3f}>'
+
+    @property
+    def status(self) -> str:
+        if self.error:
+            return 'failed'
+        return 'cached' if self.cached else 'ok'
+
+    @property
+    def total_time(self) -> float:
+        return sum(t for t in (self.render_time, self.save_time, self.pdftex_time) if t is not None)
+
+
+def _init_worker(log_queue=None):
+    import matplotlib
+    matplotlib.use('Agg')
+    if log_queue is not None:
+        from .logger import worker_logging
+        worker_logging(log_queue)
+
+
+def _render(spec: FigureSpec) -> ExportResult:
+    """Renders and saves a single figure (executed in the worker processes)"""
+    import matplotlib.pyplot as plt
+    from .plotting import StdRcParam
+
+    result = ExportResult(spec.filename)
+    try:
+        with StdRcParam():
+            t0 = time.perf_counter()
+            fig = spec.func(**spec.kwargs)
+            result.render_time = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            fig.savefig(spec.filename, **spec.savefig_kwargs)
+            result.save_time = time.perf_counter() - t0
+            plt.close(fig)
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    return result
+
+
+def _convert(result: ExportResult) -> ExportResult:
+    """Converts an exported svg file for pdftex (executed in threads)"""
+    from .plotting import svg2pdftex
+
+    t0 = time.perf_counter()
+    try:
+        cp = svg2pdftex(result.filename)
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+    else:
+        if cp.returncode != 0:
+            result.error = f'svg2pdftex failed with return code {cp.returncode}'
+    result.pdftex_time = time.perf_counter() - t0
+    return result
+
+
+def _to_spec(spec) -> FigureSpec:
+    if isinstance(spec, FigureSpec):
+        return spec
+    if isinstance(spec, (tuple, list)):
+        return FigureSpec(*spec)
+    raise TypeError(f'Expected a FigureSpec or a tuple (func, filename[, kwargs]) but got {type(spec)}')
+
+
+def export_figures(specs: List, pdftex: bool = False, processes: int = None,
+                   threads: int = None, cache=None) -> List[ExportResult]:
+    """Renders and saves figures in a process pool using the Agg/SVG backends
+    and the standard style (`StdRcParam`). Optionally, the svg files are converted
+    for pdftex afterwards, running the conversions concurrently.
+
+    Parameters
+    ----------
+    specs: List[Union[FigureSpec, Tuple]]
+        Figures to export. Tuples are interpreted as (func, filename[, kwargs]).
+    pdftex: bool
+        Whether to convert the svg files for pdftex (see `plotting.svg2pdftex`)
+    processes: int, optional
+        Number of worker processes. Default is the number of CPUs.
+    threads: int, optional
+        Number of concurrent pdftex conversions. Default is the number of processes.
+    cache: figcache.FigureCache, optional
+        If given, figures whose function, kwargs and mplstyle are unchanged are
+        restored from the cache instead of being rendered and converted.
+
+    Returns
+    -------
+    List[ExportResult]
+        Results with per-figure timings in the order of `specs`
+    """
+    specs = [_to_spec(spec) for spec in specs]
+    if pdftex:
+        for spec in specs:
+            if spec.filename.suffix != '.svg':
+                raise ValueError(f'Filename suffix must be ".svg" for pdftex but is "{spec.filename.suffix}".')
+
+    results = [None] * len(specs)
+    keys = [None] * len(specs)
+    if cache is not None:
+        for i, spec in enumerate(specs):
+            keys[i] = figure_key(spec.func, spec.kwargs, suffix=spec.filename.suffix,
+                                 savefig_kwargs=spec.savefig_kwargs, pdftex=pdftex)
+            if cache.get(keys[i], spec.filename):
+                results[i] = ExportResult(spec.filename, cached=True)
+    to_render = [i for i, r in enumerate(results) if r is None]
+
+    if to_render:
+        # in the queue mode of the logger, the workers forward their records to the parent
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(get_log_queue(),)) as executor:
+            for i, result in zip(to_render, executor.map(_render, [specs[i] for i in to_render])):
+                results[i] = result
+
+    if pdftex:
+        to_convert = [results[i] for i in to_render if not results[i].error]
+        for result in to_convert:
+            # artefacts of a previous run must not be taken for the output of this one
+            for suffix in PDFTEX_SUFFIXES:
+                result.filename.with_suffix(suffix).unlink(missing_ok=True)
+        with ThreadPoolExecutor(max_workers=threads or processes) as executor:
+            list(executor.map(_convert, to_convert))
+
+    if cache is not None:
+        for i in to_render:
+            if not results[i].error:
+                cache.put(keys[i], specs[i].filename,
+                          [specs[i].filename.suffix, *(PDFTEX_SUFFIXES if pdftex else ())])
+
+    for result in results:
+        if result.error:
+            logger.error(f'Exporting {result.filename} failed: {result.error}')
+        else:
+            logger.debug(f'Exported {result.filename} in {result.total_time:.3f} s')
+    return results
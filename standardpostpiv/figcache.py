@@ -0,0 +1,203 @@
+"""Content-hash cache of exported figures (svg, pdf, pdf_tex, png, ...)"""
+import hashlib
+import inspect
+import json
+import pathlib
+import pickle
+import shutil
+import sys
+import time
+from typing import Callable, Dict, List, Union
+
+import appdirs
+import numpy as np
+import xarray as xr
+
+from ._version import __version__
+from .logger import logger
+
+DEFAULT_MAX_SIZE = 500 * 1024 ** 2  # bytes
+PDFTEX_SUFFIXES = ('.pdf', '.pdf_tex')  # files written by the pdftex conversion of an svg file
+
+
+def _update_hash(h, obj):
+    """Updates the hash `h` with the content of `obj`. Raises a TypeError for
+    objects whose content cannot be hashed (instead of hashing their repr)."""
+    h5py = sys.modules.get('h5py')  # h5py objects exist only if h5py is imported
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        h.update(f'{type(obj).__name__}:{obj!r}'.encode())
+    elif isinstance(obj, np.generic):
+        _update_hash(h, np.asarray(obj))
+    elif isinstance(obj, xr.DataArray):
+        h.update(b'DataArray')
+        _update_hash(h, obj.name)
+        _update_hash(h, obj.dims)
+        _update_hash(h, obj.values)
+        _update_hash(h, {k: v.values for k, v in obj.coords.items()})
+        _update_hash(h, obj.attrs)
+    elif isinstance(obj, xr.Dataset):
+        h.update(b'Dataset')
+        _update_hash(h, dict(obj.data_vars))
+        _update_hash(h, obj.attrs)
+    elif isinstance(obj, np.ndarray):
+        h.update(f'ndarray{obj.shape}{obj.dtype}'.encode())
+        h.update(np.ascontiguousarray(obj).view(np.uint8).data if obj.dtype != object else pickle.dumps(obj))
+    elif isinstance(obj, bytes):
+        h.update(obj)
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj, key=str):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(type(obj).__name__.encode())
+        for item in obj:
+            _update_hash(h, item)
+    elif isinstance(obj, pathlib.Path):
+        # files are identified by their path, size and modification time
+        h.update(str(obj.absolute()).encode())
+        if obj.exists():
+            stat = obj.stat()
+            h.update(f'{stat.st_size}{stat.st_mtime_ns}'.encode())
+    elif h5py is not None and isinstance(obj, (h5py.Dataset, h5py.Group)):
+        # HDF5 objects are identified by their file (path, size, modification time) and name
+        h.update(type(obj).__name__.encode())
+        _update_hash(h, pathlib.Path(obj.file.filename))
+        _update_hash(h, obj.name)
+    elif callable(obj) and hasattr(obj, '__code__'):
+        # only the source of the function itself is hashed, not the one of the
+        # functions it calls (see `figure_key`)
+        h.update(f'{obj.__module__}.{obj.__qualname__}'.encode())
+        try:
+            h.update(inspect.getsource(obj).encode())
+        except (OSError, TypeError):
+            h.update(obj.__code__.co_code)
+    else:
+        raise TypeError(f'Cannot hash the content of an object of type {type(obj).__name__}')
+
+
+def hash_content(*objs) -> str:
+    """Returns a hex digest of the content of the objects (numbers, strings,
+    arrays, DataArrays, dicts, lists, functions, files, HDF5 datasets). Raises a
+    TypeError for other objects."""
+    h = hashlib.sha256()
+    for obj in objs:
+        _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def figure_key(func: Callable, kwargs: Dict = None, mplstyle_filename=None, **extra) -> str:
+    """Cache key of a figure built by `func(**kwargs)` with the mplstyle file
+    `mplstyle_filename` (default: `plotting.MPLSTYLE_FILENAME`).
+
+    Only the source code of `func` itself is part of the key, changes of the
+    functions called by `func` are not detected (except for those of this
+    package, whose version is part of the key). Pass e.g. a version of such
+    helpers in `extra`."""
+    if mplstyle_filename is None:
+        from .plotting import MPLSTYLE_FILENAME
+        mplstyle_filename = MPLSTYLE_FILENAME
+    return hash_content(func, kwargs or {}, pathlib.Path(mplstyle_filename).read_bytes(), __version__, extra)
+
+
+class FigureCache:
+    """Cache of figure artefacts keyed by a content hash. Entries are evicted
+    (least recently used first) if the total size exceeds `max_size`.
+
+    Parameters
+    ----------
+    directory: Union[str, pathlib.Path], optional
+        Cache directory. Default is the user cache directory of standardpostpiv.
+    max_size: int
+        Maximal total size of the cache in bytes
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path] = None, max_size: int = DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = pathlib.Path(appdirs.user_cache_dir('standardpostpiv')) / 'figures'
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+    def __repr__(self):
+        return f'<FigureCache directory={self.directory}, n_entries={len(self.entries())}, size={self.size}>'
+
+    def __contains__(self, key: str) -> bool:
+        return (self.directory / key / 'meta.json').exists()
+
+    @property
+    def size(self) -> int:
+        """Total size of the cache in bytes"""
+        return sum(entry['size'] for entry in self.entries())
+
+    def entries(self) -> List[Dict]:
+        """Returns key, files, size and last access time of all entries"""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for meta_filename in self.directory.glob('*/meta.json'):
+            meta = json.loads(meta_filename.read_text())
+            meta['size'] = sum(f.stat().st_size for f in meta_filename.parent.iterdir())
+            entries.append(meta)
+        return entries
+
+    def get(self, key: str, filename: Union[str, pathlib.Path]) -> bool:
+        """Restores the artefacts of `key` next to `filename` (same stem, cached
+        suffixes). Returns False if the key is not cached."""
+        entry_dir = self.directory / key
+        meta_filename = entry_dir / 'meta.json'
+        if not meta_filename.exists():
+            return False
+        filename = pathlib.Path(filename)
+        meta = json.loads(meta_filename.read_text())
+        for suffix in meta['suffixes']:
+            target = filename.parent / f'{filename.stem}{suffix}'
+            if suffix == '.pdf_tex':
+                # the pdf_tex file references the pdf file by name
+                text = (entry_dir / f'artefact{suffix}').read_text()
+                target.write_text(text.replace(f'{meta["stem"]}.pdf', f'{filename.stem}.pdf'))
+            else:
+                shutil.copyfile(entry_dir / f'artefact{suffix}', target)
+        meta['last_access'] = time.time()
+        meta_filename.write_text(json.dumps(meta))
+        logger.debug(f'Restored {filename} from figure cache ({key})')
+        return True
+
+    def put(self, key: str, filename: Union[str, pathlib.Path], suffixes: List[str] = None):
+        """Stores the files with the stem of `filename` and the given suffixes
+        (default: only the suffix of filename) under `key`. Only pass the
+        suffixes the export wrote, other files with the same stem (e.g. from an
+        earlier run) must not end up in the cache. All files must exist."""
+        filename = pathlib.Path(filename)
+        if suffixes is None:
+            suffixes = [filename.suffix]
+        files = {s: filename.parent / f'{filename.stem}{s}' for s in dict.fromkeys(suffixes)}
+        missing = [str(f) for f in files.values() if not f.exists()]
+        if missing:
+            raise FileNotFoundError(f'Artefacts of {filename} not found: {missing}')
+        entry_dir = self.directory / key
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        for suffix, f in files.items():
+            shutil.copyfile(f, entry_dir / f'artefact{suffix}')
+        meta = {'key': key, 'stem': filename.stem, 'suffixes': list(files), 'last_access': time.time()}
+        (entry_dir / 'meta.json').write_text(json.dumps(meta))
+        self.evict()
+
+    def remove(self, key: str):
+        """Removes an entry"""
+        shutil.rmtree(self.directory / key, ignore_errors=True)
+
+    def evict(self):
+        """Removes least recently used entries until the size is below `max_size`"""
+        entries = sorted(self.entries(), key=lambda e: e['last_access'])
+        size = sum(e['size'] for e in entries)
+        for entry in entries:
+            if size <= self.max_size:
+                break
+            self.remove(entry['key'])
+            size -= entry['size']
+            logger.debug(f'Evicted {entry["key"]} from figure cache')
+
+    def clear(self):
+        """Removes all entries"""
+        for entry in self.entries():
+            self.remove(entry['key'])
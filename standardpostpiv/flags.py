@@ -1,7 +1,9 @@
 import numpy as np
 import xarray as xr
+from .instrumentation import instrument
 
 
+@instrument
 def apply_mask(da, flag):
     """Apply a mask to a DataArray"""
     if da.dims == flag.dims:
@@ -9,6 +11,7 @@ def apply_mask(da, flag):
     raise ValueError('Dimensions of DataArray and flag do not match')
 
 
+@instrument
 def eval_flags(flag_data: xr.DataArray, dim='reltime'):
     """Evaluate flags and return a dictionary of DataArrays
     with the number of flags per time step"""
@@ -0,0 +1,278 @@
+"""Lightweight static HTML rendering of executed reports. In contrast to the
+nbconvert `HTMLExporter`, no templates are involved and figures are not
+embedded as base64 but written once as separate (content-addressed) image
+files, which the browser loads lazily. The table of contents is built with
+`notebook_utils.toc.generate_toc_html` from the section headings."""
+import base64
+import hashlib
+import html
+import pathlib
+import re
+from typing import Dict, List, Tuple, Union
+
+import nbformat
+
+from .instrumentation import instrument
+from .notebook_utils.toc import generate_toc_html
+
+IMAGE_FORMATS = ('png', 'webp')
+MATHJAX_URL = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js'
+
+CSS = """body { font-family: -apple-system, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; margin: 0;
+       color: #222; line-height: 1.5; }
+nav.toc { position: fixed; top: 0; left: 0; bottom: 0; width: 260px; overflow-y: auto; padding: 1em;
+          background: #f7f7f7; border-right: 1px solid #ddd; font-size: 0.9em; box-sizing: border-box; }
+main { margin-left: 280px; max-width: 1100px; padding: 1em 2em; }
+body.no-toc main { margin-left: auto; margin-right: auto; }
+pre { background: #f5f5f5; padding: 0.5em; overflow-x: auto; font-size: 0.85em; }
+pre.input { border-left: 3px solid #9ab; }
+pre.stderr { background: #fdd; }
+pre.error { background: #fdd; border-left: 3px solid #c00; }
+img { max-width: 100%; height: auto; }
+details.code summary { cursor: pointer; color: #678; font-size: 0.8em; }
+@media (max-width: 900px) { nav.toc { position: static; width: auto; } main { margin-left: 0; } }
+"""
+
+_ANSI = re.compile(r'\x1b\[[0-9;]*[a-zA-Z]')
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*(?:<a id="piv-([^"]+)"></a>)?\s*$', re.MULTILINE)
+_SECTION_NUMBER = re.compile(r'^\d+(\.\d+)*\.?\s+')
+_MATH = re.compile(r'(\$\$.+?\$\$|\$[^$\n]+?\$|\\begin\{([a-z]+\*?)\}.+?\\end\{\2\})', re.DOTALL)
+
+
+def _markdown(text: str) -> str:
+    """Markdown to HTML. Math is protected from the markdown parser and rendered by MathJax."""
+    import mistune
+
+    math = []
+
+    def _protect(match):
+        math.append(match.group(0))
+        return f'MATHPLACEHOLDER{len(math) - 1}X'
+
+    rendered = mistune.html(_MATH.sub(_protect, text))
+    return re.sub(r'MATHPLACEHOLDER(\d+)X', lambda m: html.escape(math[int(m.group(1))], quote=False), rendered)
+
+
+def toc_data(nb: nbformat.NotebookNode) -> List[Tuple[int, str, str]]:
+    """(level, title, label) of the headings of the markdown cells like
+    `Section.get_toc()`. Section numbers are removed from the titles, they are
+    added by `generate_toc_html`."""
+    data = []
+    for cell in nb.cells:
+        if cell.cell_type == 'markdown':
+            for hashes, title, label in _HEADING.findall(cell.source):
+                data.append((len(hashes), _SECTION_NUMBER.sub('', title), label or None))
+    return data
+
+
+def _is_toc_cell(cell) -> bool:
+    return cell.cell_type == 'markdown' and 'class="dropdown-toc"' in cell.source
+
+
+def _png_size(data: bytes) -> Union[Tuple[int, int], None]:
+    """(width, height) from the IHDR chunk of a PNG"""
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+
+class _Assets:
+    """Writes figures as content-addressed files to the asset folder"""
+    __slots__ = ('directory', 'prefix', 'image_format', 'filenames', 'webp_quality')
+
+    def __init__(self, directory: pathlib.Path, prefix: str, image_format: str, webp_quality: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.image_format = image_format
+        self.webp_quality = webp_quality
+        self.filenames = []
+
+    def write(self, data: bytes, suffix: str) -> str:
+        name = f'{hashlib.sha256(data).hexdigest()[:20]}{suffix}'
+        filename = self.directory / name
+        if not filename.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            filename.write_bytes(data)
+        self.filenames.append(filename)
+        return f'{self.prefix}/{name}'
+
+    def image(self, data: bytes, mimetype: str, metadata: Dict) -> str:
+        size = None
+        if mimetype == 'image/svg+xml':
+            src = self.write(data, '.svg')
+        elif mimetype == 'image/png' and self.image_format == 'webp':
+            import io
+            from PIL import Image
+
+            with Image.open(io.BytesIO(data)) as img:
+                size = img.size
+                buffer = io.BytesIO()
+                img.save(buffer, 'WEBP', quality=self.webp_quality, method=4)
+            src = self.write(buffer.getvalue(), '.webp')
+        else:
+            if mimetype == 'image/png':
+                size = _png_size(data)
+            src = self.write(data, '.' + mimetype.split('/')[1])
+        width, height = metadata.get('width'), metadata.get('height')
+        if width is None and size is not None:
+            width, height = size
+        attrs = f' width="{width}" height="{height}"' if width and height else ''
+        return f'<img src="{src}" loading="lazy" decoding="async"{attrs} alt="figure">'
+
+
+class _InlineAssets:
+    """Embeds figures as data URIs (for pages served on demand)"""
+    __slots__ = ()
+
+    def image(self, data: bytes, mimetype: str, metadata: Dict) -> str:
+        size = _png_size(data) if mimetype == 'image/png' else None
+        width, height = metadata.get('width'), metadata.get('height')
+        if width is None and size is not None:
+            width, height = size
+        attrs = f' width="{width}" height="{height}"' if width and height else ''
+        return f'<img src="data:{mimetype};base64,{base64.b64encode(data).decode("ascii")}"{attrs} alt="figure">'
+
+
+def _text(value: Union[str, List[str]]) -> str:
+    """Text of a (possibly multiline list) notebook output field"""
+    return value if isinstance(value, str) else ''.join(value)
+
+
+def _render_output(output, assets: _Assets) -> str:
+    if output.output_type == 'stream':
+        return f'<pre class="{output.name}">{html.escape(_text(output.text))}</pre>'
+    if output.output_type == 'error':
+        traceback = _ANSI.sub('', '\n'.join(output.traceback))
+        return f'<pre class="error">{html.escape(traceback)}</pre>'
+    data = output.get('data', {})
+    metadata = output.get('metadata', {})
+    for mimetype in ('image/svg+xml', 'image/png', 'image/jpeg', 'image/gif'):
+        if mimetype in data:
+            if mimetype == 'image/svg+xml':
+                raw = _text(data[mimetype]).encode()
+            else:
+                raw = base64.b64decode(_text(data[mimetype]))
+            return assets.image(raw, mimetype, metadata.get(mimetype, {}))
+    if 'text/html' in data:
+        return f'<div class="output">{_text(data["text/html"])}</div>'
+    if 'text/markdown' in data:
+        return f'<div class="output">{_markdown(_text(data["text/markdown"]))}</div>'
+    if 'text/latex' in data:
+        return f'<div class="output">{html.escape(_text(data["text/latex"]))}</div>'
+    if 'text/plain' in data:
+        return f'<pre class="output">{html.escape(_text(data["text/plain"]))}</pre>'
+    return ''
+
+
+@instrument
+def render_html(nb: nbformat.NotebookNode,
+                html_filename: Union[str, pathlib.Path],
+                title: str = None,
+                toc: bool = True,
+                show_code: bool = True,
+                image_format: str = 'png',
+                webp_quality: int = 90,
+                mathjax: bool = True) -> Dict:
+    """Renders an executed notebook (e.g. `PIVReportNotebook.notebook`) to a
+    static HTML page. Figures are written to the folder "<stem>_files" next to
+    the HTML file and loaded lazily by the browser.
+
+    Parameters
+    ----------
+    nb: nbformat.NotebookNode
+        The (executed) notebook
+    html_filename: Union[str, pathlib.Path]
+        Target filename
+    title: str, optional
+        Title of the page. Default is the first heading.
+    toc: bool
+        Whether to show the table of contents as side bar. Table of contents
+        cells of the notebook are replaced by the side bar.
+    show_code: bool
+        Whether to show the code of the cells (collapsed)
+    image_format: str
+        "png" (the figures are written as they are) or "webp" (smaller files,
+        re-encoded with Pillow). SVG figures are always written as SVG.
+    webp_quality: int
+        Quality of the WebP images (0-100)
+    mathjax: bool
+        Whether to load MathJax to render math in the markdown cells
+
+    Returns
+    -------
+    Dict
+        The filenames of the html file ("html") and of the images ("assets")
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f'image_format must be one of {IMAGE_FORMATS} but got "{image_format}"')
+    html_filename = pathlib.Path(html_filename)
+    assets = _Assets(html_filename.parent / f'{html_filename.stem}_files', f'{html_filename.stem}_files',
+                     image_format, webp_quality)
+
+    headings = toc_data(nb)
+    if title is None:
+        title = headings[0][1] if headings else html_filename.stem
+
+    body = _render_cells(nb.cells, assets, skip_toc=toc, show_code=show_code)
+    nav = f'<nav class="toc">{generate_toc_html(headings)}</nav>' if toc and headings else ''
+    html_filename.write_text(_page(title, body, nav, mathjax), encoding='utf-8')
+    return {'html': html_filename, 'assets': sorted(set(assets.filenames))}
+
+
+def render_inline_html(cells: List[nbformat.NotebookNode], title: str, show_code: bool = False,
+                       mathjax: bool = True) -> str:
+    """Renders (executed) notebook cells to a self-contained HTML page with the
+    figures embedded as data URIs
+
+    Parameters
+    ----------
+    cells: List[nbformat.NotebookNode]
+        The cells, e.g. of a single section
+    title: str
+        Title of the page
+    show_code: bool
+        Whether to show the code of the cells (collapsed)
+    mathjax: bool
+        Whether to load MathJax to render math in the markdown cells
+
+    Returns
+    -------
+    str
+        The html page
+    """
+    return _page(title, _render_cells(cells, _InlineAssets(), skip_toc=True, show_code=show_code), '', mathjax)
+
+
+def _render_cells(cells, assets, skip_toc: bool, show_code: bool) -> List[str]:
+    """HTML of the cells, grouped by section"""
+    body = []
+    current_section = None
+    for cell in cells:
+        if skip_toc and _is_toc_cell(cell):
+            continue
+        section = cell.get('metadata', {}).get('section', None)
+        if section != current_section:
+            if current_section is not None:
+                body.append('</section>')
+            body.append(f'<section data-section="{html.escape(str(section))}">')
+            current_section = section
+        if cell.cell_type == 'markdown':
+            body.append(_markdown(cell.source))
+        elif cell.cell_type == 'code':
+            if show_code and cell.source.strip():
+                body.append('<details class="code"><summary>code</summary>'
+                            f'<pre class="input">{html.escape(cell.source)}</pre></details>')
+            body.extend(_render_output(output, assets) for output in cell.get('outputs', []))
+    if current_section is not None:
+        body.append('</section>')
+    return body
+
+
+def _page(title: str, body: List[str], nav: str, mathjax: bool) -> str:
+    math = ('<script>MathJax = {tex: {inlineMath: [["$", "$"], ["\\\\(", "\\\\)"]]}};</script>'
+            f'<script async src="{MATHJAX_URL}"></script>') if mathjax else ''
+    return (f'<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8">\n'
+            f'<meta name="viewport" content="width=device-width, initial-scale=1">\n'
+            f'<title>{html.escape(title)}</title>\n<style>\n{CSS}</style>\n{math}\n</head>\n'
+            f'<body class="{"toc" if nav else "no-toc"}">\n{nav}\n<main>\n' + '\n'.join(body) +
+            '\n</main>\n</body>\n</html>\n')
@@ -0,0 +1,279 @@
+"""Opt-in instrumentation of the hot paths (HDF5 reads, flag evaluation,
+statistics, plotting, notebook execution). Spans record wall time, bytes read
+and the peak resident set size during the span (linux, the peak is reset when a
+span is entered and passed on to the enclosing span). They can be exported as
+Chrome trace-event JSON (chrome://tracing, https://ui.perfetto.dev) or
+summarized as a table.
+
+Instrumentation is disabled by default. It is enabled with `enable()` or by
+setting the environment variable STANDARDPOSTPIV_TRACE to a filename, to which
+the trace is written at exit ("{pid}" in the filename is replaced by the
+process id, e.g. for notebook kernels).
+"""
+import atexit
+import functools
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Union
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+_enabled = False
+_spans = []
+_local = threading.local()  # stack of the open spans per thread
+_t0_ns = time.perf_counter_ns()
+_NULL_SPAN = nullcontext()
+
+
+def _read_bytes() -> Union[int, None]:
+    """Bytes read by the process so far (linux only, else None)"""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def _proc_status(key: str, pid: Union[int, str] = 'self') -> Union[int, None]:
+    """Value of `key` (e.g. "VmHWM") of /proc/<pid>/status in bytes"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def current_rss(pid: Union[int, str] = 'self') -> Union[int, None]:
+    """Current resident set size in bytes of the process `pid` (linux only)"""
+    return _proc_status('VmRSS', pid)
+
+
+def peak_rss(pid: Union[int, str] = 'self') -> Union[int, None]:
+    """Peak resident set size in bytes of the process `pid` since its start or
+    the last `reset_peak_rss()`"""
+    hwm = _proc_status('VmHWM', pid)
+    if hwm is not None or pid != 'self':
+        return hwm
+    return process_max_rss()
+
+
+def reset_peak_rss(pid: Union[int, str] = 'self') -> bool:
+    """Resets the peak resident set size of the process `pid` (linux >= 4.0).
+    Returns False if not supported, then the peak of a stage is only known if
+    it exceeds all previous peaks."""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def process_max_rss() -> Union[int, None]:
+    """Peak resident set size of the process since its start (or the last
+    `reset_peak_rss()` on linux) in bytes"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _open_spans() -> List['Span']:
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+
+class Span:
+    """Context manager recording a single span. Use `span()` instead of
+    instantiating it directly, which returns a no-op context if disabled.
+
+    The peak RSS of the process is reset when a span is entered. The peak
+    reached so far is kept by the enclosing span, the peak of a span is passed
+    to the enclosing span when it exits, so nested spans record their own peak.
+    Without support for resetting the peak (see `reset_peak_rss`), the peak of
+    a span is None and the peak of the process since its start
+    (`process_max_rss`) is recorded instead."""
+    __slots__ = ('name', 'cat', 'args', '_t0', '_rchar0', '_rss0', '_peak', '_peak_is_reset')
+
+    def __init__(self, name: str, cat: str = '', args: Dict = None):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self._peak = None
+
+    def _update_peak(self, peak: Union[int, None]):
+        if peak is not None:
+            self._peak = peak if self._peak is None else max(self._peak, peak)
+
+    def __enter__(self):
+        spans = _open_spans()
+        if spans and spans[-1]._peak_is_reset:
+            spans[-1]._update_peak(peak_rss())
+        self._rchar0 = _read_bytes()
+        self._rss0 = current_rss()
+        self._peak_is_reset = reset_peak_rss()
+        spans.append(self)
+        self._t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        t1 = time.perf_counter_ns()
+        rchar1 = _read_bytes()
+        spans = _open_spans()
+        spans.remove(self)
+        peak = None
+        if self._peak_is_reset:
+            self._update_peak(peak_rss())
+            peak = self._peak
+            if spans:
+                spans[-1]._update_peak(peak)
+        _spans.append({'name': self.name,
+                       'cat': self.cat,
+                       'start': (self._t0 - _t0_ns) / 1e9,
+                       'duration': (t1 - self._t0) / 1e9,
+                       'pid': os.getpid(),
+                       'tid': threading.get_ident(),
+                       'bytes_read': None if rchar1 is None else rchar1 - self._rchar0,
+                       'peak_rss': peak,
+                       'peak_rss_increase': None if peak is None or self._rss0 is None else
+                       max(peak - self._rss0, 0),
+                       # resetting the peak resets ru_maxrss, too
+                       'process_max_rss': None if self._peak_is_reset else process_max_rss(),
+                       'args': self.args or {}})
+
+
+def span(name: str, cat: str = '', **args):
+    """Returns a context manager recording the enclosed code as span `name`.
+    Additional keyword arguments are stored with the span. If instrumentation
+    is disabled, a shared no-op context is returned."""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, cat, args)
+
+
+def instrument(func: Callable = None, *, name: str = None, cat: str = None):
+    """Decorator recording every call of `func` as span. The default name is
+    "<module>.<qualname>", the default category the module name. If
+    instrumentation is disabled, only a flag is checked before calling `func`."""
+
+    def decorator(func):
+        module = func.__module__.rsplit('.', 1)[-1]
+        span_name = name or f'{module}.{func.__qualname__}'
+        span_cat = cat or module
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, span_cat):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
+
+
+def enable(reset: bool = True):
+    """Enables the instrumentation. Recorded spans are discarded if `reset`"""
+    global _enabled
+    if reset:
+        reset_spans()
+    _enabled = True
+
+
+def disable():
+    """Disables the instrumentation. Recorded spans are kept"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset_spans():
+    """Discards all recorded spans"""
+    _spans.clear()
+
+
+def get_spans() -> List[Dict]:
+    """Returns a copy of the recorded spans. Times are in seconds"""
+    return list(_spans)
+
+
+def to_chrome_trace(filename: Union[str, pathlib.Path] = None) -> Dict:
+    """Returns the spans as Chrome trace-event dictionary and optionally
+    writes it to a JSON file
+
+    Parameters
+    ----------
+    filename: Union[str, pathlib.Path], optional
+        JSON file to write the trace to
+
+    Returns
+    -------
+    Dict
+        Trace in the Chrome trace-event format ("X" events, times in microseconds)
+    """
+    events = []
+    for s in _spans:
+        args = dict(s['args'])
+        args.update({k: s[k] for k in ('bytes_read', 'peak_rss', 'peak_rss_increase', 'process_max_rss')
+                     if s[k] is not None})
+        events.append({'name': s['name'], 'cat': s['cat'], 'ph': 'X',
+                       'ts': s['start'] * 1e6, 'dur': s['duration'] * 1e6,
+                       'pid': s['pid'], 'tid': s['tid'],
+                       'args': {k: v if isinstance(v, (int, float, str, bool)) else repr(v)
+                                for k, v in args.items()}})
+    trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    if filename is not None:
+        with open(filename, 'w') as f:
+            json.dump(trace, f)
+    return trace
+
+
+def summary():
+    """Returns a table (pandas.DataFrame) with the number of calls, total, mean
+    and maximal wall time (s), total bytes read and the maximal peak RSS and
+    peak RSS increase (bytes) per span name, sorted by the total time. Nested
+    spans are counted in their parents, too."""
+    import pandas as pd
+    columns = ['cat', 'count', 'total_time', 'mean_time', 'max_time', 'bytes_read', 'peak_rss',
+               'peak_rss_increase']
+    if not _spans:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(_spans)
+    table = df.groupby('name').agg(cat=('cat', 'first'),
+                                   count=('duration', 'size'),
+                                   total_time=('duration', 'sum'),
+                                   mean_time=('duration', 'mean'),
+                                   max_time=('duration', 'max'),
+                                   bytes_read=('bytes_read', 'sum'),
+                                   peak_rss=('peak_rss', 'max'),
+                                   peak_rss_increase=('peak_rss_increase', 'max'))
+    return table.sort_values('total_time', ascending=False)[columns]
+
+
+def _write_trace_at_exit(filename: str):
+    to_chrome_trace(filename.replace('{pid}', str(os.getpid())))
+
+
+if os.environ.get('STANDARDPOSTPIV_TRACE'):
+    enable()
+    atexit.register(_write_trace_at_exit, os.environ['STANDARDPOSTPIV_TRACE'])
@@ -0,0 +1,383 @@
+"""Live acquisition mode: statistics of a PIV file to which frames are appended
+during the measurement. The file is opened in HDF5 SWMR (single writer,
+multiple readers) read mode and polled for new entries of the time dimension.
+Only the new frames are read, they update the running moments, flag counts,
+histograms and convergence checkpoints of the summary (see `precompute`),
+so the cost of an update is proportional to the number of new frames. After
+every update, the summary file can be plotted like a precomputed summary,
+e.g. by `LiveReport`, which re-renders the statistics badges and figures to
+an html page. Usage::
+
+    standardpostpiv watch run1.hdf --interval 2 --html run1_live.html
+
+The writer must open the file with `libver="latest"` and enable
+`swmr_mode`, and should extend the time dimension after the data of a frame
+(as `synthetic.append_piv_frames()` does). Frames are only counted once all
+datasets and the time dimension contain them.
+"""
+import copy
+import json
+import os
+import pathlib
+import time
+from typing import Callable, Sequence, Tuple, Union
+
+import appdirs
+import h5py
+import numpy as np
+
+from ._version import __version__
+from .figcache import hash_content
+from .logger import logger
+from .precompute import (_SummaryAccumulator, PIVSummary, _attr, _dimension, _piv_parameters,
+                         _select_monitor_points, find_standard_names)
+
+
+def _live_checkpoints(ratio: float = 1.5, max_frames: int = 2 ** 31) -> np.ndarray:
+    """Geometrically increasing numbers of frames (the total number is not known in advance)"""
+    n = int(np.ceil(np.log(max_frames / 2) / np.log(ratio))) + 1
+    return np.unique(np.round(2 * ratio ** np.arange(n)).astype(np.int64))
+
+
+def default_live_summary_filename(hdf_filename: Union[str, pathlib.Path]) -> pathlib.Path:
+    """Filename of the live summary of `hdf_filename` in the user cache directory.
+    Unlike `precompute.default_summary_filename()`, the name only depends on the
+    path, because the file changes with every acquired frame."""
+    key = hash_content(str(pathlib.Path(hdf_filename).absolute()), __version__)
+    return pathlib.Path(appdirs.user_cache_dir('standardpostpiv')) / 'live' / f'{key}.hdf'
+
+
+class LiveSummary:
+    """Incrementally updated summary of a PIV file which is being written.
+
+    Parameters
+    ----------
+    hdf_filename: Union[str, pathlib.Path]
+        HDF5 file containing the PIV data with standard names
+    summary_filename: Union[str, pathlib.Path], optional
+        Target filename. Default is a file in the user cache directory, see
+        `default_live_summary_filename()`.
+    monitor_points: Sequence[Tuple[float, float]], optional
+        (x, y) coordinates of the monitor points. Default are `n_monitor_points`
+        random points, which are unmasked in the first frame.
+    n_monitor_points: int
+        Number of random monitor points if `monitor_points` is None
+    snapshots: Sequence[int]
+        Frame indices of which the instantaneous fields are stored (negative
+        indices are not possible as the number of frames is not known)
+    checkpoint_ratio: float
+        Ratio of consecutive numbers of frames at which the developing mean and
+        standard deviation fields are stored. The current state is always the
+        last checkpoint.
+    bins_per_pixel: int
+        Number of histogram bins per pixel displacement
+    density_bins: int
+        Number of bins of the (dx, dy) density image in each direction
+    chunk_size: int
+        Maximum number of frames read at once
+    seed: int
+        Seed of the random monitor points
+    """
+    __slots__ = ('hdf_filename', 'summary_filename', 'parameters', 'chunk_size', 'h5', 'datasets',
+                 'accumulator', 'attrs', 'n_updates', 'last_update')
+
+    def __init__(self, hdf_filename: Union[str, pathlib.Path],
+                 summary_filename: Union[str, pathlib.Path] = None,
+                 monitor_points: Sequence[Tuple[float, float]] = None,
+                 n_monitor_points: int = 4,
+                 snapshots: Sequence[int] = (2,),
+                 checkpoint_ratio: float = 1.5,
+                 bins_per_pixel: int = 10,
+                 density_bins: int = 256,
+                 chunk_size: int = 50,
+                 seed: int = 10):
+        if any(i < 0 for i in snapshots):
+            raise ValueError(f'Snapshots must be non-negative frame indices but got {snapshots}')
+        if checkpoint_ratio <= 1:
+            raise ValueError(f'checkpoint_ratio must be larger than 1 but got {checkpoint_ratio}')
+        self.hdf_filename = pathlib.Path(hdf_filename)
+        if summary_filename is None:
+            summary_filename = default_live_summary_filename(self.hdf_filename)
+        self.summary_filename = pathlib.Path(summary_filename)
+        self.parameters = dict(monitor_points=None if monitor_points is None else [list(map(float, p)) for p in
+                                                                                   monitor_points],
+                               n_monitor_points=n_monitor_points, snapshots=sorted({int(i) for i in snapshots}),
+                               checkpoint_ratio=checkpoint_ratio, bins_per_pixel=bins_per_pixel,
+                               density_bins=density_bins, seed=seed)
+        self.chunk_size = chunk_size
+        self.h5 = None
+        self.datasets = {}
+        self.accumulator = None
+        self.attrs = {}
+        self.n_updates = 0
+        self.last_update = None
+
+    def __repr__(self):
+        return f'<LiveSummary hdf_filename={self.hdf_filename}, n_frames={self.n_frames}>'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def n_frames(self) -> int:
+        """Number of frames in the summary"""
+        return 0 if self.accumulator is None else self.accumulator.n_frames
+
+    def open(self) -> 'LiveSummary':
+        """Opens the PIV file in SWMR read mode (done by the first `update()`)"""
+        if self.h5 is not None:
+            return self
+        h5 = h5py.File(self.hdf_filename, 'r', libver='latest', swmr=True)
+        try:
+            standard_names = find_standard_names(h5)
+            for sn in ('x_displacement', 'y_displacement'):
+                if sn not in standard_names:
+                    raise KeyError(f'No dataset with standard_name "{sn}" in {self.hdf_filename}')
+            datasets = {sn: h5[standard_names[sn]] for sn in ('x_displacement', 'y_displacement', 'piv_flags')
+                        if sn in standard_names}
+            if datasets['x_displacement'].ndim != 3:
+                raise ValueError(f'Expected a 3D displacement dataset but got shape '
+                                 f'{datasets["x_displacement"].shape}')
+            time_scales = datasets['x_displacement'].dims[0]
+            if len(time_scales) > 0:
+                datasets['time'] = time_scales[0]
+            self.attrs = {'units': _attr(datasets['x_displacement'].attrs.get('units', 'px')),
+                          **_piv_parameters(h5, standard_names)}
+        except Exception:
+            h5.close()
+            raise
+        self.h5, self.datasets = h5, datasets
+        logger.debug(f'Opened {self.hdf_filename} in SWMR read mode')
+        return self
+
+    def close(self):
+        """Closes the PIV file. The summary stays, `update()` reopens the file."""
+        if self.h5 is not None:
+            self.h5.close()
+        self.h5, self.datasets = None, {}
+
+    def available_frames(self) -> int:
+        """Number of complete frames in the PIV file (refreshes the SWMR datasets)"""
+        self.open()
+        for ds in self.datasets.values():
+            ds.refresh()
+        return min(ds.shape[0] for ds in self.datasets.values())
+
+    def _create_accumulator(self) -> _SummaryAccumulator:
+        """Accumulator of the summary, the monitor points are selected in the first frame"""
+        ds_dx, ds_flags = self.datasets['x_displacement'], self.datasets.get('piv_flags', None)
+        dims = [_dimension(ds_dx, axis, default) for axis, default in enumerate(('reltime', 'y', 'x'))]
+        name, values, attrs = dims[0]
+        dims[0] = (name, np.asarray(values)[:0], attrs)
+        flag_meaning = {}
+        if ds_flags is not None:
+            meaning = ds_flags.attrs.get('flag_meaning', None)
+            if meaning is not None:
+                if isinstance(meaning, (str, bytes)):
+                    meaning = json.loads(meaning)
+                flag_meaning = {int(k): str(v) for k, v in meaning.items()}
+
+        monitor_points = self.parameters['monitor_points']
+        if monitor_points is None:
+            first_mask = (ds_flags[0] & 2).astype(bool) if ds_flags is not None else ~np.isfinite(ds_dx[0])
+            mp_indices = _select_monitor_points(first_mask, self.parameters['n_monitor_points'],
+                                                self.parameters['seed'])
+        else:
+            mp_indices = [(int(np.argmin(np.abs(dims[1][1] - y))), int(np.argmin(np.abs(dims[2][1] - x))))
+                          for x, y in monitor_points]
+        fiw = max(self.attrs.get('x_final_iw_size', 0), self.attrs.get('y_final_iw_size', 0))
+        return _SummaryAccumulator(dims, flag_meaning, mp_indices, self.parameters['snapshots'],
+                                   _live_checkpoints(self.parameters['checkpoint_ratio']),
+                                   bins_per_pixel=self.parameters['bins_per_pixel'],
+                                   histogram_range=fiw, density_range=fiw if ds_flags is not None else 0,
+                                   density_bins=self.parameters['density_bins'], seed=self.parameters['seed'])
+
+    def update(self) -> int:
+        """Reads the frames appended since the previous update, updates the
+        statistics and writes the summary file.
+
+        Returns
+        -------
+        int
+            The number of new frames
+        """
+        nt = self.available_frames()
+        i0 = self.n_frames
+        if nt <= i0:
+            return 0
+        new_summary = self.accumulator is None
+        if new_summary:
+            self.accumulator = self._create_accumulator()
+        ds_dx, ds_dy = self.datasets['x_displacement'], self.datasets['y_displacement']
+        ds_flags, ds_time = self.datasets.get('piv_flags', None), self.datasets.get('time', None)
+        for j0 in range(i0, nt, self.chunk_size):
+            j1 = min(j0 + self.chunk_size, nt)
+            dx = ds_dx[j0:j1].astype(float)
+            dy = ds_dy[j0:j1].astype(float)
+            flags = None
+            if ds_flags is not None:
+                flags = ds_flags[j0:j1]
+                masked = (flags & 2).astype(bool)
+                dx[masked] = np.nan
+                dy[masked] = np.nan
+            self.accumulator.update(dx, dy, flags, time=None if ds_time is None else ds_time[j0:j1])
+
+        if new_summary:
+            self.summary_filename.parent.mkdir(parents=True, exist_ok=True)
+        with h5py.File(self.summary_filename, 'w' if new_summary else 'a') as h5:
+            if new_summary:
+                h5.attrs['version'] = __version__
+                h5.attrs['source'] = str(self.hdf_filename.absolute())
+                h5.attrs['parameters'] = json.dumps(self.parameters)
+                h5.attrs['live'] = True
+                for k, v in self.attrs.items():
+                    h5.attrs[k] = v
+            self.accumulator.write(h5, current_checkpoint=True)
+            h5.attrs['n_frames'] = nt
+        self.n_updates += 1
+        self.last_update = time.monotonic()
+        logger.debug(f'Live summary of {self.hdf_filename}: {nt - i0} new frames, {nt} in total')
+        return nt - i0
+
+    def summary(self) -> PIVSummary:
+        """The current summary (a new `PIVSummary` is needed after every update,
+        as the time coordinate grows)"""
+        if self.accumulator is None:
+            raise RuntimeError(f'No frames of {self.hdf_filename} were read yet')
+        return PIVSummary(self.summary_filename)
+
+
+def live_section(summary_filename: Union[str, pathlib.Path]):
+    """Report section loading the live summary `summary_filename` and showing
+    the number of frames and the valid detection probability of the last frame"""
+    from .notebook_utils.cells import code_cells, markdown_cells
+    from .notebook_utils.section import Section
+
+    section = Section('Live summary', label='live', produces=('summary',))
+    for cell in [markdown_cells("""Statistics of the frames acquired so far:"""),
+                 code_cells("""from standardpostpiv.precompute import PIVSummary
+from standardpostpiv import badge
+import standardpostpiv.plotting as stdplt
+import numpy as np"""),
+                 code_cells(f"""summary = PIVSummary(r"{pathlib.Path(summary_filename).absolute()}")
+badge.display(['blue', 'green'], frames=summary.attrs['n_frames'],
+              last_vdp=f'{{float(summary.vdp()[-1]):.2f}}', inline=True)""")]:
+        section.add_cell(cell)
+    return section
+
+
+class LiveReport:
+    """Re-renders report sections from a live summary into a self-contained
+    html page, which reloads itself every `reload` seconds. Pass an instance
+    as `callback` to `watch()`.
+
+    Parameters
+    ----------
+    html_filename: Union[str, pathlib.Path]
+        Target html filename
+    sections: Sequence[Section], optional
+        Sections plotting from the variable "summary". Default are the
+        statistics badges and VDP, the monitor points and the convergence.
+    reload: float
+        Seconds after which the browser reloads the page, None disables it
+    """
+    __slots__ = ('html_filename', 'sections', 'reload', '_notebooks')
+
+    def __init__(self, html_filename: Union[str, pathlib.Path], sections: Sequence = None, reload: float = 5):
+        if sections is None:
+            from .notebook_utils.pivreport_sections import summary
+            sections = (summary.section_stats, summary.section_monitor_points, summary.section_convergence)
+        self.html_filename = pathlib.Path(html_filename)
+        self.sections = tuple(sections)
+        self.reload = reload
+        self._notebooks = {}  # rendered notebook per live summary file
+
+    def __repr__(self):
+        return f'<LiveReport html_filename={self.html_filename}>'
+
+    def _notebook(self, live: LiveSummary):
+        from .notebook import PIVReportNotebook
+
+        if live.summary_filename not in self._notebooks:
+            report = PIVReportNotebook(live.hdf_filename)
+            report.add_section(live_section(live.summary_filename), level=2)
+            for section in self.sections:
+                report.add_section(section, level=2)
+            self._notebooks[live.summary_filename] = report.render()
+        return self._notebooks[live.summary_filename]
+
+    def __call__(self, live: LiveSummary, n_new: int = None) -> pathlib.Path:
+        """Executes the sections with the current summary and writes the html page"""
+        from .executors import InProcessExecutor
+        from .htmlrender import render_inline_html
+
+        nb = copy.deepcopy(self._notebook(live))
+        InProcessExecutor().preprocess(nb)
+        page = render_inline_html(nb.cells, f'Live: {live.hdf_filename.name} ({live.n_frames} frames)')
+        if self.reload:
+            page = page.replace('<meta charset="utf-8">',
+                                f'<meta charset="utf-8">\n<meta http-equiv="refresh" content="{self.reload}">', 1)
+        self.html_filename.parent.mkdir(parents=True, exist_ok=True)
+        # replace atomically, a browser never sees a partially written page
+        tmp_filename = self.html_filename.with_name(f'.{self.html_filename.name}.tmp')
+        tmp_filename.write_text(page, encoding='utf-8')
+        os.replace(tmp_filename, self.html_filename)
+        return self.html_filename
+
+
+def watch(hdf_filename: Union[str, pathlib.Path],
+          summary_filename: Union[str, pathlib.Path] = None,
+          interval: float = 1.,
+          timeout: float = None,
+          idle_timeout: float = None,
+          callback: Callable[[LiveSummary, int], None] = None,
+          **kwargs) -> LiveSummary:
+    """Polls the PIV file for new frames every `interval` seconds and updates
+    its live summary. `callback(live, n_new)` is called after every update with
+    new frames, e.g. a `LiveReport`.
+
+    Parameters
+    ----------
+    hdf_filename: Union[str, pathlib.Path]
+        The PIV file being written
+    summary_filename: Union[str, pathlib.Path], optional
+        The live summary file (see `LiveSummary`)
+    interval: float
+        Seconds between two polls
+    timeout: float, optional
+        Seconds after which watching stops. Default is to watch until interrupted.
+    idle_timeout: float, optional
+        Seconds without new frames after which watching stops, e.g. the end of
+        the acquisition
+    callback: Callable[[LiveSummary, int], None], optional
+        Called with the live summary and the number of new frames after every update
+    kwargs:
+        Parameters of `LiveSummary`
+
+    Returns
+    -------
+    LiveSummary
+        The live summary (the PIV file is closed)
+    """
+    live = LiveSummary(hdf_filename, summary_filename, **kwargs)
+    t0 = last_frame = time.monotonic()
+    try:
+        while True:
+            n_new = live.update()
+            now = time.monotonic()
+            if n_new:
+                last_frame = now
+                if callback is not None:
+                    callback(live, n_new)
+            if timeout is not None and now - t0 >= timeout:
+                break
+            if idle_timeout is not None and now - last_frame >= idle_timeout:
+                logger.debug(f'No new frames in {hdf_filename} for {idle_timeout} s')
+                break
+            time.sleep(interval)
+    finally:
+        live.close()
+    return live
@@ -1,44 +1,134 @@
+"""Package logger. Importing this module has no side effects apart from
+attaching a stream handler. File logging (rotating) and the non-blocking queue
+mode are enabled explicitly with `configure_logging()`."""
 import logging
+import multiprocessing
 import pathlib
-from logging.handlers import RotatingFileHandler
-
-import appdirs
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Union
 
 # see https://realpython.com/python-logging/
 DEFAULT_LOGGING_LEVEL = logging.INFO
-
-logdir = pathlib.Path(appdirs.user_log_dir('standardpostpiv'))
-logdir.mkdir(parents=True, exist_ok=True)
+DEFAULT_MAX_BYTES = 10 * 1024 ** 2
+DEFAULT_BACKUP_COUNT = 5
 
 logger = logging.getLogger('standardpostpiv')
-logger.setLevel(logging.INFO)
-
-# Create handlers
-c_handler = logging.StreamHandler()
-f_handler = logging.FileHandler(logdir / 'standardpostpiv.log')
-c_handler.setLevel(logging.INFO)
-f_handler.setLevel(logging.INFO)
+logger.setLevel(DEFAULT_LOGGING_LEVEL)
 
-# Create formatters and add it to handlers
 c_format = logging.Formatter('%(name)s - %(levelname)s - %(message)s')
-f_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-c_handler.setFormatter(c_format)
-f_handler.setFormatter(f_format)
+f_format = logging.Formatter('%(asctime)s,%(msecs)d %(levelname)-8s [%(processName)s %(filename)s:%(lineno)d] '
+                             '%(message)s', datefmt='%Y-%m-%d_%H:%M:%S')
 
-# Add handlers to the logger
+c_handler = logging.StreamHandler()
+c_handler.setLevel(DEFAULT_LOGGING_LEVEL)
+c_handler.setFormatter(c_format)
 logger.addHandler(c_handler)
-logger.addHandler(f_handler)
-#
-# __formatter = logging.Formatter(
-#     '%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-#     datefmt='%Y-%m-%d_%H:%M:%S')
-# __file_handler = RotatingFileHandler(logdir / 'standardpostpiv.log')
-# __file_handler.setLevel(logging.DEBUG)  # log everything to file!
-# __file_handler.setFormatter(__formatter)
-#
-# __stream_handler = logging.StreamHandler()
-# __stream_handler.setLevel(DEFAULT_LOGGING_LEVEL)
-# __stream_handler.setFormatter(__formatter)
-#
-# logger.addHandler(__file_handler)
-# logger.addHandler(__stream_handler)
+
+_listener = None
+_log_queue = None
+
+
+def get_logdir() -> pathlib.Path:
+    """Returns the user log directory (created on first call)"""
+    import appdirs
+    logdir = pathlib.Path(appdirs.user_log_dir('standardpostpiv'))
+    logdir.mkdir(parents=True, exist_ok=True)
+    return logdir
+
+
+def configure_logging(level: Union[int, str] = None,
+                      logfile: Union[bool, str, pathlib.Path] = True,
+                      max_bytes: int = DEFAULT_MAX_BYTES,
+                      backup_count: int = DEFAULT_BACKUP_COUNT,
+                      use_queue: bool = False) -> logging.Logger:
+    """Configures the handlers of the package logger. Calling it again replaces
+    the previous configuration.
+
+    Parameters
+    ----------
+    level: Union[int, str], optional
+        Logging level of the logger and the stream handler
+    logfile: Union[bool, str, pathlib.Path]
+        Filename of the (rotating) log file. If True, "standardpostpiv.log" in
+        the user log directory is used. If False, nothing is logged to file.
+    max_bytes: int
+        Size of the log file at which it is rotated
+    backup_count: int
+        Number of rotated log files kept
+    use_queue: bool
+        If True, the logger only puts records into a queue and a background
+        thread (`QueueListener`) passes them to the stream and file handlers, so
+        that logging calls never block on I/O. Pool workers forward their records
+        to the same queue (see `worker_logging()`).
+
+    Returns
+    -------
+    logging.Logger
+        The package logger
+    """
+    global _listener, _log_queue
+    shutdown_logging()
+    if level is not None:
+        logger.setLevel(level)
+        c_handler.setLevel(level)
+
+    handlers = [c_handler]
+    if logfile:
+        if logfile is True:
+            logfile = get_logdir() / 'standardpostpiv.log'
+        f_handler = RotatingFileHandler(logfile, maxBytes=max_bytes, backupCount=backup_count)
+        f_handler.setLevel(logging.DEBUG)  # log everything to file!
+        f_handler.setFormatter(f_format)
+        handlers.append(f_handler)
+
+    _remove_handlers()
+    if use_queue:
+        _log_queue = multiprocessing.Queue(-1)
+        _listener = QueueListener(_log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(QueueHandler(_log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+    return logger
+
+
+def get_log_queue():
+    """Returns the queue of the queue mode or None if the queue mode is not configured"""
+    return _log_queue
+
+
+def worker_logging(log_queue=None, level: Union[int, str] = None):
+    """Initializer for pool workers: records are forwarded to `log_queue` (default:
+    the queue of the parent) instead of being handled in the worker"""
+    log_queue = log_queue or _log_queue
+    if log_queue is None:
+        return
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    if level is not None:
+        logger.setLevel(level)
+
+
+def _remove_handlers():
+    """Removes all handlers from the logger and closes them (except the stream handler)"""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if handler is not c_handler:
+            handler.close()
+
+
+def shutdown_logging():
+    """Stops the queue listener (flushing all queued records), closes the log
+    file and restores the stream handler"""
+    global _listener, _log_queue
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            if handler is not c_handler:
+                handler.close()
+        _listener = None
+        _log_queue = None
+    _remove_handlers()
+    logger.addHandler(c_handler)
@@ -0,0 +1,303 @@
+"""Peak-memory profiling of the report stages. Every section of a report is
+executed in-process (like the notebook kernel would) and its peak resident set
+size and the top python allocations (tracemalloc) are recorded. The harness
+runs the report on synthetic files of increasing size, each in a fresh process,
+and fails if a stage needs more than a configured multiple of the input size.
+
+Usage from the command line::
+
+    python -m standardpostpiv.memprofile --sizes 100x64x80 400x64x80 --max-ratio 4
+"""
+import argparse
+import multiprocessing
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+from .instrumentation import current_rss, peak_rss, reset_peak_rss
+from .logger import logger
+
+
+# stages with a constant memory overhead, which are not checked against the input size
+DEFAULT_EXEMPT_STAGES = ('imports',)
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """Raised if the peak memory of a stage exceeds the configured multiple of the input size"""
+
+
+def _reset_tracemalloc_peak():
+    """Resets the peak of the traced memory. `tracemalloc.reset_peak` requires
+    python 3.9, before the tracing is restarted (the memory allocated so far is
+    not traced anymore, thus the peak is relative to the restart)."""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+class StageMemory:
+    """Memory usage of a single stage (all sizes in bytes, time in seconds)"""
+    __slots__ = ('name', 'time', 'rss_before', 'peak_rss', 'peak_rss_is_reset', 'tracemalloc_before',
+                 'tracemalloc_peak', 'top_allocations', 'error')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.time = None
+        self.rss_before = None
+        self.peak_rss = None
+        self.peak_rss_is_reset = False
+        self.tracemalloc_before = None
+        self.tracemalloc_peak = None
+        self.top_allocations = []
+        self.error = None
+
+    def __repr__(self):
+        return f'<StageMemory name={self.name}, peak_rss_increase={self.peak_rss_increase}, error={self.error}>'
+
+    @property
+    def peak_rss_increase(self) -> Union[int, None]:
+        """Peak RSS during the stage above the RSS at the beginning of the stage"""
+        if self.peak_rss is None or self.rss_before is None:
+            return None
+        return max(self.peak_rss - self.rss_before, 0)
+
+    @property
+    def tracemalloc_peak_increase(self) -> Union[int, None]:
+        """Peak of the traced python allocations during the stage above the traced
+        memory at the beginning of the stage"""
+        if self.tracemalloc_peak is None or self.tracemalloc_before is None:
+            return None
+        return max(self.tracemalloc_peak - self.tracemalloc_before, 0)
+
+    def to_dict(self) -> Dict:
+        d = {k: getattr(self, k) for k in self.__slots__}
+        d['peak_rss_increase'] = self.peak_rss_increase
+        d['tracemalloc_peak_increase'] = self.tracemalloc_peak_increase
+        return d
+
+
+def get_report_stages(report) -> Dict[str, List[str]]:
+    """Returns the code of a report grouped by section label. The import lines
+    are collected in a first stage "imports" like `PIVReportNotebook.create()`
+    does. The sections of the report are not modified."""
+    import_lines = []
+    stages = {}
+    for section in report.sections:
+        cells = []
+        for cell in section.cells:
+            if not cell.is_code():
+                continue
+            lines = cell.lines.split('\n')
+            import_lines.extend(line for line in lines if 'import' in line)
+            code = '\n'.join(line for line in lines if 'import' not in line)
+            if code.strip():
+                cells.append(code)
+        stages[section.label] = cells
+    return {'imports': ['\n'.join(import_lines)], **stages}
+
+
+def profile_stages(stages: Dict[str, List[str]], namespace: Dict = None, top: int = 5,
+                   trace_python: bool = True) -> List[StageMemory]:
+    """Executes the code of the stages in order in a common namespace and
+    records the memory usage of each stage. An exception stops the stage but
+    not the following stages (like a notebook executed with allow_errors).
+
+    Parameters
+    ----------
+    stages: Dict[str, List[str]]
+        Code cells per stage name
+    namespace: Dict, optional
+        Namespace to execute the code in
+    top: int
+        Number of largest allocations (retained by the stage) to record
+    trace_python: bool
+        Whether to trace the python allocations with tracemalloc (slower)
+
+    Returns
+    -------
+    List[StageMemory]
+        Memory usage per stage
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    if namespace is None:
+        namespace = {}
+    if trace_python and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    results = []
+    for name, cells in stages.items():
+        stage = StageMemory(name)
+        if trace_python:
+            _reset_tracemalloc_peak()
+            stage.tracemalloc_before = tracemalloc.get_traced_memory()[0]
+        snapshot = tracemalloc.take_snapshot() if trace_python else None
+        stage.rss_before = current_rss()
+        stage.peak_rss_is_reset = reset_peak_rss()
+        t0 = time.perf_counter()
+        try:
+            for code in cells:
+                exec(compile(code, f'<{name}>', 'exec'), namespace)
+        except Exception as e:
+            stage.error = f'{type(e).__name__}: {e}'
+            logger.debug(f'Stage {name} failed: {stage.error}')
+        stage.time = time.perf_counter() - t0
+        stage.peak_rss = peak_rss()
+        if trace_python:
+            stage.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            diff = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+            stage.top_allocations = [(str(stat.traceback[0]), stat.size_diff) for stat in diff[:top]]
+        plt.close('all')
+        results.append(stage)
+    if trace_python:
+        tracemalloc.stop()
+    return results
+
+
+def input_size(hdf_filename: Union[str, pathlib.Path]) -> int:
+    """Uncompressed size of all datasets in an HDF5 file in bytes"""
+    import h5py
+    sizes = []
+    with h5py.File(hdf_filename, 'r') as h5:
+        h5.visititems(lambda name, obj: sizes.append(obj.size * obj.dtype.itemsize)
+                      if isinstance(obj, h5py.Dataset) else None)
+    return sum(sizes)
+
+
+def profile_report(hdf_filename: Union[str, pathlib.Path], top: int = 5,
+                   trace_python: bool = True) -> List[Dict]:
+    """Profiles the stages of the basic 2D2C report of `hdf_filename`"""
+    from .reports import get_basic_2D2C_report
+    report = get_basic_2D2C_report(hdf_filename)
+    stages = profile_stages(get_report_stages(report), top=top, trace_python=trace_python)
+    return [stage.to_dict() for stage in stages]
+
+
+def _parse_size(size: Union[str, Tuple[int, int, int]]) -> Tuple[int, int, int]:
+    if isinstance(size, str):
+        return tuple(int(n) for n in size.lower().split('x'))
+    return tuple(size)
+
+
+def run_memory_harness(sizes: List[Union[str, Tuple[int, int, int]]],
+                       directory: Union[str, pathlib.Path] = None,
+                       max_ratio: float = None,
+                       stage_ratios: Dict[str, float] = None,
+                       top: int = 5,
+                       trace_python: bool = True,
+                       **file_kwargs):
+    """Runs the report stages on synthetic files of increasing size, each in a
+    fresh process, and returns the scaling table.
+
+    Parameters
+    ----------
+    sizes: List[Union[str, Tuple[int, int, int]]]
+        File sizes as (nt, ny, nx) or "ntxnyxnx"
+    directory: Union[str, pathlib.Path], optional
+        Directory for the synthetic files. Default is a temporary directory.
+    max_ratio: float, optional
+        Maximal ratio of the peak RSS increase of a stage and the input size
+    stage_ratios: Dict[str, float], optional
+        Maximal ratios of individual stages (overrule `max_ratio`)
+    top: int
+        Number of largest allocations recorded per stage
+    trace_python: bool
+        Whether to trace the python allocations with tracemalloc
+    file_kwargs:
+        Parameters passed to `synthetic.create_piv_file`
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per size and stage with the input size, peak RSS increase,
+        tracemalloc peak (and its increase) and their ratio to the input size
+
+    Raises
+    ------
+    MemoryBudgetExceeded
+        If a stage exceeds its ratio
+    """
+    import pandas as pd
+    from .synthetic import create_piv_file
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = pathlib.Path(directory or tmpdir)
+        rows = []
+        for size in sizes:
+            nt, ny, nx = _parse_size(size)
+            filename = create_piv_file(directory / f'piv_{nt}x{ny}x{nx}.hdf', nt=nt, ny=ny, nx=nx,
+                                       overwrite=True, **file_kwargs)
+            nbytes = input_size(filename)
+            # a fresh process per file, so that the baseline does not depend on previous runs
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                stages = executor.submit(profile_report, filename, top, trace_python).result()
+            for stage in stages:
+                increase = stage['peak_rss_increase']
+                rows.append({'nt': nt, 'ny': ny, 'nx': nx, 'input_size': nbytes,
+                             'stage': stage['name'], 'time': stage['time'],
+                             'peak_rss': stage['peak_rss'], 'peak_rss_increase': increase,
+                             'ratio': None if increase is None else increase / nbytes,
+                             'tracemalloc_peak': stage['tracemalloc_peak'],
+                             'tracemalloc_peak_increase': stage['tracemalloc_peak_increase'],
+                             'top_allocations': stage['top_allocations'],
+                             'error': stage['error']})
+            logger.info(f'Profiled report stages of {nt}x{ny}x{nx} ({nbytes / 1024 ** 2:.1f} MB)')
+    table = pd.DataFrame(rows)
+    if max_ratio is not None or stage_ratios:
+        check_memory_budget(table, max_ratio, stage_ratios)
+    return table
+
+
+def check_memory_budget(table, max_ratio: float = None, stage_ratios: Dict[str, float] = None,
+                        exempt_stages: Tuple[str, ...] = DEFAULT_EXEMPT_STAGES):
+    """Raises MemoryBudgetExceeded if a stage of the table returned by
+    `run_memory_harness()` exceeds its maximal ratio of peak RSS increase and
+    input size. `exempt_stages` are only checked if listed in `stage_ratios`."""
+    stage_ratios = stage_ratios or {}
+    violations = []
+    for _, row in table.iterrows():
+        if row['stage'] in exempt_stages and row['stage'] not in stage_ratios:
+            continue
+        limit = stage_ratios.get(row['stage'], max_ratio)
+        if limit is not None and row['ratio'] is not None and row['ratio'] > limit:
+            violations.append(f'{row["stage"]} ({row["nt"]}x{row["ny"]}x{row["nx"]}): '
+                              f'{row["peak_rss_increase"] / 1024 ** 2:.1f} MB = {row["ratio"]:.2f} x input size '
+                              f'> {limit}')
+    if violations:
+        raise MemoryBudgetExceeded('Memory budget exceeded:\n' + '\n'.join(violations))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Peak-memory profiling of the report stages')
+    parser.add_argument('--sizes', nargs='+', default=['100x64x80', '400x64x80', '1600x64x80'],
+                        help='File sizes as "ntxnyxnx"')
+    parser.add_argument('--max-ratio', type=float, default=None,
+                        help='Maximal ratio of the peak RSS increase of a stage and the input size')
+    parser.add_argument('--stage-ratio', nargs=2, action='append', default=[], metavar=('STAGE', 'RATIO'),
+                        help='Maximal ratio of a single stage')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Do not trace python allocations')
+    parser.add_argument('--output', default=None, help='CSV file to write the scaling table to')
+    args = parser.parse_args(argv)
+
+    table = run_memory_harness(args.sizes, trace_python=not args.no_tracemalloc)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    columns = ['nt', 'ny', 'nx', 'stage', 'time', 'peak_rss_increase', 'ratio', 'error']
+    print(table[columns].to_string(index=False))
+    try:
+        check_memory_budget(table, args.max_ratio, {s: float(r) for s, r in args.stage_ratio})
+    except MemoryBudgetExceeded as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,19 @@
 """Main module for creating a PIV report notebook"""
 import pathlib
-from typing import Union, Dict
+from typing import Dict, List, Union
 
 import nbformat
 import numpy as np
 from nbconvert import PDFExporter, HTMLExporter
 from nbconvert.exporters import export, pdf
-from nbconvert.preprocessors import ExecutePreprocessor
 
 from .logger import logger
+from .executors import get_executor
+from .instrumentation import instrument
 from .notebook_utils.cells import markdown_cells
 from .notebook_utils.section import Section
 from .notebook_utils.toc import generate_toc_html
+from .utils import run_in_thread
 
 
 class PIVReportNotebook:
@@ -24,7 +26,8 @@ class PIVReportNotebook:
         self.notebook_filename = None
 
         # create Title cell
-        title_section = Section(f'PIV Report for "{self.hdf_filename.stem}"', 'piv-report')
+        title_section = Section(f'PIV Report for "{self.hdf_filename.stem}"', 'piv-report',
+                                produces=('hdf_filename',))
         title_section.add_cell(markdown_cells('Automatically generated report.'))
         title_section.add_cell(f'hdf_filename = r"{self.hdf_filename.absolute()}"', 'code')
         self.add_section(title_section, level=1)
@@ -37,14 +40,19 @@ class PIVReportNotebook:
         # title_section.add_cell(code_cells([f'piv_filename = r"{self.hdf_filename.absolute()}"',
         #                                    'report = spp.PIVReport(piv_filename)']))
 
-    def add_section(self, section: Section, level: int):
+    def add_section(self, section: Section, level: int) -> Section:
+        """Adds a copy of the (template) `section` with heading `level` to the
+        report and returns the copy. The passed section is not modified, so
+        module-level sections can be added to any number of reports."""
         if not isinstance(section, Section):
             raise TypeError(f'section must be of type Section but got "{type(section)}"')
-        section.level = level
+        section = section.copy(level=level)
         self.sections.append(section)
         return section
 
-    def execute(self, inplace=True, to_html=False, to_pdf=False) -> Dict:
+    @instrument
+    def execute(self, inplace=True, to_html=False, to_pdf=False, executor='kernel', cache=None,
+                html_renderer='nbconvert', profile=True) -> Dict:
         """Execute the notebook and optionally save it as html or pdf
 
         Parameters
@@ -56,11 +64,31 @@ class PIVReportNotebook:
         to_pdf: bool
             If True, the notebook is converted to pdf. Note that ioshield badges cannot be displayed in pdf.
             An error will be raised!
+        executor: Union[str, object]
+            'kernel' executes the notebook in a Jupyter kernel (full fidelity), 'inprocess' executes
+            the cells in the current process (see `executors.InProcessExecutor`), which is much faster
+            for many reports. 'parallel' executes independent sections concurrently in worker processes
+            (see `sectiongraph.ParallelExecutor`). Any object with a method `preprocess(notebook)` can be
+            passed, too, e.g. a `executors.KernelPool` of warm kernels.
+        cache: Union[bool, sectioncache.SectionCache], optional
+            If given, the outputs of the sections are cached and only sections whose code (or
+            whose dependencies or the HDF5 file) changed are executed (see `sectioncache`).
+            True uses the default cache directory.
+        html_renderer: str
+            'nbconvert' converts the notebook with the nbconvert `HTMLExporter` (a single file with
+            embedded figures). 'static' renders a lightweight page with separate, lazily loaded
+            figure files (see `htmlrender.render_html`), which is much faster for large reports.
+        profile: bool
+            The executors record the wall time and the peak memory increase of every cell in the
+            cell metadata. If True, a section "Report performance" with the slowest cells and the
+            totals is appended and the profile is written to "<notebook stem>_profile.json"
+            (see `cellprofile`).
 
         Returns
         -------
         filenames: Dict
-            Dictionary containing the filenames of the executed notebook and the html/pdf file.
+            Dictionary containing the filenames of the executed notebook, the html/pdf file and
+            the profile.
         """
         assert self.notebook_filename.exists()
         if inplace:
@@ -78,10 +106,44 @@ class PIVReportNotebook:
         # with open(self.notebook_filename) as f:
         #     nb = nbformat.read(f, as_version=4)
 
-        ep = ExecutePreprocessor(timeout=600, kernel='python3')
-        ep.allow_errors = True
-        ep.store_widget_state = False
-        ep.preprocess(self.notebook)
+        self._get_preprocessor(executor, cache).preprocess(self.notebook)
+        return self._save(inplace=inplace, to_html=to_html, to_pdf=to_pdf, html_renderer=html_renderer,
+                          profile=profile)
+
+    async def execute_async(self, inplace=True, to_html=False, to_pdf=False, executor='kernel', cache=None,
+                            html_renderer='nbconvert', profile=True) -> Dict:
+        """Asynchronous version of `execute()` with the same parameters. With the
+        'kernel' executor (and no cache), the notebook is executed with the
+        asynchronous API of nbclient, so that many reports can be executed
+        concurrently from one event loop. Other executors run in a worker thread
+        (in-process executors one at a time). Writing the notebook and the
+        conversion to html/pdf run in a worker thread, too."""
+        assert self.notebook_filename.exists()
+        if executor == 'kernel' and not cache:
+            from .executors import get_async_client
+            await get_async_client(self.notebook).async_execute()
+        else:
+            await run_in_thread(self._get_preprocessor(executor, cache).preprocess, self.notebook)
+        return await run_in_thread(self._save, inplace=inplace, to_html=to_html, to_pdf=to_pdf,
+                                   html_renderer=html_renderer, profile=profile)
+
+    def _get_preprocessor(self, executor, cache):
+        """Executor of the notebook (see `execute()`)"""
+        if cache:
+            from .sectioncache import CachedExecutor
+            return CachedExecutor(self.hdf_filename, cache=None if cache is True else cache, executor=executor)
+        return get_executor(executor)
+
+    def _save(self, inplace: bool, to_html: bool, to_pdf: bool, html_renderer: str, profile: bool) -> Dict:
+        """Writes the executed notebook, the profile and the html/pdf file (see `execute()`)"""
+        if profile:
+            from .cellprofile import add_performance_section, profile_summary, write_profile
+            summary = profile_summary(self.notebook, self.hdf_filename)
+            add_performance_section(self.notebook, summary)
+            profile_filename = write_profile(
+                summary, self.notebook_filename.parent / f'{self.notebook_filename.stem}_profile.json')
+        else:
+            profile_filename = None
 
         if inplace:
             # execute the notebook
@@ -104,13 +166,20 @@ class PIVReportNotebook:
 
         if to_html:
             html_filename = self.notebook_filename.parent / f'{self.notebook_filename.stem}.html'
-            html_data, _ = export(HTMLExporter, self.notebook)
-            with open(html_filename, "w") as f:
-                f.write(html_data)
+            if html_renderer == 'static':
+                from .htmlrender import render_html
+                render_html(self.notebook, html_filename)
+            elif html_renderer == 'nbconvert':
+                html_data, _ = export(HTMLExporter, self.notebook)
+                with open(html_filename, "w") as f:
+                    f.write(html_data)
+            else:
+                raise ValueError(f'Unknown html_renderer "{html_renderer}". Use "nbconvert" or "static".')
         else:
             html_filename = None
 
-        return {'ipynb': self.notebook_filename, 'html': html_filename, 'pdf': pdf_filename}
+        return {'ipynb': self.notebook_filename, 'html': html_filename, 'pdf': pdf_filename,
+                'profile': profile_filename}
 
         # NotebookExporter().from_notebook_node(self.notebook)
         #
@@ -126,13 +195,18 @@ class PIVReportNotebook:
         #     print(f'Notebook executed successfully')
         # return success
 
+    @instrument
     def create(self,
                notebook_filename: Union[str, pathlib.Path] = None,
                execute_notebook: bool = False,
                overwrite: bool = False,
                inplace: bool = False,
                to_html: bool = False,
-               to_pdf: bool = False) -> Dict:
+               to_pdf: bool = False,
+               executor='kernel',
+               cache=None,
+               html_renderer='nbconvert',
+               profile=True) -> Dict:
         """Create the notebook and optionally execute it and save it as html or pdf
 
         Parameters
@@ -150,6 +224,14 @@ class PIVReportNotebook:
             If True, the notebook will be converted to html after execution
         to_pdf : bool, optional
             If True, the notebook will be converted to pdf after execution
+        executor : Union[str, object], optional
+            Executor of the notebook, 'kernel' (default) or 'inprocess'. See `execute()`.
+        cache : Union[bool, sectioncache.SectionCache], optional
+            Section output cache used for the execution. See `execute()`.
+        html_renderer : str, optional
+            'nbconvert' (default) or 'static'. See `execute()`.
+        profile : bool, optional
+            Whether to append the "Report performance" section and export the cell profile. See `execute()`.
 
         Returns
         -------
@@ -157,10 +239,66 @@ class PIVReportNotebook:
             Dictionary containing the filenames of the executed notebook and the html/pdf file.
 
         """
-        target_folder = self.hdf_filename.parent
+        notebook_filename = self._prepare(notebook_filename, overwrite)
+        nbformat.write(self.notebook, str(notebook_filename))
+        logger.info(f'Standard evaluation notebook will be written to: {notebook_filename.absolute()}')
+
+        if execute_notebook:
+            logger.info(f'Executing the notebook: {notebook_filename}')
+            return self.execute(inplace=inplace,
+                                to_html=to_html,
+                                to_pdf=to_pdf,
+                                executor=executor,
+                                cache=cache,
+                                html_renderer=html_renderer,
+                                profile=profile)
+        return {'ipynb': notebook_filename, 'html': None, 'pdf': None, 'profile': None}
+
+    async def create_async(self,
+                           notebook_filename: Union[str, pathlib.Path] = None,
+                           execute_notebook: bool = False,
+                           overwrite: bool = False,
+                           inplace: bool = False,
+                           to_html: bool = False,
+                           to_pdf: bool = False,
+                           executor='kernel',
+                           cache=None,
+                           html_renderer='nbconvert',
+                           profile=True) -> Dict:
+        """Asynchronous version of `create()` with the same parameters. The
+        notebook is written in a worker thread and executed with `execute_async()`.
+
+        Examples
+        --------
+        semaphore = asyncio.Semaphore(8)
+
+        async def run(filename):
+            async with semaphore:
+                return await get_basic_2D2C_report(filename).create_async(execute_notebook=True)
+
+        results = await asyncio.gather(*[run(f) for f in filenames])
+
+        See also `batch.run_reports_async()`.
+        """
+        notebook_filename = self._prepare(notebook_filename, overwrite)
+        await run_in_thread(nbformat.write, self.notebook, str(notebook_filename))
+        logger.info(f'Standard evaluation notebook will be written to: {notebook_filename.absolute()}')
 
+        if execute_notebook:
+            logger.info(f'Executing the notebook: {notebook_filename}')
+            return await self.execute_async(inplace=inplace,
+                                            to_html=to_html,
+                                            to_pdf=to_pdf,
+                                            executor=executor,
+                                            cache=cache,
+                                            html_renderer=html_renderer,
+                                            profile=profile)
+        return {'ipynb': notebook_filename, 'html': None, 'pdf': None, 'profile': None}
+
+    def _prepare(self, notebook_filename: Union[str, pathlib.Path, None], overwrite: bool) -> pathlib.Path:
+        """Resolves the notebook filename and renders the notebook (see `create()`)"""
         if notebook_filename is None:
-            notebook_filename = target_folder / f'{self.hdf_filename.stem}_StdPIVReport.ipynb'
+            notebook_filename = self.hdf_filename.parent / f'{self.hdf_filename.stem}_StdPIVReport.ipynb'
         else:
             notebook_filename = pathlib.Path(notebook_filename)
 
@@ -170,19 +308,27 @@ class PIVReportNotebook:
         print(f'Creating notebook: {notebook_filename.absolute()}')
 
         self.notebook_filename = notebook_filename
+        self.notebook = self.render()
+        return notebook_filename
 
-        root_section = self.sections[0]
+    def render(self) -> nbformat.NotebookNode:
+        """Renders the sections into a new notebook. The import lines of all
+        code cells are collected in a section "Imports" at the beginning and a
+        table of contents is added. The sections of the report are not modified,
+        so a report can be rendered any number of times."""
+        sections = [section.copy() for section in self.sections]
+        root_section = sections[0]
 
         assert len(root_section.cells) > 0
         # add table of contents in second cell:
-        _ = root_section.cells.insert(1, self._generate_toc_cell())
+        root_section.cells.insert(1, self._generate_toc_cell())
 
         cells = []
         level_numbers = np.zeros(10, dtype=int)
 
         # extract all imports and insert them in a separate section at the beginning
         import_lines = []
-        for section in self.sections:
+        for section in sections:
             iremove_cell = []
             for icell, cell in enumerate(section.cells):
                 if cell.is_code():
@@ -201,32 +347,29 @@ class PIVReportNotebook:
                 logger.debug(f'Removing cell {icell} because it is empty.')
                 section.cells.pop(icell)
 
-        import_section = Section('Imports', label='imports')
-        import_section.level = 2
+        import_section = Section('Imports', label='imports', level=2)
         import_section.add_cell('\n'.join(import_lines), 'code')
+        sections.insert(1, import_section)
 
-        self.sections.insert(1, import_section)
-        # for section in self.sections[2:]:
-        #     section.level += 1
-
-        for section in self.sections:
+        for section in sections:
             cells, _ = section.get_cells(cells, level_numbers)
 
         notebook = nbformat.v4.new_notebook()
-
         notebook['cells'] = cells
-
-        nbformat.write(notebook, str(notebook_filename))
-
-        logger.info(f'Standard evaluation notebook will be written to: {notebook_filename.absolute()}')
-        self.notebook = notebook
-
-        if execute_notebook:
-            logger.info(f'Executing the notebook: {notebook_filename}')
-            return self.execute(inplace=inplace,
-                                to_html=to_html,
-                                to_pdf=to_pdf)
-        return {'ipynb': notebook_filename, 'html': None, 'pdf': None}
+        # declared variables of the sections (see `sectiongraph`)
+        notebook.metadata['standardpostpiv'] = {
+            'sections': {s.name: {'produces': list(s.produces), 'consumes': list(s.consumes)}
+                         for section in sections for s in section.iter_sections()
+                         if s.produces or s.consumes}}
+        return notebook
+
+    def get_section_graph(self) -> Dict[str, List[str]]:
+        """Returns the labels of the sections each section depends on, built from
+        the declared and the detected variables of the sections (call `create()` first)"""
+        if self.notebook is None:
+            raise RuntimeError('The notebook is not created yet. Call `create()` first.')
+        from .sectiongraph import SectionGraph
+        return SectionGraph.from_notebook(self.notebook, setup=('imports',)).to_dict()
 
     def _get_table_of_content_info(self):
         _toc_data = []
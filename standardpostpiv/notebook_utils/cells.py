@@ -11,6 +11,8 @@ class CellType(Enum):
 def make_markdown_cell(sources):
     if not isinstance(sources, list):
         sources = [sources]
+    else:
+        sources = list(sources)
     _sources = []
     for i, source in enumerate(sources):
         if source:
@@ -47,6 +49,10 @@ class NotebookCells:
         cells.lines = lines
         return cells
 
+    def copy(self) -> 'NotebookCells':
+        """Returns an independent copy"""
+        return self(list(self.lines) if isinstance(self.lines, list) else self.lines)
+
     def is_markdown(self):
         return self.ctype == CellType.MARKDOWN
 
@@ -2,47 +2,90 @@ from standardpostpiv.notebook_utils.cells import markdown_cells, code_cells
 
 from standardpostpiv.notebook_utils.section import Section
 
+section_data = Section('Displacement data', label='displacement_data',
+                       produces=('load_displacement', 'load_point', 'load_line'), consumes=('res',))
+
+__cells = [markdown_cells("""The masked displacement fields are read from the HDF5 file on demand (a time step, the
+time series of a point or of a line), the full time series is never loaded at once:"""),
+           code_cells("""from standardpostpiv.utils import mask_displacement"""),
+           code_cells("""# masked x/y displacement and magnitude of displacement at `index`:
+def load_displacement(index):
+    return mask_displacement(res.x_displacement[index], res.y_displacement[index], res.piv_flags[index])
+
+# time series of the masked displacements at the grid point closest to (x, y):
+def load_point(x, y):
+    ix = int(np.abs(np.asarray(res.x_coordinate[()]) - x).argmin())
+    iy = int(np.abs(np.asarray(res.y_coordinate[()]) - y).argmin())
+    return load_displacement((slice(None), iy, ix))
+
+# time series of the masked displacements along the grid line closest to y:
+def load_line(y):
+    iy = int(np.abs(np.asarray(res.y_coordinate[()]) - y).argmin())
+    return load_displacement((slice(None), iy))""")]
+
+for cell in __cells:
+    section_data.add_cell(cell)
+
+section_full_data = Section('Displacement data of all time steps', label='displacement_full_data',
+                            produces=('dx', 'dy', 'displacement_magnitude'), consumes=('load_displacement',))
+
+__cells = [markdown_cells("""Masked displacement fields of all time steps. Note, that the full time series is loaded
+into memory (required e.g. by the normality check):"""),
+           code_cells("""dx, dy, displacement_magnitude = load_displacement(slice(None))""")]
+
+for cell in __cells:
+    section_full_data.add_cell(cell)
+
 __cells = [markdown_cells("""Analysis of the velocity fields"""),
-           code_cells("""from standardpostpiv.utils import compute_magnitude
-import xarray as xr"""), markdown_cells("""Velocity magnitude for each time step:"""),
-           code_cells("""displacement_magnitude = xr.concat(
-    [compute_magnitude(dx[i,...], dy[i,...]) for i in range(dx.coords['reltime'].size)], 'reltime'
-)
-displacement_magnitude.attrs['standard_name'] = 'magnitude_of_displacement'"""),
+           code_cells("""from standardpostpiv.statistics import FieldMoments
+from standardpostpiv.utils import iter_masked_displacement"""),
            markdown_cells(
-               """Ensemble mean of velocity magnitude (compute the mean for each time step an then compute mean)""")]
+               """Ensemble mean of the displacement fields and of the velocity magnitude (compute the magnitude for
+each time step and then compute the mean), accumulated chunk by chunk:"""),
+           code_cells("""moments = [FieldMoments() for _ in range(3)]  # dx, dy, magnitude
+for chunk in iter_masked_displacement(res.x_displacement, res.y_displacement, res.piv_flags):
+    for moment, field in zip(moments, chunk):
+        moment.update(field)
+dx_mean, dy_mean, displacement_magnitude_mean = (moment.mean() for moment in moments)
+displacement_magnitude_global_mean = moments[2].global_mean()""")]
 
-main_section = Section('Displacement fields', label='displacement_fields')
+main_section = Section('Displacement fields', label='displacement_fields',
+                       produces=('dx_mean', 'dy_mean', 'displacement_magnitude_mean',
+                                 'displacement_magnitude_global_mean'),
+                       consumes=('res',))
 
 for cell in __cells:
     main_section.add_cell(cell)
 
-section_instantaneous_velocity = Section('Displacement fields at specific time stamps', label='inst_vel')
+section_instantaneous_velocity = Section('Displacement fields at specific time stamps', label='inst_vel',
+                                         consumes=('load_displacement',))
 
 __cells = [code_cells("""it = 2
+dx_it, dy_it, displacement_magnitude_it = load_displacement(it)
 
 fig, axes = stdplt.subplots(1, 3, figsize=(12, 3), tight_layout=True)
-displacement_magnitude.isel(reltime=it).plot(ax=axes[0])
-# axes.pivstreamplot(dx.mean('reltime')[:,:], dy.mean('reltime')[:,:], color='k')
-axes[0].pivquiver(dx.isel(reltime=it)[:,:], dy.isel(reltime=it)[:,:], color='k', every=8)
+axes[0].pivfield(displacement_magnitude_it)
+# axes.pivstreamplot(dx_mean, dy_mean, color='k')
+axes[0].pivquiver(dx_it, dy_it, color='k', every='auto')
 
-dx.isel(reltime=it).plot(ax=axes[1])
-dy.isel(reltime=it).plot(ax=axes[2])
+axes[1].pivfield(dx_it)
+axes[2].pivfield(dy_it)
 for ax in axes:
     ax.set_aspect('equal')""")]
 
 for cell in __cells:
     section_instantaneous_velocity.add_cell(cell)
 
-section_mean_displacement = Section('Mean displacement fields', label='mean_velocity')
+section_mean_displacement = Section('Mean displacement fields', label='mean_velocity',
+                                    consumes=('dx_mean', 'dy_mean', 'displacement_magnitude_mean'))
 
 __cells = [code_cells("""fig, axes = stdplt.subplots(1, 3, figsize=(12, 3), tight_layout=True)
-displacement_magnitude.stdpiv.mean('reltime').plot(ax=axes[0])
-# axes.pivstreamplot(dx.mean('reltime')[:,:], dy.mean('reltime')[:,:], color='k')
-axes[0].pivquiver(dx.mean('reltime')[:,:], dy.mean('reltime')[:,:], color='k', every=8)
+axes[0].pivfield(displacement_magnitude_mean)
+# axes.pivstreamplot(dx_mean, dy_mean, color='k')
+axes[0].pivquiver(dx_mean, dy_mean, color='k', every='auto')
 
-dx.stdpiv.mean('reltime').plot(ax=axes[1])
-dy.stdpiv.mean('reltime').plot(ax=axes[2])
+axes[1].pivfield(dx_mean)
+axes[2].pivfield(dy_mean)
 for ax in axes:
     ax.set_aspect('equal')""")]
 
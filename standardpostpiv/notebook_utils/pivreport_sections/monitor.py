@@ -17,12 +17,12 @@ monitor_points = MaskSeeder(res.get_mask()[0,:,:],
 # manually:
 # monitor_points = [(130, 100, 20, 50), (25, 30.5, 100, 200)]"""),
                code_cells("""fig, axes = stdplt.subplots(1, 2, figsize=(10, 3), tight_layout=True)
-displacement_magnitude.stdpiv.mean('reltime').plot(ax=axes[0])
+axes[0].pivfield(displacement_magnitude_mean)
 axes[0].set_aspect(1)
 
 for x, y in monitor_points:
     m, c = next(stdplt.markers), next(stdplt.gray_colors)
-    monitor_pt = displacement_magnitude.sel(x=x, y=y)
+    _, _, monitor_pt = load_point(x, y)
     line = monitor_pt.plot(ax=axes[1], marker='', color=c)
     # mark first and last point:
     axes[1].scatter(monitor_pt.reltime[0], monitor_pt[0], marker=m, color=line[0].get_color())
@@ -30,7 +30,9 @@ for x, y in monitor_points:
     axes[0].scatter(monitor_pt.x, monitor_pt.y, marker=m, color=line[0].get_color())"""),
                ]
 
-    section_monitor_points = Section('Monitor points', label='monitor_points')
+    section_monitor_points = Section('Monitor points', label='monitor_points',
+                                     produces=('monitor_points',),
+                                     consumes=('res', 'displacement_magnitude_mean', 'load_point'))
     for cell in __cells:
         section_monitor_points.add_cell(cell)
     return section_monitor_points
@@ -38,7 +40,9 @@ for x, y in monitor_points:
 
 def convergence():
     """Build convergence section."""
-    section_convergence = Section('Convergence', label='convergence')
+    section_convergence = Section('Convergence', label='convergence',
+                                  consumes=('displacement_magnitude_mean', 'displacement_magnitude_global_mean',
+                                            'monitor_points', 'load_point'))
 
     __cells = [markdown_cells(r"""Convergence or "significance" is judged by analyzing the developing the running mean $\mu_d$ and 
 standard deviation $\sigma_d$. The evolution is plotted for the monitor points. Note, that the mean data is 
@@ -47,29 +51,26 @@ normalized by the last data point."""),
                # code_cells("""displacement_magnitude.stdpiv.mean('reltime').standard_name"""),
                code_cells("""fig, axes = stdplt.subplots(1, 3, figsize=(10, 3), tight_layout=True)
 
-displacement_magnitude.stdpiv.mean('reltime').plot(ax=axes[0])
+axes[0].pivfield(displacement_magnitude_mean)
 axes[0].set_aspect(1)
 
 ddof = 2
 
-rrsd = displacement_magnitude.stdpiv.compute_developing_relative_standard_deviation(dim='reltime', ddof=ddof)
-mag_develop_mean = displacement_magnitude.stdpiv.compute_developing_mean(dim='reltime')
-
-_norm_displ_mag = displacement_magnitude / displacement_magnitude.mean()
-_norm_displ_mag.attrs['standard_name'] = 'normalized_magnitude'
-norm_mag_develop_std = _norm_displ_mag.stdpiv.compute_developing_std(dim='reltime', ddof=ddof)
-
 # ax2 = axes[1].twinx()
 for x, y in monitor_points:
     m, c = next(stdplt.markers), next(stdplt.gray_colors)
+    # only the time series of the monitor point is read:
+    _, _, monitor_pt = load_point(x, y)
+    _norm_displ_mag = monitor_pt / displacement_magnitude_global_mean
+    _norm_displ_mag.attrs['standard_name'] = 'normalized_magnitude'
 
     # plot developing properties:
-    data = mag_develop_mean.sel(x=x, y=y, method='nearest')
+    data = monitor_pt.stdpiv.compute_developing_mean(dim='reltime')
     normalize_data = data/data[-1]  # normalize with mean, which is the last
     line = normalize_data[1:].plot(color=c, ax=axes[1])
     axes[0].scatter(x, y, marker=m, color=line[0].get_color())
 
-    line = norm_mag_develop_std.sel(x=x, y=y, method='nearest').plot(color=line[0].get_color(), ax=axes[2], linestyle='--')
+    line = _norm_displ_mag.stdpiv.compute_developing_std(dim='reltime', ddof=ddof).plot(color=line[0].get_color(), ax=axes[2], linestyle='--')
     
     axes[0].set_title('mean mag. field')
     axes[1].set_title('Normalized developing mean')
@@ -97,13 +98,15 @@ axes[2].set_ylabel('developing std')"""),
 
 
 def line(linedata):
-    section_monitor_line = Section('Monitor line', label='monitor_line')
+    section_monitor_line = Section('Monitor line', label='monitor_line', consumes=('load_line',))
     __cells = [code_cells("""fig, axes = stdplt.subplots(1, 1)
 
-mean_abs_displacement = displacement_magnitude.sel(y=80, method='nearest').mean('reltime')
-max_abs_displacement = displacement_magnitude.sel(y=80, method='nearest').max('reltime')
-min_abs_displacement = displacement_magnitude.sel(y=80, method='nearest').min('reltime')
-std_abs_displacement = displacement_magnitude.sel(y=80, method='nearest').std('reltime')
+# only the time series of the line is read:
+_, _, displacement_magnitude_line = load_line(80)
+mean_abs_displacement = displacement_magnitude_line.mean('reltime')
+max_abs_displacement = displacement_magnitude_line.max('reltime')
+min_abs_displacement = displacement_magnitude_line.min('reltime')
+std_abs_displacement = displacement_magnitude_line.std('reltime')
 
 max_abs_displacement.plot(ax=axes, linestyle='--', label='min/max', color='lightgray')
 min_abs_displacement.plot(ax=axes, linestyle='--', color='lightgray')
@@ -30,11 +30,13 @@ norm_res.plot(vmax=1, cmap=stdplt.get_discrete_cmap(['red', 'green']), levels=[0
 
            ]
 
-section_normality_check = Section('Normality check', label='normality_check')
+section_normality_check = Section('Normality check', label='normality_check',
+                                  consumes=('res', 'dx', 'dy', 'displacement_magnitude'))
 for cell in __cells:
     section_normality_check.add_cell(cell)
 
-section_monitor_point_convergence = Section('Convergence', label='convergence')
+section_monitor_point_convergence = Section('Convergence', label='convergence',
+                                            consumes=('displacement_magnitude', 'monitor_points'))
 
 __cells = [markdown_cells(r"""Convergence or "significance" is judged by analyzing the evolution the running standard deviation $\sigma_r$ in relation to the running mean $\mu_r$:
 \begin{equation}
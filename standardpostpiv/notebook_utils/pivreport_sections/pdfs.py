@@ -2,51 +2,72 @@ from ..cells import markdown_cells, code_cells
 
 cells = []
 cells.append(markdown_cells("""Find out what the PIV method is, the final window size, etc.:"""))
-cells.append(code_cells("""from standardpostpiv.utils import apply_mask"""))
+cells.append(code_cells("""bins_per_pixel = 10"""))
 
-cells.append(code_cells("""dx = apply_mask(res.x_displacement[()],
-                res.piv_flags[()],
-                2)
-dy = apply_mask(res.y_displacement[()],
-                res.piv_flags[()],
-                2)"""))
+cells.append(code_cells("""from standardpostpiv.statistics import Histogram, QuantileSketch, stream_update"""))
 
-cells.append(code_cells("""bins_per_pixel = 10"""))
+cells.append(code_cells("""# histograms and quantile sketches are accumulated chunk by chunk in one pass, the
+# histograms cover the range of the data (see `Histogram.max_bins`):
+hist_dx, quantiles_dx = stream_update(res.x_displacement, [Histogram(1/bins_per_pixel), QuantileSketch()],
+                                      flags=res.piv_flags)
+hist_dy, quantiles_dy = stream_update(res.y_displacement, [Histogram(1/bins_per_pixel), QuantileSketch()],
+                                      flags=res.piv_flags)"""))
+
+cells.append(code_cells("""from standardpostpiv.statistics import stream_peak_locking"""))
+
+cells.append(code_cells("""# sub-pixel histograms and peak-locking index of all frames:
+pl_dx = stream_peak_locking(res.x_displacement, nbins=bins_per_pixel, flags=res.piv_flags)
+pl_dy = stream_peak_locking(res.y_displacement, nbins=bins_per_pixel, flags=res.piv_flags)
 
-cells.append(code_cells("""dx_subpx = dx[0,:,:]-dx[0,:,:].astype(int)
-dy_subpx = dy[0,:,:]-dy[0,:,:].astype(int)
+def _peak_locking_color(pli):
+    if abs(pli) < 0.1:
+        return 'green'
+    if abs(pli) < 0.3:
+        return 'orange'
+    return 'red'
 
-dx_subpx = dx_subpx.where(dx_subpx<0.5, dx_subpx-1).where(dx_subpx>-0.5, dx_subpx+1)
-dx_subpx.attrs['standard_name'] = 'x_sub_pixel_displacement'
-dy_subpx = dy_subpx.where(dy_subpx<0.5, dy_subpx-1).where(dy_subpx>-0.5, dy_subpx+1)
-dy_subpx.attrs['standard_name'] = 'y_sub_pixel_displacement'"""))
+badge.display([_peak_locking_color(pl.attrs['global_peak_locking_index']) for pl in (pl_dx, pl_dy)],
+              peak_locking_x=f"{pl_dx.attrs['global_peak_locking_index']:.2f}",
+              peak_locking_y=f"{pl_dy.attrs['global_peak_locking_index']:.2f}",
+              inline=True)"""))
 
 cells.append(code_cells("""fig, axes = stdplt.subplots(2, 1, tight_layout=True)
 fig.suptitle('Displacement:')
-_ = dx.plot.hist(binwidth=1/bins_per_pixel, density=True, ax=axes[0])  # 10 bins per pixel
-_ = dy.plot.hist(binwidth=1/bins_per_pixel, density=True, ax=axes[1])  # 10 bins per pixel
-# axes[0].plot_normal_distribution(dx, n=100)
-# axes[1].plot_normal_distribution(dy, n=100)
-axes[0].set_xlim([-7.5, 7.5])
-axes[1].set_xlim([0, 17.5])
+_ = axes[0].hist(hist_dx, density=True)  # 10 bins per pixel
+_ = axes[1].hist(hist_dy, density=True)  # 10 bins per pixel
+# robust limits from the 0.1 and 99.9 percentiles:
+axes[0].set_xlim(quantiles_dx.quantile([0.001, 0.999]) + [-0.5, 0.5])
+axes[1].set_xlim(quantiles_dy.quantile([0.001, 0.999]) + [-0.5, 0.5])
 stdplt.show()
 
 fig, axes = stdplt.subplots(2, 1, tight_layout=True)
-fig.suptitle('Sub-pixel displacement:')
-_ = dx_subpx.plot.hist(binwidth=1/bins_per_pixel, ax=axes[0])
-_ = dy_subpx.plot.hist(binwidth=1/bins_per_pixel, ax=axes[1])
-stdplt.show()"""))
-
-cells.append(code_cells("""stdplt.piv_scatter(res.x_displacement[...],
-                   res.y_displacement[...],
-                   flags=res.piv_flags[...],
+fig.suptitle('Sub-pixel displacement (all frames):')
+for ax, pl, name in zip(axes, (pl_dx, pl_dy), ('x', 'y')):
+    counts = pl.sub_pixel_histogram.sum('reltime')
+    ax.hist(counts.sub_pixel_displacement, bins=np.linspace(-0.5, 0.5, counts.size + 1), weights=counts)
+    ax.set_xlabel(f'{name}_sub_pixel_displacement')
+stdplt.show()
+
+fig, axes = stdplt.subplots(1, 1, tight_layout=True)
+pl_dx.peak_locking_index.plot(ax=axes, label='x')
+pl_dy.peak_locking_index.plot(ax=axes, label='y')
+axes.set_ylabel('peak-locking index')
+_ = stdplt.legend()"""))
+
+cells.append(code_cells("""# density image of all vectors, binned chunk by chunk:
+stdplt.piv_scatter(res.x_displacement,
+                   res.y_displacement,
+                   flags=res.piv_flags,
                    fiwsize=res.final_iw_size,
-                   alpha=0.1)
+                   density=True,
+                   value_range=(quantiles_dx.quantile([0.001, 0.999]), quantiles_dy.quantile([0.001, 0.999])))
 _ = stdplt.legend(loc='lower left')"""))
 
 from standardpostpiv.notebook_utils.section import Section
 
-section = Section('PDFs', label='pdfs')
+section = Section('PDFs', label='pdfs',
+                  produces=('hist_dx', 'hist_dy', 'quantiles_dx', 'quantiles_dy', 'pl_dx', 'pl_dy'),
+                  consumes=('res',))
 
 for cell in cells:
     section.add_cell(cell)
@@ -45,7 +45,7 @@ from standardpostpiv.notebook_utils.section import Section
 
 
 def _build_section(shield_badge=True):
-    _section = Section('Stats', label='stats')
+    _section = Section('Stats', label='stats', produces=('res', 'vdp'), consumes=('hdf_filename',))
     _section.add_cell(mk1, 'markdown')
     _section.add_cell(cell1, 'code')
     _section.add_cell(mk2, 'markdown')
@@ -0,0 +1,179 @@
+"""Report sections plotting from the summary file written by
+`standardpostpiv.precompute.precompute()`. The PIV file is read once in the
+precompute section, all other sections only read the (small) summary."""
+from standardpostpiv.notebook_utils.cells import code_cells, markdown_cells
+from standardpostpiv.notebook_utils.section import Section
+
+section_precompute = Section('Precomputation', label='precompute', produces=('summary',),
+                             consumes=('hdf_filename',))
+for cell in [markdown_cells("""All quantities of the report are computed in a single pass over the PIV file
+and stored in a summary file, which is reused as long as the PIV file does not change:"""),
+             code_cells("""from standardpostpiv.precompute import precompute, PIVSummary
+import standardpostpiv.plotting as stdplt
+import numpy as np"""),
+             code_cells("""summary = PIVSummary(precompute(hdf_filename))
+summary""")]:
+    section_precompute.add_cell(cell)
+
+section_stats = Section('Stats', label='stats', produces=('vdp',), consumes=('summary',))
+for cell in [markdown_cells("""Find out what the PIV method is, the final window size, etc.:"""),
+             code_cells("""from standardpostpiv import badge"""),
+             code_cells("""vdp = summary.vdp()
+badge.display(method=summary.attrs.get('piv_method'),
+              final_ws=summary.final_iw_size,
+              piv_dim=summary.attrs.get('piv_dim'),
+              piv_type=summary.attrs.get('piv_type'),
+              magnification=f"{summary.attrs.get('piv_scaling_factor')}{summary.attrs.get('piv_scaling_factor_units', '')}",
+              vdp=f'{np.mean(vdp):.2f}',
+              color=['green', 'blue', 'yellow', None, 'orange'], inline=True)"""),
+             code_cells("""fig, axes = stdplt.subplots(1, 1, tight_layout=True)
+vdp.plot(ax=axes)""")]:
+    section_stats.add_cell(cell)
+
+section_pdfs = Section('PDFs', label='pdfs', consumes=('summary',))
+for cell in [code_cells("""hist_dx, hist_dy = summary.histogram('x_displacement'), summary.histogram('y_displacement')
+pl_dx, pl_dy = summary.peak_locking('x_displacement'), summary.peak_locking('y_displacement')
+
+def _peak_locking_color(pli):
+    if abs(pli) < 0.1:
+        return 'green'
+    if abs(pli) < 0.3:
+        return 'orange'
+    return 'red'
+
+badge.display([_peak_locking_color(pl.attrs['global_peak_locking_index']) for pl in (pl_dx, pl_dy)],
+              peak_locking_x=f"{pl_dx.attrs['global_peak_locking_index']:.2f}",
+              peak_locking_y=f"{pl_dy.attrs['global_peak_locking_index']:.2f}",
+              inline=True)"""),
+             code_cells("""fig, axes = stdplt.subplots(2, 1, tight_layout=True)
+fig.suptitle('Displacement:')
+_ = axes[0].hist(hist_dx, density=True)
+_ = axes[1].hist(hist_dy, density=True)
+# robust limits from the 0.1 and 99.9 percentiles:
+axes[0].set_xlim(summary.quantile('x_displacement', [0.001, 0.999]) + [-0.5, 0.5])
+axes[1].set_xlim(summary.quantile('y_displacement', [0.001, 0.999]) + [-0.5, 0.5])
+stdplt.show()
+
+fig, axes = stdplt.subplots(2, 1, tight_layout=True)
+fig.suptitle('Sub-pixel displacement (all frames):')
+for ax, pl, name in zip(axes, (pl_dx, pl_dy), ('x', 'y')):
+    counts = pl.sub_pixel_histogram.sum(pl.peak_locking_index.dims[0])
+    ax.hist(counts.sub_pixel_displacement, bins=np.linspace(-0.5, 0.5, counts.size + 1), weights=counts)
+    ax.set_xlabel(f'{name}_sub_pixel_displacement')
+stdplt.show()
+
+fig, axes = stdplt.subplots(1, 1, tight_layout=True)
+pl_dx.peak_locking_index.plot(ax=axes, label='x')
+pl_dy.peak_locking_index.plot(ax=axes, label='y')
+axes.set_ylabel('peak-locking index')
+_ = stdplt.legend()"""),
+             code_cells("""# density image of all vectors:
+density = summary.density()
+if density:
+    ax = stdplt.plot_density(density)
+    ax.set_xlim(summary.quantile('x_displacement', [0.001, 0.999]) + [-0.5, 0.5])
+    ax.set_ylim(summary.quantile('y_displacement', [0.001, 0.999]) + [-0.5, 0.5])
+    ax.set_xlabel(f'x_displacement / {summary.units}')
+    ax.set_ylabel(f'y_displacement / {summary.units}')
+    ax.set_aspect(1)
+    _ = stdplt.legend(loc='lower left')""")]:
+    section_pdfs.add_cell(cell)
+
+section_mean_displacement = Section('Mean displacement fields', label='mean_velocity', consumes=('summary',))
+section_mean_displacement.add_cell(code_cells("""fig, axes = stdplt.subplots(1, 3, figsize=(12, 3), tight_layout=True)
+axes[0].pivfield(summary.field('magnitude_of_displacement', 'mean'))
+axes[0].pivquiver(summary.field('x_displacement', 'mean'), summary.field('y_displacement', 'mean'),
+                  color='k', every='auto')
+
+axes[1].pivfield(summary.field('x_displacement', 'mean'))
+axes[2].pivfield(summary.field('y_displacement', 'mean'))
+for ax in axes:
+    ax.set_aspect('equal')"""))
+
+section_instantaneous_displacement = Section('Displacement fields at specific time stamps', label='inst_vel',
+                                             consumes=('summary',))
+section_instantaneous_displacement.add_cell(code_cells("""fig, axes = stdplt.subplots(1, 3, figsize=(12, 3), tight_layout=True)
+axes[0].pivfield(summary.snapshot('magnitude_of_displacement'))
+axes[0].pivquiver(summary.snapshot('x_displacement'), summary.snapshot('y_displacement'), color='k', every='auto')
+
+axes[1].pivfield(summary.snapshot('x_displacement'))
+axes[2].pivfield(summary.snapshot('y_displacement'))
+for ax in axes:
+    ax.set_aspect('equal')"""))
+
+section_monitor_points = Section('Monitor points', label='monitor_points', produces=('monitor_series',),
+                                 consumes=('summary',))
+section_monitor_points.add_cell(code_cells("""monitor_series = summary.monitor_series('magnitude_of_displacement')
+
+fig, axes = stdplt.subplots(1, 2, figsize=(10, 3), tight_layout=True)
+axes[0].pivfield(summary.field('magnitude_of_displacement', 'mean'))
+axes[0].set_aspect(1)
+
+for ipt in range(monitor_series.sizes['point']):
+    m, c = next(stdplt.markers), next(stdplt.gray_colors)
+    monitor_pt = monitor_series.isel(point=ipt)
+    line = monitor_pt.plot(ax=axes[1], marker='', color=c)
+    # mark first and last point:
+    axes[1].scatter(monitor_pt[monitor_pt.dims[0]][0], monitor_pt[0], marker=m, color=line[0].get_color())
+    axes[1].scatter(monitor_pt[monitor_pt.dims[0]][-1], monitor_pt[-1], marker=m, color=line[0].get_color())
+    axes[0].scatter(*summary.monitor_points[ipt], marker=m, color=line[0].get_color())"""))
+
+section_convergence = Section('Convergence', label='convergence', consumes=('summary', 'monitor_series'))
+for cell in [markdown_cells(r"""Convergence or "significance" is judged by analyzing the developing the running mean $\mu_d$ and
+standard deviation $\sigma_d$. The evolution is plotted for the monitor points. Note, that the mean data is
+normalized by the last data point."""),
+             code_cells("""fig, axes = stdplt.subplots(1, 3, figsize=(10, 3), tight_layout=True)
+
+axes[0].pivfield(summary.field('magnitude_of_displacement', 'mean'))
+axes[0].set_aspect(1)
+
+ddof = 2
+time_dim = monitor_series.dims[0]
+mag_develop_mean = monitor_series.stdpiv.compute_developing_mean(dim=time_dim)
+_norm_displ_mag = monitor_series / summary.global_mean('magnitude_of_displacement')
+_norm_displ_mag.attrs['standard_name'] = 'normalized_magnitude'
+norm_mag_develop_std = _norm_displ_mag.stdpiv.compute_developing_std(dim=time_dim, ddof=ddof)
+
+for ipt in range(monitor_series.sizes['point']):
+    m, c = next(stdplt.markers), next(stdplt.gray_colors)
+    data = mag_develop_mean.isel(point=ipt)
+    normalize_data = data/data[-1]  # normalize with mean, which is the last
+    line = normalize_data[1:].plot(color=c, ax=axes[1])
+    axes[0].scatter(*summary.monitor_points[ipt], marker=m, color=line[0].get_color())
+    norm_mag_develop_std.isel(point=ipt).plot(color=line[0].get_color(), ax=axes[2], linestyle='--')
+
+axes[0].set_title('mean mag. field')
+axes[1].set_title('Normalized developing mean')
+axes[2].set_title('developing std')
+axes[1].set_ylabel('developing mean')
+axes[2].set_ylabel('developing std')"""),
+             markdown_cells("""Change of the developing mean and standard deviation fields relative to
+the final fields (spatial mean):"""),
+             code_cells("""checkpoints = summary.convergence()
+fig, axes = stdplt.subplots(1, 1, tight_layout=True)
+for name in ('mean', 'std'):
+    final = checkpoints[name].isel(n_frames=-1)
+    change = abs(checkpoints[name] - final).mean(final.dims) / abs(final).mean()
+    change.plot(ax=axes, marker='.', label=name)
+axes.set_xscale('log')
+axes.set_ylabel('relative change')
+_ = stdplt.legend()""")]:
+    section_convergence.add_cell(cell)
+
+section_monitor_line = Section('Monitor line', label='monitor_line', consumes=('summary',))
+section_monitor_line.add_cell(code_cells("""fig, axes = stdplt.subplots(1, 1)
+
+_stats = {s: summary.field('magnitude_of_displacement', s) for s in ('mean', 'min', 'max', 'std')}
+_y = _stats['mean'].dims[0]
+_line = {s: v.isel({_y: v.sizes[_y] // 2}) for s, v in _stats.items()}
+
+_line['max'].plot(ax=axes, linestyle='--', label='min/max', color='lightgray')
+_line['min'].plot(ax=axes, linestyle='--', color='lightgray')
+_line['mean'].plot(ax=axes, label='mean', color='k')
+
+axes.fill_between(_line['mean'][_line['mean'].dims[0]],
+                  (_line['mean'] - _line['std']), (_line['mean'] + _line['std']),
+                  color='lightgray', label='$\\\\sigma$')
+
+axes.set_ylabel('magnitude of displacement / pixel')
+_ = stdplt.legend()"""))
@@ -1,35 +1,69 @@
 from .cells import markdown_cells, code_cells, NotebookCells
 from .toc import USECHAPTER
-from typing import Union
+from typing import Iterable, Union
 
 
 class Section:
-    """A section of a notebook"""
-
-    def __init__(self, title, label, level=None, report=None):
+    """A section of a notebook. A section is a template: adding it to a report
+    (`PIVReportNotebook.add_section()`) stores a copy and rendering the cells
+    (`get_cells()`) does not modify it, so module-level sections can be used
+    by any number of reports in one process.
+
+    Parameters
+    ----------
+    title: str
+        Title of the section
+    label: str
+        Label (anchor) of the section
+    level: int, optional
+        Heading level
+    report: PIVReportNotebook, optional
+        The report of the section
+    produces: Iterable[str], optional
+        Variables the section provides to later sections
+    consumes: Iterable[str], optional
+        Variables of earlier sections the section needs. Together with
+        `produces`, they define the section graph of the report (names read by
+        the code are found automatically, too, see `sectiongraph`).
+    """
+
+    def __init__(self, title, label, level=None, report=None, produces: Iterable[str] = None,
+                 consumes: Iterable[str] = None):
         self.title = title
         self.label = label
         self.level = level
         self.report = report
+        self.produces = tuple(produces or ())
+        self.consumes = tuple(consumes or ())
         self.sections = []
         self.cells = []
 
     def __repr__(self):
         return f'<Section title="{self.title}", n_sections={len(self.sections)}, n_cells={len(self.cells)}>'
 
+    def copy(self, level: int = None) -> 'Section':
+        """Returns an independent copy of the section, its cells and subsections.
+        If `level` is given, the copy gets this heading level."""
+        section = Section(self.title, self.label, self.level if level is None else level, self.report,
+                          produces=self.produces, consumes=self.consumes)
+        section.cells = [cell.copy() for cell in self.cells]
+        section.sections = [s.copy() for s in self.sections]
+        return section
+
     def _make_title(self, level_numbers):
+        title = self.title
         use_level = self.level - USECHAPTER
         if use_level > 0:
             level_numbers[use_level - 1] += 1
             level_numbers[use_level:] = 0
             section_num_str = '.'.join([str(_level) for _level in level_numbers[:use_level]])
-            self.title = f'{section_num_str} {self.title}'
-        return '#' * self.level + f' {self.title}', level_numbers
+            title = f'{section_num_str} {title}'
+        return '#' * self.level + f' {title}', level_numbers
 
-    def add_section(self, title, label=None, level=None):
+    def add_section(self, title, label=None, level=None, produces=None, consumes=None):
         if level is None:
             level = self.level + 1
-        section = Section(title, label, level, self.report)
+        section = Section(title, label, level, self.report, produces=produces, consumes=consumes)
         self.sections.append(section)
         return section
 
@@ -46,10 +80,23 @@ class Section:
     def __getitem__(self, item):
         return self.sections[item]
 
-    def get_cells(self, cells, level_numbers):
+    @property
+    def name(self) -> str:
+        """Label of the section or the title if it has no label"""
+        return self.title if self.label is None else self.label
 
+    def iter_sections(self):
+        """Yields the section and all subsections in document order"""
+        yield self
+        for section in self.sections:
+            yield from section.iter_sections()
+
+    def get_cells(self, cells, level_numbers):
+        """Appends the notebook cells of the section and its subsections to
+        `cells` and returns them with the updated section numbers. The section
+        is not modified."""
         if not self.cells:
-            return []
+            return cells, level_numbers
 
         _title, level_numbers = self._make_title(level_numbers)
         if self.label is None:
@@ -59,13 +106,21 @@ class Section:
 
         if self.cells[0].is_markdown():
             # combine the title and the first markdown cell
-            self.cells[0].lines = title_cell.lines + '\n' + self.cells[0].lines
+            lines = self.cells[0].lines
+            if isinstance(lines, list):
+                lines = [title_cell.lines] + lines
+            else:
+                lines = title_cell.lines + '\n' + lines
+            section_cells = [markdown_cells(lines)] + self.cells[1:]
         else:
             # add title in front of cells
-            self.cells.insert(0, title_cell)
+            section_cells = [title_cell] + self.cells
 
-        for cell in self.cells:
-            cells.append(cell.make())
+        for cell in section_cells:
+            nb_cell = cell.make()
+            # used by the section cache to group the cells
+            nb_cell.metadata['section'] = self.name
+            cells.append(nb_cell)
 
         for section in self.sections:
             cells, level_numbers = section.get_cells(cells, level_numbers)
@@ -8,9 +8,12 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
-from scipy.stats import norm
 
-from .utils import build_vector
+from .instrumentation import instrument
+from .logger import logger
+from .pyramid import get_pyramid
+from .statistics import Histogram, Histogram2D
+from .utils import build_vector, iter_chunks
 
 __this_dir__ = pathlib.Path(__file__).parent
 MPLSTYLE_FILENAME = __this_dir__ / 'style.mplstyle'
@@ -59,6 +62,7 @@ def get_normal_distribution_from_data(data, n=100, step=None) -> Tuple[np.ndarra
         raise ValueError("Either step or n must be specified")
     if step is None:
         step = (np.nanmax(data) - np.nanmin(data)) / n
+    from scipy.stats import norm
     x_axis = np.arange(np.nanmin(data), np.nanmax(data), step)
     return x_axis, norm.pdf(x_axis, data.mean(), data.std())
 
@@ -117,16 +121,25 @@ class StandardAxes(plt.Axes):
     def __exit__(self, *args, **kwargs):
         plt.rcParams.update(self.curr_rc_params)
 
+    @instrument
     def hist(self, data, binwidth=None, **kwargs):
+        """Plot a histogram of the data. If `data` is a `statistics.Histogram`,
+        the precomputed counts are drawn and no binning is performed."""
         color = kwargs.pop('color', 'lightgray')
         edgecolor = kwargs.pop('edgecolor', 'k')
-        bins = kwargs.pop('bins', None)
-        if bins is None:
-            if binwidth is None:
-                raise ValueError('Either binwidth or bins must be provided')
-            bins = np.arange(np.nanmin(data), np.nanmax(data) + binwidth, binwidth)
-        super().hist(data, bins=bins, color=color, edgecolor=edgecolor, **kwargs)
-        if isinstance(data, xr.DataArray):
+        if isinstance(data, Histogram):
+            if kwargs.pop('bins', None) is not None or binwidth is not None:
+                logger.warning('The bins of a precomputed Histogram are fixed, "bins" and "binwidth" are ignored')
+            super().hist(data.centers, bins=data.edges, weights=data.counts,
+                         color=color, edgecolor=edgecolor, **kwargs)
+        else:
+            bins = kwargs.pop('bins', None)
+            if bins is None:
+                if binwidth is None:
+                    raise ValueError('Either binwidth or bins must be provided')
+                bins = np.arange(np.nanmin(data), np.nanmax(data) + binwidth, binwidth)
+            super().hist(data, bins=bins, color=color, edgecolor=edgecolor, **kwargs)
+        if isinstance(data, (xr.DataArray, Histogram)):
             xlabel = data.attrs.get('standard_name', data.attrs.get('long_name', None))
             if xlabel is None:
                 xlabel = data.name
@@ -137,6 +150,7 @@ class StandardAxes(plt.Axes):
             self.set_ylabel('count')
         return self
 
+    @instrument
     def plot_normal_distribution(self, data, n=None, step=None, **kwargs):
         """Plot a normal distribution using the mean and standard deviation of the data"""
         with self:
@@ -148,23 +162,49 @@ class StandardAxes(plt.Axes):
                 self.set_xlabel(xlabel)
             return self
 
-    def pivquiver(self, u, v, w=None, every=1, **kwargs):
-        """Plot a quiver plot of the given vector field"""
+    @instrument
+    def pivquiver(self, u, v, w=None, every=1, arrow_spacing=16, **kwargs):
+        """Plot a quiver plot of the given vector field
+
+        Parameters
+        ----------
+        u, v, w: xr.DataArray
+            2D vector components. w is optional.
+        every: Union[int, Tuple[int, int], str]
+            Plot only every n-th vector. If 'auto', the components are block-averaged
+            (NaN aware) to the pyramid level matching `arrow_spacing`.
+        arrow_spacing: float
+            Approximate distance between two arrows in screen pixels if every='auto'
+        """
         if not u.ndim == 2:
             raise ValueError('u must be 2D')
         if not v.ndim == 2:
             raise ValueError('v must be 2D')
         if w is not None and not w.ndim == 2:
             raise ValueError('w must be 2D')
-        if isinstance(every, int):
-            every = (every, every)
         data = {'u': u, 'v': v}
         if w is not None:
             data['w'] = w
-        disp = build_vector(**{k: v[::every[1], ::every[0]] for k, v in data.items()})
+        if every == 'auto':
+            disp = build_vector(**{k: get_pyramid(v).for_axes(self, arrow_spacing) for k, v in data.items()})
+        else:
+            if isinstance(every, int):
+                every = (every, every)
+            disp = build_vector(**{k: v[::every[1], ::every[0]] for k, v in data.items()})
         disp.plot.quiver(x='x', y='y', u='u', v='v', ax=self, **kwargs)
 
-    def pivstreamplot(self, u, v, w=None, **kwargs):
+    @instrument
+    def pivstreamplot(self, u, v, w=None, level=0, **kwargs):
+        """Plot streamlines of the given vector field
+
+        Parameters
+        ----------
+        u, v, w: xr.DataArray
+            2D vector components. w is optional.
+        level: Union[int, str]
+            Pyramid level of the (block-averaged) components. If 'auto', the
+            level matching the axes size in screen pixels is used.
+        """
         if not u.ndim == 2:
             raise ValueError('u must be 2D')
         if not v.ndim == 2:
@@ -174,8 +214,33 @@ class StandardAxes(plt.Axes):
         data = {'u': u, 'v': v}
         if w is not None:
             data['w'] = w
-        disp = build_vector(**{k: v[()] for k, v in data.items()})
-        disp.plot.streamplot(x='x', y='y', u='u', v='v', **kwargs)
+        if level == 'auto':
+            disp = build_vector(**{k: get_pyramid(v).for_axes(self) for k, v in data.items()})
+        else:
+            disp = build_vector(**{k: get_pyramid(v)[level] for k, v in data.items()})
+        disp.plot.streamplot(x='x', y='y', u='u', v='v', ax=self, **kwargs)
+
+    @instrument
+    def pivfield(self, field, level='auto', **kwargs):
+        """Plot a 2D field using `xr.DataArray.plot()`. The (block-averaged) pyramid level
+        is chosen such that a grid cell is not smaller than a screen pixel.
+
+        Parameters
+        ----------
+        field: xr.DataArray
+            2D field
+        level: Union[int, str]
+            Pyramid level or 'auto'
+        kwargs: Dict
+            Parameters passed to `xr.DataArray.plot()`
+        """
+        if not field.ndim == 2:
+            raise ValueError('field must be 2D')
+        if level == 'auto':
+            field = get_pyramid(field).for_axes(self)
+        else:
+            field = get_pyramid(field)[level]
+        return field.plot(ax=self, **kwargs)
 
 
 tight_layout = plt.tight_layout
@@ -189,6 +254,7 @@ import matplotlib.projections as proj
 proj.register_projection(StandardAxes)
 
 
+@instrument
 def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                 v: Union[np.ndarray, xr.DataArray],
                 fiwsize: Union[int, List[int], Tuple[int], Dict, None] = None,
@@ -199,6 +265,10 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                 marker='.',
                 s=20,
                 indicate_means: bool = True,
+                density: bool = False,
+                bins: Union[int, Tuple[int, int]] = 256,
+                value_range=None,
+                chunk_size: int = 10,
                 **kwargs):
     """
 
@@ -220,6 +290,17 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
         size of the scatter plot
     indicate_means: bool
         whether to indicate the mean of the vectors as a red lines
+    density: bool
+        If True, the vectors are binned into a 2D histogram per flag category
+        and drawn as image (see `piv_density`) instead of one marker per vector.
+        u, v and flags may then also be HDF5 datasets, which are read chunk by chunk.
+    bins: Union[int, Tuple[int, int]]
+        Number of bins of the density image (only used if density is True)
+    value_range: Tuple[Tuple[float, float], Tuple[float, float]], optional
+        ((umin, umax), (vmin, vmax)) of the density image. If None, the range is
+        determined by an additional pass over the data (only used if density is True)
+    chunk_size: int
+        Number of frames read at once (only used if density is True)
     kwargs: dict
         additional keyword arguments passed to the scatter plot
     """
@@ -230,20 +311,20 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
 
     u_is_xr = isinstance(u, xr.DataArray)
     v_is_xr = isinstance(v, xr.DataArray)
-    if u_is_xr:
-        dx = u.values.ravel()
-    else:
-        dx = u.ravel()
-    if v_is_xr:
-        dy = v.values.ravel()
-    else:
-        dy = v.ravel()
 
     show_window_size = fiwsize is not None
 
     if ax is None:
         fig, ax = subplots(1, 1, tight_layout=True)
-    if flags is not None:
+    if density:
+        ax, hists, (umean, vmean) = piv_density(u, v, flags=flags, bins=bins, value_range=value_range,
+                                                chunk_size=chunk_size, color=color, alpha=alpha, ax=ax)
+        hist = next(iter(hists.values()))
+        if not u_is_xr and xlabel is None and hist.xattrs:
+            xlabel = _axis_label(hist.xname, hist.xattrs)
+        if not v_is_xr and ylabel is None and hist.yattrs:
+            ylabel = _axis_label(hist.yname, hist.yattrs)
+    elif flags is not None:
         ax.scatter(u.where(flags == 1),
                    v.where(flags == 1), marker=marker, s=s, color='k', alpha=alpha,
                    label='active')
@@ -256,10 +337,13 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                    v.where(mask64).data.ravel(), marker=marker, s=s, color='b', alpha=alpha,
                    label='active+replaced')
     else:
+        dx = u.values.ravel() if u_is_xr else u.ravel()
+        dy = v.values.ravel() if v_is_xr else v.ravel()
         ax.scatter(dx, dy, color=color, alpha=alpha, marker=marker, **kwargs)
 
-    umean = u.mean()
-    vmean = v.mean()
+    if not density:
+        umean = u.mean()
+        vmean = v.mean()
 
     if show_window_size:
 
@@ -314,6 +398,143 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
     return ax
 
 
+def _axis_label(name, attrs: Dict) -> str:
+    """Axis label from the standard_name (or long_name or name) and units"""
+    name = attrs.get('standard_name', attrs.get('long_name', name))
+    return f'{name} / {attrs.get("units", "?units?")}'
+
+
+def _flag_category_masks(flags) -> Dict[str, np.ndarray]:
+    """Masks (True = ignored) of the flag categories shown in PIV scatter plots"""
+    flags = np.asarray(flags)
+    return {'active': flags != 1,
+            'active+interpolated': ~(flags & 32).astype(bool),
+            'active+replaced': ~(flags & 64).astype(bool)}
+
+
+PIV_SCATTER_COLORS = {'active': 'k', 'active+interpolated': 'r', 'active+replaced': 'b'}
+
+
+@instrument
+def piv_density(u, v,
+                flags=None,
+                bins: Union[int, Tuple[int, int]] = 256,
+                value_range=None,
+                chunk_size: int = 10,
+                color='k',
+                alpha=1.,
+                ax=None):
+    """Density version of a PIV scatter plot. The (u, v) pairs are binned into
+    a 2D histogram per flag category chunk by chunk and drawn as image, where the
+    opacity is the logarithmic count. Memory, render time and output size are
+    independent of the number of vectors.
+
+    Parameters
+    ----------
+    u: array-like
+        x-velocity or x-displacement, e.g. an HDF5 dataset. Read in chunks along the first axis.
+    v: array-like
+        y-velocity or y-displacement with the same shape as u
+    flags: array-like, optional
+        PIV flags. If given, the categories active, active+interpolated and
+        active+replaced are drawn in black, red and blue.
+    bins: Union[int, Tuple[int, int]]
+        Number of bins in u and v
+    value_range: Tuple[Tuple[float, float], Tuple[float, float]], optional
+        ((umin, umax), (vmin, vmax)). If None, the range is determined by an
+        additional pass over the data.
+    chunk_size: int
+        Number of entries along the first axis read at once
+    color: str
+        Color used if no flags are given
+    alpha: float
+        Maximal opacity of the image
+    ax: plt.Axes, optional
+        Axes to plot on
+
+    Returns
+    -------
+    ax: plt.Axes
+    hists: Dict[str, Histogram2D]
+        The 2D histograms per category
+    means: Tuple[float, float]
+        Mean of all finite u and v values
+    """
+    if value_range is None:
+        umin, umax, vmin, vmax = np.inf, -np.inf, np.inf, -np.inf
+        for uchunk, vchunk in zip(iter_chunks(u, chunk_size), iter_chunks(v, chunk_size)):
+            uchunk, vchunk = np.asarray(uchunk), np.asarray(vchunk)
+            if np.isfinite(uchunk).any() and np.isfinite(vchunk).any():
+                umin, umax = min(umin, np.nanmin(uchunk)), max(umax, np.nanmax(uchunk))
+                vmin, vmax = min(vmin, np.nanmin(vchunk)), max(vmax, np.nanmax(vchunk))
+        if not np.isfinite([umin, umax, vmin, vmax]).all():
+            raise ValueError('No finite data to plot')
+        value_range = ((umin, umax if umax > umin else umin + 1), (vmin, vmax if vmax > vmin else vmin + 1))
+
+    if flags is None:
+        colors = {None: color}
+    else:
+        colors = PIV_SCATTER_COLORS
+    hists = {category: Histogram2D(*value_range, bins=bins) for category in colors}
+
+    sum_u, sum_v, n_u, n_v = 0., 0., 0, 0
+    if flags is None:
+        chunks = zip(iter_chunks(u, chunk_size), iter_chunks(v, chunk_size))
+    else:
+        chunks = zip(iter_chunks(u, chunk_size), iter_chunks(v, chunk_size), iter_chunks(flags, chunk_size))
+    for chunk in chunks:
+        uchunk, vchunk = chunk[0], chunk[1]
+        if flags is None:
+            hists[None].update(uchunk, vchunk)
+        else:
+            for category, mask in _flag_category_masks(chunk[2]).items():
+                hists[category].update(uchunk, vchunk, mask=mask)
+        _u, _v = np.asarray(uchunk), np.asarray(vchunk)
+        sum_u += float(np.nansum(_u, dtype=float))
+        sum_v += float(np.nansum(_v, dtype=float))
+        n_u += int(np.count_nonzero(np.isfinite(_u)))
+        n_v += int(np.count_nonzero(np.isfinite(_v)))
+
+    ax = plot_density(hists, color=color, alpha=alpha, ax=ax)
+    means = (sum_u / n_u if n_u else np.nan, sum_v / n_v if n_v else np.nan)
+    return ax, hists, means
+
+
+def plot_density(hists: Dict, color='k', alpha=1., ax=None):
+    """Draws 2D histograms (e.g. of `piv_density` or `precompute.PIVSummary.density`)
+    as images, where the opacity is the logarithmic count.
+
+    Parameters
+    ----------
+    hists: Dict[str, Histogram2D]
+        The 2D histograms per flag category (see `PIV_SCATTER_COLORS`). The
+        key None draws the histogram in `color`.
+    color: str
+        Color of the histogram with key None
+    alpha: float
+        Maximal opacity of the images
+    ax: plt.Axes, optional
+        Axes to plot on
+
+    Returns
+    -------
+    ax: plt.Axes
+    """
+    if ax is None:
+        fig, ax = subplots(1, 1, tight_layout=True)
+    for category, hist in hists.items():
+        rgba = np.zeros((hist.ny, hist.nx, 4))
+        rgba[..., :3] = mpl.colors.to_rgb(color if category is None else PIV_SCATTER_COLORS[category])
+        cmax = hist.counts.max()
+        if cmax > 0:
+            rgba[..., 3] = alpha * np.log1p(hist.counts) / np.log1p(cmax)
+        ax.imshow(rgba, extent=hist.extent, origin='lower', interpolation='nearest', aspect='auto')
+        if category is not None:
+            # proxy artist for the legend
+            ax.plot([], [], linestyle='', marker='s', color=PIV_SCATTER_COLORS[category], label=category)
+    return ax
+
+
 def get_discrete_cmap(colors: List[str]):
     """Return a discrete colormap from a list of colors."""
     import matplotlib.colors
@@ -337,7 +558,8 @@ class StdRcParam:
         plt.rcParams.update(self.curr_rc_params)
 
 
-def savefig2svg(fig, filename, pdftex: bool = False, **kwargs) -> pathlib.Path:
+@instrument
+def savefig2svg(fig, filename, pdftex: bool = False, cache=None, key: str = None, **kwargs) -> pathlib.Path:
     """Save figure to svg. Optionally convert to pdf for pdftex (pdf+tex file)
 
     Parameters
@@ -348,26 +570,53 @@ def savefig2svg(fig, filename, pdftex: bool = False, **kwargs) -> pathlib.Path:
         Filename passed to fig.savefig
     pdftex: bool
         Whether to convert pdftex
+    cache: figcache.FigureCache, optional
+        If given, the svg file is written reproducibly (no date, fixed ids) and
+        the pdftex conversion is skipped if the svg content is cached.
+    key: str, optional
+        Cache key of the content of `fig`, e.g. `figcache.figure_key(func, kwargs)`
+        of the function building it. If given with `cache`, the svg (and pdftex)
+        files are restored from the cache without drawing the figure.
     kwargs: Dict
         Optional parameters for savefig
     """
     filename = pathlib.Path(filename)
     if filename.suffix != '.svg':
         raise ValueError(f'Filename suffix must be ".svg" but is "{filename.suffix}".')
+    entry_key = None
+    if cache is not None and key is not None:
+        from .figcache import PDFTEX_SUFFIXES, hash_content
+        entry_key = hash_content('savefig2svg', key, pdftex, repr(sorted(kwargs.items())),
+                                 MPLSTYLE_FILENAME.read_bytes())
+        if cache.get(entry_key, filename):
+            return filename
     with StdRcParam():
-        fig.savefig(filename, **kwargs)
+        if cache is None:
+            fig.savefig(filename, **kwargs)
+        else:
+            kwargs['metadata'] = {'Date': None, **kwargs.get('metadata', {})}
+            with mpl.rc_context({'svg.hashsalt': 'standardpostpiv'}):
+                fig.savefig(filename, **kwargs)
         if pdftex:
-            svg2pdftex(filename)
+            cp = svg2pdftex(filename, cache=cache)
+            if cp.returncode != 0:
+                entry_key = None
+    if entry_key is not None:
+        cache.put(entry_key, filename, ['.svg', *(PDFTEX_SUFFIXES if pdftex else ())])
     return filename
 
 
-def svg2pdftex(image_filename: pathlib.Path) -> subprocess.CompletedProcess:
+@instrument
+def svg2pdftex(image_filename: pathlib.Path, cache=None) -> subprocess.CompletedProcess:
     """Convert svg to pdf for pdftex
 
     Parameters
     ----------
     image_filename : pathlib.Path
         Path to the svg file
+    cache: figcache.FigureCache, optional
+        If given, the pdf and pdf_tex files are restored from the cache if the
+        content of the svg file (and the mplstyle) is cached.
 
     Returns
     -------
@@ -376,6 +625,14 @@ def svg2pdftex(image_filename: pathlib.Path) -> subprocess.CompletedProcess:
     image_filename = pathlib.Path(image_filename)
     assert image_filename.exists()
     target_filename = image_filename.parent / f'{image_filename.stem}.pdf'
+    if cache is not None:
+        from .figcache import PDFTEX_SUFFIXES, hash_content
+        key = hash_content('svg2pdftex', image_filename.read_bytes(), MPLSTYLE_FILENAME.read_bytes())
+        if cache.get(key, image_filename):
+            return subprocess.CompletedProcess(args=['svg2pdftex', str(image_filename)], returncode=0)
+        # artefacts of a previous run must not be taken for the output of this one
+        for suffix in PDFTEX_SUFFIXES:
+            image_filename.with_suffix(suffix).unlink(missing_ok=True)
     try:
         cp = subprocess.run(
             f'inkscapecom.com --export-filename={target_filename} --export-type=pdf --export-latex {image_filename}'.split(
@@ -385,4 +642,6 @@ def svg2pdftex(image_filename: pathlib.Path) -> subprocess.CompletedProcess:
         cp = subprocess.run(
             f'inkscape --export-filename={target_filename} --export-type=pdf --export-latex {image_filename}'.split(' ')
         )
+    if cache is not None and cp.returncode == 0:
+        cache.put(key, image_filename, list(PDFTEX_SUFFIXES))
     return cp
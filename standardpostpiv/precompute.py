@@ -0,0 +1,649 @@
+"""Single-pass precomputation of the quantities plotted in a report. The PIV
+file is read once, chunk by chunk, and all per-pixel moments, histograms,
+quantiles, peak-locking counts, flag series, monitor-point series,
+convergence checkpoints and a few snapshot frames are written to a compact
+summary HDF5 file. Report sections built on `PIVSummary` only plot from this
+file, so their runtime depends on the number of plots but not on the size of
+the PIV file."""
+import json
+import pathlib
+from typing import Dict, List, Sequence, Tuple, Union
+
+import appdirs
+import h5py
+import numpy as np
+import xarray as xr
+
+from ._version import __version__
+from .figcache import hash_content
+from .instrumentation import instrument
+from .logger import logger
+from .statistics import Histogram, Histogram2D, QuantileSketch, peak_locking, _update_peak_locking_index
+from .utils import MaskSeeder
+
+VARIABLES = ('x_displacement', 'y_displacement', 'magnitude_of_displacement')
+STATISTICS = ('count', 'mean', 'std', 'min', 'max')
+DENSITY_CATEGORIES = ('active', 'active+interpolated', 'active+replaced')
+QUANTILE_LEVELS = np.linspace(0, 1, 1001)
+
+
+def find_standard_names(h5: h5py.File) -> Dict[str, str]:
+    """Returns the names of the datasets of an HDF5 file by their standard_name
+    attribute. If a standard name occurs more than once, the first dataset is returned."""
+    names = {}
+
+    def _visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            sn = obj.attrs.get('standard_name', None)
+            if isinstance(sn, bytes):
+                sn = sn.decode()
+            if sn is not None and sn not in names:
+                names[sn] = name
+
+    h5.visititems(_visit)
+    return names
+
+
+def _attr(value):
+    """Converts an HDF5 attribute value to a python type"""
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _dimension(ds: h5py.Dataset, axis: int, default: str) -> Tuple[str, np.ndarray, Dict]:
+    """Name, values and attributes of the dimension scale attached to `axis` of `ds`"""
+    if len(ds.dims[axis]) > 0:
+        scale = ds.dims[axis][0]
+        return scale.name.rsplit('/', 1)[-1], scale[()], {k: _attr(v) for k, v in scale.attrs.items()
+                                                          if k in ('standard_name', 'units', 'long_name')}
+    return default, np.arange(ds.shape[axis]), {}
+
+
+def _piv_parameters(h5: h5py.File, standard_names: Dict[str, str]) -> Dict:
+    """PIV meta data as used by the report (method, window size, type, ...)"""
+    params = {}
+
+    def _visit(name, obj):
+        if 'piv_method' in obj.attrs and 'piv_method' not in params:
+            params['piv_method'] = _attr(obj.attrs['piv_method'])
+            if isinstance(obj, h5py.Group):
+                for key in ('x_final_iw_size', 'y_final_iw_size', 'x_final_iw_overlap_size',
+                            'y_final_iw_overlap_size'):
+                    if key in obj:
+                        params[key] = int(obj[key][()])
+
+    h5.visititems(_visit)
+    params['piv_dim'] = '2D3C' if 'z_displacement' in standard_names else '2D2C'
+    if 'x_velocity' in standard_names:
+        params['piv_type'] = {2: 'snapshot', 3: 'plane'}.get(h5[standard_names['x_velocity']].ndim, 'mplane')
+    if 'piv_scaling_factor' in standard_names:
+        ds = h5[standard_names['piv_scaling_factor']]
+        params['piv_scaling_factor'] = float(ds[()])
+        params['piv_scaling_factor_units'] = _attr(ds.attrs.get('units', ''))
+    return params
+
+
+def _select_monitor_points(mask: np.ndarray, n: int, seed: int) -> List[Tuple[int, int]]:
+    """Random (iy, ix) indices of unmasked points with a distance to the mask and the borders"""
+    min_dist = min(20, max(1, min(mask.shape) // 4))
+    state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        indices = MaskSeeder(xr.DataArray(mask.astype(bool)), None, None, n=n,
+                             min_dist=min_dist).generate(ret_indices=True)
+    except ValueError as e:
+        logger.debug(f'No monitor points seeded: {e}')
+        indices = []
+    finally:
+        np.random.set_state(state)
+    return [(int(iy), int(ix)) for iy, ix in indices]
+
+
+def _checkpoints(nt: int, n: int) -> np.ndarray:
+    """Approximately logarithmically spaced numbers of frames (the last one is `nt`)"""
+    if nt < 1:
+        return np.zeros(0, dtype=int)
+    return np.unique(np.geomspace(min(2, nt), nt, n).round().astype(int))
+
+
+class _Moments:
+    """NaN-aware per-pixel count, sum, sum of squares, min and max"""
+    __slots__ = ('count', 'sum', 'sum2', 'min', 'max')
+
+    def __init__(self, shape: Tuple[int, int]):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.sum2 = np.zeros(shape)
+        self.min = np.full(shape, np.nan)
+        self.max = np.full(shape, np.nan)
+
+    def update(self, x: np.ndarray):
+        self.count += np.count_nonzero(np.isfinite(x), axis=0)
+        self.sum += np.nansum(x, axis=0)
+        self.sum2 += np.nansum(x ** 2, axis=0)
+        self.min = np.fmin(self.min, np.fmin.reduce(x, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(x, axis=0))
+
+    def mean_std(self, count=None, total=None, total2=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Mean and (population) standard deviation of the accumulated values or of
+        the given count, sum and sum of squares"""
+        count = self.count if count is None else count
+        total = self.sum if total is None else total
+        total2 = self.sum2 if total2 is None else total2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, np.nan)
+            std = np.sqrt(np.maximum(total2 / count - mean ** 2, 0))
+        return mean, std
+
+
+def _append(group: h5py.Group, name: str, data: np.ndarray, chunk_rows: int = 1024, **kwargs) -> h5py.Dataset:
+    """Appends `data` along the first axis of the dataset `name`, which is created
+    resizable if it does not exist"""
+    data = np.asarray(data)
+    if name not in group:
+        return group.create_dataset(name, data=data, maxshape=(None,) + data.shape[1:],
+                                    chunks=(chunk_rows,) + tuple(max(n, 1) for n in data.shape[1:]), **kwargs)
+    ds = group[name]
+    n = ds.shape[0]
+    ds.resize(n + data.shape[0], axis=0)
+    ds[n:] = data
+    return ds
+
+
+def _overwrite(group: h5py.Group, name: str, data: np.ndarray, **kwargs) -> h5py.Dataset:
+    """Writes `data` to the dataset `name`, which is replaced if its shape differs"""
+    data = np.asarray(data)
+    if name in group:
+        if group[name].shape == data.shape:
+            group[name][()] = data
+            return group[name]
+        del group[name]
+    return group.create_dataset(name, data=data, **kwargs)
+
+
+class _SummaryAccumulator:
+    """Running state of all quantities of the summary, updated frame block by
+    frame block. `write()` appends the per-frame series (flag counts, monitor
+    points, peak locking, time coordinate) of the frames added since the
+    previous call and overwrites the per-pixel statistics, histograms and
+    quantiles, so the cost of an update is proportional to the number of new
+    frames and not to the number of frames in total.
+
+    Parameters
+    ----------
+    dims: List[Tuple[str, np.ndarray, Dict]]
+        Name, values and attributes of the time, y and x dimension. The time
+        values are taken from `update()`.
+    flag_meaning: Dict[int, str]
+        Flag bits and their meaning
+    mp_indices: List[Tuple[int, int]]
+        (iy, ix) indices of the monitor points
+    snapshots: Sequence[int]
+        Frame indices of which the instantaneous fields are stored
+    checkpoints: np.ndarray
+        Increasing numbers of frames at which the developing mean and standard
+        deviation of the displacement magnitude are stored
+    bins_per_pixel: int
+        Number of histogram bins per pixel displacement
+    histogram_range: float
+        The displacement histograms cover +/- `histogram_range`, values outside
+        are counted in `n_outside`. 0 lets the histograms grow with the data
+        (up to `Histogram.max_bins` bins).
+    density_range: float
+        The (dx, dy) density images cover +/- `density_range`. 0 disables them.
+    density_bins: int
+        Number of bins of the density images in each direction
+    seed: int
+        Seed of the quantile sketches
+    """
+    __slots__ = ('dims', 'flag_meaning', 'mp_iy', 'mp_ix', 'snapshots', 'checkpoints', 'bins_per_pixel',
+                 'n_frames', 'moments', 'hists', 'sketches', 'density', 'pending', 'checkpoint_frames',
+                 'checkpoint_mean', 'checkpoint_std', 'n_checkpoints_written')
+
+    def __init__(self, dims: List[Tuple[str, np.ndarray, Dict]], flag_meaning: Dict[int, str],
+                 mp_indices: List[Tuple[int, int]], snapshots: Sequence[int], checkpoints: np.ndarray,
+                 bins_per_pixel: int = 10, histogram_range: float = 0, density_range: float = 0,
+                 density_bins: int = 256, seed: int = 10):
+        shape = (dims[1][1].size, dims[2][1].size)
+        self.dims = dims
+        self.flag_meaning = flag_meaning
+        self.mp_iy = np.array([p[0] for p in mp_indices], dtype=int)
+        self.mp_ix = np.array([p[1] for p in mp_indices], dtype=int)
+        self.snapshots = sorted(snapshots)
+        self.checkpoints = np.asarray(checkpoints, dtype=int)
+        self.bins_per_pixel = bins_per_pixel
+        self.n_frames = 0
+        self.moments = {name: _Moments(shape) for name in VARIABLES}
+        value_range = (-histogram_range, histogram_range) if histogram_range > 0 else None
+        self.hists = {name: Histogram(1 / bins_per_pixel, value_range=value_range) for name in VARIABLES[:2]}
+        self.sketches = {name: QuantileSketch(seed=seed) for name in VARIABLES[:2]}
+        self.density = {c: Histogram2D((-density_range, density_range), (-density_range, density_range),
+                                       bins=density_bins) for c in DENSITY_CATEGORIES} if density_range > 0 else {}
+        self.pending = {}  # dataset name -> blocks not written yet
+        self.checkpoint_frames, self.checkpoint_mean, self.checkpoint_std = [], [], []
+        self.n_checkpoints_written = 0
+
+    def __repr__(self):
+        return f'<_SummaryAccumulator n_frames={self.n_frames}>'
+
+    def _add(self, name: str, block: np.ndarray):
+        self.pending.setdefault(name, []).append(block)
+
+    def update(self, dx: np.ndarray, dy: np.ndarray, flags: np.ndarray = None, time: np.ndarray = None):
+        """Adds the frames (first axis) of the displacements `dx`, `dy` and
+        the `flags`. Masked vectors must already be NaN. `time` are the values
+        of the time coordinate of the frames."""
+        from .plotting import _flag_category_masks
+
+        n = dx.shape[0]
+        i0, i1 = self.n_frames, self.n_frames + n
+        if time is None:
+            time = np.arange(i0, i1)
+        self._add(f'coords/{self.dims[0][0]}', np.asarray(time))
+        if flags is not None:
+            for bit, meaning in self.flag_meaning.items():
+                self._add(f'flags/{meaning}', np.count_nonzero((flags & bit).reshape(n, -1), axis=1))
+            for category, mask in _flag_category_masks(flags).items() if self.density else ():
+                self.density[category].update(dx, dy, mask=mask)
+        data = {'x_displacement': dx, 'y_displacement': dy, 'magnitude_of_displacement': np.hypot(dx, dy)}
+
+        mag = data['magnitude_of_displacement']
+        mag_moments = self.moments['magnitude_of_displacement']
+        for n_frames in self.checkpoints[(self.checkpoints > i0) & (self.checkpoints <= i1)]:
+            part = mag[:n_frames - i0]
+            mean, std = mag_moments.mean_std(mag_moments.count + np.count_nonzero(np.isfinite(part), axis=0),
+                                             mag_moments.sum + np.nansum(part, axis=0),
+                                             mag_moments.sum2 + np.nansum(part ** 2, axis=0))
+            self.checkpoint_frames.append(int(n_frames))
+            self.checkpoint_mean.append(mean)
+            self.checkpoint_std.append(std)
+
+        for name, x in data.items():
+            self.moments[name].update(x)
+            self._add(f'monitor/{name}', x[:, self.mp_iy, self.mp_ix])
+            for it in self.snapshots:
+                if i0 <= it < i1:
+                    self._add(f'snapshots/{name}', x[it - i0][np.newaxis])
+        for it in self.snapshots:
+            if i0 <= it < i1:
+                self._add('snapshots/frames', np.array([it]))
+        for name in VARIABLES[:2]:
+            self.hists[name].update(data[name])
+            self.sketches[name].update(data[name])
+            ds = peak_locking(data[name], self.bins_per_pixel)
+            for key in ('sub_pixel_histogram', 'n_inner', 'n_valid'):
+                self._add(f'peak_locking/{name}/{key}', ds[key].values)
+        self.n_frames = i1
+
+    def write(self, h5: h5py.File, current_checkpoint: bool = False):
+        """Writes the state to the (new or previously written) summary file `h5`.
+        If `current_checkpoint`, the developing mean and standard deviation of
+        all frames are added as last checkpoint (replaced by the next write)."""
+        coords = h5.require_group('coords')
+        if 'dims' not in coords.attrs:
+            for name, values, attrs in self.dims[1:]:
+                ds = coords.create_dataset(name, data=values)
+                ds.attrs.update(attrs)
+            time_name, time_values, time_attrs = self.dims[0]
+            _append(coords, time_name, np.asarray(time_values)[:0]).attrs.update(time_attrs)
+            coords.attrs['dims'] = [d[0] for d in self.dims]
+            h5.create_dataset('monitor/indices', data=np.stack([self.mp_iy, self.mp_ix], axis=-1).reshape(-1, 2))
+            h5.create_dataset('quantiles/levels', data=QUANTILE_LEVELS)
+            h5.require_group('flags')
+            for bit, meaning in self.flag_meaning.items():
+                _append(h5, f'flags/{meaning}', np.zeros(0, dtype=np.int64)).attrs['bit'] = bit
+            _append(h5, 'snapshots/frames', np.zeros(0, dtype=int))
+            for name in VARIABLES:
+                _append(h5, f'monitor/{name}', np.zeros((0, self.mp_iy.size)))
+                _append(h5, f'snapshots/{name}', np.zeros((0,) + self.moments[name].count.shape),
+                        chunk_rows=1, compression='gzip')
+        for name, blocks in self.pending.items():
+            _append(h5, name, np.concatenate(blocks))
+        self.pending = {}
+
+        for name in VARIABLES:
+            moments = self.moments[name]
+            mean, std = moments.mean_std()
+            grp = h5.require_group(f'fields/{name}')
+            for stat, values in zip(STATISTICS, (moments.count, mean, std, moments.min, moments.max)):
+                _overwrite(grp, stat, values)
+            grp.attrs['sum'] = float(np.sum(moments.sum))
+            grp.attrs['n'] = int(np.sum(moments.count))
+
+        for name in VARIABLES[:2]:
+            hist = self.hists[name]
+            ds = _overwrite(h5, f'histograms/{name}', hist.counts)
+            ds.attrs.update(binwidth=hist.binwidth, origin=hist.origin, offset=hist._offset,
+                            n_outside=hist.n_outside)
+            if hist.value_range is not None:
+                ds.attrs['value_range'] = hist.value_range
+            _overwrite(h5, f'quantiles/{name}', self.sketches[name].quantile(QUANTILE_LEVELS)
+                       if self.sketches[name].n_retained else np.full(QUANTILE_LEVELS.size, np.nan))
+
+        grp = h5.require_group('checkpoints')
+        frames = self.checkpoint_frames[self.n_checkpoints_written:]
+        mean = self.checkpoint_mean[self.n_checkpoints_written:]
+        std = self.checkpoint_std[self.n_checkpoints_written:]
+        if 'n_frames' in grp:
+            # drop the current state of the previous write
+            for name in ('n_frames', 'mean', 'std'):
+                grp[name].resize(self.n_checkpoints_written, axis=0)
+        self.n_checkpoints_written = len(self.checkpoint_frames)
+        if current_checkpoint and self.n_frames > 0 and self.n_frames not in self.checkpoint_frames:
+            frames = frames + [self.n_frames]
+            current_mean, current_std = self.moments['magnitude_of_displacement'].mean_std()
+            mean, std = mean + [current_mean], std + [current_std]
+        shape = (0,) + self.moments['magnitude_of_displacement'].count.shape
+        _append(grp, 'n_frames', np.array(frames, dtype=int))
+        _append(grp, 'mean', np.stack(mean) if mean else np.zeros(shape), chunk_rows=1, compression='gzip')
+        _append(grp, 'std', np.stack(std) if std else np.zeros(shape), chunk_rows=1, compression='gzip')
+
+        for category, hist in self.density.items():
+            ds = _overwrite(h5, f'density/{category}', hist.counts, compression='gzip')
+            ds.attrs.update(xrange=hist.xrange, yrange=hist.yrange, n_outside=hist.n_outside,
+                            sum_x=hist.sum_x, sum_y=hist.sum_y, n_finite=hist.n_finite)
+
+
+def default_summary_filename(hdf_filename: Union[str, pathlib.Path], **parameters) -> pathlib.Path:
+    """Filename of the summary of `hdf_filename` in the user cache directory. The
+    name is a hash of the file fingerprint, the parameters and the package version,
+    so a changed file or parameter results in a new summary."""
+    key = hash_content([pathlib.Path(hdf_filename), parameters, __version__])
+    return pathlib.Path(appdirs.user_cache_dir('standardpostpiv')) / 'summaries' / f'{key}.hdf'
+
+
+@instrument
+def precompute(hdf_filename: Union[str, pathlib.Path],
+               summary_filename: Union[str, pathlib.Path] = None,
+               monitor_points: Sequence[Tuple[float, float]] = None,
+               n_monitor_points: int = 4,
+               snapshots: Sequence[int] = (2,),
+               n_checkpoints: int = 10,
+               bins_per_pixel: int = 10,
+               density_bins: int = 256,
+               chunk_size: int = 50,
+               seed: int = 10,
+               overwrite: bool = False) -> pathlib.Path:
+    """Reads the PIV file once and writes the summary of all quantities
+    plotted by the summary sections of the report (see `PIVSummary`).
+
+    Parameters
+    ----------
+    hdf_filename: Union[str, pathlib.Path]
+        HDF5 file containing the PIV data with standard names
+    summary_filename: Union[str, pathlib.Path], optional
+        Target filename. Default is a file in the user cache directory, see
+        `default_summary_filename()`.
+    monitor_points: Sequence[Tuple[float, float]], optional
+        (x, y) coordinates of the monitor points. Default are `n_monitor_points`
+        random unmasked points.
+    n_monitor_points: int
+        Number of random monitor points if `monitor_points` is None
+    snapshots: Sequence[int]
+        Frame indices of which the instantaneous fields are stored
+    n_checkpoints: int
+        Number of frame counts at which the developing mean and standard
+        deviation fields of the displacement magnitude are stored
+    bins_per_pixel: int
+        Number of histogram bins per pixel displacement
+    density_bins: int
+        Number of bins of the (dx, dy) density image in each direction
+    chunk_size: int
+        Number of frames read at once
+    seed: int
+        Seed of the random monitor points
+    overwrite: bool
+        If False, an existing summary of the same file and parameters is reused
+
+    Returns
+    -------
+    pathlib.Path
+        The summary filename
+    """
+    hdf_filename = pathlib.Path(hdf_filename)
+    parameters = dict(monitor_points=None if monitor_points is None else [list(map(float, p)) for p in
+                                                                          monitor_points],
+                      n_monitor_points=n_monitor_points, snapshots=list(snapshots), n_checkpoints=n_checkpoints,
+                      bins_per_pixel=bins_per_pixel, density_bins=density_bins, seed=seed)
+    key = hash_content([hdf_filename, parameters, __version__])
+    if summary_filename is None:
+        summary_filename = default_summary_filename(hdf_filename, **parameters)
+    summary_filename = pathlib.Path(summary_filename)
+    if summary_filename.exists() and not overwrite:
+        with h5py.File(summary_filename, 'r') as h5:
+            if h5.attrs.get('key', None) == key:
+                logger.debug(f'Summary {summary_filename} of {hdf_filename} is up to date')
+                return summary_filename
+    summary_filename.parent.mkdir(parents=True, exist_ok=True)
+
+    with h5py.File(hdf_filename, 'r') as h5:
+        standard_names = find_standard_names(h5)
+        for sn in ('x_displacement', 'y_displacement'):
+            if sn not in standard_names:
+                raise KeyError(f'No dataset with standard_name "{sn}" in {hdf_filename}')
+        ds_dx = h5[standard_names['x_displacement']]
+        ds_dy = h5[standard_names['y_displacement']]
+        if ds_dx.ndim != 3:
+            raise ValueError(f'Expected a 3D displacement dataset but got shape {ds_dx.shape}')
+        ds_flags = h5[standard_names['piv_flags']] if 'piv_flags' in standard_names else None
+        nt, ny, nx = ds_dx.shape
+        dims = [_dimension(ds_dx, axis, default) for axis, default in enumerate(('reltime', 'y', 'x'))]
+        units = _attr(ds_dx.attrs.get('units', 'px'))
+        params = _piv_parameters(h5, standard_names)
+
+        flag_meaning = {}
+        if ds_flags is not None:
+            meaning = ds_flags.attrs.get('flag_meaning', None)
+            if meaning is not None:
+                if isinstance(meaning, (str, bytes)):
+                    meaning = json.loads(meaning)
+                flag_meaning = {int(k): str(v) for k, v in meaning.items()}
+
+        first_mask = (ds_flags[0] & 2).astype(bool) if ds_flags is not None else ~np.isfinite(ds_dx[0])
+        if monitor_points is None:
+            mp_indices = _select_monitor_points(first_mask, n_monitor_points, seed)
+        else:
+            mp_indices = [(int(np.argmin(np.abs(dims[1][1] - y))), int(np.argmin(np.abs(dims[2][1] - x))))
+                          for x, y in monitor_points]
+
+        snapshots = sorted({int(i) if i >= 0 else nt + int(i) for i in snapshots if -nt <= i < nt})
+        fiw = max(params.get('x_final_iw_size', 0), params.get('y_final_iw_size', 0))
+        accumulator = _SummaryAccumulator(dims, flag_meaning, mp_indices, snapshots,
+                                          _checkpoints(nt, n_checkpoints), bins_per_pixel=bins_per_pixel,
+                                          histogram_range=fiw, density_range=fiw if ds_flags is not None else 0,
+                                          density_bins=density_bins, seed=seed)
+
+        for i0 in range(0, nt, chunk_size):
+            i1 = min(i0 + chunk_size, nt)
+            dx = ds_dx[i0:i1].astype(float)
+            dy = ds_dy[i0:i1].astype(float)
+            flags = None
+            if ds_flags is not None:
+                flags = ds_flags[i0:i1]
+                masked = (flags & 2).astype(bool)
+                dx[masked] = np.nan
+                dy[masked] = np.nan
+            accumulator.update(dx, dy, flags, time=dims[0][1][i0:i1])
+
+    with h5py.File(summary_filename, 'w') as h5:
+        h5.attrs['key'] = key
+        h5.attrs['version'] = __version__
+        h5.attrs['source'] = str(hdf_filename.absolute())
+        h5.attrs['parameters'] = json.dumps(parameters)
+        h5.attrs['units'] = units
+        for k, v in params.items():
+            h5.attrs[k] = v
+        accumulator.write(h5)
+    logger.debug(f'Wrote summary {summary_filename} of {hdf_filename}')
+    return summary_filename
+
+
+class PIVSummary:
+    """Read access to a summary file written by `precompute()`. All data is
+    returned as xr.DataArray (or `statistics` accumulators) with the coordinates
+    and standard names of the PIV file."""
+    __slots__ = ('filename', 'attrs', 'dims', 'coords', 'units')
+
+    def __init__(self, filename: Union[str, pathlib.Path]):
+        self.filename = pathlib.Path(filename)
+        with h5py.File(self.filename, 'r') as h5:
+            self.attrs = {k: _attr(v) for k, v in h5.attrs.items()}
+            self.dims = [_attr(d) for d in h5['coords'].attrs['dims']]
+            self.coords = {d: xr.DataArray(h5['coords'][d][()], dims=d, name=d,
+                                           attrs={k: _attr(v) for k, v in h5['coords'][d].attrs.items()})
+                           for d in self.dims}
+        self.units = self.attrs.get('units', 'px')
+
+    def __repr__(self):
+        return f'<PIVSummary filename={self.filename}, source={self.attrs.get("source")}>'
+
+    def _read(self, name: str) -> np.ndarray:
+        with h5py.File(self.filename, 'r') as h5:
+            return h5[name][()]
+
+    def _attrs(self, name: str) -> Dict:
+        with h5py.File(self.filename, 'r') as h5:
+            return {k: _attr(v) for k, v in h5[name].attrs.items()}
+
+    @property
+    def final_iw_size(self) -> Tuple[int, int]:
+        return self.attrs.get('x_final_iw_size'), self.attrs.get('y_final_iw_size')
+
+    def field(self, name: str = 'magnitude_of_displacement', statistic: str = 'mean') -> xr.DataArray:
+        """Per-pixel statistic over all frames, one of "count", "mean", "std"
+        (population standard deviation), "min" and "max"."""
+        if statistic not in STATISTICS:
+            raise ValueError(f'statistic must be one of {STATISTICS} but got "{statistic}"')
+        prefix = {'mean': 'arithmetic_mean_of_', 'std': 'standard_deviation_of_', 'min': 'minimum_of_',
+                  'max': 'maximum_of_', 'count': 'number_of_'}[statistic]
+        dims = self.dims[1:]
+        return xr.DataArray(self._read(f'fields/{name}/{statistic}'), dims=dims,
+                            coords={d: self.coords[d] for d in dims}, name=f'{statistic}_of_{name}',
+                            attrs={'standard_name': f'{prefix}{name}',
+                                   'units': '' if statistic == 'count' else self.units})
+
+    def global_mean(self, name: str = 'magnitude_of_displacement') -> float:
+        """Mean of `name` over all frames and pixels"""
+        attrs = self._attrs(f'fields/{name}')
+        return attrs['sum'] / attrs['n'] if attrs['n'] else np.nan
+
+    def snapshot(self, name: str = 'magnitude_of_displacement', frame: int = None) -> xr.DataArray:
+        """Instantaneous field of frame `frame` (only frames passed as `snapshots` to
+        `precompute()` are available). Default is the first stored frame."""
+        frames = list(self._read('snapshots/frames'))
+        if frame is None:
+            frame = frames[0]
+        if frame not in frames:
+            raise KeyError(f'Frame {frame} is not stored. Available frames: {frames}')
+        t, y, x = self.dims
+        with h5py.File(self.filename, 'r') as h5:
+            data = h5[f'snapshots/{name}'][frames.index(frame)]
+        return xr.DataArray(data, dims=(y, x), coords={y: self.coords[y], x: self.coords[x],
+                                                       t: self.coords[t][frame]},
+                            name=name, attrs={'standard_name': name, 'units': self.units})
+
+    def histogram(self, name: str) -> Histogram:
+        """Histogram of all (unmasked) values of "x_displacement" or "y_displacement\""""
+        attrs = self._attrs(f'histograms/{name}')
+        if 'value_range' in attrs:
+            hist = Histogram(attrs['binwidth'], value_range=tuple(attrs['value_range']))
+        else:
+            hist = Histogram(attrs['binwidth'], origin=attrs['origin'])
+        hist._offset = int(attrs['offset'])
+        hist._counts = self._read(f'histograms/{name}')
+        hist.n_outside = attrs['n_outside']
+        hist.name = name
+        hist.attrs = {'standard_name': name, 'units': self.units}
+        return hist
+
+    def quantile(self, name: str, q: Union[float, List[float], np.ndarray]) -> Union[float, np.ndarray]:
+        """Approximate quantiles of "x_displacement" or "y_displacement\""""
+        values = np.interp(q, self._read('quantiles/levels'), self._read(f'quantiles/{name}'))
+        return float(values) if np.ndim(values) == 0 else values
+
+    def peak_locking(self, name: str) -> xr.Dataset:
+        """Per-frame sub-pixel histogram and peak-locking index (see `statistics.peak_locking()`)"""
+        t = self.dims[0]
+        with h5py.File(self.filename, 'r') as h5:
+            grp = h5[f'peak_locking/{name}']
+            counts = grp['sub_pixel_histogram'][()]
+            n_inner, n_valid = grp['n_inner'][()], grp['n_valid'][()]
+        nbins = counts.shape[1]
+        ds = xr.Dataset({'sub_pixel_histogram': ((t, 'sub_pixel_displacement'), counts),
+                         'n_inner': (t, n_inner),
+                         'n_valid': (t, n_valid)},
+                        coords={t: self.coords[t],
+                                'sub_pixel_displacement': ('sub_pixel_displacement',
+                                                           (np.arange(nbins) + 0.5) / nbins - 0.5,
+                                                           {'units': 'pixel'})})
+        return _update_peak_locking_index(ds)
+
+    def flag_series(self) -> Dict[str, xr.DataArray]:
+        """Number of vectors per flag and frame (see `flags.eval_flags()`)"""
+        t = self.dims[0]
+        with h5py.File(self.filename, 'r') as h5:
+            return {name: xr.DataArray(ds[()], dims=t, coords={t: self.coords[t]}, name=name)
+                    for name, ds in h5['flags'].items()}
+
+    def vdp(self) -> xr.DataArray:
+        """Valid detection probability per frame"""
+        flag_series = self.flag_series()
+        edited = sum(flag_series[f] for f in ('NORESULT', 'FILTERED', 'INTERPOLATED', 'REPLACED', 'MANUALEDIT')
+                     if f in flag_series)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vdp = (flag_series['ACTIVE'] - edited) / flag_series['ACTIVE']
+        vdp.name = 'vdp'
+        vdp.attrs.update(standard_name='valid_detection_probability', units='')
+        return vdp
+
+    @property
+    def monitor_points(self) -> List[Tuple[float, float]]:
+        """(x, y) coordinates of the monitor points"""
+        y, x = self.dims[1:]
+        return [(float(self.coords[x][ix]), float(self.coords[y][iy]))
+                for iy, ix in self._read('monitor/indices')]
+
+    def monitor_series(self, name: str = 'magnitude_of_displacement') -> xr.DataArray:
+        """Time series of `name` at the monitor points (dimensions: time, "point")"""
+        t, y, x = self.dims
+        indices = self._read('monitor/indices')
+        return xr.DataArray(self._read(f'monitor/{name}'), dims=(t, 'point'),
+                            coords={t: self.coords[t],
+                                    'point': np.arange(indices.shape[0]),
+                                    x: ('point', self.coords[x].values[indices[:, 1]]),
+                                    y: ('point', self.coords[y].values[indices[:, 0]])},
+                            name=name, attrs={'standard_name': name, 'units': self.units})
+
+    def convergence(self) -> xr.Dataset:
+        """Developing mean and standard deviation fields of the displacement
+        magnitude after the numbers of frames `n_frames`"""
+        y, x = self.dims[1:]
+        with h5py.File(self.filename, 'r') as h5:
+            grp = h5['checkpoints']
+            n_frames, mean, std = grp['n_frames'][()], grp['mean'][()], grp['std'][()]
+        attrs = {'units': self.units}
+        return xr.Dataset({'mean': (('n_frames', y, x), mean, {**attrs, 'standard_name':
+                                                               'developing_mean_of_magnitude_of_displacement'}),
+                           'std': (('n_frames', y, x), std, {**attrs, 'standard_name':
+                                                             'developing_std_of_magnitude_of_displacement'})},
+                          coords={'n_frames': n_frames, y: self.coords[y], x: self.coords[x]})
+
+    def density(self) -> Dict[str, Histogram2D]:
+        """2D histograms of the (dx, dy) pairs per flag category (see `plotting.piv_density()`)"""
+        hists = {}
+        with h5py.File(self.filename, 'r') as h5:
+            if 'density' not in h5:
+                return hists
+            for category in DENSITY_CATEGORIES:
+                ds = h5['density'][category]
+                hist = Histogram2D(ds.attrs['xrange'], ds.attrs['yrange'], bins=ds.shape[::-1])
+                hist.counts = ds[()]
+                for k in ('n_outside', 'sum_x', 'sum_y', 'n_finite'):
+                    setattr(hist, k, _attr(ds.attrs[k]))
+                hist.xname, hist.xattrs = 'x_displacement', {'standard_name': 'x_displacement', 'units': self.units}
+                hist.yname, hist.yattrs = 'y_displacement', {'standard_name': 'y_displacement', 'units': self.units}
+                hists[category] = hist
+        return hists
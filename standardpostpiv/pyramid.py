@@ -0,0 +1,177 @@
+"""Multi-resolution (block-mean) pyramid of 2D fields used to plot fields and
+vectors at the resolution of the axes instead of the full PIV grid"""
+import pathlib
+from collections import OrderedDict
+from typing import Tuple, Union
+
+import h5py
+import numpy as np
+import xarray as xr
+
+from .figcache import hash_content
+
+PYRAMID_CACHE_SIZE = 8  # number of pyramids kept by `get_pyramid()`
+_PYRAMID_CACHE = OrderedDict()  # content key -> pyramid, least recently used first
+
+
+def block_mean(field: xr.DataArray, factor: int = 2) -> xr.DataArray:
+    """Averages blocks of `factor` x `factor` values of a 2D field. NaNs are
+    ignored, blocks without any valid value become NaN. The dimension coordinates
+    are averaged accordingly.
+
+    Parameters
+    ----------
+    field: xr.DataArray
+        2D field
+    factor: int
+        Size of the blocks
+
+    Returns
+    -------
+    xr.DataArray
+        Field with shape ceil(ny/factor), ceil(nx/factor)
+    """
+    if field.ndim != 2:
+        raise ValueError(f'field must be 2D but is {field.ndim}D')
+    ny, nx = field.shape
+    pad = ((0, -ny % factor), (0, -nx % factor))
+    values = np.pad(field.values.astype(float), pad, constant_values=np.nan)
+    blocks = values.reshape(values.shape[0] // factor, factor, values.shape[1] // factor, factor)
+    valid = np.isfinite(blocks)
+    n = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, blocks, 0).sum(axis=(1, 3)) / n
+
+    coords = {}
+    for i, dim in enumerate(field.dims):
+        if dim in field.coords:
+            c = np.pad(field.coords[dim].values.astype(float), pad[i], constant_values=np.nan)
+            coords[dim] = (dim, np.nanmean(c.reshape(-1, factor), axis=1), field.coords[dim].attrs)
+    for name, coord in field.coords.items():
+        if coord.ndim == 0:
+            coords[name] = coord
+    return xr.DataArray(mean, dims=field.dims, coords=coords, attrs=field.attrs, name=field.name)
+
+
+class FieldPyramid:
+    """Block-mean pyramid of a 2D field. Level 0 is the (masked) field itself,
+    every further level is coarser by `factor` in both directions. Levels are
+    computed on first access and kept in memory. They can be written to and
+    read from an HDF5 file.
+
+    Parameters
+    ----------
+    field: xr.DataArray
+        2D field
+    mask: array-like, optional
+        Values where mask is True (or non-zero) are excluded from the averages
+    factor: int
+        Coarsening factor between two levels
+    min_size: int
+        Minimal number of values along each dimension of the coarsest level
+    """
+
+    def __init__(self, field: xr.DataArray, mask=None, factor: int = 2, min_size: int = 4):
+        if field.ndim != 2:
+            raise ValueError(f'field must be 2D but is {field.ndim}D')
+        if mask is not None:
+            field = field.where(~np.asarray(mask).astype(bool))
+        self.factor = factor
+        self.min_size = min_size
+        self._levels = [field]
+
+    def __repr__(self):
+        return f'<FieldPyramid name={self._levels[0].name}, shape={self._levels[0].shape}, nlevels={self.nlevels}>'
+
+    def __len__(self):
+        return self.nlevels
+
+    def __getitem__(self, level: int) -> xr.DataArray:
+        if not 0 <= level < self.nlevels:
+            raise IndexError(f'Level must be in [0, {self.nlevels - 1}] but got {level}')
+        while len(self._levels) <= level:
+            self._levels.append(block_mean(self._levels[-1], self.factor))
+        return self._levels[level]
+
+    @property
+    def nlevels(self) -> int:
+        """Number of levels including the original field"""
+        nlevels = 1
+        while min(self.shape(nlevels)) >= self.min_size:
+            nlevels += 1
+        return nlevels
+
+    def shape(self, level: int) -> Tuple[int, int]:
+        """Shape of a level (without computing it)"""
+        f = self.factor ** level
+        ny, nx = self._levels[0].shape
+        return -(-ny // f), -(-nx // f)
+
+    def select_level(self, max_shape: Tuple[float, float]) -> int:
+        """Returns the finest level whose shape does not exceed `max_shape`
+        (or the coarsest level)"""
+        for level in range(self.nlevels):
+            ny, nx = self.shape(level)
+            if ny <= max_shape[0] and nx <= max_shape[1]:
+                return level
+        return self.nlevels - 1
+
+    def for_axes(self, ax, pixels_per_value: float = 1.) -> xr.DataArray:
+        """Returns the level matching the size of the axes in screen pixels,
+        so that every value covers at least `pixels_per_value` pixels"""
+        bbox = ax.get_window_extent()
+        return self[self.select_level((bbox.height / pixels_per_value, bbox.width / pixels_per_value))]
+
+    def to_hdf(self, hdf_filename: Union[str, pathlib.Path], group_name: str, overwrite: bool = False):
+        """Writes all levels except level 0 to the group `group_name` of an HDF5 file"""
+        with h5py.File(hdf_filename, 'a') as h5:
+            if group_name in h5:
+                if not overwrite:
+                    raise FileExistsError(f'Group "{group_name}" already exists')
+                del h5[group_name]
+            grp = h5.create_group(group_name)
+            grp.attrs['factor'] = self.factor
+            grp.attrs['min_size'] = self.min_size
+            for level in range(1, self.nlevels):
+                field = self[level]
+                ds = grp.create_dataset(f'level_{level}', data=field.values, compression='gzip')
+                ds.attrs['dims'] = list(field.dims)
+                for dim in field.dims:
+                    if dim in field.coords:
+                        grp.create_dataset(f'level_{level}_{dim}', data=field.coords[dim].values)
+
+    @classmethod
+    def from_hdf(cls, field: xr.DataArray, hdf_filename: Union[str, pathlib.Path], group_name: str,
+                 mask=None) -> 'FieldPyramid':
+        """Builds the pyramid of `field` with the coarse levels read from an HDF5
+        file written by `to_hdf()`"""
+        with h5py.File(hdf_filename, 'r') as h5:
+            grp = h5[group_name]
+            pyramid = cls(field, mask=mask, factor=int(grp.attrs['factor']), min_size=int(grp.attrs['min_size']))
+            level = 1
+            while f'level_{level}' in grp:
+                ds = grp[f'level_{level}']
+                dims = [str(d) for d in ds.attrs['dims']]
+                coords = {d: (d, grp[f'level_{level}_{d}'][()], field.coords[d].attrs)
+                          for d in dims if f'level_{level}_{d}' in grp}
+                pyramid._levels.append(xr.DataArray(ds[()], dims=dims, coords=coords,
+                                                    attrs=field.attrs, name=field.name))
+                level += 1
+        return pyramid
+
+
+def get_pyramid(field: xr.DataArray, **kwargs) -> FieldPyramid:
+    """Returns the pyramid of `field` built with `kwargs` (see `FieldPyramid`)
+    from the in-memory cache or builds it. The cache is keyed by the content of
+    the field and the kwargs, so temporaries like `dx.isel(reltime=it)` hit
+    the cache, too. The `PYRAMID_CACHE_SIZE` most recently used pyramids are kept."""
+    key = hash_content(field, kwargs)
+    pyramid = _PYRAMID_CACHE.get(key, None)
+    if pyramid is not None:
+        _PYRAMID_CACHE.move_to_end(key)
+        return pyramid
+    pyramid = FieldPyramid(field, **kwargs)
+    _PYRAMID_CACHE[key] = pyramid
+    while len(_PYRAMID_CACHE) > PYRAMID_CACHE_SIZE:
+        _PYRAMID_CACHE.popitem(last=False)
+    return pyramid
@@ -3,16 +3,20 @@ from typing import Union
 
 from .notebook import PIVReportNotebook
 from .notebook_utils.pivreport_sections import imports, statistics, pdfs, \
-    displacement, monitor
+    displacement, monitor, summary
 
 
-def get_basic_2D2C_report(hdf_filename: Union[str, pathlib.Path]):
+def get_basic_2D2C_report(hdf_filename: Union[str, pathlib.Path], precompute: bool = False):
     """
 
     Parameters
     ----------
     hdf_filename: Union[str, pathlib.Path]
         HDF5 file containing the PIV data with standard names.
+    precompute: bool
+        If True, the PIV file is read once in a first section (see `precompute.precompute()`)
+        and all other sections only plot from the summary. The runtime of the report is
+        then nearly independent of the size of the PIV file.
 
     Returns
     -------
@@ -31,9 +35,21 @@ def get_basic_2D2C_report(hdf_filename: Union[str, pathlib.Path]):
 
     report = PIVReportNotebook(hdf_filename)
 
+    if precompute:
+        report.add_section(summary.section_precompute, level=2)
+        report.add_section(summary.section_stats, level=2)
+        report.add_section(summary.section_pdfs, level=2)
+        report.add_section(summary.section_mean_displacement, level=2)
+        report.add_section(summary.section_instantaneous_displacement, level=3)
+        report.add_section(summary.section_monitor_points, level=2)
+        report.add_section(summary.section_convergence, level=3)
+        report.add_section(summary.section_monitor_line, level=3)
+        return report
+
     # report.add_section(imports.section, level=2)
     report.add_section(statistics.section_with_badge, level=2)
     report.add_section(pdfs.section, level=2)
+    report.add_section(displacement.section_data, level=2)
     report.add_section(displacement.main_section, level=2)
     report.add_section(displacement.section_mean_displacement, level=3)
     report.add_section(displacement.section_instantaneous_velocity, level=3)
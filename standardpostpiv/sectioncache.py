@@ -0,0 +1,328 @@
+"""Cache of the executed outputs of report sections. The cache key of a section
+is a hash of its code cells, the fingerprint of the HDF5 file and the keys of
+the preceding sections it depends on. A section depends on a preceding section
+if it reads a name the other section assigns before assigning it itself (found
+by parsing the code). If a report is executed again, only sections with a
+changed key and the sections they depend on (to rebuild the namespace) are
+executed, the outputs of all other sections are restored from the cache. Sections which completed without
+error are cached even if the execution crashes later on, so a re-run continues
+where the crash happened."""
+import ast
+import copy
+import json
+import pathlib
+from typing import Dict, List, Set, Tuple, Union
+
+import appdirs
+import nbformat
+
+from ._version import __version__
+from .executors import get_executor
+from .figcache import hash_content
+from .instrumentation import instrument
+from .logger import logger
+
+DEFAULT_MAX_SIZE = 200 * 1024 ** 2  # bytes
+
+
+def _walk_names(node: ast.AST) -> Tuple[Set[str], Set[str]]:
+    """Names assigned and read anywhere in `node`. Attribute and item assignments
+    (`a.b = 1`, `a[0] = 1`) count as assignment of `a`."""
+    stored, loaded = set(), set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            if isinstance(child.ctx, (ast.Store, ast.Del)):
+                stored.add(child.id)
+            else:
+                loaded.add(child.id)
+        elif isinstance(child, ast.arg):
+            stored.add(child.arg)
+        elif isinstance(child, (ast.Import, ast.ImportFrom)):
+            for alias in child.names:
+                stored.add((alias.asname or alias.name).split('.')[0])
+        elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stored.add(child.name)
+        elif isinstance(child, (ast.Attribute, ast.Subscript)) and isinstance(child.ctx, (ast.Store, ast.Del)):
+            base = child.value
+            while isinstance(base, (ast.Attribute, ast.Subscript)):
+                base = base.value
+            if isinstance(base, ast.Name):
+                stored.add(base.id)
+    return stored, loaded
+
+
+def code_names(codes: Union[str, List[str]]) -> Union[Tuple[Set[str], Set[str]], None]:
+    """Returns the names assigned by the code (cells) and the free names, which
+    are read before they are assigned, e.g. `fig` is not free in
+    "fig = plt.figure(); fig.show()". Returns None if the code cannot be parsed
+    (e.g. because of magics)."""
+    if isinstance(codes, str):
+        codes = [codes]
+    assigned, free = set(), set()
+    for code in codes:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return None
+        for stmt in tree.body:
+            if isinstance(stmt, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+                # the value is evaluated before the targets are assigned
+                targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+                value_stored, value_loaded = _walk_names(stmt.value) if stmt.value else (set(), set())
+                target_stored, target_loaded = set(), set()
+                for target in targets:
+                    s, l = _walk_names(target)
+                    target_stored |= s
+                    target_loaded |= l
+                if isinstance(stmt, ast.AugAssign):
+                    target_loaded |= target_stored
+                free |= (value_loaded - value_stored | target_loaded) - assigned
+                assigned |= value_stored | target_stored
+            else:
+                stored, loaded = _walk_names(stmt)
+                free |= loaded - assigned - stored
+                assigned |= stored
+    return assigned, free
+
+
+def section_dependencies(codes: List[List[str]]) -> List[Set[int]]:
+    """Returns for every section (given as list of code cells) the indices of
+    the preceding sections it depends on, i.e. which assign a free name of the
+    section. A section whose code cannot be parsed depends on all preceding
+    sections."""
+    assigned = []
+    dependencies = []
+    for i, cells in enumerate(codes):
+        names = code_names(cells)
+        if names is None:
+            dependencies.append(set(range(i)))
+            # unknown assignments: all following sections depend on it
+            assigned.append(None)
+            continue
+        dependencies.append({j for j in range(i) if assigned[j] is None or assigned[j] & names[1]})
+        assigned.append(names[0])
+    return dependencies
+
+
+def hdf_fingerprint(hdf_filename: Union[str, pathlib.Path]) -> str:
+    """Fingerprint of an HDF5 file (path, size and modification time)"""
+    return hash_content(pathlib.Path(hdf_filename))
+
+
+def split_sections(nb: nbformat.NotebookNode) -> List[Tuple[str, List[int]]]:
+    """Groups the indices of the cells of `nb` by the "section" metadata
+    written by `PIVReportNotebook.create()`. Consecutive cells without the
+    metadata form one group."""
+    groups = []
+    for i, cell in enumerate(nb.cells):
+        label = cell.get('metadata', {}).get('section')
+        if groups and groups[-1][0] == label:
+            groups[-1][1].append(i)
+        else:
+            groups.append((label, [i]))
+    return groups
+
+
+class SectionCache:
+    """Cache of the executed outputs of report sections keyed by a content
+    hash. Entries are evicted (least recently used first) if the total size
+    exceeds `max_size`.
+
+    Parameters
+    ----------
+    directory: Union[str, pathlib.Path], optional
+        Cache directory. Default is the user cache directory of standardpostpiv.
+    max_size: int
+        Maximal total size of the cache in bytes
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path] = None, max_size: int = DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = pathlib.Path(appdirs.user_cache_dir('standardpostpiv')) / 'sections'
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+    def __repr__(self):
+        return f'<SectionCache directory={self.directory}, n_entries={len(self.entries())}, size={self.size}>'
+
+    def __contains__(self, key: str) -> bool:
+        return (self.directory / f'{key}.json').exists()
+
+    @property
+    def size(self) -> int:
+        """Total size of the cache in bytes"""
+        return sum(entry['size'] for entry in self.entries())
+
+    def entries(self) -> List[Dict]:
+        """Returns key, section, size and last access time of all entries"""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for filename in self.directory.glob('*.json'):
+            stat = filename.stat()
+            # the last access is the modification time (touched by `get()`)
+            entries.append({'key': filename.stem, 'size': stat.st_size, 'last_access': stat.st_mtime})
+        return entries
+
+    def get(self, key: str) -> Union[List[Dict], None]:
+        """Returns the outputs and execution counts of the code cells of a
+        section or None if the key is not cached"""
+        filename = self.directory / f'{key}.json'
+        try:
+            entry = json.loads(filename.read_text())
+        except (OSError, ValueError):
+            return None
+        filename.touch()
+        return entry['cells']
+
+    def put(self, key: str, cells: List[nbformat.NotebookNode], section: str = None):
+        """Stores the outputs of the code `cells` of a section under `key`"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = {'key': key, 'section': section,
+                 'cells': [{'outputs': cell.outputs, 'execution_count': cell.execution_count}
+                           for cell in cells if cell.cell_type == 'code']}
+        filename = self.directory / f'{key}.json'
+        tmp_filename = filename.with_suffix('.tmp')
+        tmp_filename.write_text(json.dumps(entry))
+        tmp_filename.replace(filename)
+        self.evict()
+
+    def remove(self, key: str):
+        """Removes an entry"""
+        (self.directory / f'{key}.json').unlink(missing_ok=True)
+
+    def evict(self):
+        """Removes least recently used entries until the size is below `max_size`"""
+        entries = sorted(self.entries(), key=lambda e: e['last_access'])
+        size = sum(e['size'] for e in entries)
+        for entry in entries:
+            if size <= self.max_size:
+                break
+            self.remove(entry['key'])
+            size -= entry['size']
+            logger.debug(f'Evicted {entry["key"]} from section cache')
+
+    def clear(self):
+        """Removes all entries"""
+        for entry in self.entries():
+            self.remove(entry['key'])
+
+
+def _succeeded(cells: List[nbformat.NotebookNode]) -> bool:
+    """Whether all code cells were executed without error"""
+    return all(cell.execution_count is not None and
+               not any(output.output_type == 'error' for output in cell.outputs)
+               for cell in cells if cell.cell_type == 'code')
+
+
+class CachedExecutor:
+    """Executes only the sections of a notebook whose outputs are not cached
+    (and the sections they depend on) with `executor` and restores the outputs
+    of all other sections from `cache`. The interface is that of
+    `ExecutePreprocessor.preprocess()`.
+
+    Parameters
+    ----------
+    hdf_filename: Union[str, pathlib.Path]
+        HDF5 file of the report (its fingerprint is part of the cache keys)
+    cache: SectionCache, optional
+        The cache. Default is a `SectionCache` in the user cache directory.
+    executor: Union[str, object]
+        Executor of the sections to run, see `executors.get_executor()`
+    """
+
+    def __init__(self, hdf_filename: Union[str, pathlib.Path], cache: SectionCache = None, executor='kernel'):
+        self.hdf_filename = pathlib.Path(hdf_filename)
+        self.cache = SectionCache() if cache is None else cache
+        self.executor = executor
+        self.executed_sections = []
+        self.cached_sections = []
+
+    def __repr__(self):
+        return (f'<CachedExecutor executed_sections={self.executed_sections}, '
+                f'cached_sections={self.cached_sections}>')
+
+    def section_keys(self, nb: nbformat.NotebookNode,
+                     groups: List[Tuple[str, List[int]]] = None) -> Tuple[List[str], List[Set[int]]]:
+        """Returns the cache keys and the dependencies of the sections of `nb`"""
+        if groups is None:
+            groups = split_sections(nb)
+        codes = [[nb.cells[i].source for i in indices if nb.cells[i].cell_type == 'code']
+                 for _, indices in groups]
+        dependencies = section_dependencies(codes)
+        fingerprint = hdf_fingerprint(self.hdf_filename)
+        keys = []
+        for (label, _), code, deps in zip(groups, codes, dependencies):
+            keys.append(hash_content(__version__, fingerprint, label, code, [keys[j] for j in sorted(deps)]))
+        return keys, dependencies
+
+    @instrument
+    def preprocess(self, nb: nbformat.NotebookNode, resources: Dict = None) -> Tuple[nbformat.NotebookNode, Dict]:
+        """Executes the invalidated sections of `nb` and restores the others in place
+
+        Parameters
+        ----------
+        nb: nbformat.NotebookNode
+            The notebook
+        resources: Dict, optional
+            Resources passed to the executor
+
+        Returns
+        -------
+        Tuple[nbformat.NotebookNode, Dict]
+            The executed notebook and the resources
+        """
+        groups = split_sections(nb)
+        keys, dependencies = self.section_keys(nb, groups)
+
+        cached = [self.cache.get(key) for key in keys]
+        to_run = {i for i, c in enumerate(cached) if c is None}
+        # sections needed to rebuild the namespace of the invalidated sections
+        # (dependencies always precede a section, so one backward pass suffices)
+        for i in range(len(groups) - 1, -1, -1):
+            if i in to_run:
+                to_run |= dependencies[i]
+
+        self.executed_sections = [groups[i][0] for i in sorted(to_run)]
+        self.cached_sections = [groups[i][0] for i in range(len(groups)) if i not in to_run]
+
+        for i, c in enumerate(cached):
+            if c is None:
+                continue
+            code_cells = [nb.cells[j] for j in groups[i][1] if nb.cells[j].cell_type == 'code']
+            for cell, entry in zip(code_cells, c):
+                cell.outputs = [nbformat.from_dict(output) for output in entry['outputs']]
+                cell.execution_count = entry['execution_count']
+                # restored cells are not profiled
+                cell.metadata.pop('profile', None)
+
+        if not to_run:
+            logger.debug('All sections restored from the section cache')
+            return nb, resources or {}
+        logger.debug(f'Executing sections {self.executed_sections}, restored {self.cached_sections}')
+
+        # execute a notebook of the sections to run. The code cells are copied,
+        # so that outputs of cached sections are not overwritten by a dependency.
+        run_indices = [j for i in sorted(to_run) for j in groups[i][1] if nb.cells[j].cell_type == 'code']
+        sub_nb = copy.deepcopy(nb)
+        sub_nb.cells = [sub_nb.cells[j] for j in run_indices]
+        for cell in sub_nb.cells:
+            cell.outputs = []
+            cell.execution_count = None
+        executor = get_executor(self.executor)
+        try:
+            executor.preprocess(sub_nb, resources or {})
+        finally:
+            executed = dict(zip(run_indices, sub_nb.cells))
+            for i in sorted(to_run):
+                cells = [executed[j] for j in groups[i][1] if j in executed]
+                if cached[i] is None:
+                    for j in groups[i][1]:
+                        if j in executed:
+                            nb.cells[j].outputs = executed[j].outputs
+                            nb.cells[j].execution_count = executed[j].execution_count
+                            if 'profile' in executed[j].metadata:
+                                nb.cells[j].metadata['profile'] = executed[j].metadata['profile']
+                    if _succeeded(cells):
+                        self.cache.put(keys[i], cells, section=groups[i][0])
+        return nb, resources or {}
@@ -0,0 +1,405 @@
+"""Dependency graph of the report sections and their parallel execution.
+
+Sections declare the variables they produce and consume (`Section(produces=...,
+consumes=...)`), the names read and assigned by their code are detected, too.
+A section depends on the last preceding section assigning a variable it
+consumes. Independent sections (e.g. the PDFs, the convergence and the
+normality check) are executed concurrently in worker processes by the
+`ParallelExecutor`. Variables are passed between the workers through a
+`VariableStore` on disk, arrays are memory-mapped instead of copied. Values
+which cannot be stored (e.g. objects holding an open HDF5 file) are recomputed
+in the worker by executing only the cells of the producing section needed for
+them. The outputs are stitched back into the notebook in document order."""
+import os
+import pathlib
+import pickle
+import platform
+import tempfile
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Set, Tuple, Union
+
+import nbformat
+
+from .instrumentation import instrument
+from .logger import logger, get_log_queue
+from .sectioncache import code_names, split_sections
+
+
+class VariableStore:
+    """Directory of variables shared between processes. Numpy arrays and the
+    data of xarray DataArrays are stored as .npy files and memory-mapped
+    (copy-on-write) when loaded, modules are stored by name, all other values
+    are pickled.
+
+    Parameters
+    ----------
+    directory: Union[str, pathlib.Path]
+        Directory of the store (created if missing)
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path]):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return f'<VariableStore directory={self.directory}, n_variables={len(self.keys())}>'
+
+    def __contains__(self, key: str) -> bool:
+        return (self.directory / f'{key}.pkl').exists()
+
+    def keys(self) -> List[str]:
+        return sorted(f.stem for f in self.directory.glob('*.pkl'))
+
+    def put(self, key: str, value) -> bool:
+        """Stores `value` under `key`. Returns False if the value cannot be stored."""
+        import numpy as np
+        import xarray as xr
+
+        meta_filename = self.directory / f'{key}.pkl'
+        array_filename = self.directory / f'{key}.npy'
+        try:
+            if isinstance(value, types.ModuleType):
+                meta = ('module', value.__name__)
+            elif isinstance(value, np.ndarray) and value.dtype != object:
+                np.save(array_filename, value)
+                meta = ('ndarray', None)
+            elif isinstance(value, xr.DataArray) and value.dtype != object:
+                np.save(array_filename, value.values)
+                meta = ('DataArray', {'dims': value.dims, 'coords': dict(value.coords),
+                                      'attrs': value.attrs, 'name': value.name})
+            else:
+                meta = ('pickle', value)
+            # the meta file is written last, it marks the variable as complete
+            meta_filename.write_bytes(pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            logger.debug(f'Variable {key} cannot be stored: {type(e).__name__}: {e}')
+            meta_filename.unlink(missing_ok=True)
+            array_filename.unlink(missing_ok=True)
+            return False
+        return True
+
+    def get(self, key: str):
+        """Loads the variable `key`"""
+        import importlib
+        import numpy as np
+
+        kind, meta = pickle.loads((self.directory / f'{key}.pkl').read_bytes())
+        if kind == 'module':
+            return importlib.import_module(meta)
+        if kind == 'pickle':
+            return meta
+        # a plain array view of the (copy-on-write) memory map
+        data = np.load(self.directory / f'{key}.npy', mmap_mode='c').view(np.ndarray)
+        if kind == 'ndarray':
+            return data
+        import xarray as xr
+        return xr.DataArray(data, dims=meta['dims'], coords=meta['coords'], attrs=meta['attrs'],
+                            name=meta['name'])
+
+
+class SectionNode:
+    """A section of a notebook in the section graph"""
+    __slots__ = ('index', 'name', 'cell_indices', 'codes', 'cell_names', 'assigned', 'free')
+
+    def __init__(self, index: int, name: str, cell_indices: List[int], codes: List[str],
+                 produces=(), consumes=()):
+        self.index = index
+        self.name = name
+        self.cell_indices = cell_indices
+        self.codes = codes
+        self.cell_names = [code_names(code) for code in codes]
+        if any(names is None for names in self.cell_names):
+            self.assigned = None
+            self.free = None
+        else:
+            self.assigned, self.free = code_names(codes)
+            self.assigned |= set(produces)
+            self.free |= set(consumes) - self.assigned
+
+    def __repr__(self):
+        return f'<SectionNode name={self.name}, n_cells={len(self.codes)}>'
+
+
+class SectionGraph:
+    """Directed acyclic graph of the sections of a notebook. Section `i`
+    depends on section `j` if `j` is the last section before `i` assigning a
+    free name of `i`. Setup sections (e.g. the imports, which may configure
+    modules) are executed before every later section instead.
+
+    Parameters
+    ----------
+    nodes: List[SectionNode]
+        Sections in document order
+    setup: Tuple[str, ...]
+        Names of the setup sections
+    """
+
+    def __init__(self, nodes: List[SectionNode], setup: Tuple[str, ...] = ()):
+        self.nodes = nodes
+        self.setup = {node.index for node in nodes if node.name in setup and node.free is not None}
+        self.dependencies = [set() for _ in nodes]
+        # the names each section has to provide to later sections
+        self.provides = [set() for _ in nodes]
+        for node in nodes:
+            if node.free is None:
+                self.dependencies[node.index] = set(range(node.index))
+                continue
+            for name in node.free:
+                producer = self.producer(name, node.index)
+                if producer is not None and producer not in self.setup:
+                    self.dependencies[node.index].add(producer)
+                    self.provides[producer].add(name)
+
+    def __repr__(self):
+        return f'<SectionGraph n_sections={len(self.nodes)}, parsable={self.is_parsable}>'
+
+    @classmethod
+    def from_notebook(cls, nb: nbformat.NotebookNode, setup: Tuple[str, ...] = ()) -> 'SectionGraph':
+        """Builds the graph from the cells of `nb` grouped by their "section"
+        metadata and the declarations in the notebook metadata (see
+        `PIVReportNotebook.create()`)"""
+        declarations = nb.get('metadata', {}).get('standardpostpiv', {}).get('sections', {})
+        nodes = []
+        for i, (name, indices) in enumerate(split_sections(nb)):
+            code_indices = [j for j in indices if nb.cells[j].cell_type == 'code']
+            declaration = declarations.get(name, {})
+            nodes.append(SectionNode(i, name, code_indices, [nb.cells[j].source for j in code_indices],
+                                     produces=declaration.get('produces', ()),
+                                     consumes=declaration.get('consumes', ())))
+        return cls(nodes, setup)
+
+    @property
+    def is_parsable(self) -> bool:
+        """Whether the code of all sections could be parsed"""
+        return all(node.free is not None for node in self.nodes)
+
+    def producer(self, name: str, before: int) -> Union[int, None]:
+        """Index of the last section before `before` assigning `name`"""
+        for j in range(before - 1, -1, -1):
+            assigned = self.nodes[j].assigned
+            if assigned is None or name in assigned:
+                return j
+        return None
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        """Section names mapped to the names of the sections they depend on"""
+        return {node.name: [self.nodes[j].name for j in sorted(self.dependencies[node.index])]
+                for node in self.nodes}
+
+    def _slice(self, index: int, names: Set[str]) -> Tuple[List[int], Set[str]]:
+        """Code cells of section `index` needed to compute `names` and the free
+        names of these cells. All cells are needed if `names` are only declared."""
+        node = self.nodes[index]
+        needed = set(names)
+        selected = []
+        for k in range(len(node.codes) - 1, -1, -1):
+            assigned, free = node.cell_names[k]
+            if assigned & needed:
+                selected.append(k)
+                needed |= free
+        selected = selected[::-1] or list(range(len(node.codes)))
+        return selected, code_names([node.codes[k] for k in selected])[1]
+
+    def plan(self, index: int, stored: Dict[Tuple[int, str], str]) -> Tuple[List[Tuple[str, str]], List[str]]:
+        """Returns how the namespace of section `index` is built: the variables
+        to load from the store as (key, name) and the code cells to execute
+        (in document order) for variables which are not stored
+
+        Parameters
+        ----------
+        index: int
+            Section index
+        stored: Dict[Tuple[int, str], str]
+            Store keys of the variables (producer index, name) which are stored
+        """
+        loads = {}
+        cells = {(j, k) for j in self.setup if j < index for k in range(len(self.nodes[j].codes))}
+
+        def resolve(names, before):
+            for name in names:
+                producer = self.producer(name, before)
+                if producer is None or producer in self.setup:
+                    continue
+                if (producer, name) in stored:
+                    loads.setdefault(name, stored[(producer, name)])
+                    continue
+                selected, free = self._slice(producer, {name})
+                new = [k for k in selected if (producer, k) not in cells]
+                cells.update((producer, k) for k in new)
+                if new:
+                    resolve(free, producer)
+
+        resolve(sorted(self.nodes[index].free), index)
+        code = [self.nodes[j].codes[k] for j, k in sorted(cells)]
+        return [(key, name) for name, key in loads.items()], code
+
+
+def _init_worker(log_queue=None):
+    import matplotlib
+    matplotlib.use('Agg')
+    if log_queue is not None:
+        from .logger import worker_logging
+        worker_logging(log_queue)
+
+
+def _run_section(store_dir: str, key_prefix: str, codes: List[str], loads: List[Tuple[str, str]],
+                 prelude: List[str], provides: List[str], figure_format: str, dpi: float) -> Dict:
+    """Executes the code cells of a section in a worker process and stores the
+    variables other sections need"""
+    from .executors import InProcessExecutor
+
+    t0 = time.perf_counter()
+    store = VariableStore(store_dir)
+    executor = InProcessExecutor(figure_format=figure_format, dpi=dpi, reset_namespace=False)
+    executor.reset()
+    for key, name in loads:
+        executor.namespace[name] = store.get(key)
+    # recompute the variables which could not be stored, without output
+    for code in prelude:
+        try:
+            executor.execute_silent(code)
+        except Exception as e:
+            logger.debug(f'Recomputing a variable failed: {type(e).__name__}: {e}')
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell(code) for code in codes]
+    executor.preprocess(nb)
+
+    stored = []
+    for name in provides:
+        if name in executor.namespace and store.put(f'{key_prefix}{name}', executor.namespace[name]):
+            stored.append(name)
+    return {'outputs': [cell.outputs for cell in nb.cells], 'stored': stored, 'pid': os.getpid(),
+            'time': time.perf_counter() - t0, 'profiles': [cell.metadata.get('profile') for cell in nb.cells]}
+
+
+class ParallelExecutor:
+    """Executes the sections of a notebook in worker processes following the
+    section graph: a section is started as soon as the sections it depends on
+    are finished. The interface is that of `ExecutePreprocessor.preprocess()`.
+    If the code of a section cannot be parsed (e.g. magics), the notebook is
+    executed serially with the `InProcessExecutor`.
+
+    Parameters
+    ----------
+    processes: int, optional
+        Number of worker processes. Default is the number of CPUs.
+    allow_errors: bool
+        If False, a `CellExecutionError` is raised for the first failing cell
+        (after all sections are executed).
+    figure_format: str
+        Format of the captured figures ("png" or "svg")
+    dpi: float, optional
+        Resolution of png figures
+    store_dir: Union[str, pathlib.Path], optional
+        Directory of the variable store. Default is a temporary directory,
+        which is removed afterwards.
+    setup_sections: Tuple[str, ...]
+        Sections executed in every worker before a later section (default:
+        the imports collected by `PIVReportNotebook.create()`)
+    """
+
+    def __init__(self, processes: int = None, allow_errors: bool = True, figure_format: str = 'png',
+                 dpi: float = None, store_dir: Union[str, pathlib.Path] = None,
+                 setup_sections: Tuple[str, ...] = ('imports',)):
+        self.processes = processes
+        self.setup_sections = tuple(setup_sections)
+        self.allow_errors = allow_errors
+        self.figure_format = figure_format
+        self.dpi = dpi
+        self.store_dir = store_dir
+        self.timings = {}
+
+    def __repr__(self):
+        return f'<ParallelExecutor processes={self.processes}>'
+
+    def _execute(self, nb: nbformat.NotebookNode, graph: SectionGraph, store_dir: str):
+        nodes = [node for node in graph.nodes if node.codes]
+        remaining = {node.index for node in nodes}
+        done = {node.index for node in graph.nodes if not node.codes}
+        stored = {}
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                 initargs=(get_log_queue(),)) as pool:
+            while remaining or running:
+                for index in sorted(remaining):
+                    if graph.dependencies[index] <= done:
+                        node = graph.nodes[index]
+                        loads, prelude = graph.plan(index, stored)
+                        future = pool.submit(_run_section, store_dir, f'{index}_', node.codes, loads, prelude,
+                                             sorted(graph.provides[index]), self.figure_format, self.dpi)
+                        running[future] = index
+                        remaining.discard(index)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    node = graph.nodes[index]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # e.g. a crashed worker: the section fails, the others continue
+                        error = nbformat.v4.new_output('error', ename=type(e).__name__, evalue=str(e), traceback=[])
+                        result = {'outputs': [[error]] + [[] for _ in node.codes[1:]], 'stored': [], 'pid': None,
+                                  'time': None}
+                    for j, outputs in zip(node.cell_indices, result['outputs']):
+                        nb.cells[j].outputs = outputs
+                    for j, profile in zip(node.cell_indices, result.get('profiles', [])):
+                        if profile is not None:
+                            nb.cells[j].metadata['profile'] = profile
+                    for name in result['stored']:
+                        stored[(index, name)] = f'{index}_{name}'
+                    self.timings[node.name] = result['time']
+                    done.add(index)
+                    logger.debug(f'Section {node.name} executed in worker {result["pid"]}')
+
+    @instrument
+    def preprocess(self, nb: nbformat.NotebookNode, resources: Dict = None) -> Tuple[nbformat.NotebookNode, Dict]:
+        """Executes all code cells of the notebook `nb` in place
+
+        Parameters
+        ----------
+        nb: nbformat.NotebookNode
+            The notebook
+        resources: Dict, optional
+            Resources (returned unchanged)
+
+        Returns
+        -------
+        Tuple[nbformat.NotebookNode, Dict]
+            The executed notebook and the resources
+        """
+        from .executors import InProcessExecutor
+
+        graph = SectionGraph.from_notebook(nb, self.setup_sections)
+        if not graph.is_parsable:
+            logger.info('The code of a section cannot be parsed. The notebook is executed serially.')
+            return InProcessExecutor(allow_errors=self.allow_errors, figure_format=self.figure_format,
+                                     dpi=self.dpi).preprocess(nb, resources)
+
+        self.timings = {}
+        if self.store_dir is None:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                self._execute(nb, graph, tmpdir)
+        else:
+            self._execute(nb, graph, str(self.store_dir))
+
+        # execution counts in document order
+        count = 0
+        first_error = None
+        for cell in nb.cells:
+            if cell.cell_type != 'code':
+                continue
+            count += 1
+            cell.execution_count = count
+            for output in cell.outputs:
+                if output.output_type == 'execute_result':
+                    output.execution_count = count
+                elif output.output_type == 'error' and first_error is None:
+                    first_error = (cell, output)
+        nb.metadata['language_info'] = {'name': 'python', 'version': platform.python_version()}
+        if first_error is not None and not self.allow_errors:
+            from nbclient.exceptions import CellExecutionError
+            raise CellExecutionError.from_cell_and_msg(*first_error)
+        return nb, resources or {}
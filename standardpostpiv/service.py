@@ -0,0 +1,392 @@
+"""Local HTTP service rendering report sections and figures on demand. The
+service keeps the reports of recently used PIV files warm: their in-process
+namespace (the precomputed summary or a `StandardPIVResult`, the loaded arrays)
+and the executed section outputs stay in memory, so reopening a report costs
+neither a kernel start nor imports nor reading the data again. Idle reports and,
+if the memory budget is exceeded, the least recently used reports are evicted.
+
+Only the standard library is used (`http.server.ThreadingHTTPServer`). Usage::
+
+    standardpostpiv serve campaign/ --port 8765 --memory-budget 2000
+
+Routes (`file` is the path of the HDF5 file relative to the root folder):
+
+    /                                  HDF5 files of the root folder
+    /report?file=run1.hdf              all sections of the report
+    /section/<label>?file=run1.hdf     a single section
+    /figure/<label>?file=run1.hdf&index=0
+                                       a single figure of a section (png/svg)
+    /sections?file=run1.hdf            labels of the sections (json)
+    /status                            warm reports and their memory (json)
+"""
+import base64
+import copy
+import gc
+import html
+import json
+import numbers
+import pathlib
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple, Union
+from urllib.parse import parse_qs, unquote, urlparse
+
+import nbformat
+
+from .logger import logger
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3  # bytes
+DEFAULT_IDLE_TIMEOUT = 1800  # seconds
+HDF_SUFFIXES = ('.hdf', '.hdf5', '.h5')
+
+
+def default_report_factory(hdf_filename: pathlib.Path):
+    """The basic report plotting from the precomputed summary (see `precompute`)"""
+    from .reports import get_basic_2D2C_report
+    return get_basic_2D2C_report(hdf_filename, precompute=True)
+
+
+def namespace_nbytes(namespace: Dict) -> int:
+    """Approximate memory of the values of a namespace in bytes. Arrays (and
+    xarray objects) are counted with their data size, modules, classes and
+    functions are ignored."""
+    total = 0
+    for value in namespace.values():
+        if isinstance(value, (types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType)):
+            continue
+        nbytes = getattr(value, 'nbytes', None)
+        total += int(nbytes) if isinstance(nbytes, numbers.Integral) else sys.getsizeof(value)
+    return total
+
+
+def _outputs_nbytes(cells: List[nbformat.NotebookNode]) -> int:
+    return sum(len(json.dumps(cell.get('outputs', []))) for cell in cells)
+
+
+class WarmReport:
+    """The report of a PIV file with a persistent in-process namespace. Sections
+    are executed once, together with the sections they depend on (see
+    `sectiongraph.SectionGraph`), and their cells are kept.
+
+    Parameters
+    ----------
+    hdf_filename: pathlib.Path
+        The PIV file
+    report_factory: Callable
+        Returns the `PIVReportNotebook` of a file
+    """
+    __slots__ = ('hdf_filename', 'fingerprint', 'notebook', 'graph', 'executor', 'executed', 'nbytes',
+                 'last_used', 'lock')
+
+    def __init__(self, hdf_filename: pathlib.Path, report_factory: Callable = default_report_factory):
+        from .executors import InProcessExecutor
+        from .sectiongraph import SectionGraph
+
+        self.hdf_filename = pathlib.Path(hdf_filename)
+        self.fingerprint = self._fingerprint()
+        self.notebook = report_factory(self.hdf_filename).render()
+        self.graph = SectionGraph.from_notebook(self.notebook, setup=('imports',))
+        self.executor = InProcessExecutor(reset_namespace=False)
+        self.executed = {}  # section name -> executed cells
+        self.nbytes = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'<WarmReport hdf_filename={self.hdf_filename}, executed={list(self.executed)}, '
+                f'nbytes={self.nbytes}>')
+
+    def _fingerprint(self) -> Tuple[int, int]:
+        stat = self.hdf_filename.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    @property
+    def is_stale(self) -> bool:
+        """Whether the PIV file changed since the report was loaded"""
+        try:
+            return self._fingerprint() != self.fingerprint
+        except OSError:
+            return True
+
+    @property
+    def section_names(self) -> List[str]:
+        return [node.name for node in self.graph.nodes]
+
+    def _required(self, index: int) -> List[int]:
+        """Indices of the sections to execute for section `index` in document order"""
+        required = {index}
+        stack = [index]
+        while stack:
+            i = stack.pop()
+            for j in self.graph.dependencies[i] | {s for s in self.graph.setup if s < i}:
+                if j not in required:
+                    required.add(j)
+                    stack.append(j)
+        return sorted(required)
+
+    def section(self, name: str) -> List[nbformat.NotebookNode]:
+        """Executed cells of the section `name` (KeyError if unknown)"""
+        if name not in self.section_names:
+            raise KeyError(name)
+        with self.lock:
+            self.last_used = time.monotonic()
+            for i in self._required(self.section_names.index(name)):
+                node = self.graph.nodes[i]
+                if node.name in self.executed:
+                    continue
+                nb = nbformat.v4.new_notebook()
+                nb.cells = [copy.deepcopy(cell) for cell in self.notebook.cells
+                            if cell.metadata.get('section', None) == node.name]
+                t0 = time.perf_counter()
+                self.executor.preprocess(nb)
+                logger.debug(f'Executed section {node.name} of {self.hdf_filename} in '
+                             f'{time.perf_counter() - t0:.2f} s')
+                self.executed[node.name] = nb.cells
+            self.nbytes = namespace_nbytes(self.executor.namespace) + sum(
+                _outputs_nbytes(cells) for cells in self.executed.values())
+            return self.executed[name]
+
+    def figures(self, name: str) -> List[Tuple[str, bytes]]:
+        """(mimetype, data) of the figures of section `name`"""
+        figures = []
+        for cell in self.section(name):
+            for output in cell.get('outputs', []):
+                data = output.get('data', {})
+                if 'image/png' in data:
+                    figures.append(('image/png', base64.b64decode(data['image/png'])))
+                elif 'image/svg+xml' in data:
+                    figures.append(('image/svg+xml', data['image/svg+xml'].encode()))
+        return figures
+
+    def close(self):
+        """Releases the namespace and the outputs"""
+        self.executor.namespace.clear()
+        self.executed.clear()
+        self.nbytes = 0
+
+
+class ReportService:
+    """Warm reports of the PIV files in a root folder, evicted if idle for
+    `idle_timeout` seconds or (least recently used first) if their memory
+    exceeds `memory_budget`.
+
+    Parameters
+    ----------
+    root: Union[str, pathlib.Path]
+        Folder of the PIV files. Files outside are not served.
+    memory_budget: int
+        Memory of all warm reports in bytes. The report in use is kept even if
+        it alone exceeds the budget.
+    idle_timeout: float
+        Seconds after which an unused report is evicted
+    report_factory: Callable, optional
+        Returns the `PIVReportNotebook` of a file. Default is the basic report
+        plotting from the precomputed summary.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path] = '.', memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT, report_factory: Callable = None):
+        self.root = pathlib.Path(root).resolve()
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.report_factory = report_factory or default_report_factory
+        self.reports = OrderedDict()  # least recently used first
+        self.n_loaded = 0
+        self.n_evicted = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<ReportService root={self.root}, n_warm={len(self.reports)}, nbytes={self.nbytes}>'
+
+    @property
+    def nbytes(self) -> int:
+        return sum(report.nbytes for report in list(self.reports.values()))
+
+    def resolve(self, filename: Union[str, pathlib.Path]) -> pathlib.Path:
+        """Absolute path of `filename` (relative to the root). Raises
+        PermissionError for files outside the root and FileNotFoundError for
+        missing files."""
+        path = (self.root / filename).resolve()
+        try:
+            path.relative_to(self.root)
+        except ValueError:
+            raise PermissionError(f'{filename} is outside of {self.root}')
+        if not path.is_file():
+            raise FileNotFoundError(f'{filename} does not exist')
+        return path
+
+    def files(self) -> List[pathlib.Path]:
+        """PIV files of the root folder (relative paths)"""
+        return sorted(p.relative_to(self.root) for p in self.root.rglob('*') if p.suffix in HDF_SUFFIXES)
+
+    def get(self, filename: Union[str, pathlib.Path]) -> WarmReport:
+        """The warm report of `filename`. A report of a file which changed since
+        it was loaded is replaced."""
+        path = self.resolve(filename)
+        with self._lock:
+            report = self.reports.get(path, None)
+            if report is not None and report.is_stale:
+                logger.debug(f'{path} changed, reloading its report')
+                self._evict(path)
+                report = None
+            if report is None:
+                report = WarmReport(path, self.report_factory)
+                self.reports[path] = report
+                self.n_loaded += 1
+            self.reports.move_to_end(path)
+            report.last_used = time.monotonic()
+            return report
+
+    def section(self, filename: Union[str, pathlib.Path], name: str) -> List[nbformat.NotebookNode]:
+        """Executed cells of section `name` of the report of `filename`"""
+        report = self.get(filename)
+        cells = report.section(name)
+        self.enforce_budget(keep=report.hdf_filename)
+        return cells
+
+    def _evict(self, path: pathlib.Path):
+        report = self.reports.pop(path)
+        with report.lock:
+            report.close()
+        self.n_evicted += 1
+        logger.debug(f'Evicted the report of {path}')
+
+    def enforce_budget(self, keep: pathlib.Path = None):
+        """Evicts the least recently used reports (except `keep`) until the
+        memory is within the budget"""
+        with self._lock:
+            evicted = False
+            for path in list(self.reports):
+                if self.nbytes <= self.memory_budget:
+                    break
+                if path != keep:
+                    self._evict(path)
+                    evicted = True
+            if self.nbytes > self.memory_budget:
+                logger.warning(f'The report of {keep} alone exceeds the memory budget '
+                               f'({self.nbytes / 1024 ** 2:.0f} MB > {self.memory_budget / 1024 ** 2:.0f} MB)')
+        if evicted:
+            gc.collect()
+
+    def evict_idle(self):
+        """Evicts the reports not used for `idle_timeout` seconds"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [path for path, report in self.reports.items() if now - report.last_used > self.idle_timeout]
+            for path in idle:
+                self._evict(path)
+        if idle:
+            gc.collect()
+
+    def status(self) -> Dict:
+        return {'root': str(self.root), 'memory_budget': self.memory_budget, 'nbytes': self.nbytes,
+                'n_loaded': self.n_loaded, 'n_evicted': self.n_evicted,
+                'reports': [{'file': str(path.relative_to(self.root)), 'nbytes': report.nbytes,
+                             'executed': list(report.executed),
+                             'idle': round(time.monotonic() - report.last_used, 1)}
+                            for path, report in self.reports.items()]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes the requests to the `ReportService` of the server"""
+    server_version = 'standardpostpiv'
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def _send(self, body: Union[str, bytes], content_type: str = 'text/html; charset=utf-8',
+              status: HTTPStatus = HTTPStatus.OK):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data, status: HTTPStatus = HTTPStatus.OK):
+        self._send(json.dumps(data, indent=2), 'application/json', status)
+
+    def _error(self, status: HTTPStatus, message: str):
+        self._send(f'<h1>{status.value} {status.phrase}</h1><p>{html.escape(message)}</p>', status=status)
+
+    def do_GET(self):
+        from .htmlrender import render_inline_html
+
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        try:
+            if not parts:
+                links = ''.join(f'<li><a href="/report?file={html.escape(str(f))}">{html.escape(str(f))}</a></li>'
+                                for f in service.files())
+                return self._send(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>PIV reports</title>'
+                                  f'</head><body><h1>PIV reports</h1><ul>{links}</ul></body></html>')
+            if parts == ['status']:
+                return self._json(service.status())
+            if 'file' not in query:
+                return self._error(HTTPStatus.BAD_REQUEST, 'Missing parameter "file"')
+            filename = query['file']
+            if parts == ['sections']:
+                return self._json(service.get(filename).section_names)
+            if parts == ['report']:
+                report = service.get(filename)
+                cells = [cell for name in report.section_names for cell in service.section(filename, name)]
+                return self._send(render_inline_html(cells, pathlib.Path(filename).stem))
+            if len(parts) == 2 and parts[0] == 'section':
+                cells = service.section(filename, parts[1])
+                return self._send(render_inline_html(cells, f'{parts[1]} - {pathlib.Path(filename).stem}'))
+            if len(parts) == 2 and parts[0] == 'figure':
+                service.section(filename, parts[1])
+                figures = service.get(filename).figures(parts[1])
+                index = int(query.get('index', 0))
+                if not -len(figures) <= index < len(figures):
+                    return self._error(HTTPStatus.NOT_FOUND, f'Section "{parts[1]}" has {len(figures)} figures')
+                mimetype, data = figures[index]
+                return self._send(data, mimetype)
+            return self._error(HTTPStatus.NOT_FOUND, f'Unknown path {url.path}')
+        except PermissionError as e:
+            return self._error(HTTPStatus.FORBIDDEN, str(e))
+        except (FileNotFoundError, KeyError) as e:
+            return self._error(HTTPStatus.NOT_FOUND, f'Not found: {e}')
+        except ValueError as e:
+            return self._error(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            logger.error(f'Request {self.path} failed: {type(e).__name__}: {e}')
+            return self._error(HTTPStatus.INTERNAL_SERVER_ERROR, f'{type(e).__name__}: {e}')
+
+
+class ReportServer(ThreadingHTTPServer):
+    """Threading HTTP server of a `ReportService`. Idle reports are evicted
+    between requests."""
+    daemon_threads = True
+
+    def __init__(self, service: ReportService, host: str = '127.0.0.1', port: int = 8765):
+        self.service = service
+        super().__init__((host, port), _Handler)
+
+    def service_actions(self):
+        self.service.evict_idle()
+
+
+def serve(root: Union[str, pathlib.Path] = '.', host: str = '127.0.0.1', port: int = 8765,
+          memory_budget: int = DEFAULT_MEMORY_BUDGET, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+    """Serves the reports of the PIV files in `root` until interrupted"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+    server = ReportServer(ReportService(root, memory_budget=memory_budget, idle_timeout=idle_timeout), host, port)
+    logger.info(f'Serving the reports of {server.service.root} on http://{host}:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
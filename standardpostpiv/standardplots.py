@@ -12,6 +12,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import xarray as xr
 
+from .instrumentation import instrument
+from .plotting import piv_density
+
 
 def _add_winsize_to_plot(ax, fiwsize, edgecolor='r'):
     if isinstance(fiwsize, dict):
@@ -32,16 +35,30 @@ def _add_winsize_to_plot(ax, fiwsize, edgecolor='r'):
     return ax
 
 
+@instrument
 def xr_piv_scatter(dataset,
                    xname,
                    yname,
                    flagname='piv_flags',
-                   fiwsize: Union[int, List[int], Tuple[int], Dict] = None):
+                   fiwsize: Union[int, List[int], Tuple[int], Dict] = None,
+                   density: bool = False,
+                   bins: Union[int, Tuple[int, int]] = 256,
+                   value_range=None):
     x = dataset[xname]
     y = dataset[yname]
     piv_flags = dataset[flagname]
 
     fig, ax = plt.subplots()
+    if density:
+        piv_density(x, y, flags=piv_flags, bins=bins, value_range=value_range, ax=ax)
+        if fiwsize:
+            _add_winsize_to_plot(ax, fiwsize)
+        ax.set_xlabel(f'{x.standard_name} [{x.units}]')
+        ax.set_ylabel(f'{y.standard_name} [{y.units}]')
+        title_arr_names = [f'{c}={x[c].values[()]:f} [{x[c].units}]' for c in x.coords if x[c].ndim == 0]
+        ax.set_title(' '.join(title_arr_names))
+        return ax
+
     ax.scatter(x.where(piv_flags == 1), y.where(piv_flags == 1), marker='o', s=10, color='k', alpha=0.5,
                label='active')
     ax.scatter(x.where(piv_flags & 32), y.where(piv_flags & 33), marker='o', s=10, color='r', alpha=0.5,
@@ -61,6 +78,7 @@ def xr_piv_scatter(dataset,
     return ax
 
 
+@instrument
 def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                 v: Union[np.ndarray, xr.DataArray],
                 fiwsize: Union[int, List[int], Tuple[int], Dict, None] = None,
@@ -71,6 +89,9 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                 marker='.',
                 s=20,
                 indicate_means: bool = True,
+                density: bool = False,
+                bins: Union[int, Tuple[int, int]] = 256,
+                value_range=None,
                 **kwargs):
     """
 
@@ -88,6 +109,13 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
         alpha value of the scatter plot
     marker: str
         marker of the scatter plot
+    density: bool
+        If True, draw a 2D histogram per flag category as image instead of
+        one marker per vector (see `plotting.piv_density`)
+    bins: Union[int, Tuple[int, int]]
+        Number of bins of the density image
+    value_range: Tuple[Tuple[float, float], Tuple[float, float]], optional
+        ((umin, umax), (vmin, vmax)) of the density image
     kwargs: dict
         additional keyword arguments passed to the scatter plot
     """
@@ -98,20 +126,15 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
 
     u_is_xr = isinstance(u, xr.DataArray)
     v_is_xr = isinstance(v, xr.DataArray)
-    if u_is_xr:
-        dx = u.values.ravel()
-    else:
-        dx = u.ravel()
-    if v_is_xr:
-        dy = v.values.ravel()
-    else:
-        dy = v.ravel()
 
     show_window_size = fiwsize is not None
 
     if ax is None:
         fig, ax = plt.subplots()
-    if flags is not None:
+    if density:
+        ax, _, (umean, vmean) = piv_density(u, v, flags=flags, bins=bins, value_range=value_range,
+                                            color=color, alpha=alpha, ax=ax)
+    elif flags is not None:
         ax.scatter(u.where(flags == 1),
                    v.where(flags == 1), marker=marker, s=s, color='k', alpha=0.5,
                    label='active')
@@ -124,10 +147,13 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
                    v.where(mask64).data.ravel(), marker=marker, s=s, color='b', alpha=0.5,
                    label='active+replaced')
     else:
+        dx = u.values.ravel() if u_is_xr else u.ravel()
+        dy = v.values.ravel() if v_is_xr else v.ravel()
         ax.scatter(dx, dy, color=color, alpha=alpha, marker=marker, **kwargs)
 
-    umean = u.mean()
-    vmean = v.mean()
+    if not density:
+        umean = u.mean()
+        vmean = v.mean()
 
     if show_window_size:
 
@@ -182,6 +208,7 @@ def piv_scatter(u: Union[np.ndarray, xr.DataArray],
     return ax
 
 
+@instrument
 def piv_hist(u, v, ax=None, **kwargs):
     xlabel1 = kwargs.pop('xlabel1', None)
     xlabel2 = kwargs.pop('xlabel2', None)
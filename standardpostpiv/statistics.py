@@ -3,10 +3,13 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 from functools import wraps
-from scipy.stats import anderson, shapiro, normaltest
-from typing import Union
+from typing import Union, Tuple, List
 
+from .instrumentation import instrument
+from .utils import iter_chunks
 
+
+@instrument
 def stats(target):
     """compute stats for the target. dataset including flags is ignored"""
     if isinstance(target, xr.DataArray):
@@ -70,6 +73,7 @@ def next_mean(mu, n_mu, new_val):
     return (mu * n_mu + new_val) / (n_mu + 1)
 
 
+@instrument
 def developing_mean(x: np.ndarray, axis: int):
     """computing the running mean of an array along a given axis"""
 
@@ -106,6 +110,7 @@ def developing_mean_1d(arr):
     return developing_means
 
 
+@instrument
 def developing_std(x, axis, ddof=0):
     """shape of x : nt x ndata"""
 
@@ -131,6 +136,7 @@ def developing_std(x, axis, ddof=0):
     return np.moveaxis(std, 0, axis)
 
 
+@instrument
 def developing_relative_standard_deviation(x, axis, ddof=0):
     """Computes the running relative standard deviation using the running
     mean as normalization."""
@@ -150,6 +156,897 @@ def developing_relative_standard_deviation(x, axis, ddof=0):
     return np.moveaxis(rrstd, 0, axis)
 
 
+def _finite_values(data, mask=None) -> np.ndarray:
+    """Returns the finite and unmasked values of data as flat np.ndarray"""
+    if isinstance(data, xr.DataArray):
+        data = data.values
+    x = np.asarray(data)
+    if mask is not None:
+        x = x[~np.asarray(mask).astype(bool)]
+    x = x.ravel()
+    return x[np.isfinite(x)]
+
+
+class Histogram:
+    """Histogram accumulator with fixed bin edges.
+
+    Data is binned chunk by chunk (`update()`) using `np.bincount` on precomputed
+    bin indices. The bin edges are fixed on the grid `origin + k*binwidth`, so
+    histograms of different chunks or workers can be merged (`merge()` or `+`).
+    Only the counts are stored, thus the memory footprint is independent of the
+    number of accumulated values.
+
+    Parameters
+    ----------
+    binwidth: float
+        Width of the bins
+    origin: float
+        Location of one of the bin edges. Default is 0.
+    value_range: Tuple[float, float], optional
+        Fixed (min, max) range of the histogram. Values outside the range are
+        not binned but counted in `n_outside`. If None, the histogram grows with
+        the data up to `max_bins` bins.
+    max_bins: int
+        Maximum number of bins of a histogram without `value_range`. If the
+        values span more bins, the bin width is doubled (neighbouring bins are
+        merged) until they fit, so no value is dropped and the memory of the
+        counts is `8 * max_bins` bytes at most. Note that a few far outliers
+        (e.g. unmasked fill values) coarsen the bins accordingly.
+    """
+
+    def __init__(self, binwidth: float, origin: float = 0., value_range: Tuple[float, float] = None,
+                 max_bins: int = 100_000):
+        if not binwidth > 0:
+            raise ValueError(f'binwidth must be positive but got {binwidth}')
+        if not max_bins >= 2:
+            raise ValueError(f'max_bins must be at least 2 but got {max_bins}')
+        self.binwidth = float(binwidth)
+        self.value_range = value_range
+        self.max_bins = int(max_bins)
+        self.n_outside = 0
+        self.name = None
+        self.attrs = {}
+        if value_range is None:
+            self.origin = float(origin)
+            self._offset = 0
+            self._counts = np.zeros(0, dtype=np.int64)
+        else:
+            vmin, vmax = value_range
+            if not vmax > vmin:
+                raise ValueError(f'Invalid value_range: {value_range}')
+            self.origin = float(vmin)
+            self._offset = 0
+            self._counts = np.zeros(max(int(np.ceil((vmax - vmin) / self.binwidth)), 1), dtype=np.int64)
+
+    def __repr__(self):
+        return f'<Histogram binwidth={self.binwidth}, nbins={self.nbins}, n={self.n}>'
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Counts per bin"""
+        return self._counts
+
+    @property
+    def nbins(self) -> int:
+        """Number of bins"""
+        return self._counts.size
+
+    @property
+    def n(self) -> int:
+        """Number of binned values"""
+        return int(self._counts.sum())
+
+    @property
+    def edges(self) -> np.ndarray:
+        """Bin edges (nbins + 1)"""
+        return self.origin + (self._offset + np.arange(self.nbins + 1)) * self.binwidth
+
+    @property
+    def centers(self) -> np.ndarray:
+        """Bin centers"""
+        return self.origin + (self._offset + np.arange(self.nbins) + 0.5) * self.binwidth
+
+    def density(self) -> np.ndarray:
+        """Probability density per bin"""
+        return self._counts / (self.n * self.binwidth)
+
+    def copy(self) -> 'Histogram':
+        """Return a copy of the histogram"""
+        new = Histogram.__new__(Histogram)
+        new.__dict__.update(self.__dict__)
+        new._counts = self._counts.copy()
+        new.attrs = self.attrs.copy()
+        return new
+
+    def _rebin_factor(self, imin: float, imax: float) -> float:
+        """Smallest power of two by which the bins must be merged to cover the
+        current bins and the bin indices imin...imax with at most `max_bins` bins"""
+        if self.nbins > 0:
+            imin, imax = min(imin, self._offset), max(imax, self._offset + self.nbins - 1)
+        factor = 1.
+        while np.floor(imax / factor) - np.floor(imin / factor) + 1 > self.max_bins:
+            factor *= 2
+        return factor
+
+    def _coarsen(self, factor: float):
+        """Merge every `factor` (a power of two) neighbouring bins. The new bin
+        edges are a subset of the old ones, thus the counts stay exact."""
+        self.binwidth *= factor
+        if self.nbins == 0:
+            return
+        idx = np.floor((self._offset + np.arange(self.nbins)) / factor).astype(np.int64)
+        self._offset = int(idx[0])
+        self._counts = np.bincount(idx - self._offset, weights=self._counts).astype(np.int64)
+
+    def _grow(self, imin: int, imax: int):
+        """Extend the counts array to cover the bin indices imin...imax"""
+        if self.nbins == 0:
+            self._offset = imin
+            self._counts = np.zeros(imax - imin + 1, dtype=np.int64)
+            return
+        lo = min(self._offset, imin)
+        hi = max(self._offset + self.nbins - 1, imax)
+        if lo == self._offset and hi == self._offset + self.nbins - 1:
+            return
+        counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        counts[self._offset - lo:self._offset - lo + self.nbins] = self._counts
+        self._offset = lo
+        self._counts = counts
+
+    def update(self, data, mask=None) -> 'Histogram':
+        """Add the values of `data` to the histogram. NaNs are ignored.
+
+        Parameters
+        ----------
+        data: array-like
+            The values to bin
+        mask: array-like, optional
+            Values of `data` where mask is True (or non-zero) are ignored
+
+        Returns
+        -------
+        self
+        """
+        if isinstance(data, xr.DataArray) and self.name is None:
+            self.name = data.name
+            self.attrs = dict(data.attrs)
+        x = _finite_values(data, mask)
+        # rounding first puts values on a bin edge (up to round-off) into the bin starting there
+        with np.errstate(over='ignore', invalid='ignore'):
+            idx = np.floor(np.round((x - self.origin) / self.binwidth, 9))
+        # values too large to be binned at all (bin index overflow) are outside
+        finite = np.isfinite(idx)
+        if not finite.all():
+            self.n_outside += int(idx.size - np.count_nonzero(finite))
+            x, idx = x[finite], idx[finite]
+        if idx.size == 0:
+            return self
+        if self.value_range is not None:
+            # values equal to the upper range limit belong to the last bin
+            idx[x == self.value_range[1]] = self.nbins - 1
+            inside = (idx >= 0) & (idx < self.nbins)
+            self.n_outside += int(idx.size - np.count_nonzero(inside))
+            idx = idx[inside].astype(np.int64)
+            if idx.size == 0:
+                return self
+        else:
+            factor = self._rebin_factor(idx.min(), idx.max())
+            if factor > 1:
+                self._coarsen(factor)
+                idx = np.floor(idx / factor)
+            idx = idx.astype(np.int64)
+            self._grow(int(idx.min()), int(idx.max()))
+        self._counts += np.bincount(idx - self._offset, minlength=self.nbins)
+        return self
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        """Merge the counts of another histogram with the same bin edges into this
+        one. Histograms without value range may have bin widths differing by a
+        power of two (see `max_bins`), the finer bins are merged then."""
+        if not isinstance(other, Histogram):
+            raise TypeError(f'Can only merge a Histogram but got {type(other)}')
+        ratio = np.log2(other.binwidth / self.binwidth)
+        if other.origin != self.origin or other.value_range != self.value_range or \
+                not (ratio == 0 or (self.value_range is None and ratio == round(ratio))):
+            raise ValueError('Histograms must have the same binwidth, origin and value_range to be merged')
+        if self.name is None:
+            self.name = other.name
+            self.attrs = other.attrs.copy()
+        self.n_outside += other.n_outside
+        if other.nbins == 0:
+            if ratio > 0:
+                self._coarsen(2. ** ratio)
+            return self
+        if ratio < 0:
+            other = other.copy()
+            other._coarsen(2. ** -ratio)
+        elif ratio > 0:
+            self._coarsen(2. ** ratio)
+        counts, offset = other._counts, other._offset
+        if self.value_range is None:
+            factor = self._rebin_factor(offset, offset + counts.size - 1)
+            if factor > 1:
+                other = other.copy()
+                other._coarsen(factor)
+                self._coarsen(factor)
+                counts, offset = other._counts, other._offset
+        self._grow(offset, offset + counts.size - 1)
+        i0 = offset - self._offset
+        self._counts[i0:i0 + counts.size] += counts
+        return self
+
+
+class Histogram2D:
+    """2D histogram accumulator with fixed bins, e.g. for (u, v) pairs.
+
+    Pairs are binned chunk by chunk (`update()`) using `np.bincount`. Pairs
+    outside the range are not binned but counted in `n_outside`. The sums of all
+    finite pairs are tracked, so the means are available without the data.
+
+    Parameters
+    ----------
+    xrange: Tuple[float, float]
+        (min, max) range of the x-values
+    yrange: Tuple[float, float]
+        (min, max) range of the y-values
+    bins: Union[int, Tuple[int, int]]
+        Number of bins in x and y
+    """
+
+    def __init__(self, xrange: Tuple[float, float], yrange: Tuple[float, float],
+                 bins: Union[int, Tuple[int, int]] = 256):
+        if isinstance(bins, int):
+            bins = (bins, bins)
+        self.nx, self.ny = bins
+        self.xrange = tuple(float(v) for v in xrange)
+        self.yrange = tuple(float(v) for v in yrange)
+        if not (self.xrange[1] > self.xrange[0] and self.yrange[1] > self.yrange[0]):
+            raise ValueError(f'Invalid ranges: {xrange}, {yrange}')
+        self.counts = np.zeros((self.ny, self.nx), dtype=np.int64)
+        self.n_outside = 0
+        self.sum_x = 0.
+        self.sum_y = 0.
+        self.n_finite = 0
+        self.xname, self.xattrs = None, {}
+        self.yname, self.yattrs = None, {}
+
+    def __repr__(self):
+        return f'<Histogram2D bins=({self.nx}, {self.ny}), n={self.n}>'
+
+    def __add__(self, other):
+        return Histogram2D(self.xrange, self.yrange, (self.nx, self.ny)).merge(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def n(self) -> int:
+        """Number of binned pairs"""
+        return int(self.counts.sum())
+
+    @property
+    def xedges(self) -> np.ndarray:
+        return np.linspace(*self.xrange, self.nx + 1)
+
+    @property
+    def yedges(self) -> np.ndarray:
+        return np.linspace(*self.yrange, self.ny + 1)
+
+    @property
+    def extent(self) -> Tuple[float, float, float, float]:
+        """Extent (xmin, xmax, ymin, ymax) as used by imshow"""
+        return self.xrange + self.yrange
+
+    @property
+    def xmean(self) -> float:
+        """Mean of all finite x-values (including those outside the range)"""
+        return self.sum_x / self.n_finite if self.n_finite else np.nan
+
+    @property
+    def ymean(self) -> float:
+        """Mean of all finite y-values (including those outside the range)"""
+        return self.sum_y / self.n_finite if self.n_finite else np.nan
+
+    def update(self, x, y, mask=None) -> 'Histogram2D':
+        """Add the pairs (x, y) to the histogram. Pairs containing NaNs are ignored.
+
+        Parameters
+        ----------
+        x: array-like
+            x-values
+        y: array-like
+            y-values with the same shape as x
+        mask: array-like, optional
+            Pairs where mask is True (or non-zero) are ignored
+
+        Returns
+        -------
+        self
+        """
+        if isinstance(x, xr.DataArray):
+            if self.xname is None:
+                self.xname, self.xattrs = x.name, dict(x.attrs)
+            x = x.values
+        if isinstance(y, xr.DataArray):
+            if self.yname is None:
+                self.yname, self.yattrs = y.name, dict(y.attrs)
+            y = y.values
+        x = np.asarray(x).ravel()
+        y = np.asarray(y).ravel()
+        valid = np.isfinite(x) & np.isfinite(y)
+        if mask is not None:
+            valid &= ~np.asarray(mask).ravel().astype(bool)
+        x, y = x[valid], y[valid]
+        self.n_finite += x.size
+        self.sum_x += float(np.sum(x, dtype=float))
+        self.sum_y += float(np.sum(y, dtype=float))
+
+        ix = np.floor((x - self.xrange[0]) / (self.xrange[1] - self.xrange[0]) * self.nx).astype(np.int64)
+        iy = np.floor((y - self.yrange[0]) / (self.yrange[1] - self.yrange[0]) * self.ny).astype(np.int64)
+        # values equal to the upper range limit belong to the last bin
+        ix[x == self.xrange[1]] = self.nx - 1
+        iy[y == self.yrange[1]] = self.ny - 1
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        self.n_outside += int(x.size - np.count_nonzero(inside))
+        self.counts += np.bincount(iy[inside] * self.nx + ix[inside],
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other: 'Histogram2D') -> 'Histogram2D':
+        """Merge another 2D histogram with the same bins into this one"""
+        if not isinstance(other, Histogram2D):
+            raise TypeError(f'Can only merge a Histogram2D but got {type(other)}')
+        if (other.xrange, other.yrange, other.nx, other.ny) != (self.xrange, self.yrange, self.nx, self.ny):
+            raise ValueError('Histograms must have the same ranges and bins to be merged')
+        if self.xname is None:
+            self.xname, self.xattrs = other.xname, other.xattrs.copy()
+        if self.yname is None:
+            self.yname, self.yattrs = other.yname, other.yattrs.copy()
+        self.counts += other.counts
+        self.n_outside += other.n_outside
+        self.sum_x += other.sum_x
+        self.sum_y += other.sum_y
+        self.n_finite += other.n_finite
+        return self
+
+
+class FieldMoments:
+    """Per-pixel mean and standard deviation of fields accumulated chunk by chunk
+    along the first (time) axis (`update()`), e.g. with `stream_update`. Only
+    the count, mean and sum of squared deviations of every pixel are kept in
+    memory, chunks are combined with the parallel algorithm of Chan et al.
+    """
+
+    def __init__(self):
+        self.count = None
+        self._mean = None
+        self._m2 = None
+        self.name = None
+        self.attrs = {}
+        self.dims = None
+        self.coords = {}
+
+    def __repr__(self):
+        shape = None if self.count is None else self.count.shape
+        return f'<FieldMoments shape={shape}>'
+
+    def update(self, data, mask=None) -> 'FieldMoments':
+        """Add the fields of `data` (first axis) to the moments. NaNs are ignored.
+
+        Parameters
+        ----------
+        data: array-like
+            The fields to add, e.g. an xr.DataArray with dims (reltime, y, x)
+        mask: array-like, optional
+            Values of `data` where mask is True (or non-zero) are ignored
+
+        Returns
+        -------
+        self
+        """
+        if isinstance(data, xr.DataArray) and self.dims is None:
+            self.name = data.name
+            self.attrs = dict(data.attrs)
+            self.dims = data.dims[1:]
+            self.coords = {d: data.coords[d].values for d in self.dims if d in data.coords}
+        x = np.asarray(data, dtype=float)
+        valid = np.isfinite(x)
+        if mask is not None:
+            valid &= ~np.asarray(mask).astype(bool)
+        if self.count is None:
+            self.count = np.zeros(x.shape[1:], dtype=np.int64)
+            self._mean = np.zeros(x.shape[1:])
+            self._m2 = np.zeros(x.shape[1:])
+        n = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, x, 0).sum(axis=0) / n
+            m2 = (np.where(valid, x - mean, 0) ** 2).sum(axis=0)
+            total = self.count + n
+            delta = np.where(n > 0, mean - self._mean, 0)
+            self._mean += np.where(n > 0, delta * n / total, 0)
+            self._m2 += np.where(n > 0, m2 + delta ** 2 * self.count * n / total, 0)
+        self.count = total
+        return self
+
+    def _as_field(self, values: np.ndarray, prefix: str) -> xr.DataArray:
+        attrs = self.attrs.copy()
+        if 'standard_name' in attrs:
+            attrs['standard_name'] = f'{prefix}{attrs["standard_name"]}'
+        if self.dims is None:
+            return xr.DataArray(values, attrs=attrs)
+        return xr.DataArray(values, dims=self.dims, coords=self.coords, attrs=attrs, name=self.name)
+
+    def mean(self) -> xr.DataArray:
+        """Mean field (NaN where no value was accumulated)"""
+        return self._as_field(np.where(self.count > 0, self._mean, np.nan), 'arithmetic_mean_of_')
+
+    def std(self, ddof: int = 0) -> xr.DataArray:
+        """Standard deviation field (NaN where at most `ddof` values were accumulated)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(np.where(self.count > ddof, self._m2 / (self.count - ddof), np.nan))
+        return self._as_field(std, 'standard_deviation_of_')
+
+    def global_mean(self) -> float:
+        """Mean of all accumulated values"""
+        return float(np.sum(self._mean * self.count) / np.sum(self.count))
+
+
+@instrument
+def stream_update(data, accumulators: List, flags=None, flag_value: int = 2, chunk_size: int = 10,
+                  axis: int = 0) -> List:
+    """Feed (HDF5) data chunk by chunk into accumulators, e.g. `Histogram` or
+    `QuantileSketch`. Every accumulator must provide `update(data, mask)`.
+
+    Parameters
+    ----------
+    data: array-like
+        The data, e.g. an HDF5 dataset. It is read in chunks along `axis`.
+    accumulators: List
+        The accumulators to update
+    flags: array-like, optional
+        PIV flags with the same shape as `data`. Values with `flags & flag_value`
+        are ignored.
+    flag_value: int
+        Flag value used to mask the data. Default is 2 (masked).
+    chunk_size: int
+        Number of entries along `axis` read at once
+    axis: int
+        Axis along which to read the chunks
+
+    Returns
+    -------
+    List
+        The updated accumulators
+    """
+    if flags is None:
+        for chunk in iter_chunks(data, chunk_size, axis):
+            for acc in accumulators:
+                acc.update(chunk)
+        return accumulators
+    for chunk, flag_chunk in zip(iter_chunks(data, chunk_size, axis), iter_chunks(flags, chunk_size, axis)):
+        mask = np.asarray(flag_chunk) & flag_value
+        for acc in accumulators:
+            acc.update(chunk, mask=mask)
+    return accumulators
+
+
+@instrument
+def stream_histogram(data, binwidth: float, flags=None, flag_value: int = 2, chunk_size: int = 10,
+                     axis: int = 0, **kwargs) -> Histogram:
+    """Compute the histogram of (HDF5) data chunk by chunk.
+
+    Parameters
+    ----------
+    data: array-like
+        The data, e.g. an HDF5 dataset. It is read in chunks along `axis`.
+    binwidth: float
+        Width of the bins
+    flags: array-like, optional
+        PIV flags with the same shape as `data`. Values with `flags & flag_value`
+        are ignored.
+    flag_value: int
+        Flag value used to mask the data. Default is 2 (masked).
+    chunk_size: int
+        Number of entries along `axis` read at once
+    axis: int
+        Axis along which to read the chunks
+    kwargs: Dict
+        Additional parameters passed to `Histogram`
+
+    Returns
+    -------
+    Histogram
+    """
+    hist, = stream_update(data, [Histogram(binwidth, **kwargs)], flags, flag_value, chunk_size, axis)
+    return hist
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch (KLL) of a data stream.
+
+    The sketch is fed chunk by chunk (`update()`) and stores at most about
+    `3*k` values. The rank error of `quantile()` is bounded by approximately
+    `1.7/k` (e.g. 0.85 % for the default `k=200`) independent of the number of
+    accumulated values. Sketches of different chunks or workers can be merged
+    (`merge()` or `+`).
+
+    Parameters
+    ----------
+    k: int
+        Accuracy parameter. Larger values reduce the error and increase the memory.
+    seed: int, optional
+        Seed of the random number generator used for compaction
+    """
+
+    def __init__(self, k: int = 200, seed: int = None):
+        if k < 8:
+            raise ValueError(f'k must be at least 8 but got {k}')
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def __repr__(self):
+        return f'<QuantileSketch k={self.k}, n={self.n}, n_retained={self.n_retained}>'
+
+    def __add__(self, other):
+        new = QuantileSketch(self.k)
+        return new.merge(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def n_retained(self) -> int:
+        """Number of values stored in the sketch"""
+        return sum(level.size for level in self._levels)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if items.size > self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item stays on this level
+                keep = items[:items.size % 2]
+                offset = self._rng.integers(2)
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1],
+                                                          items[keep.size + offset::2]])
+                self._levels[level] = keep
+            level += 1
+
+    def update(self, data, mask=None) -> 'QuantileSketch':
+        """Add the values of `data` to the sketch. NaNs are ignored.
+
+        Parameters
+        ----------
+        data: array-like
+            The values to add
+        mask: array-like, optional
+            Values of `data` where mask is True (or non-zero) are ignored
+
+        Returns
+        -------
+        self
+        """
+        x = _finite_values(data, mask)
+        if x.size == 0:
+            return self
+        self.n += x.size
+        self.min = np.nanmin([self.min, x.min()])
+        self.max = np.nanmax([self.max, x.max()])
+        self._levels[0] = np.concatenate([self._levels[0], x.astype(float)])
+        self._compress()
+        return self
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """Merge another sketch into this one"""
+        if not isinstance(other, QuantileSketch):
+            raise TypeError(f'Can only merge a QuantileSketch but got {type(other)}')
+        if other.k != self.k:
+            raise ValueError('Sketches must have the same k to be merged')
+        if other.n == 0:
+            return self
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0))
+        for i, items in enumerate(other._levels):
+            self._levels[i] = np.concatenate([self._levels[i], items])
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        self._compress()
+        return self
+
+    def quantile(self, q: Union[float, List[float], np.ndarray]) -> Union[float, np.ndarray]:
+        """Estimated quantile(s) `q` (0 <= q <= 1) of the accumulated data"""
+        q = np.asarray(q, dtype=float)
+        if np.any((q < 0) | (q > 1)):
+            raise ValueError('Quantiles must be in the range [0, 1]')
+        if self.n == 0:
+            return np.full(q.shape, np.nan)[()]
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(level.size, 2 ** i) for i, level in enumerate(self._levels)])
+        order = np.argsort(items)
+        items = items[order]
+        cumweights = np.cumsum(weights[order])
+        idx = np.searchsorted(cumweights, q * cumweights[-1], side='left')
+        res = items[np.minimum(idx, items.size - 1)]
+        res = np.where(q == 0, self.min, np.where(q == 1, self.max, res))
+        return res[()]
+
+
+class PixelQuantileSketch:
+    """Quantile sketch per pixel based on fixed-bin histograms.
+
+    The absolute error of `quantile()` is bounded by the bin width
+    `(value_range[1] - value_range[0]) / nbins`. Values outside `value_range`
+    are not binned but counted per pixel in `n_below` and `n_above` (like
+    `Histogram.n_outside`). Sketches with identical parameters can be merged
+    (`merge()` or `+`).
+
+    The counts need `npixels * nbins * itemsize` bytes, e.g. 128 MB for a
+    megapixel frame with the default 64 bins and uint16 counts, plus 16 bytes
+    per pixel for the values outside the range. The counts start as uint16 and
+    are widened to uint32 (and uint64) only if a bin could overflow. An update
+    increments the counts in place, its temporary memory is proportional to the
+    number of values of the update, not to the number of bins.
+
+    Parameters
+    ----------
+    shape: Tuple[int, ...]
+        Shape of a single frame (e.g. (ny, nx))
+    value_range: Tuple[float, float]
+        (min, max) range of the values
+    nbins: int
+        Number of bins per pixel
+    """
+
+    def __init__(self, shape: Tuple[int, ...], value_range: Tuple[float, float], nbins: int = 64):
+        vmin, vmax = value_range
+        if not vmax > vmin:
+            raise ValueError(f'Invalid value_range: {value_range}')
+        self.shape = tuple(shape)
+        self.value_range = (float(vmin), float(vmax))
+        self.nbins = nbins
+        self.binwidth = (vmax - vmin) / nbins
+        self.counts = np.zeros((int(np.prod(self.shape)), nbins), dtype=np.uint16)
+        self.n_below = np.zeros(self.counts.shape[0], dtype=np.int64)
+        self.n_above = np.zeros(self.counts.shape[0], dtype=np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the counts in bytes"""
+        return self.counts.nbytes + self.n_below.nbytes + self.n_above.nbytes
+
+    def _reserve(self, n_max: int):
+        """Widens the dtype of the counts if a bin could exceed it by adding `n_max` counts"""
+        required = int(self.counts.max(initial=0)) + int(n_max)
+        for dtype in (np.uint16, np.uint32, np.uint64):
+            if required <= np.iinfo(dtype).max:
+                break
+        else:
+            raise OverflowError(f'{required} counts per bin exceed the range of uint64')
+        if np.dtype(dtype).itemsize > self.counts.dtype.itemsize:
+            self.counts = self.counts.astype(dtype)
+
+    def __repr__(self):
+        return f'<PixelQuantileSketch shape={self.shape}, nbins={self.nbins}>'
+
+    def __add__(self, other):
+        new = PixelQuantileSketch(self.shape, self.value_range, self.nbins)
+        return new.merge(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def n(self) -> np.ndarray:
+        """Number of accumulated values per pixel (including those outside the range)"""
+        return (self.counts.sum(axis=1) + self.n_below + self.n_above).reshape(self.shape)
+
+    @property
+    def n_outside(self) -> np.ndarray:
+        """Number of values outside `value_range` per pixel"""
+        return (self.n_below + self.n_above).reshape(self.shape)
+
+    def update(self, data, mask=None) -> 'PixelQuantileSketch':
+        """Add frames to the sketch. The leading axis of `data` is the frame axis
+        (a single frame is also accepted). NaNs are ignored.
+
+        Parameters
+        ----------
+        data: array-like
+            The frames with shape (nframes, *shape) or shape
+        mask: array-like, optional
+            Values of `data` where mask is True (or non-zero) are ignored
+
+        Returns
+        -------
+        self
+        """
+        if isinstance(data, xr.DataArray):
+            data = data.values
+        x = np.asarray(data, dtype=float).reshape(-1, self.counts.shape[0])
+        valid = np.isfinite(x)
+        if mask is not None:
+            valid &= ~np.asarray(mask).reshape(x.shape).astype(bool)
+        pixel_index = np.nonzero(valid)[1]
+        bin_index = np.floor((x[valid] - self.value_range[0]) / self.binwidth).astype(np.int64)
+        # values equal to the upper range limit belong to the last bin
+        bin_index[x[valid] == self.value_range[1]] = self.nbins - 1
+        below, above = bin_index < 0, bin_index >= self.nbins
+        self.n_below += np.bincount(pixel_index[below], minlength=self.n_below.size)
+        self.n_above += np.bincount(pixel_index[above], minlength=self.n_above.size)
+        inside = ~(below | above)
+        # a bin gets at most one value per frame
+        self._reserve(x.shape[0])
+        np.add.at(self.counts.reshape(-1), pixel_index[inside] * self.nbins + bin_index[inside], 1)
+        return self
+
+    def merge(self, other: 'PixelQuantileSketch') -> 'PixelQuantileSketch':
+        """Merge another sketch with identical parameters into this one"""
+        if not isinstance(other, PixelQuantileSketch):
+            raise TypeError(f'Can only merge a PixelQuantileSketch but got {type(other)}')
+        if (other.shape, other.value_range, other.nbins) != (self.shape, self.value_range, self.nbins):
+            raise ValueError('Sketches must have the same shape, value_range and nbins to be merged')
+        self._reserve(other.counts.max(initial=0))
+        self.counts += other.counts.astype(self.counts.dtype)
+        self.n_below += other.n_below
+        self.n_above += other.n_above
+        return self
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Estimated quantile `q` (0 <= q <= 1) per pixel. Pixels without data are
+        NaN, quantiles among the values below (above) `value_range` are -inf (inf)."""
+        if not 0 <= q <= 1:
+            raise ValueError('Quantile must be in the range [0, 1]')
+        cumcounts = np.cumsum(self.counts, axis=1)
+        n_inside = cumcounts[:, -1]
+        n = n_inside + self.n_below + self.n_above
+        target = q * n - self.n_below
+        ibin = np.argmax(cumcounts >= target[:, None], axis=1)
+        below = np.take_along_axis(cumcounts, ibin[:, None], axis=1)[:, 0] - self.counts[np.arange(n.size), ibin]
+        in_bin = self.counts[np.arange(n.size), ibin]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(in_bin > 0, (target - below) / in_bin, 0.)
+            res = self.value_range[0] + (ibin + frac) * self.binwidth
+        res[(target <= 0) & (self.n_below > 0)] = -np.inf
+        res[target > n_inside] = np.inf
+        res[n == 0] = np.nan
+        return res.reshape(self.shape)
+
+
+def sub_pixel_displacement(displacement):
+    """Returns the sub-pixel part of the displacement in the range [-0.5, 0.5]"""
+    return displacement - np.round(displacement)
+
+
+@instrument
+def peak_locking(displacement, nbins: int = 10, dim: str = 'reltime', mask=None) -> xr.Dataset:
+    """Computes the sub-pixel histogram and the peak-locking index of every
+    frame in a single vectorised pass.
+
+    The peak-locking index is defined as `2 * n_inner / n - 1`, where `n_inner`
+    is the number of sub-pixel displacements with an absolute value smaller
+    than 0.25 pixel. It is 0 for uniformly distributed sub-pixel displacements,
+    approaches 1 if the displacements lock on integer values and -1 if they lock
+    on half pixels.
+
+    Parameters
+    ----------
+    displacement: Union[xr.DataArray, np.ndarray]
+        Displacement in pixels. The frame dimension is `dim` for DataArrays and
+        the first axis for np.ndarrays.
+    nbins: int
+        Number of bins of the sub-pixel histogram between -0.5 and 0.5
+    dim: str
+        Name of the frame dimension
+    mask: array-like, optional
+        Values where mask is True (or non-zero) are ignored
+
+    Returns
+    -------
+    xr.Dataset
+        Per-frame `sub_pixel_histogram`, `peak_locking_index`, `n_inner` and
+        `n_valid`. The index of all frames is stored in the attribute
+        `global_peak_locking_index`.
+    """
+    if isinstance(displacement, xr.DataArray):
+        axis = displacement.dims.index(dim)
+        coord = displacement.coords[dim] if dim in displacement.coords else None
+        x = displacement.values
+    else:
+        axis = 0
+        coord = None
+        x = np.asarray(displacement)
+    nt = x.shape[axis]
+    x = np.moveaxis(x, axis, 0).reshape(nt, -1)
+
+    valid = np.isfinite(x)
+    if mask is not None:
+        valid &= ~np.moveaxis(np.asarray(mask), axis, 0).reshape(nt, -1).astype(bool)
+
+    frame_index = np.nonzero(valid)[0]
+    sub = sub_pixel_displacement(x[valid])
+    bin_index = np.minimum(np.floor((sub + 0.5) * nbins).astype(np.int64), nbins - 1)
+    counts = np.bincount(frame_index * nbins + bin_index, minlength=nt * nbins).reshape(nt, nbins)
+    n_inner = np.bincount(frame_index[np.abs(sub) < 0.25], minlength=nt)
+    n_valid = counts.sum(axis=1)
+
+    coords = {'sub_pixel_displacement': ('sub_pixel_displacement',
+                                         (np.arange(nbins) + 0.5) / nbins - 0.5,
+                                         {'units': 'pixel'})}
+    if coord is not None:
+        coords[dim] = coord
+    ds = xr.Dataset({'sub_pixel_histogram': ((dim, 'sub_pixel_displacement'), counts),
+                     'n_inner': (dim, n_inner),
+                     'n_valid': (dim, n_valid)},
+                    coords=coords)
+    return _update_peak_locking_index(ds)
+
+
+def _update_peak_locking_index(ds: xr.Dataset) -> xr.Dataset:
+    """(Re-)computes the per-frame and global peak-locking index from `n_inner` and `n_valid`"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ds['peak_locking_index'] = 2 * ds.n_inner / ds.n_valid - 1
+    ds['peak_locking_index'].attrs['units'] = ''
+    n_valid = int(ds.n_valid.sum())
+    if n_valid > 0:
+        ds.attrs['global_peak_locking_index'] = 2 * int(ds.n_inner.sum()) / n_valid - 1
+    else:
+        ds.attrs['global_peak_locking_index'] = np.nan
+    return ds
+
+
+@instrument
+def stream_peak_locking(data, nbins: int = 10, flags=None, flag_value: int = 2, chunk_size: int = 10,
+                        dim: str = 'reltime') -> xr.Dataset:
+    """Computes `peak_locking()` for all frames of (HDF5) data chunk by chunk.
+    The frame dimension must be the first one.
+
+    Parameters
+    ----------
+    data: array-like
+        Displacement in pixels, e.g. an HDF5 dataset.
+    nbins: int
+        Number of bins of the sub-pixel histogram
+    flags: array-like, optional
+        PIV flags with the same shape as `data`. Values with `flags & flag_value`
+        are ignored.
+    flag_value: int
+        Flag value used to mask the data. Default is 2 (masked).
+    chunk_size: int
+        Number of frames read at once
+    dim: str
+        Name of the frame dimension
+
+    Returns
+    -------
+    xr.Dataset
+        See `peak_locking()`
+    """
+    if flags is None:
+        results = [peak_locking(chunk, nbins, dim) for chunk in iter_chunks(data, chunk_size)]
+    else:
+        results = [peak_locking(chunk, nbins, dim, mask=np.asarray(flag_chunk) & flag_value)
+                   for chunk, flag_chunk in zip(iter_chunks(data, chunk_size), iter_chunks(flags, chunk_size))]
+    return _update_peak_locking_index(xr.concat(results, dim=dim))
+
+
 # Normality tests (taken from https://www.kaggle.com/code/shashwatwork/guide-to-normality-tests-in-python):
 
 
@@ -166,6 +1063,7 @@ def xrwrapper(func):
     return wrapper
 
 
+@instrument
 @xrwrapper
 def is_gaussian(data, method: str, axis=0, alpha: float = 0.05) -> Union[bool, np.ndarray]:
     """Tests if the data is Gaussian distributed.
@@ -240,6 +1138,7 @@ def anderson_darling_test(data, alpha: int) -> float:
     """Anderson-Darling test for normality
     Note, that alpha is used differently here
     """
+    from scipy.stats import anderson
     res = anderson(np.asarray(data))
     return res.statistic < res.critical_values[alpha]
 
@@ -248,6 +1147,7 @@ def shapiro_wilk(data, alpha=0.05) -> bool:
     """Shapiro-Wilk test for normality"""
     if data.ndim != 1:
         raise ValueError('data must be 1D')
+    from scipy.stats import shapiro
     stat, p = shapiro(data)
     # interpret results
     # alpha = 0.05
@@ -260,6 +1160,7 @@ def shapiro_wilk(data, alpha=0.05) -> bool:
 
 def agostino_pearson_test(data, axis, alpha=0.05):
     """D'Agostino and Pearson's Test for normality"""
+    from scipy.stats import normaltest
     stat, p = normaltest(data, axis=axis)
     # print('Statistics=%.3f, p=%.3f' % (stat, p))
     # interpret results
@@ -0,0 +1,246 @@
+"""Generator of synthetic PIV result files with standard names, e.g. for
+benchmarks and tests at a configurable scale"""
+import json
+import pathlib
+from typing import Tuple, Union
+
+import h5py
+import numpy as np
+
+from .instrumentation import instrument
+
+FLAG_MEANING = {1: 'ACTIVE', 2: 'MASKED', 4: 'NORESULT', 8: 'DISABLED', 16: 'FILTERED',
+                32: 'INTERPOLATED', 64: 'REPLACED', 128: 'MANUALEDIT'}
+
+
+def _mean_displacement(x: np.ndarray, y: np.ndarray, u0: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Uniform flow superimposed by a Lamb-Oseen vortex in the center (pixel units)"""
+    xc, yc = x.mean(), y.mean()
+    r0 = 0.15 * min(np.ptp(x), np.ptp(y))
+    dxv, dyv = x - xc, y - yc
+    r2 = dxv ** 2 + dyv ** 2 + 1e-12
+    utheta = 2 * u0 * r0 / np.sqrt(r2) * (1 - np.exp(-r2 / r0 ** 2))
+    r = np.sqrt(r2)
+    return u0 - utheta * dyv / r, utheta * dxv / r
+
+
+def _obstacle_mask(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Circular obstacle in the lower left quarter"""
+    xc, yc = x.min() + 0.25 * np.ptp(x), y.min() + 0.25 * np.ptp(y)
+    return (x - xc) ** 2 + (y - yc) ** 2 < (0.08 * min(np.ptp(x), np.ptp(y))) ** 2
+
+
+def _generate_frames(rng: np.random.Generator, n: int, mean_dx: np.ndarray, mean_dy: np.ndarray,
+                     mask: np.ndarray, noise: float, outlier_fraction: float,
+                     peak_locking: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Displacements and flags of `n` frames"""
+    ny, nx = mask.shape
+    dx = mean_dx + rng.normal(0, noise, (n, ny, nx))
+    dy = mean_dy + rng.normal(0, noise, (n, ny, nx))
+    if peak_locking > 0:
+        dx -= peak_locking * (dx - np.round(dx))
+        dy -= peak_locking * (dy - np.round(dy))
+
+    flags = np.ones((n, ny, nx), dtype='u1')
+    flags[:, mask] = 2
+    outlier = (rng.random((n, ny, nx)) < outlier_fraction) & ~mask
+    outlier_type = rng.choice(np.array([16, 32, 64], dtype='u1'), size=(n, ny, nx), p=[0.2, 0.6, 0.2])
+    flags[outlier] |= outlier_type[outlier]
+    dx[:, mask] = np.nan
+    dy[:, mask] = np.nan
+    return dx, dy, flags
+
+
+def _create_dimension(h5: h5py.File, name: str, data: np.ndarray, standard_name: str, units: str,
+                      maxshape: Tuple = None) -> h5py.Dataset:
+    ds = h5.create_dataset(name, data=data, maxshape=maxshape)
+    ds.attrs['standard_name'] = standard_name
+    ds.attrs['units'] = units
+    ds.make_scale(name)
+    return ds
+
+
+@instrument
+def create_piv_file(filename: Union[str, pathlib.Path],
+                    nt: int = 100,
+                    ny: int = 64,
+                    nx: int = 80,
+                    chunks: Union[bool, Tuple[int, int, int]] = None,
+                    compression: str = None,
+                    compression_opts=None,
+                    final_iw_size: int = 32,
+                    overlap: int = 16,
+                    dt: float = 1e-4,
+                    scaling_factor: float = 1e4,
+                    noise: float = 0.3,
+                    outlier_fraction: float = 0.02,
+                    peak_locking: float = 0.,
+                    write_chunk_size: int = 50,
+                    seed: int = None,
+                    resizable: bool = False,
+                    overwrite: bool = False) -> pathlib.Path:
+    """Writes a synthetic 2D2C PIV plane result with standard names.
+
+    The displacement field is a uniform flow with a vortex plus noise. A circular
+    obstacle is masked, a fraction of the vectors is flagged as filtered,
+    interpolated or replaced outliers. The file contains the coordinates,
+    displacements, velocities, flags with "flag_meaning", the scaling factor and
+    a parameter group with "piv_method" and the final window sizes. Frames are
+    written in blocks of `write_chunk_size`, so large files can be generated with
+    little memory.
+
+    Parameters
+    ----------
+    filename: Union[str, pathlib.Path]
+        Target HDF5 filename
+    nt, ny, nx: int
+        Number of time steps and of vectors in y and x direction
+    chunks: Union[bool, Tuple[int, int, int]], optional
+        HDF5 chunk shape of the 3D datasets. Default is one frame per chunk.
+    compression: str, optional
+        HDF5 compression filter, e.g. "gzip" or "lzf"
+    compression_opts: optional
+        Options of the compression filter, e.g. the gzip level
+    final_iw_size: int
+        Final interrogation window size in pixels
+    overlap: int
+        Overlap of the final interrogation windows in pixels
+    dt: float
+        Time between two frames (of an image pair) in seconds
+    scaling_factor: float
+        Scaling factor in px/m
+    noise: float
+        Standard deviation of the random displacement noise in pixels
+    outlier_fraction: float
+        Fraction of unmasked vectors that are flagged as outliers
+    peak_locking: float
+        Bias of the displacements towards integer values between 0 (no peak
+        locking) and 1 (integer displacements only)
+    write_chunk_size: int
+        Number of frames generated and written at once
+    seed: int, optional
+        Seed of the random number generator
+    resizable: bool
+        Whether the time dimension is unlimited, so frames can be appended with
+        `append_piv_frames()`. The file is written with the latest HDF5 file
+        format, which is required for SWMR (single writer, multiple readers).
+    overwrite: bool
+        Whether to overwrite an existing file
+
+    Returns
+    -------
+    pathlib.Path
+        The filename
+    """
+    filename = pathlib.Path(filename)
+    if filename.exists() and not overwrite:
+        raise FileExistsError(f'File {filename} exists and overwrite is False')
+    if not 0 <= peak_locking <= 1:
+        raise ValueError(f'peak_locking must be in [0, 1] but got {peak_locking}')
+    rng = np.random.default_rng(seed)
+
+    step = final_iw_size - overlap
+    xpx = final_iw_size / 2 + np.arange(nx) * step
+    ypx = final_iw_size / 2 + np.arange(ny) * step
+    XPX, YPX = np.meshgrid(xpx, ypx)
+    mean_dx, mean_dy = _mean_displacement(XPX, YPX, u0=0.2 * final_iw_size)
+    mask = _obstacle_mask(XPX, YPX)
+    if chunks is None:
+        chunks = (1, ny, nx)
+    dataset_kwargs = dict(shape=(nt, ny, nx), chunks=chunks, compression=compression,
+                          compression_opts=compression_opts, maxshape=(None, ny, nx) if resizable else None)
+
+    with h5py.File(filename, 'w', libver='latest' if resizable else None) as h5:
+        h5.attrs['title'] = 'Synthetic PIV plane result'
+        dims = (_create_dimension(h5, 'reltime', np.arange(nt) * 0.1, 'time', 's',
+                                  maxshape=(None,) if resizable else None),
+                _create_dimension(h5, 'y', ypx / scaling_factor, 'y_coordinate', 'm'),
+                _create_dimension(h5, 'x', xpx / scaling_factor, 'x_coordinate', 'm'))
+
+        variables = {'dx': ('x_displacement', 'px', 'f4'),
+                     'dy': ('y_displacement', 'px', 'f4'),
+                     'u': ('x_velocity', 'm/s', 'f4'),
+                     'v': ('y_velocity', 'm/s', 'f4'),
+                     'piv_flags': ('piv_flags', '', 'u1')}
+        datasets = {}
+        for name, (standard_name, units, dtype) in variables.items():
+            ds = h5.create_dataset(name, dtype=dtype, **dataset_kwargs)
+            ds.attrs['standard_name'] = standard_name
+            ds.attrs['units'] = units
+            for i, dim in enumerate(dims):
+                ds.dims[i].attach_scale(dim)
+            datasets[name] = ds
+        datasets['piv_flags'].attrs['flag_meaning'] = json.dumps({str(k): v for k, v in FLAG_MEANING.items()})
+
+        sf = h5.create_dataset('piv_scaling_factor', data=scaling_factor)
+        sf.attrs['standard_name'] = 'piv_scaling_factor'
+        sf.attrs['units'] = 'px/m'
+
+        params = h5.create_group('piv_parameters')
+        params.attrs['piv_method'] = 'multi_grid'
+        for name, value in (('x_final_iw_size', final_iw_size), ('y_final_iw_size', final_iw_size),
+                            ('x_final_iw_overlap_size', overlap), ('y_final_iw_overlap_size', overlap)):
+            ds = params.create_dataset(name, data=value)
+            ds.attrs['standard_name'] = name
+            ds.attrs['units'] = 'px'
+
+        for i0 in range(0, nt, write_chunk_size):
+            n = min(write_chunk_size, nt - i0)
+            dx, dy, flags = _generate_frames(rng, n, mean_dx, mean_dy, mask, noise, outlier_fraction, peak_locking)
+            slc = slice(i0, i0 + n)
+            datasets['dx'][slc] = dx
+            datasets['dy'][slc] = dy
+            datasets['u'][slc] = dx / scaling_factor / dt
+            datasets['v'][slc] = dy / scaling_factor / dt
+            datasets['piv_flags'][slc] = flags
+    return filename
+
+
+def append_piv_frames(h5: h5py.File,
+                      n: int,
+                      dt: float = 1e-4,
+                      noise: float = 0.3,
+                      outlier_fraction: float = 0.02,
+                      peak_locking: float = 0.,
+                      seed: int = None) -> int:
+    """Appends `n` frames to a file written by `create_piv_file(..., resizable=True)`,
+    e.g. to simulate a running acquisition. The data of the new frames is written
+    before the time stamps ("reltime"), so readers polling the time dimension
+    only see complete frames. `h5` may be open in SWMR mode (`h5.swmr_mode = True`),
+    it is flushed after the frames are written.
+
+    Parameters
+    ----------
+    h5: h5py.File
+        The file opened for writing
+    n: int
+        Number of frames to append
+    dt, noise, outlier_fraction, peak_locking:
+        See `create_piv_file()`
+    seed: int, optional
+        Seed of the random number generator
+
+    Returns
+    -------
+    int
+        The number of frames in the file
+    """
+    rng = np.random.default_rng(seed)
+    scaling_factor = float(h5['piv_scaling_factor'][()])
+    final_iw_size = int(h5['piv_parameters/x_final_iw_size'][()])
+    XPX, YPX = np.meshgrid(h5['x'][()] * scaling_factor, h5['y'][()] * scaling_factor)
+    mean_dx, mean_dy = _mean_displacement(XPX, YPX, u0=0.2 * final_iw_size)
+    dx, dy, flags = _generate_frames(rng, n, mean_dx, mean_dy, _obstacle_mask(XPX, YPX), noise,
+                                     outlier_fraction, peak_locking)
+
+    nt = h5['reltime'].shape[0]
+    slc = slice(nt, nt + n)
+    for name, data in (('dx', dx), ('dy', dy), ('u', dx / scaling_factor / dt), ('v', dy / scaling_factor / dt),
+                       ('piv_flags', flags)):
+        h5[name].resize(nt + n, axis=0)
+        h5[name][slc] = data
+    h5.flush()
+    h5['reltime'].resize((nt + n,))
+    h5['reltime'][slc] = np.arange(nt, nt + n) * 0.1
+    h5.flush()
+    return nt + n
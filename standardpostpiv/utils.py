@@ -1,6 +1,8 @@
 import numpy as np
 import xarray as xr
 
+from .instrumentation import span
+
 
 def apply_mask(da, flags, value):
     """Apply a mask to a DataArray"""
@@ -9,6 +11,37 @@ def apply_mask(da, flags, value):
     raise ValueError('Dimensions of DataArray and flag do not match')
 
 
+def iter_chunks(data, chunk_size: int = 10, axis: int = 0):
+    """Iterate over `data` in slices of `chunk_size` along `axis`.
+
+    Works with every object supporting `.shape` and slicing, e.g. HDF5
+    datasets, xr.DataArrays or np.ndarrays. HDF5 datasets are only read chunk
+    by chunk, thus the memory footprint is independent of the dataset size.
+
+    Parameters
+    ----------
+    data: array-like
+        The data to iterate over
+    chunk_size: int
+        Number of entries along `axis` per chunk
+    axis: int
+        Axis along which to iterate
+
+    Yields
+    ------
+    The slices of `data`
+    """
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size must be at least 1 but got {chunk_size}')
+    n = data.shape[axis]
+    for i in range(0, n, chunk_size):
+        slc = [slice(None)] * len(data.shape)
+        slc[axis] = slice(i, min(i + chunk_size, n))
+        with span('utils.read_chunk', 'io', start=i):
+            chunk = data[tuple(slc)]
+        yield chunk
+
+
 def compute_magnitude(*args):
     """compute magnitude of a vector"""
     if len(args) < 2:
@@ -19,6 +52,46 @@ def compute_magnitude(*args):
     return np.sqrt(c)
 
 
+def mask_displacement(dx, dy, flags, flag_value: int = 2):
+    """Returns the masked x and y displacement and the magnitude of displacement
+
+    Parameters
+    ----------
+    dx, dy: xr.DataArray
+        x and y displacement, e.g. a time step or time range read from the HDF5 file
+    flags: xr.DataArray
+        PIV flags with the dimensions of `dx` and `dy`
+    flag_value: int
+        Flag value used to mask the data. Default is 2 (masked).
+
+    Returns
+    -------
+    Tuple[xr.DataArray, xr.DataArray, xr.DataArray]
+    """
+    dx = apply_mask(dx, flags, flag_value)
+    dy = apply_mask(dy, flags, flag_value)
+    magnitude = compute_magnitude(dx, dy)
+    magnitude.name = 'magnitude_of_displacement'
+    magnitude.attrs['standard_name'] = 'magnitude_of_displacement'
+    if 'units' in dx.attrs:
+        magnitude.attrs['units'] = dx.attrs['units']
+    return dx, dy, magnitude
+
+
+def iter_masked_displacement(dx, dy, flags, chunk_size: int = 10, flag_value: int = 2):
+    """Iterate over the masked displacements (see `mask_displacement`) of
+    `chunk_size` time steps (first axis) at a time. HDF5 datasets are only read
+    chunk by chunk.
+
+    Yields
+    ------
+    Tuple[xr.DataArray, xr.DataArray, xr.DataArray]
+        x and y displacement and the magnitude of displacement of the chunk
+    """
+    for chunks in zip(iter_chunks(dx, chunk_size), iter_chunks(dy, chunk_size), iter_chunks(flags, chunk_size)):
+        yield mask_displacement(*chunks, flag_value=flag_value)
+
+
 def build_vector(**kwargs) -> xr.Dataset:
     """Build a xr.Dataset from two components"""
     return xr.Dataset({k: v[()] for k, v in kwargs.items()})
@@ -90,3 +163,12 @@ class MaskSeeder:
         if ret_indices:
             return seed_indices
         return [(self.x[a], self.y[b]) for b, a in seed_indices]
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` in the default executor of the running event
+    loop (like `asyncio.to_thread`, which requires python 3.9)"""
+    import asyncio
+    import functools
+
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
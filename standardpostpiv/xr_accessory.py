@@ -1,6 +1,6 @@
 import xarray as xr
 
-from .statistics import developing_relative_standard_deviation, developing_mean, developing_std
+from .instrumentation import instrument
 
 
 @xr.register_dataarray_accessor('stdpiv')
@@ -8,12 +8,14 @@ class StdPIVDAAccessor:
     def __init__(self, obj):
         self._obj = obj
 
+    @instrument
     def apply_mask(self, mask, value):
         """Apply a mask to a DataArray"""
         assert self._obj.ndim == mask.ndim
         assert self._obj.dims == mask.dims
         return self._obj.where(~mask & value)
 
+    @instrument
     def mean(self, dim=None, **kwargs):
         """wrapper for xarray.DataArray.mean() that
          generates new standard_name"""
@@ -23,8 +25,10 @@ class StdPIVDAAccessor:
             new_obj.attrs['standard_name'] = f'arithmetic_mean_of_{sn}'
         return new_obj
 
+    @instrument
     def compute_developing_mean(self, dim):
         """Compute the running mean along a dimension"""
+        from .statistics import developing_mean
         dim_axis = 0
         for d in self._obj.dims:
             if dim == d:
@@ -40,8 +44,10 @@ class StdPIVDAAccessor:
                             coords={d: self._obj.coords[d] for d in dims},
                             attrs=attrs)
 
+    @instrument
     def compute_developing_std(self, dim, ddof):
         """Compute the running standard deviation along a dimension"""
+        from .statistics import developing_std
         dim_axis = 0
         for d in self._obj.dims:
             if dim == d:
@@ -57,6 +63,7 @@ class StdPIVDAAccessor:
                             coords={d: self._obj.coords[d] for d in dims},
                             attrs=attrs)
 
+    @instrument
     def compute_developing_relative_standard_deviation(self, dim, ddof=0) -> xr.DataArray:
         """Compute the running relative standard deviation using the running
         mean as normalization. Useful to judge the convergence of PIV
@@ -73,6 +80,7 @@ class StdPIVDAAccessor:
         xr.DataArray
             running relative standard deviation
         """
+        from .statistics import developing_relative_standard_deviation
         dim_axis = 0
         for d in self._obj.dims:
             if dim == d:
@@ -91,6 +99,7 @@ class StdPIVDSAccessor:
     def __init__(self, obj):
         self._obj = obj
 
+    @instrument
     def compute_magnitude(self, data_vars=None):
         """helper function to compute the magnitude of the velocity vector"""
         if vars is not None:
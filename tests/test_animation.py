@@ -0,0 +1,51 @@
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import matplotlib.pyplot as plt
+import numpy as np
+import xarray as xr
+
+from standardpostpiv import animation
+from standardpostpiv.animation import FramePrefetcher, PIVAnimation
+from standardpostpiv.pyramid import FieldPyramid
+
+
+class TestAnimation(unittest.TestCase):
+    """Tests the animation export"""
+
+    def test_prefetcher(self):
+        data = np.arange(7 * 2 * 3).reshape(7, 2, 3)
+        frames = list(FramePrefetcher({'a': data, 'b': -data, 'c': None}, chunk_size=3))
+        self.assertEqual(len(frames), 7)
+        np.testing.assert_array_equal(frames[4]['b'], -data[4])
+
+    def test_save_gif(self):
+        nt, ny, nx = 6, 32, 40
+        coords = {'reltime': np.arange(nt), 'y': np.arange(ny) * 0.5, 'x': np.arange(nx) * 0.5}
+        u = xr.DataArray(np.random.rand(nt, ny, nx), dims=('reltime', 'y', 'x'), coords=coords)
+        v = xr.DataArray(np.random.rand(nt, ny, nx), dims=('reltime', 'y', 'x'), coords=coords)
+        anim = PIVAnimation(np.hypot(u, v), u, v, chunk_size=4)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / 'movie.gif'
+            info = anim.save(filename, fps=10, dpi=50)
+            self.assertTrue(filename.exists())
+        self.assertEqual(info['nframes'], nt)
+        self.assertEqual(anim.title.get_text(), f'frame {nt - 1}')
+        plt.close('all')
+
+    def test_auto_vectors(self):
+        nt, ny, nx = 3, 64, 80
+        coords = {'reltime': np.arange(nt), 'y': np.arange(ny), 'x': np.arange(nx)}
+        u = xr.DataArray(np.random.rand(nt, ny, nx), dims=('reltime', 'y', 'x'), coords=coords)
+        anim = PIVAnimation(u, u, -u, arrow_spacing=64)
+        self.assertGreater(anim._level, 0)
+        # the level is selected once, the frames are reduced without a new pyramid
+        with mock.patch.object(animation, 'FieldPyramid', side_effect=AssertionError):
+            qx, qy, qu, qv = anim._vectors(u[2], -u[2])
+        expected = FieldPyramid(u[2])[anim._level]
+        np.testing.assert_array_equal(qx, expected.x.values)
+        np.testing.assert_array_equal(qu, expected.values)
+        np.testing.assert_array_equal(qv, -expected.values)
+        plt.close('all')
@@ -0,0 +1,115 @@
+import asyncio
+import csv
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import h5py
+import numpy as np
+
+from standardpostpiv import batch, cli
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+from standardpostpiv.synthetic import create_piv_file
+
+
+class TestBatch(unittest.TestCase):
+    """Tests the batch generation of reports"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+        self.piv_filename = create_piv_file(self.tmpdir / 'run1.hdf', nt=7, ny=10, nx=12, seed=2)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_mean_vdp(self):
+        with h5py.File(self.piv_filename, 'r') as h5:
+            flags = h5['piv_flags'][()]
+        active = np.sum(flags & 1, axis=(1, 2))
+        edited = sum(np.sum((flags & b).astype(bool), axis=(1, 2)) for b in (4, 16, 32, 64, 128))
+        expected = np.mean((active - edited) / active)
+        self.assertAlmostEqual(batch.mean_vdp(self.piv_filename, chunk_size=3), expected)
+        self.assertIsNone(batch.mean_vdp(self.piv_filename, flag_name='missing'))
+
+    def test_expand_filenames(self):
+        (self.tmpdir / 'sub').mkdir()
+        create_piv_file(self.tmpdir / 'sub' / 'run2.hdf', nt=2, ny=4, nx=4)
+        filenames = batch.expand_filenames([self.tmpdir / '**' / '*.hdf', self.piv_filename])
+        self.assertEqual([f.name for f in filenames], ['run1.hdf', 'run2.hdf'])
+
+    def test_skip_failure_and_timeout(self):
+        broken = self.tmpdir / 'broken.hdf'
+        broken.write_text('no hdf file')
+        up_to_date = create_piv_file(self.tmpdir / 'done.hdf', nt=2, ny=4, nx=4)
+        targets = batch.report_filenames(up_to_date, self.tmpdir / 'reports')
+        targets['ipynb'].parent.mkdir()
+        for target in targets.values():
+            target.write_text('')
+            os.utime(target, (time.time() + 10, time.time() + 10))
+        self.assertTrue(batch.is_up_to_date(up_to_date, self.tmpdir / 'reports'))
+        self.assertFalse(batch.is_up_to_date(self.piv_filename, self.tmpdir / 'reports'))
+
+        results = batch.run_reports([broken, up_to_date], jobs=2, output_dir=self.tmpdir / 'reports')
+        self.assertEqual([r.status for r in results], ['failed', 'skipped'])
+        self.assertIsNotNone(results[0].error)
+        self.assertIsNotNone(results[1].vdp)
+
+        # the worker cannot build the report within the timeout:
+        results = batch.run_reports([self.piv_filename], timeout=0.01, output_dir=self.tmpdir / 'reports')
+        self.assertEqual(results[0].status, 'timeout')
+
+        summary = batch.write_summary(results, self.tmpdir)
+        with open(summary['csv']) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]['status'], 'timeout')
+        self.assertIn('run1.hdf', summary['html'].read_text())
+
+    def test_run_reports_async(self):
+        broken = self.tmpdir / 'broken.hdf'
+        broken.write_text('no hdf file')
+        results = asyncio.run(batch.run_reports_async([broken], output_dir=self.tmpdir / 'reports',
+                                                      executor='inprocess'))
+        self.assertEqual(results[0].status, 'failed')
+        results = asyncio.run(batch.run_reports_async([self.piv_filename], timeout=0.001,
+                                                      output_dir=self.tmpdir / 'reports'))
+        self.assertEqual(results[0].status, 'timeout')
+
+    def test_create_async(self):
+        async def run(n):
+            reports = []
+            for i in range(n):
+                report = PIVReportNotebook(self.piv_filename)
+                section = Section('Wait', label='wait')
+                section.add_cell('import time\nt0 = time.time()\ntime.sleep(1)\nprint(t0, time.time())', 'code')
+                report.add_section(section, level=2)
+                reports.append(report)
+            semaphore = asyncio.Semaphore(n)
+
+            async def create(i, report):
+                async with semaphore:
+                    return await report.create_async(self.tmpdir / f'report{i}.ipynb', execute_notebook=True,
+                                                     inplace=True, to_html=True, html_renderer='static')
+            return reports, await asyncio.gather(*[create(i, r) for i, r in enumerate(reports)])
+
+        reports, filenames = asyncio.run(run(2))
+        self.assertTrue(all(f['html'].exists() and f['profile'].exists() for f in filenames))
+        intervals = [[float(v) for v in report.notebook.cells[-2].outputs[0].text.split()] for report in reports]
+        # the kernels executed the cells at the same time:
+        self.assertLess(max(t0 for t0, _ in intervals), min(t1 for _, t1 in intervals))
+
+    def test_cli(self):
+        with self.assertRaises(SystemExit):
+            cli.main(['report'])
+        self.assertEqual(cli.main(['report', str(self.tmpdir / 'missing*.hdf')]), 1)
+
+    def test_cli_precompute(self):
+        with mock.patch('standardpostpiv.batch.run_reports', return_value=[]) as run_reports:
+            self.assertEqual(cli.main(['report', str(self.piv_filename), '--precompute',
+                                       '--summary-dir', str(self.tmpdir)]), 0)
+        self.assertTrue(run_reports.call_args.kwargs['precompute'])
+        self.assertFalse(cli.get_parser().parse_args(['report', 'x.hdf']).precompute)
@@ -0,0 +1,89 @@
+import json
+import pathlib
+import sys
+import tempfile
+import unittest
+
+import nbformat
+
+from standardpostpiv.cellprofile import CellTimer, add_performance_section, profile_summary
+from standardpostpiv.executors import InProcessExecutor
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+
+
+class TestCellProfile(unittest.TestCase):
+    """Tests the runtime and memory profile of report cells"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_timer(self):
+        timer = CellTimer().start()
+        data = bytearray(64 * 1024 ** 2)
+        data[::4096] = b'x' * len(data[::4096])
+        profile = timer.stop()
+        self.assertGreater(profile['wall_time'], 0)
+        if sys.platform == 'linux':
+            self.assertGreater(profile['peak_memory_delta'], 32 * 1024 ** 2)
+        del data
+        # unknown process (e.g. remote kernel): only the time is measured
+        profile = CellTimer(None).start().stop()
+        self.assertIsNone(profile['peak_memory_delta'])
+        self.assertIsNone(profile['rss_delta'])
+
+    def test_summary(self):
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_code_cell('import time\ntime.sleep(0.05)', metadata={'section': 'slow'}),
+                    nbformat.v4.new_code_cell('x = 1 | 2', metadata={'section': 'fast'}),
+                    nbformat.v4.new_code_cell('y = 2', metadata={'section': 'fast'})]
+        InProcessExecutor().preprocess(nb)
+        self.assertGreaterEqual(nb.cells[0].metadata['profile']['wall_time'], 0.05)
+        del nb.cells[2].metadata['profile']
+
+        summary = profile_summary(nb)
+        self.assertEqual(summary['totals']['n_cells'], 3)
+        self.assertEqual(summary['totals']['n_profiled'], 2)
+        self.assertEqual(summary['sections']['fast']['n_cells'], 1)
+        self.assertEqual(summary['cells'][0]['source'], 'import time')
+        self.assertFalse(summary['cells'][2]['profiled'])
+
+        add_performance_section(nb, summary)
+        add_performance_section(nb, summary)
+        self.assertEqual(len(nb.cells), 4)
+        text = nb.cells[-1].source
+        self.assertTrue(text.startswith('## Report performance <a id="piv-performance"></a>'))
+        self.assertIn('1 cells were not executed', text)
+        self.assertIn('`x = 1 \\| 2`', text)
+        # the slowest cell is listed first
+        self.assertLess(text.index('`import time`'), text.index('`x = 1'))
+
+    def test_report(self):
+        report = PIVReportNotebook(self.tmpdir / 'piv.hdf')
+        section = Section('Compute', label='compute')
+        section.add_cell('import numpy as np\nx = np.ones(10 ** 6).sum()', 'code')
+        report.add_section(section, level=2)
+        filenames = report.create(self.tmpdir / 'report.ipynb', execute_notebook=True, inplace=True,
+                                  executor='inprocess')
+        self.assertEqual(filenames['profile'], self.tmpdir / 'report_profile.json')
+        nb = nbformat.read(filenames['ipynb'], as_version=4)
+        self.assertTrue(all('profile' in c.metadata for c in nb.cells if c.cell_type == 'code'))
+        self.assertEqual(nb.cells[-1].metadata['section'], 'performance')
+
+        data = json.loads(filenames['profile'].read_text())
+        self.assertTrue({'imports', 'compute'}.issubset(data['sections']))
+        self.assertEqual(data['totals']['n_profiled'], len([c for c in nb.cells if c.cell_type == 'code']))
+        self.assertEqual(data['hdf_filename'], str(self.tmpdir / 'piv.hdf'))
+
+        report = PIVReportNotebook(self.tmpdir / 'piv.hdf')
+        section = Section('Print', label='print')
+        section.add_cell('print(1)', 'code')
+        report.add_section(section, level=2)
+        filenames = report.create(self.tmpdir / 'report2.ipynb', execute_notebook=True, inplace=True,
+                                  executor='inprocess', profile=False)
+        self.assertIsNone(filenames['profile'])
+        self.assertFalse((self.tmpdir / 'report2_profile.json').exists())
@@ -0,0 +1,140 @@
+import pathlib
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import nbformat
+from nbclient.exceptions import CellExecutionError
+
+from standardpostpiv.executors import InProcessExecutor
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+
+
+def _notebook(*sources):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell(source) for source in sources]
+    return nb
+
+
+class TestInProcessExecutor(unittest.TestCase):
+    """Tests the in-process execution of notebooks"""
+
+    def test_outputs(self):
+        nb = _notebook('x = 2\nprint("x is", x)',
+                       'from IPython.display import display, Markdown\ndisplay(Markdown("**bold**"))\nx + 1',
+                       'import matplotlib.pyplot as plt\nplt.plot([1, 2, 3])\nplt.title("line")',
+                       '1 / 0',
+                       'x')
+        InProcessExecutor().preprocess(nb)
+        c0, c1, c2, c3, c4 = nb.cells
+        self.assertEqual(c0.outputs[0].text, 'x is 2\n')
+        self.assertEqual(c1.outputs[0].data['text/markdown'], '**bold**')
+        self.assertEqual(c1.outputs[1].output_type, 'execute_result')
+        self.assertEqual(c1.outputs[1].data['text/plain'], '3')
+        self.assertEqual([o.output_type for o in c2.outputs], ['execute_result', 'display_data'])
+        self.assertIn('image/png', c2.outputs[1].data)
+        self.assertEqual(c3.outputs[-1].output_type, 'error')
+        self.assertEqual(c3.outputs[-1].ename, 'ZeroDivisionError')
+        # execution continues after an error:
+        self.assertEqual(c4.outputs[0].data['text/plain'], '2')
+        self.assertEqual([c.execution_count for c in nb.cells], [1, 2, 3, 4, 5])
+        nbformat.validate(nb)
+
+    def test_disallow_errors(self):
+        with self.assertRaises(CellExecutionError):
+            InProcessExecutor(allow_errors=False).preprocess(_notebook('raise ValueError("bad")'))
+
+    def test_namespace(self):
+        executor = InProcessExecutor()
+        executor.preprocess(_notebook('y = 5'))
+        nb = _notebook('y')
+        executor.preprocess(nb)
+        self.assertEqual(nb.cells[0].outputs[0].ename, 'NameError')
+
+        executor = InProcessExecutor(reset_namespace=False)
+        executor.preprocess(_notebook('y = 5'))
+        nb = _notebook('y')
+        executor.preprocess(nb)
+        self.assertEqual(nb.cells[0].outputs[0].data['text/plain'], '5')
+
+    def test_execute_silent(self):
+        import matplotlib.pyplot as plt
+
+        executor = InProcessExecutor()
+        executor.reset()
+        executor.execute_silent('import matplotlib.pyplot as plt\nprint("hidden")\nplt.figure()\ny = 5')
+        self.assertEqual(executor.namespace['y'], 5)
+        self.assertEqual(plt.get_fignums(), [])
+        with self.assertRaises(NameError):
+            executor.execute_silent('undefined_name')
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            report = PIVReportNotebook(tmpdir / 'piv.hdf')
+            section = Section('Test', label='test')
+            section.add_cell('import numpy as np', 'code')
+            section.add_cell('print(pathlib_name(hdf_filename))', 'code')
+            report.add_section(section, level=2)
+            report.sections[0].add_cell('from pathlib import Path as pathlib_name', 'code')
+            filenames = report.create(notebook_filename=tmpdir / 'report.ipynb', execute_notebook=True,
+                                      inplace=True, to_html=True, executor='inprocess')
+            self.assertTrue(filenames['html'].exists())
+            nb = nbformat.read(filenames['ipynb'], as_version=4)
+            outputs = [o for c in nb.cells if c.cell_type == 'code' for o in c.outputs]
+            self.assertEqual(outputs[-1].text.strip(), str(tmpdir / 'piv.hdf'))
+
+
+class TestKernelPool(unittest.TestCase):
+    """Tests the execution of notebooks on warm kernels"""
+
+    def test_reuse_and_recycle(self):
+        from standardpostpiv.executors import KernelPool
+
+        with KernelPool(n=1, max_uses=2, preload='import math') as pool:
+            self.assertEqual(pool.n_started, 1)
+            nb = pool.execute(_notebook('import sys\nprint("math" in sys.modules, "x" in dir())\nx = 1'))
+            self.assertEqual(nb.cells[0].outputs[0].text, 'True False\n')
+            # the namespace is reset between notebooks:
+            nb = pool.execute(_notebook('print("x" in dir())', '1 / 0', 'print("after")'))
+            self.assertEqual(nb.cells[0].outputs[0].text, 'False\n')
+            self.assertEqual(nb.cells[1].outputs[0].ename, 'ZeroDivisionError')
+            self.assertEqual(nb.cells[2].outputs[0].text, 'after\n')
+            # replaced after max_uses
+            self.assertEqual(pool.n_started, 2)
+            nb, _ = pool.preprocess(_notebook('print(2)'))
+            self.assertEqual(nb.cells[0].outputs[0].text, '2\n')
+        self.assertEqual(pool._kernels, [])
+
+    def test_default_preload(self):
+        from standardpostpiv.executors import DEFAULT_PRELOAD
+        from standardpostpiv.notebook_utils.pivreport_sections import imports
+
+        self.assertIn('import h5rdmtoolbox as h5tbx', DEFAULT_PRELOAD)
+        self.assertTrue(all(line in imports.codecells_info for line in DEFAULT_PRELOAD.splitlines()))
+
+    def test_start_failure(self):
+        from standardpostpiv.executors import KernelPool, PooledKernel
+
+        def fake_kernel():
+            return PooledKernel(SimpleNamespace(is_alive=lambda: True, shutdown_kernel=lambda now: None,
+                                                provisioner=None))
+
+        pool = KernelPool(n=1, max_uses=1)
+        with mock.patch.object(pool, '_start_kernel', side_effect=RuntimeError('no kernel')):
+            with self.assertRaises(RuntimeError):
+                pool.start()
+            # the slot is kept and the start is retried
+            with self.assertRaises(RuntimeError):
+                pool.acquire(timeout=1)
+            self.assertEqual(pool._idle.qsize(), 1)
+        with mock.patch.object(pool, '_start_kernel', side_effect=fake_kernel):
+            kernel = pool.acquire(timeout=1)
+        # replacing the kernel after max_uses fails
+        with mock.patch.object(pool, '_start_kernel', side_effect=RuntimeError('no kernel')):
+            pool.release(kernel)
+        self.assertEqual(pool._idle.qsize(), 1)
+        with mock.patch.object(pool, '_start_kernel', side_effect=fake_kernel):
+            self.assertIsNot(pool.acquire(timeout=1), kernel)
@@ -0,0 +1,100 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from standardpostpiv.export import FigureSpec, export_figures
+from standardpostpiv.figcache import FigureCache, hash_content
+
+
+def _line_figure(n):
+    from standardpostpiv import plotting
+    fig, ax = plotting.subplots(1, 1)
+    ax.plot(np.arange(n), np.random.rand(n))
+    return fig
+
+
+def _failing_figure():
+    raise RuntimeError('no data')
+
+
+class TestExport(unittest.TestCase):
+    """Tests the batch figure export"""
+
+    def test_export_figures(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            specs = [FigureSpec(_line_figure, tmpdir / f'fig{i}.svg', {'n': 10 * (i + 1)}) for i in range(3)]
+            specs.append((_failing_figure, tmpdir / 'failing.svg'))
+            results = export_figures(specs, processes=2)
+            self.assertEqual([r.status for r in results], ['ok', 'ok', 'ok', 'failed'])
+            for r in results[:3]:
+                self.assertTrue(r.filename.exists())
+                self.assertGreater(r.total_time, 0)
+            self.assertIn('no data', results[3].error)
+
+    def test_figure_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            cache = FigureCache(tmpdir / 'cache')
+            specs = [FigureSpec(_line_figure, tmpdir / f'fig{i}.svg', {'n': 10 * (i + 1)}) for i in range(2)]
+            self.assertEqual([r.status for r in export_figures(specs, processes=1, cache=cache)], ['ok', 'ok'])
+            self.assertEqual(len(cache.entries()), 2)
+
+            specs.append(FigureSpec(_line_figure, tmpdir / 'fig2.svg', {'n': 5}))
+            (tmpdir / 'fig0.svg').unlink()
+            results = export_figures(specs, processes=1, cache=cache)
+            self.assertEqual([r.status for r in results], ['cached', 'cached', 'ok'])
+            self.assertTrue((tmpdir / 'fig0.svg').exists())
+
+            cache.max_size = cache.size - 1
+            cache.evict()
+            self.assertEqual(len(cache.entries()), 2)
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+
+    def test_cache_only_written_artefacts(self):
+        from standardpostpiv.plotting import savefig2svg
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            cache = FigureCache(tmpdir / 'cache')
+            # a pdf of an earlier, different run is not cached with the svg
+            (tmpdir / 'fig.pdf').write_text('stale')
+            specs = [FigureSpec(_line_figure, tmpdir / 'fig.svg', {'n': 10})]
+            export_figures(specs, processes=1, cache=cache)
+            self.assertEqual([e['suffixes'] for e in cache.entries()], [['.svg']])
+            with self.assertRaises(FileNotFoundError):
+                cache.put('key', tmpdir / 'fig.svg', ['.svg', '.pdf_tex'])
+
+            # with a key of the figure content, a cached svg is restored without drawing
+            filename = savefig2svg(_line_figure(10), tmpdir / 'line.svg', cache=cache, key='line-10')
+            svg = filename.read_bytes()
+            filename.unlink()
+            savefig2svg(_line_figure(20), filename, cache=cache, key='line-10')
+            self.assertEqual(filename.read_bytes(), svg)
+            savefig2svg(_line_figure(20), filename, cache=cache, key='line-20')
+            self.assertNotEqual(filename.read_bytes(), svg)
+
+    def test_hash_content(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / 'data.hdf'
+            with h5py.File(filename, 'w') as h5:
+                h5.create_dataset('u', data=np.zeros(4))
+            with h5py.File(filename, 'r') as h5:
+                key = hash_content(h5['u'])
+                self.assertEqual(key, hash_content(h5['u']))
+            with h5py.File(filename, 'r+') as h5:
+                h5['u'][0] = 1
+            # the data changed: the file is modified (independent of the mtime resolution)
+            mtime = filename.stat().st_mtime
+            os.utime(filename, (mtime + 2, mtime + 2))
+            with h5py.File(filename, 'r') as h5:
+                self.assertNotEqual(key, hash_content(h5['u']))
+        self.assertEqual(hash_content(1, 'a', None, np.float32(2)), hash_content(1, 'a', None, np.float32(2)))
+        self.assertNotEqual(hash_content(1), hash_content('1'))
+        with self.assertRaises(TypeError):
+            hash_content(object())
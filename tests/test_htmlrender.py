@@ -0,0 +1,84 @@
+import base64
+import io
+import pathlib
+import tempfile
+import time
+import unittest
+
+import matplotlib.pyplot as plt
+import nbformat
+
+from standardpostpiv.htmlrender import render_html, toc_data
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+
+
+def _png() -> str:
+    fig, ax = plt.subplots(figsize=(2, 1), dpi=50)
+    ax.plot([0, 1])
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    plt.close(fig)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class TestHTMLRender(unittest.TestCase):
+    """Tests the static html renderer"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_render(self):
+        png = _png()
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_markdown_cell('# Report <a id="piv-report"></a>\n'
+                                                  '<div class="dropdown-toc">old toc</div>'),
+                    nbformat.v4.new_markdown_cell('## 1.1 Stats <a id="piv-stats"></a>\n'
+                                                  'mean $\\mu_d$ and $\\sigma_d$ of <b>x</b>'),
+                    nbformat.v4.new_code_cell('plot()', outputs=[
+                        nbformat.v4.new_output('display_data', data={'image/png': png, 'text/plain': 'fig'}),
+                        nbformat.v4.new_output('display_data', data={'image/png': png, 'text/plain': 'fig'}),
+                        nbformat.v4.new_output('stream', name='stdout', text='a < b\n'),
+                        nbformat.v4.new_output('error', ename='ValueError', evalue='bad',
+                                               traceback=['\x1b[0;31mValueError\x1b[0m: bad'])])]
+        self.assertEqual(toc_data(nb), [(1, 'Report', 'report'), (2, 'Stats', 'stats')])
+
+        t0 = time.perf_counter()
+        out = render_html(nb, self.tmpdir / 'report.html')
+        self.assertLess(time.perf_counter() - t0, 1)
+        page = out['html'].read_text()
+        # identical figures are written once
+        self.assertEqual(len(out['assets']), 1)
+        self.assertEqual(out['assets'][0].parent.name, 'report_files')
+        self.assertEqual(page.count(f'src="report_files/{out["assets"][0].name}" loading="lazy"'), 2)
+        self.assertIn('width="100" height="50"', page)
+        self.assertNotIn('old toc', page)
+        self.assertIn('<a href="#piv-stats">1. Stats</a>', page)
+        self.assertIn('$\\mu_d$ and $\\sigma_d$', page)
+        self.assertIn('a &lt; b', page)
+        self.assertIn('ValueError: bad', page)
+        self.assertNotIn(png[:50], page)
+
+        out = render_html(nb, self.tmpdir / 'report.html', image_format='webp', toc=False, show_code=False)
+        self.assertEqual(out['assets'][0].suffix, '.webp')
+        page = out['html'].read_text()
+        self.assertIn('old toc', page)
+        self.assertNotIn('plot()', page)
+        with self.assertRaises(ValueError):
+            render_html(nb, self.tmpdir / 'report.html', image_format='bmp')
+
+    def test_report(self):
+        report = PIVReportNotebook(self.tmpdir / 'piv.hdf')
+        section = Section('Plot', label='plot')
+        section.add_cell('import matplotlib.pyplot as plt\nplt.plot([1, 2])\nplt.show()', 'code')
+        report.add_section(section, level=2)
+        filenames = report.create(self.tmpdir / 'report.ipynb', execute_notebook=True, inplace=True,
+                                  to_html=True, executor='inprocess', html_renderer='static')
+        page = filenames['html'].read_text()
+        self.assertIn('loading="lazy"', page)
+        self.assertIn('<a href="#piv-plot">2. Plot</a>', page)
+        self.assertTrue(any((self.tmpdir / 'report_files').glob('*.png')))
@@ -0,0 +1,39 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# not imported by `import standardpostpiv`, only on first use of a submodule
+HEAVY_MODULES = ('matplotlib', 'xarray', 'h5py', 'scipy.stats', 'nbconvert', 'nbformat', 'IPython',
+                 'h5rdmtoolbox')
+
+SCRIPT = """import json, sys
+import standardpostpiv
+print(json.dumps([m for m in %r if m in sys.modules]))
+""" % (HEAVY_MODULES,)
+
+
+def _run(script: str):
+    cp = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+    return json.loads(cp.stdout.strip().splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    """Regression test of the modules imported with the package (the import
+    time is measured in benchmarks/test_bench_import.py)"""
+
+    def test_no_heavy_imports(self):
+        self.assertEqual(_run(SCRIPT), [])
+
+    def test_accessor(self):
+        # the accessor is registered as soon as xarray is imported, before or after the package
+        for script in ('import standardpostpiv, xarray', 'import xarray, standardpostpiv',
+                       'import standardpostpiv, standardpostpiv.statistics, xarray'):
+            self.assertTrue(_run(script + '\nimport json\nprint(json.dumps(hasattr(xarray.DataArray([1.]), "stdpiv")))'))
+
+    def test_lazy_attributes(self):
+        import standardpostpiv
+        self.assertTrue(callable(standardpostpiv.get_basic_2D2C_report))
+        self.assertIn('plotting', dir(standardpostpiv))
+        with self.assertRaises(AttributeError):
+            standardpostpiv.does_not_exist
@@ -0,0 +1,92 @@
+import json
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from standardpostpiv import instrumentation
+from standardpostpiv.core import InstrumentedDataset
+from standardpostpiv.instrumentation import instrument, span
+from standardpostpiv.statistics import developing_mean, stream_histogram
+
+
+@instrument
+def _add(a, b):
+    return a + b
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests the recording and export of spans"""
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset_spans()
+
+    def test_disabled(self):
+        instrumentation.disable()
+        self.assertEqual(_add(1, 2), 3)
+        with span('nothing'):
+            pass
+        self.assertEqual(instrumentation.get_spans(), [])
+
+    def test_spans(self):
+        instrumentation.enable()
+        with span('outer', 'test', n=3):
+            for i in range(3):
+                _add(i, 1)
+            developing_mean(np.random.rand(10, 4), axis=0)
+            data = xr.DataArray(np.random.rand(25, 4, 5), dims=('reltime', 'y', 'x'))
+            stream_histogram(data, 0.1, chunk_size=10)
+        spans = instrumentation.get_spans()
+        names = [s['name'] for s in spans]
+        self.assertEqual(names.count('test_instrumentation._add'), 3)
+        self.assertIn('statistics.developing_mean', names)
+        self.assertIn('statistics.stream_histogram', names)
+        self.assertEqual(names.count('utils.read_chunk'), 3)
+        outer = spans[names.index('outer')]
+        self.assertEqual(outer['args'], {'n': 3})
+        self.assertGreater(outer['duration'], 0)
+
+        table = instrumentation.summary()
+        self.assertEqual(table.loc['test_instrumentation._add', 'count'], 3)
+        self.assertEqual(table.index[0], 'outer')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = pathlib.Path(tmpdir) / 'trace.json'
+            instrumentation.to_chrome_trace(filename)
+            with open(filename) as f:
+                trace = json.load(f)
+        self.assertEqual(len(trace['traceEvents']), len(spans))
+        self.assertTrue(all(e['ph'] == 'X' for e in trace['traceEvents']))
+
+    def test_peak_rss(self):
+        if not instrumentation.reset_peak_rss():
+            self.skipTest('resetting the peak RSS is not supported')
+        instrumentation.enable()
+        nbytes = 200 * 1024 ** 2
+        with span('outer'):
+            with span('alloc'):
+                data = np.ones(nbytes, dtype=np.uint8)
+                del data
+            with span('no_alloc'):
+                pass
+        spans = {s['name']: s for s in instrumentation.get_spans()}
+        self.assertGreater(spans['alloc']['peak_rss_increase'], 0.9 * nbytes)
+        self.assertLess(spans['no_alloc']['peak_rss_increase'], 0.5 * nbytes)
+        # the peak of the nested span is passed on to the enclosing span
+        self.assertGreaterEqual(spans['outer']['peak_rss'], spans['alloc']['peak_rss'])
+        self.assertIsNone(spans['outer']['process_max_rss'])
+        self.assertIn('peak_rss_increase', instrumentation.summary().columns)
+
+    def test_instrumented_dataset(self):
+        ds = InstrumentedDataset(np.arange(12).reshape(3, 4), 'x_displacement')
+        self.assertEqual(ds.shape, (3, 4))
+        self.assertEqual(len(ds), 3)
+        instrumentation.enable()
+        np.testing.assert_array_equal(ds[1:], np.arange(4, 12).reshape(2, 4))
+        spans = instrumentation.get_spans()
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], 'core.read')
+        self.assertEqual(spans[0]['args']['dataset'], 'x_displacement')
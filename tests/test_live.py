@@ -0,0 +1,92 @@
+import pathlib
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from standardpostpiv.live import LiveReport, LiveSummary, watch
+from standardpostpiv.precompute import PIVSummary, precompute
+from standardpostpiv.synthetic import append_piv_frames, create_piv_file
+
+
+class TestLive(unittest.TestCase):
+    """Tests the incremental summary of a PIV file which is being written"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+        self.piv_filename = create_piv_file(self.tmpdir / 'piv.hdf', nt=1, ny=20, nx=24, seed=1, resizable=True)
+        self.writer = h5py.File(self.piv_filename, 'r+', libver='latest')
+        self.writer.swmr_mode = True
+
+    def tearDown(self):
+        self.writer.close()
+        self._tmpdir.cleanup()
+
+    def test_update(self):
+        with LiveSummary(self.piv_filename, self.tmpdir / 'live.hdf', chunk_size=4) as live:
+            self.assertEqual(live.update(), 1)
+            self.assertEqual(live.update(), 0)
+            for seed in range(4):
+                append_piv_frames(self.writer, 6, seed=seed)
+                # only the new frames are read
+                self.assertEqual(live.update(), 6)
+            self.assertEqual(live.n_frames, 25)
+            summary = live.summary()
+        self.assertEqual(summary.attrs['n_frames'], 25)
+        np.testing.assert_allclose(summary.coords['reltime'].values, np.arange(25) * 0.1)
+
+        reference = PIVSummary(precompute(self.piv_filename, self.tmpdir / 'reference.hdf',
+                                          monitor_points=summary.monitor_points))
+        with np.errstate(invalid='ignore'):
+            for statistic in ('count', 'mean', 'std', 'min', 'max'):
+                np.testing.assert_allclose(summary.field('x_displacement', statistic),
+                                           reference.field('x_displacement', statistic))
+        np.testing.assert_array_equal(summary.vdp(), reference.vdp())
+        np.testing.assert_array_equal(summary.histogram('y_displacement').counts,
+                                      reference.histogram('y_displacement').counts)
+        np.testing.assert_array_equal(summary.peak_locking('x_displacement').n_inner,
+                                      reference.peak_locking('x_displacement').n_inner)
+        np.testing.assert_array_equal(summary.monitor_series(), reference.monitor_series())
+        np.testing.assert_array_equal(summary.snapshot('x_displacement', 2), reference.snapshot('x_displacement', 2))
+
+        # geometric checkpoints plus the current state, which is replaced by the next update
+        convergence = summary.convergence()
+        np.testing.assert_array_equal(convergence.n_frames, [2, 3, 4, 7, 10, 15, 23, 25])
+        with np.errstate(invalid='ignore'):
+            np.testing.assert_allclose(convergence['mean'][-1], reference.field('magnitude_of_displacement'))
+        append_piv_frames(self.writer, 10, seed=10)
+        with LiveSummary(self.piv_filename, self.tmpdir / 'live2.hdf') as live:
+            live.update()
+            self.assertEqual(live.summary().convergence().n_frames[-1], 35)
+
+    def test_incomplete_frames(self):
+        # frames are only counted once the time dimension is extended
+        for name in ('dx', 'dy', 'piv_flags'):
+            self.writer[name].resize(3, axis=0)
+        self.writer.flush()
+        with LiveSummary(self.piv_filename, self.tmpdir / 'live.hdf') as live:
+            self.assertEqual(live.available_frames(), 1)
+        with self.assertRaises(ValueError):
+            LiveSummary(self.piv_filename, snapshots=(-1,))
+
+    def test_watch(self):
+        report = LiveReport(self.tmpdir / 'live.html', reload=2)
+        updates = []
+
+        def _callback(live, n_new):
+            updates.append(n_new)
+            if len(updates) < 3:
+                append_piv_frames(self.writer, 5, seed=len(updates))
+            report(live, n_new)
+
+        live = watch(self.piv_filename, self.tmpdir / 'live.hdf', interval=0.01, idle_timeout=0.1,
+                     callback=_callback)
+        self.assertEqual(updates, [1, 5, 5])
+        self.assertEqual(live.n_frames, 11)
+        self.assertIsNone(live.h5)
+        page = (self.tmpdir / 'live.html').read_text()
+        self.assertIn('<meta http-equiv="refresh" content="2">', page)
+        self.assertIn('badge/frames-11-blue', page)
+        self.assertIn('data:image/png;base64,', page)
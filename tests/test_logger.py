@@ -0,0 +1,50 @@
+import logging
+import pathlib
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from standardpostpiv.logger import logger, configure_logging, get_log_queue, shutdown_logging, \
+    worker_logging
+
+
+def _log_from_worker(i):
+    logger.warning(f'message from worker {i}')
+    return i
+
+
+class TestLogger(unittest.TestCase):
+    """Tests the configuration of the package logger"""
+
+    def tearDown(self):
+        shutdown_logging()
+
+    def test_no_file_handler_on_import(self):
+        self.assertFalse(any(isinstance(h, logging.FileHandler) for h in logger.handlers))
+
+    def test_rotating_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logfile = pathlib.Path(tmpdir) / 'test.log'
+            configure_logging(logfile=logfile, max_bytes=500, backup_count=2)
+            for i in range(50):
+                logger.info(f'message {i}')
+            shutdown_logging()
+            self.assertTrue(logfile.exists())
+            self.assertTrue(logfile.with_suffix('.log.1').exists())
+            self.assertFalse(logfile.with_suffix('.log.3').exists())
+            self.assertIn('message 49', logfile.read_text())
+
+    def test_queue_mode_with_workers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            logfile = pathlib.Path(tmpdir) / 'test.log'
+            configure_logging(logfile=logfile, use_queue=True)
+            self.assertIsNotNone(get_log_queue())
+            logger.info('message from parent')
+            with ProcessPoolExecutor(2, initializer=worker_logging, initargs=(get_log_queue(),)) as executor:
+                list(executor.map(_log_from_worker, range(3)))
+            shutdown_logging()
+            self.assertIsNone(get_log_queue())
+            text = logfile.read_text()
+            self.assertIn('message from parent', text)
+            for i in range(3):
+                self.assertIn(f'message from worker {i}', text)
@@ -0,0 +1,61 @@
+import tracemalloc
+import types
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from standardpostpiv import memprofile
+from standardpostpiv.memprofile import MemoryBudgetExceeded, check_memory_budget, get_report_stages, \
+    profile_stages
+from standardpostpiv.reports import get_basic_2D2C_report
+
+
+class TestMemProfile(unittest.TestCase):
+    """Tests the peak-memory profiling of stages"""
+
+    def test_profile_stages(self):
+        stages = {'imports': ['import numpy as np'],
+                  'alloc': ['a = np.ones(8 * 1024 ** 2)', 'b = a.sum()'],
+                  'release': ['del a'],
+                  'error': ['undefined_name']}
+        results = profile_stages(stages, top=3)
+        self.assertEqual([r.name for r in results], list(stages))
+        alloc = results[1]
+        self.assertIsNone(alloc.error)
+        self.assertGreaterEqual(alloc.tracemalloc_peak, 64 * 1024 ** 2)
+        self.assertGreaterEqual(alloc.tracemalloc_peak_increase, 64 * 1024 ** 2)
+        self.assertLess(results[2].tracemalloc_peak_increase, 1024 ** 2)
+        self.assertEqual(len(alloc.top_allocations), 3)
+        if alloc.peak_rss_is_reset:
+            self.assertGreaterEqual(alloc.peak_rss_increase, 32 * 1024 ** 2)
+        self.assertIn('NameError', results[3].error)
+
+    def test_profile_stages_without_reset_peak(self):
+        # python 3.8: tracemalloc has no reset_peak
+        functions = ('start', 'stop', 'is_tracing', 'take_snapshot', 'get_traced_memory')
+        py38_tracemalloc = types.SimpleNamespace(**{f: getattr(tracemalloc, f) for f in functions})
+        stages = {'alloc': ['import numpy as np\na = np.ones(8 * 1024 ** 2)'], 'release': ['del a']}
+        with mock.patch.object(memprofile, 'tracemalloc', py38_tracemalloc):
+            results = profile_stages(stages)
+        self.assertGreaterEqual(results[0].tracemalloc_peak_increase, 64 * 1024 ** 2)
+        self.assertLess(results[1].tracemalloc_peak_increase, 1024 ** 2)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_report_stages(self):
+        report = get_basic_2D2C_report('piv.hdf')
+        ncells = [len(s.cells) for s in report.sections]
+        stages = get_report_stages(report)
+        self.assertEqual(list(stages)[:3], ['imports', 'piv-report', 'stats'])
+        self.assertIn('import', stages['imports'][0])
+        self.assertFalse(any('import' in code for code in stages['pdfs']))
+        self.assertEqual(ncells, [len(s.cells) for s in report.sections])
+
+    def test_check_memory_budget(self):
+        table = pd.DataFrame({'nt': [10, 10], 'ny': [8, 8], 'nx': [8, 8], 'stage': ['imports', 'pdfs'],
+                              'peak_rss_increase': [100e6, 5e6], 'ratio': [100., 5.]})
+        check_memory_budget(table, max_ratio=10)
+        with self.assertRaises(MemoryBudgetExceeded):
+            check_memory_budget(table, max_ratio=4)
+        with self.assertRaises(MemoryBudgetExceeded):
+            check_memory_budget(table, stage_ratios={'imports': 50})
@@ -2,8 +2,10 @@ import unittest
 
 import matplotlib.pyplot as plt
 import numpy as np
+import xarray as xr
 
 from standardpostpiv import plotting
+from standardpostpiv.statistics import Histogram
 
 
 class TestPlotting(unittest.TestCase):
@@ -16,3 +18,32 @@ class TestPlotting(unittest.TestCase):
         fig, axs = plotting.subplots(1, 3)
         ax = plotting.piv_scatter(u, v, ax=axs[0])
         plt.show()
+
+    def test_piv_scatter_density(self):
+        shape = (20, 8, 10)
+        u = xr.DataArray(np.random.normal(2, 1, shape), dims=('reltime', 'y', 'x'),
+                         attrs={'standard_name': 'x_displacement', 'units': 'pixel'})
+        v = xr.DataArray(np.random.normal(-1, 1, shape), dims=('reltime', 'y', 'x'),
+                         attrs={'standard_name': 'y_displacement', 'units': 'pixel'})
+        flags = xr.DataArray(np.ones(shape, dtype=int), dims=('reltime', 'y', 'x'))
+        flags[:, 0, :] = 33
+        flags[:, 1, :] = 65
+        ax, hists, (umean, vmean) = plotting.piv_density(u, v, flags=flags, bins=32, chunk_size=3)
+        self.assertEqual(hists['active'].n, 20 * 6 * 10)
+        self.assertEqual(hists['active+interpolated'].n, 20 * 10)
+        self.assertEqual(hists['active+replaced'].n, 20 * 10)
+        self.assertAlmostEqual(umean, float(u.mean()))
+        self.assertAlmostEqual(vmean, float(v.mean()))
+        self.assertEqual(len(ax.images), 3)
+
+        ax = plotting.piv_scatter(u, v, flags=flags, fiwsize=16, density=True)
+        self.assertEqual(ax.get_xlabel(), 'x_displacement / pixel')
+        plt.close('all')
+
+    def test_hist_of_histogram(self):
+        hist = Histogram(0.5).update(np.random.normal(0, 1, 100))
+        fig, ax = plotting.subplots(1, 1)
+        with self.assertLogs('standardpostpiv', level='WARNING'):
+            ax.hist(hist, bins=10)
+        self.assertEqual(sum(p.get_height() for p in ax.patches), 100)
+        plt.close('all')
@@ -0,0 +1,95 @@
+import pathlib
+import tempfile
+import unittest
+
+import h5py
+import nbformat
+import numpy as np
+
+from standardpostpiv.precompute import PIVSummary, precompute
+from standardpostpiv.reports import get_basic_2D2C_report
+from standardpostpiv.statistics import Histogram, peak_locking
+from standardpostpiv.synthetic import create_piv_file
+
+
+class TestPrecompute(unittest.TestCase):
+    """Tests the single-pass summary of a PIV file"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+        self.piv_filename = create_piv_file(self.tmpdir / 'piv.hdf', nt=23, ny=30, nx=40, seed=1)
+        with h5py.File(self.piv_filename, 'r') as h5:
+            self.flags = h5['piv_flags'][()]
+            self.dx = h5['dx'][()].astype(float)
+            self.dy = h5['dy'][()].astype(float)
+        masked = (self.flags & 2).astype(bool)
+        self.dx[masked] = np.nan
+        self.dy[masked] = np.nan
+        self.mag = np.hypot(self.dx, self.dy)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_summary(self):
+        filename = precompute(self.piv_filename, self.tmpdir / 'summary.hdf', chunk_size=7,
+                              monitor_points=[(0.0049, 0.0031)], snapshots=(2, -1))
+        summary = PIVSummary(filename)
+        self.assertEqual(summary.dims, ['reltime', 'y', 'x'])
+        self.assertEqual(summary.final_iw_size, (32, 32))
+        self.assertEqual(summary.attrs['piv_method'], 'multi_grid')
+
+        valid = np.isfinite(self.mag).any(axis=0)
+        with np.errstate(invalid='ignore'):
+            for name, data in (('x_displacement', self.dx), ('magnitude_of_displacement', self.mag)):
+                np.testing.assert_allclose(summary.field(name, 'mean').values[valid], np.nanmean(data[:, valid], 0))
+                np.testing.assert_allclose(summary.field(name, 'std').values[valid], np.nanstd(data[:, valid], 0),
+                                           atol=1e-10)
+                np.testing.assert_array_equal(summary.field(name, 'max').values[valid],
+                                              np.nanmax(data[:, valid], 0))
+        self.assertAlmostEqual(summary.global_mean(), np.nanmean(self.mag))
+        self.assertEqual(summary.field('magnitude_of_displacement').attrs['standard_name'],
+                         'arithmetic_mean_of_magnitude_of_displacement')
+        np.testing.assert_array_equal(summary.snapshot('y_displacement', 22).values, self.dy[22])
+
+        np.testing.assert_array_equal(summary.histogram('x_displacement').counts,
+                                      Histogram(0.1, value_range=(-32, 32)).update(self.dx).counts)
+        self.assertEqual(summary.histogram('x_displacement').value_range, (-32, 32))
+        self.assertAlmostEqual(summary.quantile('y_displacement', 0.5), np.nanmedian(self.dy), delta=0.1)
+        np.testing.assert_array_equal(summary.peak_locking('x_displacement').n_inner,
+                                      peak_locking(self.dx).n_inner)
+
+        self.assertEqual(summary.monitor_points, [(0.0048, 0.0032)])
+        np.testing.assert_array_equal(summary.monitor_series('x_displacement').values[:, 0], self.dx[:, 1, 2])
+        vdp = summary.vdp()
+        active = np.count_nonzero(self.flags & 1, axis=(1, 2))
+        edited = sum(np.count_nonzero(self.flags & b, axis=(1, 2)) for b in (4, 16, 32, 64, 128))
+        np.testing.assert_allclose(vdp.values, (active - edited) / active)
+
+        checkpoints = summary.convergence()
+        self.assertEqual(checkpoints.n_frames[-1], 23)
+        n = int(checkpoints.n_frames[3])
+        with np.errstate(invalid='ignore'):
+            np.testing.assert_allclose(checkpoints['mean'][3].values[valid], np.nanmean(self.mag[:n, valid], 0))
+        self.assertEqual(sum(h.n for h in summary.density().values()),
+                         np.count_nonzero(np.isfinite(self.dx) & (self.flags == 1)) +
+                         np.count_nonzero((self.flags & 32) | (self.flags & 64)))
+
+    def test_reuse(self):
+        filename = precompute(self.piv_filename, self.tmpdir / 'summary.hdf')
+        mtime = filename.stat().st_mtime_ns
+        self.assertEqual(precompute(self.piv_filename, filename), filename)
+        self.assertEqual(filename.stat().st_mtime_ns, mtime)
+        self.assertEqual(len(PIVSummary(filename).monitor_points), 4)
+        # other parameters invalidate the summary
+        precompute(self.piv_filename, filename, n_monitor_points=2)
+        self.assertEqual(len(PIVSummary(filename).monitor_points), 2)
+
+    def test_report(self):
+        report = get_basic_2D2C_report(self.piv_filename, precompute=True)
+        filenames = report.create(notebook_filename=self.tmpdir / 'report.ipynb', execute_notebook=True,
+                                  inplace=True, executor='inprocess')
+        nb = nbformat.read(filenames['ipynb'], as_version=4)
+        errors = [o for c in nb.cells if c.cell_type == 'code' for o in c.outputs if o.output_type == 'error']
+        self.assertEqual(errors, [])
+        self.assertEqual(report.get_section_graph()['mean_velocity'], ['precompute'])
@@ -0,0 +1,57 @@
+import unittest
+
+import matplotlib.pyplot as plt
+import numpy as np
+import xarray as xr
+
+from standardpostpiv import plotting
+from standardpostpiv.pyramid import FieldPyramid, block_mean, get_pyramid
+
+
+def _field(ny, nx):
+    return xr.DataArray(np.random.rand(ny, nx), dims=('y', 'x'),
+                        coords={'x': np.arange(nx, dtype=float), 'y': np.arange(ny, dtype=float)},
+                        attrs={'standard_name': 'x_displacement'}, name='dx')
+
+
+class TestPyramid(unittest.TestCase):
+    """Tests the block-mean pyramid"""
+
+    def test_block_mean(self):
+        field = _field(5, 6)
+        field[0, 0] = np.nan
+        coarse = block_mean(field, 2)
+        self.assertEqual(coarse.shape, (3, 3))
+        self.assertAlmostEqual(float(coarse[0, 0]), float(np.nanmean(field.values[:2, :2])))
+        self.assertAlmostEqual(float(coarse[2, 1]), float(field.values[4, 2:4].mean()))
+        np.testing.assert_array_equal(coarse.x, [0.5, 2.5, 4.5])
+        np.testing.assert_array_equal(coarse.y, [0.5, 2.5, 4.])
+        self.assertEqual(coarse.attrs['standard_name'], 'x_displacement')
+
+        field[:2, :2] = np.nan
+        self.assertTrue(np.isnan(block_mean(field, 2)[0, 0]))
+
+    def test_levels(self):
+        field = _field(64, 40)
+        mask = np.zeros(field.shape, dtype=bool)
+        mask[0, :] = True
+        pyramid = FieldPyramid(field, mask=mask)
+        self.assertEqual(pyramid.nlevels, 4)
+        self.assertEqual(pyramid[3].shape, pyramid.shape(3))
+        self.assertEqual(pyramid.select_level((20, 20)), 2)
+        self.assertTrue(np.isnan(pyramid[0][0, 0]))
+        self.assertIs(get_pyramid(field), get_pyramid(field))
+        # the cache is keyed by content and kwargs, not by object identity
+        self.assertIs(get_pyramid(field.copy()), get_pyramid(field))
+        self.assertIsNot(get_pyramid(field, mask=mask), get_pyramid(field))
+        self.assertTrue(np.isnan(get_pyramid(field, mask=mask)[0][0, 0]))
+        other = field + 1
+        self.assertFalse(np.allclose(get_pyramid(other)[1], get_pyramid(field)[1]))
+
+    def test_axes(self):
+        u, v = _field(200, 300), _field(200, 300)
+        fig, ax = plotting.subplots(1, 1, figsize=(3, 2), dpi=100)
+        ax.pivfield(u)
+        self.assertLessEqual(ax.collections[0].get_array().size, 300 * 200 / 4)
+        ax.pivquiver(u, v, every='auto')
+        plt.close('all')
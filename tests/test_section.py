@@ -0,0 +1,73 @@
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.pivreport_sections import pdfs, statistics, summary
+from standardpostpiv.notebook_utils.section import Section
+from standardpostpiv.reports import get_basic_2D2C_report
+
+
+def _state(section: Section):
+    return (section.title, section.level, [cell.lines for cell in section.cells],
+            [_state(s) for s in section.sections])
+
+
+class TestSectionTemplates(unittest.TestCase):
+    """Tests that sections are templates which are not modified by reports"""
+
+    def test_copy(self):
+        section = Section('Stats', label='stats', level=2, produces=('x',))
+        section.add_cell('x = 1', 'code')
+        section.add_section('Sub', label='sub').add_cell(['a', 'b'], 'markdown')
+        copy = section.copy(level=3)
+        copy.cells[0].lines = 'x = 2'
+        copy.sections[0].cells[0].lines.append('c')
+        self.assertEqual(copy.level, 3)
+        self.assertEqual(copy.produces, ('x',))
+        self.assertEqual(_state(section), ('Stats', 2, ['x = 1'], [('Sub', 3, [['a', 'b']], [])]))
+
+        cells, _ = section.get_cells([], np.zeros(10, dtype=int))
+        self.assertEqual(cells[0].source, '## 1 Stats <a id="piv-stats"></a>')
+        self.assertEqual(cells[2].source, '### 1.1 Sub <a id="piv-sub"></a>\na<br>\nb<br>')
+        self.assertEqual(_state(section), ('Stats', 2, ['x = 1'], [('Sub', 3, [['a', 'b']], [])]))
+
+    def test_reuse(self):
+        templates = [summary.section_precompute, summary.section_stats, summary.section_convergence]
+        before = [_state(s) for s in templates]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            notebooks = []
+            for i in range(3):
+                report = get_basic_2D2C_report(tmpdir / 'piv.hdf', precompute=True)
+                report.create(tmpdir / f'report{i}.ipynb')
+                notebooks.append([(cell.cell_type, cell.source) for cell in report.notebook.cells])
+            self.assertEqual(notebooks[0], notebooks[2])
+            self.assertEqual([_state(s) for s in templates], before)
+            # the template is the same, the heading level is the one of the report
+            self.assertEqual(summary.section_convergence.level, None)
+
+            # a report can be rendered repeatedly
+            report = PIVReportNotebook(tmpdir / 'piv.hdf')
+            report.add_section(summary.section_precompute, level=2)
+            sources = [cell.source for cell in report.render().cells]
+            self.assertEqual(sources, [cell.source for cell in report.render().cells])
+            self.assertEqual(sum('dropdown-toc' in source for source in sources), 1)
+            self.assertTrue(any(source.startswith('## 2 Precomputation') for source in sources))
+            self.assertTrue(any('from standardpostpiv.precompute import' in source for source in sources))
+
+    def test_reuse_basic_report(self):
+        templates = [statistics.section_with_badge, pdfs.section]
+        before = [_state(s) for s in templates]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            notebooks = []
+            for _ in range(3):
+                report = get_basic_2D2C_report(tmpdir / 'piv.hdf')
+                notebooks.append([(cell.cell_type, cell.source) for cell in report.render().cells])
+                self.assertEqual(notebooks[-1], [(cell.cell_type, cell.source) for cell in report.render().cells])
+            self.assertEqual(notebooks[0], notebooks[1])
+            self.assertEqual(notebooks[0], notebooks[2])
+        self.assertEqual([_state(s) for s in templates], before)
@@ -0,0 +1,117 @@
+import os
+import pathlib
+import tempfile
+import unittest
+
+import nbformat
+from nbclient.exceptions import CellExecutionError
+
+from standardpostpiv.executors import InProcessExecutor
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+from standardpostpiv.sectioncache import CachedExecutor, SectionCache, section_dependencies, split_sections
+
+
+def _notebook(sections):
+    nb = nbformat.v4.new_notebook()
+    for label, sources in sections:
+        nb.cells.append(nbformat.v4.new_markdown_cell(f'# {label}', metadata={'section': label}))
+        for source in sources:
+            nb.cells.append(nbformat.v4.new_code_cell(source, metadata={'section': label}))
+    return nb
+
+
+class TestSectionCache(unittest.TestCase):
+    """Tests the incremental execution of reports with the section cache"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+        self.hdf_filename = self.tmpdir / 'piv.hdf'
+        self.hdf_filename.write_bytes(b'data')
+        self.cache = SectionCache(self.tmpdir / 'cache')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def _run(self, sections, executor='inprocess'):
+        nb = _notebook(sections)
+        ep = CachedExecutor(self.hdf_filename, self.cache, executor=executor)
+        ep.preprocess(nb)
+        return nb, ep
+
+    def test_dependencies(self):
+        deps = section_dependencies([['import numpy as np\nx = 1'],
+                                     ['y = np.ones(x)', 'y[0] = 2'],
+                                     ['print(x)'],
+                                     ['print(y)'],
+                                     ['%matplotlib inline']])
+        self.assertEqual(deps, [set(), {0}, {0}, {1}, {0, 1, 2, 3}])
+
+    def test_incremental(self):
+        sections = [('load', ['x = 2']),
+                    ('double', ['y = 2 * x', 'print(y)']),
+                    ('plot', ['print("plot", x)'])]
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, ['load', 'double', 'plot'])
+        self.assertEqual(len(self.cache.entries()), 3)
+        self.assertEqual([g[0] for g in split_sections(nb)], ['load', 'double', 'plot'])
+
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, [])
+        self.assertEqual(nb.cells[4].outputs[0].text, '4\n')
+
+        # a changed plot re-executes the plot and the section it depends on
+        sections[2] = ('plot', ['print("new plot", x)'])
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, ['load', 'plot'])
+        self.assertEqual(ep.cached_sections, ['double'])
+        self.assertEqual(nb.cells[4].outputs[0].text, '4\n')
+        self.assertEqual(nb.cells[-1].outputs[0].text, 'new plot 2\n')
+
+        # a changed section invalidates its dependents
+        sections[0] = ('load', ['x = 3'])
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, ['load', 'double', 'plot'])
+        self.assertEqual(nb.cells[4].outputs[0].text, '6\n')
+
+        # a modified HDF5 file invalidates all sections
+        os.utime(self.hdf_filename, ns=(0, 0))
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, ['load', 'double', 'plot'])
+
+    def test_resume_after_crash(self):
+        sections = [('load', ['x = 2']),
+                    ('crash', ['raise RuntimeError("crash")']),
+                    ('plot', ['print(x)'])]
+        with self.assertRaises(CellExecutionError):
+            self._run(sections, executor=InProcessExecutor(allow_errors=False))
+        sections[1] = ('crash', ['pass'])
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.cached_sections, [])
+        self.assertEqual(ep.executed_sections, ['load', 'crash', 'plot'])
+        self.assertEqual(nb.cells[-1].outputs[0].text, '2\n')
+
+        # failing sections are not cached
+        sections[2] = ('plot', ['print(x)', 'undefined'])
+        self._run(sections)
+        nb, ep = self._run(sections)
+        self.assertEqual(ep.executed_sections, ['load', 'plot'])
+
+    def test_report(self):
+        def build():
+            report = PIVReportNotebook(self.hdf_filename)
+            section = Section('Test', label='test')
+            section.add_cell('import numpy as np', 'code')
+            section.add_cell('print(np.arange(3).sum())', 'code')
+            report.add_section(section, level=2)
+            return report
+
+        for _ in range(2):
+            filenames = build().create(notebook_filename=self.tmpdir / 'report.ipynb', execute_notebook=True,
+                                       overwrite=True, inplace=True, executor='inprocess', cache=self.cache)
+            nb = nbformat.read(filenames['ipynb'], as_version=4)
+            self.assertEqual(nb.cells[-2].outputs[0].text, '3\n')
+        self.assertEqual({c.metadata['section'] for c in nb.cells}, {'piv-report', 'imports', 'test', 'performance'})
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
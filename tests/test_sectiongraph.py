@@ -0,0 +1,128 @@
+import pathlib
+import tempfile
+import unittest
+
+import nbformat
+import numpy as np
+import xarray as xr
+from nbclient.exceptions import CellExecutionError
+
+from standardpostpiv.notebook import PIVReportNotebook
+from standardpostpiv.notebook_utils.section import Section
+from standardpostpiv.reports import get_basic_2D2C_report
+from standardpostpiv.sectiongraph import ParallelExecutor, SectionGraph, VariableStore
+
+
+def _notebook(sections, declarations=None):
+    nb = nbformat.v4.new_notebook()
+    for label, sources in sections:
+        nb.cells.append(nbformat.v4.new_markdown_cell(f'# {label}', metadata={'section': label}))
+        for source in sources:
+            nb.cells.append(nbformat.v4.new_code_cell(source, metadata={'section': label}))
+    nb.metadata['standardpostpiv'] = {'sections': declarations or {}}
+    return nb
+
+
+class TestSectionGraph(unittest.TestCase):
+    """Tests the section graph and the parallel execution of sections"""
+
+    def test_variable_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = VariableStore(tmpdir)
+            da = xr.DataArray(np.arange(6.).reshape(2, 3), dims=('y', 'x'), coords={'x': [1, 2, 3]},
+                              attrs={'units': 'm'}, name='u')
+            self.assertTrue(store.put('da', da))
+            self.assertTrue(store.put('arr', np.ones(4)))
+            self.assertTrue(store.put('np', np))
+            self.assertTrue(store.put('d', {'a': 1}))
+            self.assertFalse(store.put('gen', (i for i in range(2))))
+            self.assertEqual(store.keys(), ['arr', 'd', 'da', 'np'])
+
+            loaded = store.get('da')
+            xr.testing.assert_identical(loaded, da)
+            self.assertIsInstance(loaded.data.base, np.memmap)
+            arr = store.get('arr')
+            arr[0] = 5  # copy-on-write
+            self.assertEqual(store.get('arr')[0], 1)
+            self.assertIs(store.get('np'), np)
+            self.assertEqual(store.get('d'), {'a': 1})
+
+    def test_graph(self):
+        nb = _notebook([('setup', ['import numpy as np']),
+                        ('load', ['x = np.arange(3)\nfig = 1']),
+                        ('a', ['fig = x.sum()\nprint(fig)']),
+                        ('b', ['y = 2 * x']),
+                        ('c', ['print(y, z)'])],
+                       declarations={'a': {'produces': ['z']}})
+        graph = SectionGraph.from_notebook(nb, setup=('setup',))
+        self.assertEqual(graph.to_dict(), {'setup': [], 'load': [], 'a': ['load'], 'b': ['load'],
+                                           'c': ['a', 'b']})
+        loads, prelude = graph.plan(4, {(3, 'y'): '3_y'})
+        self.assertEqual(loads, [('3_y', 'y')])
+        self.assertEqual(prelude, ['import numpy as np', 'x = np.arange(3)\nfig = 1', 'fig = x.sum()\nprint(fig)'])
+
+    def test_parallel_execution(self):
+        nb = _notebook([('imports', ['import os, time', 'import numpy as np']),
+                        ('load', ['x = np.arange(5)', 'gen = iter(range(3))']),
+                        ('a', ['time.sleep(1)\nprint(x.sum(), os.getpid())']),
+                        ('b', ['time.sleep(1)\nprint(len(list(gen)), os.getpid())']),
+                        ('c', ['x[0] = 10\nx[:2]'])])
+        executor = ParallelExecutor(processes=2)
+        executor.preprocess(nb)
+        code_cells = [c for c in nb.cells if c.cell_type == 'code']
+        self.assertEqual([c.execution_count for c in code_cells], list(range(1, 8)))
+        sum_a, pid_a = code_cells[4].outputs[0].text.split()
+        n_b, pid_b = code_cells[5].outputs[0].text.split()
+        self.assertEqual((sum_a, n_b), ('10', '3'))
+        # the independent sections ran concurrently:
+        self.assertNotEqual(pid_a, pid_b)
+        self.assertEqual(code_cells[6].outputs[0].data['text/plain'], 'array([10,  1])')
+        self.assertEqual(code_cells[6].outputs[0].execution_count, 7)
+        self.assertEqual(set(executor.timings), {'imports', 'load', 'a', 'b', 'c'})
+
+        nb = _notebook([('a', ['x = 1']), ('b', ['x / 0']), ('c', ['print(x)'])])
+        with self.assertRaises(CellExecutionError):
+            ParallelExecutor(processes=2, allow_errors=False).preprocess(nb)
+        self.assertEqual(nb.cells[-1].outputs[0].text, '1\n')
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            report = PIVReportNotebook(tmpdir / 'piv.hdf')
+            section = Section('Load', label='load', produces=('n',), consumes=('hdf_filename',))
+            section.add_cell('import pathlib\nn = len(pathlib.Path(hdf_filename).name)', 'code')
+            report.add_section(section, level=2)
+            section = Section('Print', label='print', consumes=('n',))
+            section.add_cell('print(n)', 'code')
+            report.add_section(section, level=2)
+            report.create(tmpdir / 'report.ipynb', execute_notebook=True, inplace=True, executor='parallel')
+            self.assertEqual(report.get_section_graph()['print'], ['load'])
+            nb = nbformat.read(tmpdir / 'report.ipynb', as_version=4)
+            self.assertEqual(nb.metadata['standardpostpiv']['sections']['print'], {'produces': [], 'consumes': ['n']})
+            self.assertEqual(nb.cells[-2].outputs[0].text, '7\n')
+            self.assertIn('profile', nb.cells[-2].metadata)
+
+    def test_basic_report_graph(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = pathlib.Path(tmpdir)
+            report = get_basic_2D2C_report(tmpdir / 'piv.hdf')
+            report.create(tmpdir / 'report.ipynb')
+            graph = report.get_section_graph()
+
+        def ancestors(label):
+            found, todo = set(), list(graph[label])
+            while todo:
+                dependency = todo.pop()
+                if dependency not in found:
+                    found.add(dependency)
+                    todo.extend(graph[dependency])
+            return found
+
+        # the full time series is never loaded
+        for cell in report.notebook.cells:
+            self.assertNotIn('displacement[()]', cell.source)
+        # the masked displacement fields are loaded in their own section, not in the PDFs
+        self.assertIn('displacement_data', ancestors('convergence'))
+        self.assertNotIn('pdfs', ancestors('convergence'))
+        self.assertNotIn('convergence', ancestors('pdfs'))
+        self.assertNotIn('displacement_data', ancestors('pdfs'))
@@ -0,0 +1,89 @@
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from standardpostpiv.service import ReportServer, ReportService
+from standardpostpiv.synthetic import create_piv_file
+
+
+class TestReportService(unittest.TestCase):
+    """Tests the local report service"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = pathlib.Path(self._tmpdir.name)
+        create_piv_file(self.tmpdir / 'run1.hdf', nt=7, ny=10, nx=12, seed=1)
+        create_piv_file(self.tmpdir / 'run2.hdf', nt=5, ny=10, nx=12, seed=2)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_cache(self):
+        service = ReportService(self.tmpdir)
+        self.assertEqual([str(f) for f in service.files()], ['run1.hdf', 'run2.hdf'])
+        report = service.get('run1.hdf')
+        self.assertIn('mean_velocity', report.section_names)
+        cells = service.section('run1.hdf', 'mean_velocity')
+        self.assertTrue(any('image/png' in o.get('data', {}) for c in cells for o in c.get('outputs', [])))
+        self.assertEqual(set(report.executed), {'piv-report', 'imports', 'precompute', 'mean_velocity'})
+        self.assertGreater(report.nbytes, 0)
+        # warm: the section is not executed again
+        self.assertIs(service.section('run1.hdf', 'mean_velocity'), cells)
+        self.assertIn('summary', report.executor.namespace)
+        self.assertEqual(len(report.figures('mean_velocity')), 1)
+
+        # least recently used reports are evicted if the budget is exceeded
+        service.memory_budget = report.nbytes + 1
+        service.section('run2.hdf', 'mean_velocity')
+        self.assertEqual([p.name for p in service.reports], ['run2.hdf'])
+        self.assertEqual(service.n_evicted, 1)
+        self.assertEqual(report.executed, {})
+
+        # a changed file is reloaded
+        report = service.get('run2.hdf')
+        os.utime(self.tmpdir / 'run2.hdf', ns=(0, 0))
+        self.assertIsNot(service.get('run2.hdf'), report)
+        self.assertEqual(service.get('run2.hdf').executed, {})
+
+        service.idle_timeout = 0
+        service.evict_idle()
+        self.assertEqual(len(service.reports), 0)
+
+        with self.assertRaises(PermissionError):
+            service.get('../outside.hdf')
+        with self.assertRaises(FileNotFoundError):
+            service.get('missing.hdf')
+
+    def test_server(self):
+        server = ReportServer(ReportService(self.tmpdir), port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            with urllib.request.urlopen(f'{url}/') as r:
+                self.assertIn('report?file=run1.hdf', r.read().decode())
+            with urllib.request.urlopen(f'{url}/sections?file=run1.hdf') as r:
+                self.assertIn('convergence', json.loads(r.read()))
+            with urllib.request.urlopen(f'{url}/section/stats?file=run1.hdf') as r:
+                page = r.read().decode()
+                self.assertIn('data:image/png;base64,', page)
+            with urllib.request.urlopen(f'{url}/figure/mean_velocity?file=run1.hdf&index=0') as r:
+                self.assertEqual(r.headers['Content-Type'], 'image/png')
+                self.assertEqual(r.read()[:4], b'\x89PNG')
+            with urllib.request.urlopen(f'{url}/status') as r:
+                status = json.loads(r.read())
+                self.assertEqual(status['reports'][0]['file'], 'run1.hdf')
+                self.assertEqual(status['n_loaded'], 1)
+            for path, code in (('/section/unknown?file=run1.hdf', 404), ('/section/stats?file=../x.hdf', 403),
+                               ('/figure/stats?file=run1.hdf&index=99', 404), ('/section/stats', 400)):
+                with self.assertRaises(urllib.error.HTTPError) as cm:
+                    urllib.request.urlopen(url + path)
+                self.assertEqual(cm.exception.code, code)
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,182 @@
+import tracemalloc
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from standardpostpiv.statistics import FieldMoments, Histogram, QuantileSketch, PixelQuantileSketch, \
+    stream_histogram, stream_update, peak_locking, stream_peak_locking
+from standardpostpiv.utils import iter_masked_displacement
+
+
+class TestHistogram(unittest.TestCase):
+    """Tests the chunk-wise statistics"""
+
+    def test_histogram_matches_numpy(self):
+        data = np.random.normal(0, 2, (20, 16, 12))
+        hist = Histogram(binwidth=0.1)
+        for i in range(0, 20, 3):
+            hist.update(data[i:i + 3])
+        counts, _ = np.histogram(data.ravel(), bins=hist.edges)
+        np.testing.assert_array_equal(hist.counts, counts)
+        self.assertEqual(hist.n, data.size)
+
+    def test_merge(self):
+        data = np.random.uniform(-5, 5, 1000)
+        h1 = Histogram(0.5).update(data[:500])
+        h2 = Histogram(0.5).update(data[500:])
+        h = h1 + h2
+        np.testing.assert_array_equal(h.counts, Histogram(0.5).update(data).counts)
+        with self.assertRaises(ValueError):
+            h1.merge(Histogram(0.3))
+
+    def test_value_range_and_mask(self):
+        data = np.array([-1., 0., 0.25, 0.5, 1., np.nan, 2.])
+        mask = np.array([0, 0, 0, 0, 0, 0, 2])
+        hist = Histogram(0.5, value_range=(0., 1.)).update(data, mask=mask)
+        np.testing.assert_array_equal(hist.edges, [0., 0.5, 1.])
+        np.testing.assert_array_equal(hist.counts, [2, 2])
+        self.assertEqual(hist.n_outside, 1)
+
+    def test_bin_edges(self):
+        hist = Histogram(0.1).update([0.3, 0.7, -0.2])
+        np.testing.assert_array_equal(hist.counts[[0, 5, 9]], [1, 1, 1])
+        self.assertEqual(hist.edges[0], -0.2)
+
+    def test_max_bins(self):
+        # a single fill value does not allocate the bins up to it, the bins are merged instead
+        hist = Histogram(0.1).update([1e12, 0.3, 0.05, -1e12])
+        self.assertLessEqual(hist.nbins, hist.max_bins)
+        self.assertEqual(hist.n, 4)
+        self.assertEqual(hist.n_outside, 0)
+        # drifting data: the bins are merged, no value is dropped
+        data = np.arange(12.)
+        hist = Histogram(1., max_bins=5)
+        for i in range(0, 12, 3):
+            hist.update(data[i:i + 3])
+        self.assertEqual(hist.binwidth, 4.)
+        np.testing.assert_array_equal(hist.counts, [4, 4, 4])
+        np.testing.assert_array_equal(hist.edges, [0., 4., 8., 12.])
+        self.assertEqual(hist.n_outside, 0)
+        # merged histograms of different bin width
+        h1 = Histogram(1., max_bins=5).update([0, 1, 2])
+        h2 = Histogram(1., max_bins=5).update([3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(h2.binwidth, 2.)
+        hist = h1 + h2
+        np.testing.assert_array_equal(hist.counts, [2, 2, 2, 2, 2])
+        self.assertEqual(hist.binwidth, 2.)
+        self.assertEqual((h2 + h1).counts.tolist(), hist.counts.tolist())
+        with self.assertRaises(ValueError):
+            Histogram(1.).merge(Histogram(3.))
+
+    def test_stream_histogram(self):
+        data = xr.DataArray(np.random.normal(0, 1, (10, 4, 4)), dims=('reltime', 'y', 'x'),
+                            attrs={'standard_name': 'x_displacement'})
+        flags = xr.DataArray(np.ones((10, 4, 4), dtype=int), dims=('reltime', 'y', 'x'))
+        flags[:, 0, :] = 2
+        hist = stream_histogram(data, binwidth=0.1, flags=flags, chunk_size=3)
+        self.assertEqual(hist.n, 10 * 3 * 4)
+        self.assertEqual(hist.attrs['standard_name'], 'x_displacement')
+
+    def test_peak_locking(self):
+        locked = np.random.randint(-5, 5, (4, 8, 8)) + np.random.normal(0, 0.05, (4, 8, 8))
+        uniform = np.random.uniform(-5, 5, (4, 8, 8))
+        data = xr.DataArray(np.concatenate([locked, uniform]), dims=('reltime', 'y', 'x'),
+                            coords={'reltime': np.arange(8)})
+        pl = peak_locking(data, nbins=10)
+        self.assertEqual(pl.sub_pixel_histogram.shape, (8, 10))
+        np.testing.assert_array_equal(pl.n_valid, 64)
+        self.assertTrue(np.all(pl.peak_locking_index[:4] > 0.9))
+        self.assertTrue(np.all(np.abs(pl.peak_locking_index[4:]) < 0.5))
+
+        flags = np.zeros(data.shape, dtype=int)
+        flags[:, 0, :] = 2
+        streamed = stream_peak_locking(data, nbins=10, flags=flags, chunk_size=3)
+        np.testing.assert_array_equal(streamed.n_valid, 56)
+        self.assertEqual(streamed.reltime.size, 8)
+        self.assertAlmostEqual(streamed.attrs['global_peak_locking_index'],
+                               float(2 * streamed.n_inner.sum() / streamed.n_valid.sum() - 1))
+
+    def test_quantile_sketch(self):
+        data = np.random.normal(0, 1, (50, 40, 40))
+        q = [0.01, 0.25, 0.5, 0.75, 0.99]
+        sketch = QuantileSketch(k=200, seed=1)
+        for i in range(0, 50, 5):
+            sketch.update(data[i:i + 5])
+        self.assertEqual(sketch.n, data.size)
+        self.assertLess(sketch.n_retained, 3 * 200 + 50)
+        ranks = np.searchsorted(np.sort(data.ravel()), sketch.quantile(q)) / data.size
+        np.testing.assert_allclose(ranks, q, atol=0.02)
+        self.assertEqual(sketch.quantile(0), data.min())
+        self.assertEqual(sketch.quantile(1), data.max())
+
+        merged = QuantileSketch(seed=1).update(data[:25]) + QuantileSketch(seed=2).update(data[25:])
+        self.assertEqual(merged.n, data.size)
+        ranks = np.searchsorted(np.sort(data.ravel()), merged.quantile(q)) / data.size
+        np.testing.assert_allclose(ranks, q, atol=0.02)
+
+    def test_pixel_quantile_sketch(self):
+        data = np.random.uniform(0, 10, (400, 3, 4))
+        data[:, 0, 0] = np.nan
+        sketch = PixelQuantileSketch((3, 4), value_range=(0, 10), nbins=100)
+        stream_update(data, [sketch], chunk_size=30)
+        median = sketch.quantile(0.5)
+        self.assertEqual(median.shape, (3, 4))
+        self.assertTrue(np.isnan(median[0, 0]))
+        np.testing.assert_allclose(median[1:], np.median(data, axis=0)[1:], atol=0.1)
+
+    def test_pixel_quantile_sketch_overflow(self):
+        sketch = PixelQuantileSketch((2, 2), value_range=(0, 1))
+        self.assertEqual(sketch.nbytes, 4 * 64 * 2 + 2 * 4 * 8)
+        sketch.counts[0, 0] = np.iinfo(np.uint16).max
+        sketch.update(np.full((3, 2, 2), 0.001))
+        self.assertEqual(sketch.counts.dtype, np.uint32)
+        self.assertEqual(int(sketch.counts[0, 0]), np.iinfo(np.uint16).max + 3)
+        self.assertEqual(int(sketch.n[0, 1]), 3)
+
+    def test_field_moments(self):
+        coords = {'reltime': np.arange(25), 'y': np.arange(3), 'x': np.arange(4)}
+        dx = xr.DataArray(np.random.normal(1, 2, (25, 3, 4)), dims=('reltime', 'y', 'x'), coords=coords,
+                          attrs={'standard_name': 'x_displacement', 'units': 'px'})
+        dy = -dx
+        flags = xr.DataArray(np.ones((25, 3, 4), dtype=int), dims=('reltime', 'y', 'x'))
+        flags[:4, 0, 0] = 2
+        flags[:, 1, 1] = 2
+        moments = [FieldMoments() for _ in range(3)]
+        for chunk in iter_masked_displacement(dx, dy, flags, chunk_size=7):
+            for moment, field in zip(moments, chunk):
+                moment.update(field)
+        expected = dx.where(flags != 2)
+        mean = moments[0].mean()
+        self.assertEqual(mean.attrs, {'standard_name': 'arithmetic_mean_of_x_displacement', 'units': 'px'})
+        np.testing.assert_array_equal(mean.x, coords['x'])
+        np.testing.assert_allclose(mean, expected.mean('reltime'))
+        np.testing.assert_allclose(moments[0].std(ddof=1), expected.std('reltime', ddof=1))
+        np.testing.assert_array_equal(moments[0].count[[0, 1], [0, 1]], [21, 0])
+        np.testing.assert_allclose(moments[1].mean(), -expected.mean('reltime'))
+        self.assertAlmostEqual(moments[2].global_mean(), float(np.hypot(expected, expected).mean()))
+        self.assertEqual(moments[2].mean().attrs['standard_name'], 'arithmetic_mean_of_magnitude_of_displacement')
+
+    def test_pixel_quantile_sketch_outside(self):
+        sketch = PixelQuantileSketch((1, 2), value_range=(0, 10), nbins=10)
+        sketch.update(np.array([[[-5., 1.]], [[1., 1.]], [[2., 20.]], [[3., 1.]], [[10., 30.]]]))
+        np.testing.assert_array_equal(sketch.n_outside, [[1, 2]])
+        np.testing.assert_array_equal(sketch.n, [[5, 5]])
+        self.assertEqual(sketch.quantile(0.)[0, 0], -np.inf)
+        self.assertEqual(sketch.quantile(1.)[0, 1], np.inf)
+        # the quantiles of the values inside the range are not skewed by the outside values
+        self.assertTrue(2 <= sketch.quantile(0.5)[0, 0] <= 3)
+        self.assertTrue(9 <= sketch.quantile(1.)[0, 0] <= 10)
+
+    def test_pixel_quantile_sketch_memory(self):
+        sketch = PixelQuantileSketch((200, 200), value_range=(0, 1))
+        data = np.random.rand(2, 200, 200)
+        tracemalloc.start()
+        try:
+            sketch.update(data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        # no temporary array with an entry per pixel and bin
+        self.assertLess(peak, sketch.counts.size * 2)
+        np.testing.assert_array_equal(sketch.n, 2)
@@ -0,0 +1,46 @@
+import json
+import pathlib
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from standardpostpiv.statistics import peak_locking
+from standardpostpiv.synthetic import create_piv_file
+
+
+class TestSynthetic(unittest.TestCase):
+    """Tests the synthetic PIV file generator"""
+
+    def test_create_piv_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = create_piv_file(pathlib.Path(tmpdir) / 'piv.hdf', nt=12, ny=20, nx=30,
+                                       compression='gzip', write_chunk_size=5, seed=1)
+            with self.assertRaises(FileExistsError):
+                create_piv_file(filename)
+            with h5py.File(filename, 'r') as h5:
+                self.assertEqual(h5['dx'].shape, (12, 20, 30))
+                self.assertEqual(h5['dx'].compression, 'gzip')
+                self.assertEqual(h5['dx'].attrs['standard_name'], 'x_displacement')
+                self.assertEqual(h5['x'].attrs['standard_name'], 'x_coordinate')
+                self.assertEqual(h5['piv_parameters'].attrs['piv_method'], 'multi_grid')
+                self.assertEqual(h5['piv_parameters/x_final_iw_size'][()], 32)
+                flag_meaning = json.loads(h5['piv_flags'].attrs['flag_meaning'])
+                self.assertEqual(flag_meaning['2'], 'MASKED')
+                flags = h5['piv_flags'][()]
+                dx = h5['dx'][()]
+        masked = (flags & 2).astype(bool)
+        self.assertTrue(masked.any())
+        self.assertTrue(np.all(np.isnan(dx[masked])))
+        self.assertTrue(np.all(np.isfinite(dx[~masked])))
+        self.assertTrue((flags & 32).any())
+
+    def test_peak_locking(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = create_piv_file(pathlib.Path(tmpdir) / 'piv.hdf', nt=5, ny=20, nx=30,
+                                       peak_locking=0.8, seed=1)
+            with h5py.File(filename, 'r') as h5:
+                dx = h5['dx'][()]
+        ds = peak_locking(dx[np.isfinite(dx)])
+        self.assertGreater(ds.attrs['global_peak_locking_index'], 0.5)